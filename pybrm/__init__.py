@@ -1,9 +1,17 @@
 from .pybrm import (
+    ArrayIndex,
     BRMArray,
     BRMError,
     BRMHandler,
     Client,
+    ClientPool,
     FList,
+    FListDiff,
+    FListPool,
+    FListTemplate,
+    FListView,
+    Opcode,
+    OpcodeCache,
     PIN_ERR_LEVEL_DEBUG,
     PIN_ERR_LEVEL_ERROR,
     PIN_ERR_LEVEL_NONE,
@@ -18,10 +26,15 @@ from .pybrm import (
     PIN_FLDT_STR,
     PIN_FLDT_SUBSTRUCT,
     PIN_FLDT_TSTAMP,
+    Path,
     Poid,
+    RetryPolicy,
     brm_to_python_log_level,
+    cache_opcode,
     field_by_identifier,
     field_type_by_identifier,
+    flags,
+    path,
     pin_conf,
     pin_field_get_name,
     pin_field_get_type,
@@ -29,7 +42,8 @@ from .pybrm import (
     pin_virtual_time,
     pin_err_set_level,
     pin_err_set_logfile,
-    pin_err_set_program
+    pin_err_set_program,
+    uncache_opcode
 )
 
 from ._version import __version__
\ No newline at end of file
@@ -2,17 +2,21 @@ import faulthandler
 import operator
 
 faulthandler.enable()
-from pybrm.cbrm import _FList, _Client, BRMError
+from pybrm.cbrm import _FList, _Client, BRMError, FListView, Poid
 from pybrm.cbrm import pin_virtual_time as _pin_virtual_time, pin_field_of_name, pin_field_get_name, pin_field_get_type
 from pybrm.cbrm import pin_err_log_msg, pin_conf, pin_err_set_level as _pin_err_set_level, pin_err_set_logfile as _pin_err_set_logfile, pin_err_set_program
 from pybrm.constants import field_by_identifier, field_type_by_identifier, field_name_by_identifier, opcode_by_name, all_flags
 from datetime import datetime
-from decimal import Decimal
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from collections.abc import Mapping
+import contextlib
 import functools
 import logging
+import random
+import re
+import threading
+import time
 import xml.etree.ElementTree as ET
-import json
 
 pin_err_set_program("pybrm")
 
@@ -33,12 +37,36 @@ PIN_ERR_LEVEL_WARNING = 2
 PIN_ERR_LEVEL_ERROR = 1
 PIN_ERR_LEVEL_NONE = 0
 
+# Comparisons accepted by _FList.array_filter, in the order of Py_LT ... Py_GE
+_ARRAY_FILTER_OPS = {'<': 0, '<=': 1, '==': 2, '!=': 3, '>': 4, '>=': 5}
 
-# Poid's database will default to the value provided by PCM_CONNECT when it is set on an Flist
-Poid = namedtuple('Poid', ('type', 'id', 'revision', 'database'))
-Poid.__new__.__defaults__ = (None, -1, 0, None)
-Poid.is_type_only = lambda poid: poid.id == -1
-Poid.__str__ = lambda poid: f'0.0.0.{poid.database} {poid.type} {poid.id} {poid.revision}'
+# Kinds of result returned by _FList.array_group
+_ARRAY_GROUP_ELEM_IDS = 0
+_ARRAY_INDEX_VIEWS = 1
+_ARRAY_INDEX_ELEM_IDS = 2
+
+# Values of _Client.tstamp_mode and _Client.decimal_mode, and of the same arguments of the C getters
+_TSTAMP_MODES = {'datetime': 0, 'epoch_int': 1, 'aware_utc': 2}
+_DECIMAL_MODES = {'float': 0, 'decimal': 1, 'scaled_int': 2}
+# Passed to the C getters to use the client's mode
+_CLIENT_MODE = -1
+
+# Errors raised when a CM cannot be reached, or drops the connection
+_CONNECTION_ERRORS = frozenset((
+    'PIN_ERR_NAP_CONNECT_FAILED', 'PIN_ERR_CM_ADDRESS_LOOKUP_FAILED', 'PIN_ERR_STREAM_IO', 'PIN_ERR_STREAM_EOF',
+    'PIN_ERR_CONNECTION_LOST',
+))
+
+# Kinds of iterator returned by _FList.array_iter
+_ARRAY_ITER_KEYS = 0
+_ARRAY_ITER_VALUES = 1
+_ARRAY_ITER_ITEMS = 2
+
+
+FListDiff = namedtuple('FListDiff', ('added', 'removed', 'changed'))
+
+# Opcode number to OpcodeCache, see cache_opcode
+_OPCODE_CACHES = {}
 
 
 def pin_virtual_time():
@@ -158,7 +186,8 @@ class Client:
     The client will try to connect as soon as you instantiate it with `Client()`
     unless you open it like Client(open=False)
     """
-    def __init__(self, open=True):
+    def __init__(self, open=True, tstamp_mode='datetime', decimal_mode='float', decimal_scale=2, endpoint=None,
+                 retry_policy=None):
         """
         Instantiate a Client connection to the CM.
 
@@ -170,13 +199,70 @@ class Client:
         :param program: passed to PIN_ERR_SET_PROGRAM
         :param log_file: passed to PIN_ERR_SET_LOGFILE
         :param log_level: passed to PIN_ERR_SET_LOGFILE
+        :param tstamp_mode: how tstamp fields are returned by flists of this client, see `tstamp_mode`
+        :param decimal_mode: how decimal fields are returned by flists of this client, see `decimal_mode`
+        :param decimal_scale: the number of decimal places kept by decimal_mode 'scaled_int'
+        :param endpoint: a CM to connect to instead of the cm_ptr of the pin.conf, as 'host:port' or (host, port)
+            The login is still taken from the pin.conf. See also `ClientPool`
+        :param retry_policy: a `RetryPolicy` to reconnect and retry idempotent opcodes that fail on a broken connection
         """
         self._transaction = None
         self.database = 1  # this will get set during the call to open() if its not actually 1
+        self.endpoint = _parse_endpoint(endpoint) if endpoint is not None else None
+        self.retry_policy = retry_policy
         self._client = _Client()
+        self.tstamp_mode = tstamp_mode
+        self.decimal_mode = decimal_mode
+        self.decimal_scale = decimal_scale
         if open:
             self.open()
 
+    @property
+    def tstamp_mode(self):
+        """
+        How tstamp fields are returned by flists, views and paths of this client. The conversion is done in C.
+            'datetime': a naive datetime in local time, like datetime.fromtimestamp. This is the default
+            'epoch_int': the seconds since the epoch, as stored by BRM
+            'aware_utc': a datetime with tzinfo of timezone.utc
+        Setting a tstamp accepts any of these regardless of the mode.
+        """
+        return _mode_name(_TSTAMP_MODES, self._client.tstamp_mode)
+
+    @tstamp_mode.setter
+    def tstamp_mode(self, tstamp_mode):
+        if tstamp_mode is None:
+            raise ValueError('tstamp_mode cannot be None')
+        self._client.tstamp_mode = _mode_value(_TSTAMP_MODES, 'tstamp_mode', tstamp_mode)
+
+    @property
+    def decimal_mode(self):
+        """
+        How decimal fields are returned by flists, views and paths of this client. The conversion is done in C.
+            'float': a float, from pbo_decimal_to_double. This is the default
+            'decimal': an exact Decimal
+            'scaled_int': an int of the value times 10 ** decimal_scale, rounded half away from zero,
+                e.g. 12.345 is 1235 with the default decimal_scale of 2
+        Setting a decimal accepts a str, int, float or Decimal regardless of the mode.
+        """
+        return _mode_name(_DECIMAL_MODES, self._client.decimal_mode)
+
+    @decimal_mode.setter
+    def decimal_mode(self, decimal_mode):
+        if decimal_mode is None:
+            raise ValueError('decimal_mode cannot be None')
+        self._client.decimal_mode = _mode_value(_DECIMAL_MODES, 'decimal_mode', decimal_mode)
+
+    @property
+    def decimal_scale(self):
+        """The number of decimal places kept by decimal_mode 'scaled_int'"""
+        return self._client.decimal_scale
+
+    @decimal_scale.setter
+    def decimal_scale(self, decimal_scale):
+        if not isinstance(decimal_scale, int) or decimal_scale < 0:
+            raise ValueError(f'decimal_scale should be a non-negative int, not {decimal_scale!r}')
+        self._client.decimal_scale = decimal_scale
+
     def flist(self, data=None, capsule=None, copy_capsule=True):
         """
         Create an flist and associate it to this client.
@@ -188,7 +274,8 @@ class Client:
             if a dictionary, it will populate the flist with the keys and values on the dict, recursively
             if a string, it will attempt to convert the string into an flist
                 The string can be json, xml, or a brm flist string.
-                It will attempt to parse it each way, and if only after all three fail will it raise an exception.
+                The format is sniffed from the first non-whitespace character, and parsed only once.
+                If you already know the format, use `flist_from_json`, `flist_from_xml` or `flist_from_str`.
         :param capsule:
             Sets the flist to the flistp in the PyCapsule
             This is for advanced users who want to call C from Python or Python from C
@@ -205,6 +292,36 @@ class Client:
 
         return FList(self, data=data)
 
+    def flist_from_json(self, data):
+        """
+        Create an flist from a json string, as produced by `flist.json()`.
+
+        Unlike `client.flist(data)`, this does not sniff the format of the string.
+        :param data: json string
+        :return: FList instance
+        """
+        return FList(self, data=data, data_format='json')
+
+    def flist_from_xml(self, data):
+        """
+        Create an flist from an xml string, as produced by `flist.xml()`.
+
+        Unlike `client.flist(data)`, this does not sniff the format of the string.
+        :param data: xml string serialized with PIN_XML_BY_TYPE or PIN_XML_BY_NAME
+        :return: FList instance
+        """
+        return FList(self, data=data, data_format='xml')
+
+    def flist_from_str(self, data):
+        """
+        Create an flist from a BRM flist string, as produced by `str(flist)`, via PIN_STR_TO_FLIST
+
+        Unlike `client.flist(data)`, this does not sniff the format of the string.
+        :param data: BRM flist string
+        :return: FList instance
+        """
+        return FList(self, data=data, data_format='str')
+
     def open(self):
         """
         Opens a connection to the CM.
@@ -212,7 +329,7 @@ class Client:
         unless it is instantiated with Client(open=False)
         """
         try:
-            database = self._client.open()
+            self._open()
         except BRMError as ex:
             if ex.err in ('PIN_ERR_NAP_CONNECT_FAILED', 'PIN_ERR_CM_ADDRESS_LOOKUP_FAILED', 'PIN_ERR_STREAM_IO'):
                 print("Check if CM is up with psme | grep cm\n")
@@ -221,7 +338,35 @@ class Client:
             if ex.err == 'PIN_ERR_MISSING_ARG':
                 print('pin.conf most likely missing "- nap cm_ptr ip ${HOSTNAME} ${BRM_CM_PORT}"')
             raise ex
-        self.database = database
+
+    def reopen(self):
+        """
+        Closes and opens the connection to the CM, e.g. after the CM dropped it.
+        Rolls back any open transaction.
+        """
+        self.close()
+        self._open()
+
+    def _open(self):
+        """Opens the connection without printing any advice on failure"""
+        if self.endpoint is None:
+            self.database = self._client.open()
+            return
+
+        # PCM_CONTEXT_OPEN takes the login of PCM_CONNECT on an flist, with the CM to connect to
+        userid = (pin_conf('-', 'userid') or '0.0.0.1 /service/pcm_client 1').split()
+        login_type = int(pin_conf('nap', 'login_type') or 1)
+        host, port = self.endpoint
+        poid = Poid(userid[1], int(userid[2]), 0, int(userid[0].split('.')[-1]))
+        login = self.flist({
+            'PIN_FLD_POID': poid,
+            'PIN_FLD_TYPE': login_type,
+            'PIN_FLD_CM_PTRS': [{'PIN_FLD_CM_PTR': f'ip {host} {port}'}],
+        })
+        if login_type:
+            login['PIN_FLD_LOGIN'] = pin_conf('nap', 'login_name')
+            login['PIN_FLD_PASSWD_CLEAR'] = pin_conf('nap', 'login_pw')
+        self.database = self._client.open(login._flist.capsule(False), poid.database)
 
     def close(self):
         """
@@ -241,6 +386,25 @@ class Client:
         """
         return self._client.is_open()
 
+    def flist_template(self, template):
+        """
+        Creates a template to stamp out flists that differ from it in only a few fields, see `FListTemplate`.
+
+        :param template: an FList or a dict
+        :return: FListTemplate
+        """
+        return FListTemplate(self, template)
+
+    def flist_pool(self, template, size=16):
+        """
+        Creates a pool of scratch flists shaped like template, see `FListPool`.
+
+        :param template: an FList or a dict to build the flists from
+        :param size: the most released flists kept for reuse
+        :return: FListPool
+        """
+        return FListPool(self, template, size=size)
+
     def transaction(self, poid, flags=None):
         """
         Opens a transaction on this client.
@@ -511,13 +675,416 @@ class Client:
         self._client.set_ebuf_error()
 
 
+class ClientPool:
+    """
+    A pool of clients spread across several CMs, which keeps working when some of them are down:
+
+        pool = pybrm.ClientPool(['cm1:11960', 'cm2:11960'], strategy='least_outstanding')
+        with pool.client() as c:
+            out = c.flist({'PIN_FLD_POID': ('/account', 1)})('PCM_OP_READ_OBJ')
+
+    Clients are opened with PCM_CONTEXT_OPEN to one endpoint, chosen by `strategy`:
+        'round_robin': each endpoint in turn
+        'least_outstanding': the endpoint with the fewest clients currently acquired
+    An endpoint that cannot be connected to, or drops a connection, is skipped for `backoff` seconds, doubling on each
+    consecutive failure up to `max_backoff`. If every endpoint is backing off, they are all tried anyway.
+
+    Released clients are kept open for reuse. A client idle for longer than `idle_timeout` seconds is reconnected
+    before it is handed out again, since the CM may have dropped it.
+    """
+    def __init__(self, endpoints, strategy='round_robin', backoff=1.0, max_backoff=60.0, idle_timeout=None,
+                 max_idle=16, **client_kwargs):
+        """
+        :param endpoints: the CMs, as 'host:port' or (host, port)
+        :param strategy: 'round_robin' or 'least_outstanding'
+        :param backoff: the seconds an endpoint is skipped after its first failure
+        :param max_backoff: the most seconds an endpoint is skipped
+        :param idle_timeout: the seconds a released client stays idle before it is reconnected, or None for never
+        :param max_idle: the most released clients kept open per endpoint
+        :param client_kwargs: passed on to `Client`, like tstamp_mode or retry_policy
+        """
+        if strategy not in ('round_robin', 'least_outstanding'):
+            raise ValueError(f"strategy should be 'round_robin' or 'least_outstanding', not {strategy!r}")
+        self.endpoints = [_Endpoint(*_parse_endpoint(endpoint)) for endpoint in endpoints]
+        if not self.endpoints:
+            raise ValueError('At least one endpoint is required')
+        self.strategy = strategy
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._client_kwargs = client_kwargs
+        self._next = 0
+        self._in_use = {}
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.strategy == 'round_robin':
+                start = self._next
+                self._next = (self._next + 1) % len(self.endpoints)
+                endpoints = self.endpoints[start:] + self.endpoints[:start]
+            else:
+                endpoints = sorted(self.endpoints, key=lambda endpoint: endpoint.outstanding)
+        healthy = [endpoint for endpoint in endpoints if endpoint.retry_at <= now]
+        return healthy or sorted(endpoints, key=lambda endpoint: endpoint.retry_at)
+
+    def _mark_failed(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            delay = min(self.backoff * 2 ** (endpoint.failures - 1), self.max_backoff)
+            endpoint.retry_at = time.monotonic() + delay
+
+    def _connect(self, endpoint):
+        client = None
+        now = time.monotonic()
+        with self._lock:
+            while endpoint.idle and client is None:
+                client, released_at = endpoint.idle.pop()
+                if not client.is_open():
+                    client = None
+                elif self.idle_timeout is not None and now - released_at > self.idle_timeout:
+                    client.close()
+
+        if client is None:
+            client = Client(open=False, endpoint=(endpoint.host, endpoint.port), **self._client_kwargs)
+        if not client.is_open():
+            client._open()
+
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.retry_at = 0.0
+            endpoint.outstanding += 1
+            self._in_use[id(client)] = (client, endpoint)
+        return client
+
+    def acquire(self):
+        """
+        Returns an open client to a healthy endpoint
+        Raises the BRMError of the last endpoint if none of them can be connected to
+        :return: Client
+        """
+        error = None
+        for endpoint in self._candidates():
+            try:
+                return self._connect(endpoint)
+            except BRMError as ex:
+                if ex.err not in _CONNECTION_ERRORS:
+                    raise
+                self._mark_failed(endpoint)
+                error = ex
+        raise error
+
+    def release(self, client, failed=False):
+        """
+        Gives a client back to the pool
+        :param client: a Client returned by `acquire`
+        :param failed: set to True if the connection of the client failed, to close it and back off its endpoint
+        """
+        with self._lock:
+            try:
+                _, endpoint = self._in_use.pop(id(client))
+            except KeyError:
+                raise ValueError('This client was not acquired from this pool') from None
+            endpoint.outstanding -= 1
+            keep = not failed and client.is_open() and len(endpoint.idle) < self.max_idle
+            if keep:
+                endpoint.idle.append((client, time.monotonic()))
+
+        if failed:
+            self._mark_failed(endpoint)
+        if not keep:
+            client.close()
+
+    @contextlib.contextmanager
+    def client(self):
+        """
+        Acquires a client and releases it at the end of the with block
+        The client is closed and its endpoint backs off if the block raises a connection error
+        """
+        client = self.acquire()
+        try:
+            yield client
+        except BRMError as ex:
+            self.release(client, failed=ex.err in _CONNECTION_ERRORS)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        self.release(client)
+
+    def close(self):
+        """Closes every released client. Acquired clients are closed when they are released"""
+        with self._lock:
+            idle = [client for endpoint in self.endpoints for client, _ in endpoint.idle]
+            for endpoint in self.endpoints:
+                endpoint.idle.clear()
+            self.max_idle = 0
+        for client in idle:
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _Endpoint:
+    __slots__ = ('host', 'port', 'failures', 'retry_at', 'outstanding', 'idle')
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.failures = 0
+        self.retry_at = 0.0
+        self.outstanding = 0
+        # (client, released_at)
+        self.idle = []
+
+    def __repr__(self):
+        return f'{self.host}:{self.port}'
+
+
+def _parse_endpoint(endpoint):
+    if isinstance(endpoint, str):
+        host, sep, port = endpoint.rpartition(':')
+        if not sep or not host:
+            raise ValueError(f"endpoint should be 'host:port', not {endpoint!r}")
+        endpoint = host, port
+    host, port = endpoint
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f'endpoint port should be an int, not {port!r}') from None
+    return host, port
+
+
+class RetryPolicy:
+    """
+    Reconnects and retries idempotent opcodes that fail because the connection to the CM broke:
+
+        policy = pybrm.RetryPolicy(retries=3, backoff=0.5, idempotent=['PCM_OP_CUST_POL_GET_CONFIG'])
+        c = Client(retry_policy=policy)
+
+    Before each retry, the policy sleeps with exponential backoff and jitter, and reopens the client's connection.
+    An opcode is never retried while the client has an open transaction, since the CM rolled it back,
+    nor when it is called with `reference=True` or `consume=True`, since the opcode may have changed the input flist.
+    A reconnect that fails counts as a failed attempt, and the next one only opens the connection again.
+    If the last attempt fails to reconnect, its error is raised and the client is left closed, see `Client.is_open`.
+    """
+    # Opcodes that only read, so calling them twice is harmless
+    READ_ONLY_OPCODES = (
+        'PCM_OP_READ_OBJ', 'PCM_OP_READ_FLDS', 'PCM_OP_SEARCH', 'PCM_OP_GLOBAL_SEARCH', 'PCM_OP_TEST_LOOPBACK',
+    )
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0, jitter=0.5, idempotent=None, errors=None):
+        """
+        :param retries: the most times an opcode is retried
+        :param backoff: the seconds slept before the first retry, doubling before each later one
+        :param max_backoff: the most seconds slept before a retry
+        :param jitter: the fraction of each sleep that is random, from 0 to 1, so that workers do not retry in step
+        :param idempotent: opcode names, numbers or Opcodes that are safe to retry, besides READ_ONLY_OPCODES
+        :param errors: the BRMError err names to retry on. Defaults to the errors of a broken connection
+        """
+        if not isinstance(retries, int) or retries < 0:
+            raise ValueError(f'retries should be a non-negative int, not {retries!r}')
+        if not 0 <= jitter <= 1:
+            raise ValueError(f'jitter should be between 0 and 1, not {jitter!r}')
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.opcodes = frozenset(
+            opcode_by_name(code) if isinstance(code, str) else int(code)
+            for code in self.READ_ONLY_OPCODES + tuple(idempotent or ())
+        )
+        self.errors = frozenset(errors) if errors is not None else _CONNECTION_ERRORS
+
+    def delay(self, attempt):
+        """
+        Returns the seconds to sleep before a retry
+        :param attempt: the number of the retry, from 0
+        """
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def _call(self, flist, code, flags):
+        client = flist.client
+        if code not in self.opcodes or (client._transaction is not None and client._transaction.is_open()):
+            return FList(client, _flist=flist._flist.opcode(code, flags, False))
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.delay(attempt - 1))
+                try:
+                    # After a failed reconnect the client is already closed
+                    client.reopen() if client.is_open() else client._open()
+                except BRMError as ex:
+                    if ex.err not in self.errors:
+                        raise
+                    error = ex
+                    continue
+            try:
+                return FList(client, _flist=flist._flist.opcode(code, flags, False))
+            except BRMError as ex:
+                if ex.err not in self.errors:
+                    raise
+                error = ex
+        raise error
+
+    def __repr__(self):
+        return f'RetryPolicy(retries={self.retries}, backoff={self.backoff}, max_backoff={self.max_backoff})'
+
+
+class FListTemplate:
+    """
+    An flist built once, that is copied and patched to create flists which differ from it in only a few fields:
+
+        tmpl = client.flist_template({
+            'PIN_FLD_POID': ('/account', -1),
+            'PIN_FLD_PROGRAM_NAME': 'billing',
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 10100, 'PIN_FLD_NAME': 'a'},
+        })
+        f = tmpl.instantiate({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_INHERITED_INFO': {'PIN_FLD_NAME': 'b'}})
+
+    The template is copied natively with PIN_FLIST_COPY, and the overrides are set directly onto the copy,
+    instead of building the whole dict through `client.flist` each time, or building the overrides into
+    a second flist for `update`.
+    """
+    __slots__ = ('client', '_template')
+
+    def __init__(self, client, template):
+        """
+        Don't invoke this directly, instead use client.flist_template()
+        :param client: `Client` the flists belong to
+        :param template: an FList, which is copied, or a dict
+        """
+        self.client = client
+        self._template = template.copy() if isinstance(template, FList) else client.flist(template)
+
+    def instantiate(self, overrides=None):
+        """
+        Returns a new flist copied from the template, with overrides applied the same way as `FList.update`:
+        substructures are updated recursively, array elements are replaced by elem_id, and other fields are set.
+        :param overrides: dict of fields to set on the new flist, or None
+        :return: FList
+        """
+        flist = FList(self.client, _flist=self._template._flist.copy_flist())
+        flist._virtual_arrays.update(self._template._virtual_arrays)
+        if overrides:
+            _patch_flist(flist, overrides)
+        return flist
+
+    def __call__(self, overrides=None):
+        """Same as `instantiate`"""
+        return self.instantiate(overrides)
+
+
+def _patch_flist(flist, overrides):
+    for name, value in overrides.items():
+        field_type = field_type_by_identifier(name)
+        substruct = None
+        if field_type == PIN_FLDT_SUBSTRUCT and isinstance(value, dict) and name in flist:
+            # A NULL substructure is None, and is replaced like any other field
+            substruct = flist[name]
+        if substruct is not None:
+            _patch_flist(substruct, value)
+        elif field_type == PIN_FLDT_ARRAY and isinstance(value, (dict, list)) and name in flist:
+            array = flist[name]
+            for elem_id, elem in (value.items() if isinstance(value, dict) else enumerate(value)):
+                array[elem_id] = elem
+        else:
+            flist[name] = value
+
+
+class FListPool:
+    """
+    A pool of scratch flists that are all shaped like a template, for building many similar input flists:
+
+        pool = client.flist_pool({'PIN_FLD_POID': ('/account', -1), 'PIN_FLD_STATUS': 10100})
+        for account_id in account_ids:
+            with pool.flist() as f:
+                f['PIN_FLD_POID'] = ('/account', account_id)
+                out = f('PCM_OP_READ_FLDS')
+
+    Released flists are not destroyed. Only the top level fields that differ from the template are dropped or copied
+    back from the template, and a flist that was not modified at all is reused as is.
+    An flist must not be used after it is released.
+    """
+    __slots__ = ('client', '_template', '_size', '_free', '_in_use')
+
+    def __init__(self, client, template, size=16):
+        """
+        Don't invoke this directly, instead use client.flist_pool()
+        :param client: `Client` the flists belong to
+        :param template: an FList, which is copied, or a dict
+        :param size: the most released flists kept for reuse
+        """
+        if not isinstance(size, int) or size < 0:
+            raise ValueError(f'size should be a non-negative int, not {size!r}')
+        self.client = client
+        self._template = template.copy() if isinstance(template, FList) else client.flist(template)
+        self._size = size
+        self._free = []
+        self._in_use = {}
+
+    def acquire(self):
+        """
+        Returns an flist shaped like the template, reusing a released flist if there is one
+        :return: FList
+        """
+        if self._free:
+            flist = self._free.pop()
+        else:
+            flist = self._template.copy()
+            flist._virtual_arrays = set(self._template._virtual_arrays)
+        self._in_use[id(flist)] = (flist, flist._flist.tree_generation)
+        return flist
+
+    def release(self, flist):
+        """
+        Gives an flist back to the pool, resetting the fields that were changed since it was acquired
+        :param flist: an FList returned by `acquire`
+        """
+        try:
+            _, generation = self._in_use.pop(id(flist))
+        except KeyError:
+            raise ValueError('This flist was not acquired from this pool') from None
+
+        if len(self._free) >= self._size or isinstance(flist._flist, _ConsumedFList):
+            # A consumed flist has nothing left to reuse
+            return
+
+        if flist._flist.tree_generation != generation:
+            flist._flist.reset(self._template._flist)
+            flist._virtual_arrays = set(self._template._virtual_arrays)
+        self._free.append(flist)
+
+    @contextlib.contextmanager
+    def flist(self):
+        """
+        Acquires an flist and releases it at the end of the with block
+        """
+        flist = self.acquire()
+        try:
+            yield flist
+        finally:
+            self.release(flist)
+
+    def __len__(self):
+        """The number of released flists ready for reuse"""
+        return len(self._free)
+
+
 class FList:
     __slots__ = ['client', '_flist', '_virtual_arrays']
     """
     Wrapper for a BRM flist
     To instantiate, call `client.flist()`; do not call `FList()` directly
     """
-    def __init__(self, client, data=None, _flist=None):
+    def __init__(self, client, data=None, _flist=None, data_format=None):
         """
         Do not call FList(...) directly, instead call `client.flist(...)`
         :param client: the `Client` which owns this flist
@@ -526,9 +1093,11 @@ class FList:
             if a dictionary, it will populate the flist with the keys and values on the dict, recursively
             if a string, it will attempt to convert the string into an flist
                 The string can be json, xml, or a brm flist string.
-                It will attempt to parse it each way, and if only after all three fail will it raise an exception.
+                The format is sniffed from the first non-whitespace character, and parsed only once.
 
         :param _flist: a C wrapper flist. Calling code should not use this.
+        :param data_format: if data is a string, one of 'json', 'xml' or 'str' to skip format sniffing.
+            Calling code should use `client.flist_from_json`, `client.flist_from_xml` or `client.flist_from_str`.
         """
         self.client = client
 
@@ -568,12 +1137,9 @@ class FList:
             return
 
         if isinstance(data, str):
-            # Here we will try to parse json, xml, or regular flist string
-            data = self._parse_flist_data(data)
-            if data is None:
-                # It's either a flist str, or xml.
-                # json will return a dict that is populated a few lines down
-                return
+            # Here we will parse json, xml, or regular flist string
+            self._parse_flist_data(data, data_format)
+            return
 
         self._flist = _FList(self.client._client, True)
 
@@ -587,45 +1153,59 @@ class FList:
             for k in data:
                 self[k] = None
 
-    def _parse_flist_data(self, data):
+    def _parse_flist_data(self, data, data_format=None):
         """
-        For convenience, this will attempt to parse the input as json, xml, and a BRM flist string.
-        Only after failing all three will it raise an exception.
+        Parses the input as json, xml, or a BRM flist string.
 
-        If the data was in json, this returns a dict. Calling code must populate the flist.
+        Unless `data_format` is given, the format is sniffed from the first non-whitespace character:
+            `{` is json, `<` is xml, and anything else is a BRM flist string.
+        Each string is handed to exactly one parser, so a BRM flist string never pays for a failed
+        json and xml parse, and json never reaches PIN_STR_TO_FLIST, which prints to stderr on failure.
 
-        Otherwise, it returns None, and calling code should return immedaitely.
+        Each parser opens self._flist and populates it, so calling code should return immediately.
 
         :param data: json, xml, or brm flist string representing an flist
-        :return: None or a dict
+        :param data_format: one of 'json', 'xml', 'str', or None to sniff the format
         """
-        try:
-            data = json.loads(data)
-        except ValueError:
-            pass
+        if data_format is None:
+            data_format = _sniff_flist_format(data)
+
+        if data_format == 'json':
+            self._parse_json(data)
+        elif data_format == 'xml':
+            self._parse_xml(data)
+        elif data_format == 'str':
+            self._parse_str(data)
         else:
-            return data
+            raise ValueError("data_format must be one of 'json', 'xml' or 'str', not %s" % data_format)
 
+    def _parse_json(self, data):
+        """
+        The json is decoded in C directly onto the flist, in one pass, without building an intermediate dict.
+        Values are converted the same way as `f[field] = value` would convert the output of json.loads.
+        Illegal json raises a ValueError. Unknown fields raise a KeyError and bad values raise a TypeError.
+        """
+        self._flist = _FList(self.client._client, False)
+        virtual_arrays = self._flist.from_json(data, all_flags)
+        # Arrays set to {} or [] have no elements on the C flist
+        self._virtual_arrays.update(virtual_arrays)
+
+    def _parse_xml(self, data):
         try:
-            data = ET.fromstring(data)
+            root = ET.fromstring(data)
         except ET.ParseError:
-            pass
-        else:
-            self._flist = _FList(self.client._client, True)
-            self._flist_from_xml(self, data)
-            return
+            raise ValueError("Illegal xml flist string")
+
+        self._flist = _FList(self.client._client, True)
+        self._flist_from_xml(self, root)
 
+    def _parse_str(self, data):
         try:
             self._flist = _FList(self.client._client, True, data)
         except BRMError as ex:
             if ex.err != 'PIN_ERR_BAD_ARG':
                 raise ex
-            is_error = True
-        else:
-            return
-
-        if is_error:
-            # The data string failed to be parsed in json, xml, or flist string format
+            # The data string failed to be parsed in flist string format
             raise ValueError("Illegal flist string")
 
     def _flist_from_xml(self, f, root):
@@ -680,35 +1260,38 @@ class FList:
                 d[k] = v
         return d
 
-    def _json_formatted(self):
-        """Recurvisely formats this flist to JSON"""
-        d = {}
-        for k, v in self.items():
-            if isinstance(v, FList):
-                d[k] = v._json_formatted()
-            elif isinstance(v, BRMArray):
-                d[k] = {elem_id: f._json_formatted() if f is not None else None for elem_id, f in v.items()}
-            elif isinstance(v, Poid):
-                d[k] = str(v)
-            elif isinstance(v, datetime):
-                d[k] = int(v.timestamp())
-            else:
-                d[k] = v
-        return d
-
-    def json(self):
+    def json(self, stream=None):
         """
         Serialize the flist to a json string.
 
         Unlike BRM's xml function, this will disambiguate between an empty substruct and a NULL substruct.
+        POIDs are serialized to strings like "0.0.0.1 /account -1 0" and timestamps to epoch ints.
+
+        The json is written by the C extension directly from the flist, without building an intermediate dict.
 
-        :param timestamp_format: if None, serializes PIN_FLDT_TSTAMP to float
-            Otherwise, a datetime format specifier, like '%Y-%m-%dT%H:%M:%S.%f' may convert it to a string
-        :return: json serialized string
+        :param stream: if None, return the json string.
+            Otherwise a text file object; the json is written to it in chunks and None is returned.
+        :return: json serialized string, or None if `stream` was given
         """
-        d = self._json_formatted()
+        return self._flist.to_json(stream)
 
-        return json.dumps(d)
+    def view(self):
+        """
+        Returns a read-only view of this flist, for cheap traversal of opcode output.
+
+        The view is a mapping of field names to values, converted the same way as the getters on this flist.
+        Substructs and array elements are returned as more views, and arrays as views keyed by elem_id.
+        A view borrows the C flist instead of allocating an FList for every substruct and array element.
+
+        Do not modify the flist while using its views; a view raises a RuntimeError once the flist has been modified.
+
+            out = c.opcode('PCM_OP_READ_OBJ', {'PIN_FLD_POID': ('/account', 1)})
+            for elem_id, balance in out.view()['PIN_FLD_BALANCES'].items():
+                print(elem_id, balance['PIN_FLD_CURRENT_BAL'])
+
+        :return: FListView
+        """
+        return self._flist.view()
 
     # getters
 
@@ -723,15 +1306,22 @@ class FList:
         except KeyError as ex:
             raise AttributeError
 
-    def get(self, name, default=None):
+    def get(self, name, default=None, tstamp_mode=None, decimal_mode=None):
         """
         Get the value of a field off an flist.
         This will return None or `default` if the field does not exist.
         :param name: The name of the field
         :param default: value to return if the field does not exist
+        :param tstamp_mode: for a tstamp field, overrides the client's tstamp_mode for this call
+        :param decimal_mode: for a decimal field, overrides the client's decimal_mode for this call
         :return:
         """
-        value = self._get_field(name, optional=1)
+        if tstamp_mode is not None and field_type_by_identifier(name) == PIN_FLDT_TSTAMP:
+            value = self._get_tstamp(name, optional=1, tstamp_mode=tstamp_mode)
+        elif decimal_mode is not None and field_type_by_identifier(name) == PIN_FLDT_DECIMAL:
+            value = self._get_decimal(name, optional=1, decimal_mode=decimal_mode)
+        else:
+            value = self._get_field(name, optional=1)
         if value is None:
             value = default
         return value
@@ -769,11 +1359,7 @@ class FList:
             raise ex
 
     def _get_poid(self, name, optional=0):
-        poid = self._flist.get_poid(field_by_identifier(name), optional)
-        if poid is not None:
-            poid = Poid(*poid)
-
-        return poid
+        return self._flist.get_poid(field_by_identifier(name), optional)
 
     def _get_int(self, name, optional=0):
         return self._flist.get_int(field_by_identifier(name), optional)
@@ -790,14 +1376,15 @@ class FList:
     def _get_buf(self, name, optional=0):
         return self._flist.get_buf(field_by_identifier(name), optional)
 
-    def _get_tstamp(self, name, optional=0):
-        ts = self._flist.get_tstamp(field_by_identifier(name), optional)
-        if ts is None:
-            return None
-        return datetime.fromtimestamp(ts)
+    def _get_tstamp(self, name, optional=0, tstamp_mode=None):
+        return self._flist.get_tstamp(
+            field_by_identifier(name), optional, _mode_value(_TSTAMP_MODES, 'tstamp_mode', tstamp_mode)
+        )
 
-    def _get_decimal(self, name, optional=0):
-        return self._flist.get_decimal(field_by_identifier(name), optional)
+    def _get_decimal(self, name, optional=0, decimal_mode=None):
+        return self._flist.get_decimal(
+            field_by_identifier(name), optional, _mode_value(_DECIMAL_MODES, 'decimal_mode', decimal_mode)
+        )
 
     def _get_flist(self, name, optional=0):
         _flist = self._flist.get_flist(field_by_identifier(name), optional)
@@ -864,7 +1451,9 @@ class FList:
             raise ex
 
     def _set_poid(self, name, value, id=-1, revision=0, database=None):
-        poid_string = None
+        """
+        Poids are applied to the flist natively. Poid's database defaults to the value provided by PCM_CONNECT.
+        """
         if isinstance(value, tuple):
             # Short cut to allow the user to do:
             # f['PIN_FLD_POID'] = '/account',
@@ -875,35 +1464,20 @@ class FList:
             if len(value) != 4:
                 raise TypeError("Expecting tuple length of less than 5")
             value = Poid(*value)
-        if isinstance(value, Poid):
-            value, id, revision, database, = value.type, value.id, value.revision, value.database
-        else:
-            if not isinstance(value, str) and value is not None:
-                raise TypeError('value must be Poid, tuple, str, or None')
-
-        if isinstance(value, str) and len(value.split()) == 4:
-            # value is a real Poid string like 0.0.0.1 /account -1 0
-            database, value, id, revision = value.split()
-
-        if database is None:
-            database = self.client.database
-
-        if value is not None:
-            if value[0] in '0123456789':
-                # I think types should start with / anyways, could simply raise error here for that
+        elif isinstance(value, str):
+            if len(value.split()) != 4:
+                value = Poid(value, id, revision, database)
+            elif value.split()[1][0] in '0123456789':
                 raise ValueError("PIN_POID_FROM_STR cannot take a type starting with integer: %s" % value)
-            if isinstance(database, int):
-                database = '0.0.0.%i' % database
-            poid_string = f'{database} {value} {id} {revision}'
+            # Otherwise value is a real Poid string like 0.0.0.1 /account -1 0
+        elif not isinstance(value, Poid) and value is not None:
+            raise TypeError('value must be Poid, tuple, str, or None')
 
         try:
-            if poid_string is not None:
-                self._flist.set_poid(field_by_identifier(name), value=poid_string)
-            else:
-                self._flist.set_poid(field_by_identifier(name))
+            self._flist.set_poid(field_by_identifier(name), value=value)
         except BRMError as ex:
             if ex.err == 'PIN_ERR_BAD_ARG':
-                raise ValueError('Invalid POID string: %s' % poid_string)
+                raise ValueError('Invalid POID string: %s' % value)
             raise ex
 
     def _set_str(self, name, value):
@@ -928,20 +1502,15 @@ class FList:
             self._flist.set_buf(field_by_identifier(name))
 
     def _set_tstamp(self, name, value):
-        if isinstance(value, datetime):
-            value = int(value.timestamp())
-
-        if value is not None:
+        # datetimes and ints are converted in C
+        if value is not None and not isinstance(value, (datetime, int)):
             # This will truncate floats which is OK because time date type is time_t
             try:
                 value = int(value)
             except ValueError:
                 raise TypeError('Expected int not %s' % value)
 
-        if value is not None:
-            self._flist.set_tstamp(field_by_identifier(name), value=value)
-        else:
-            self._flist.set_tstamp(field_by_identifier(name))
+        self._flist.set_tstamp(field_by_identifier(name), value=value)
 
     def _set_int(self, name, value):
         if isinstance(value, str):
@@ -976,20 +1545,13 @@ class FList:
             self._flist.set_enum(field_by_identifier(name))
 
     def _set_decimal(self, name, value):
-        if isinstance(value, str):
-            try:
-                float(value)
-            except ValueError:
-                raise TypeError('expecting a float or decimal, not %s' % value)
-
-        if isinstance(value, (int, float, Decimal)):
-            # `_flist.set_decimal` expects a char *
-            value = str(value)
-
-        if value is not None:
+        # ints, floats, Decimals and strings are converted in C, and strings are parsed by pin_decimal
+        try:
             self._flist.set_decimal(field_by_identifier(name), value=value)
-        else:
-            self._flist.set_decimal(field_by_identifier(name))
+        except BRMError as ex:
+            if isinstance(value, str):
+                raise TypeError('expecting a float or decimal, not %s' % value)
+            raise ex
 
     def _set_flist_on_array(self, name, value, elem_id):
         if value is not None and not isinstance(value, FList):
@@ -1025,7 +1587,8 @@ class FList:
             self._virtual_arrays.discard(field_by_identifier(name))
 
         elif isinstance(value, BRMArray):
-            for elem_id, f in value.items():
+            # value may be this very array, which cannot be set on while it is being iterated
+            for elem_id, f in list(value.items()):
                 self._set_flist_on_array(name, value=f, elem_id=elem_id)
 
             self._virtual_arrays.discard(field_by_identifier(name))
@@ -1121,17 +1684,24 @@ class FList:
 
         self._flist.sort_reverse_flist(sort_flist._flist, sort_default)
 
-    def opcode(self, code, flags=None, reference=False):
+    def opcode(self, code, flags=None, reference=False, consume=False):
         """
         Calls an opcode for this flist
         You can also just do `flist('PCM_OP_TEST_LOOPBACK')` instead of `flist.opcode('PCM_OP_TEST_LOOPBACK')`
-        :param code: the opcode to execute
-        :param flags: the opcode flags, may be a string or a list/tuple of strings
+        :param code: the opcode to execute, as a name, a number or an Opcode
+        :param flags: the opcode flags, may be a string or a list/tuple of strings, or an int from `pybrm.flags`
+            If None, the flags of an Opcode are used
         :param reference: if False, the opcode is executed by passing a copy of the input flist; e.g PCM_OP
             if True, the opcode is executed by passing a reference to the input flist; e.g. PCM_OPREF
+        :param consume: if True, the input flist is handed to the opcode with PCM_OPREF and is not copied.
+            This flist cannot be used afterwards, any use raises a ValueError, even if the opcode fails.
+            Only a top level flist can be consumed, while no flists on its substructs or arrays are referenced.
         :return:
         """
-        if isinstance(code, str):
+        if isinstance(code, Opcode):
+            if flags is None:
+                flags = code.flags
+        elif isinstance(code, str):
             try:
                 code = opcode_by_name(code)
             except KeyError:
@@ -1139,35 +1709,84 @@ class FList:
 
         flags = _bitwise_or_flags(flags)
 
-        c_flist = self._flist.opcode(code, flags, reference)
+        cache = _OPCODE_CACHES.get(code) if _OPCODE_CACHES else None
+        if cache is not None and not reference and not consume:
+            return cache._call(self, code, flags)
+
+        if not consume:
+            if reference or self.client.retry_policy is None:
+                return FList(self.client, _flist=self._flist.opcode(code, flags, reference))
+            return self.client.retry_policy._call(self, code, flags)
+
+        _flist = self._flist
+        try:
+            c_flist = _flist.opcode(code, flags, True, True)
+        finally:
+            if not _flist.is_open():
+                self._flist = _ConsumedFList(code)
+                self._virtual_arrays = set()
 
         return FList(self.client, _flist=c_flist)
 
-    def __call__(self, code, flags=None, reference=False):
+    def __call__(self, code, flags=None, reference=False, consume=False):
         """
         Allows you to call an opcode via `flist('PCM_OP_TEST_LOOPBACK')`
         instead of `flist.opcode('PCM_OP_TEST_LOOPBACK')
         """
-        return self.opcode(code, flags=flags, reference=reference)
+        return self.opcode(code, flags=flags, reference=reference, consume=consume)
 
-    def update(self, other):
+    def update(self, other, in_place=False):
         """
         Adds the keys on the other flist to this flist, and overwites it it already exists
         This is similar to PIN_FLIST_OONCAT, except that PIN_FLIST_CONCAT has a bug where it will just duplicate
         the fields if they already exist, resulting in strange behavior.
         If you really need this behavior, you can use `_concat` but it is unlikely you need this.
 
+        Substructures on both flists are updated recursively. Array elements are replaced by elem_id.
+        If `other` has a field more than once, the first one is used.
+
         You can also + two flists together. It results in a brand new flist, and doesn't mutate the original flists.
 
+        :param other: FList or dict
+        :param in_place: set to True to move the fields off of `other` instead of copying them, leaving it empty
         """
+        if other is self:
+            return
+
         if other is not None and not isinstance(other, FList):
+            # Nobody else has this flist, so its fields can be moved instead of copied
             other = self.client.flist(data=other)
+            in_place = True
 
-        for k, v in other.items():
-            if isinstance(v, (FList, BRMArray)):
-                self[k].update(v)
-            else:
-                self[k] = v
+        self._flist.merge(other._flist, in_place)
+        for field in other._virtual_arrays:
+            if not self._flist.does_field_exist(field):
+                self._virtual_arrays.add(field)
+
+    def project(self, spec, in_place=False):
+        """
+        Keeps only the fields named in `spec`, in a single pass over the flist.
+
+        `spec` has the same shape as the `results` of `Client.search`:
+            a set, list or tuple of fields keeps those fields entirely
+            a dict maps fields to None or an empty set to keep them entirely, or to a nested spec to keep
+            only those fields on a substructure, or on every flist of an array
+
+            f.project({'PIN_FLD_POID': None, 'PIN_FLD_BALANCES': {'PIN_FLD_CURRENT_BAL'}})
+
+        :param spec: set, list, tuple or dict of fields
+        :param in_place: set to True to drop all other fields off this flist, instead of returning a new flist
+        :return: the new FList, or this FList if in_place is True
+        """
+        spec = _projection_spec(spec)
+        if in_place:
+            self._flist.project(spec, True)
+            self._virtual_arrays.intersection_update(spec)
+            return self
+
+        flist = FList(self.client, _flist=self._flist.project(spec, False))
+        flist._virtual_arrays.update(self._virtual_arrays.intersection(spec))
+        return flist
 
     def __add__(self, other_flist):
         """
@@ -1199,8 +1818,8 @@ class FList:
         """
         # PIN_FLIST_COUNT has a bug, where if you use PIN_ELEM_FLD_SET to place an item on the array,
         # PIN_FLIST_COUNT will then return the recursive count, instead of the top-level count.
-        # As a workaround, just return the count of the keys on this flist.
-        c = len([k for k in self.keys()])
+        # As a workaround, the C extension counts the keys on this flist, and caches it until the flist changes.
+        c = self._flist.count()
         if not recursive:
             return c
 
@@ -1218,7 +1837,7 @@ class FList:
         return self.count()
 
     def __iter__(self):
-        yield from self._flist.init_iter()
+        return self._flist.iter_fields()
 
     def __dir__(self):
         return super().__dir__() + list(self.keys())
@@ -1305,9 +1924,8 @@ class FList:
 
     def clear(self):
         """Removes everything from ths flist"""
-        for k in self:
-            # This is safe to delete while iterating
-            # because FListIterator pre-fetches the entire list of keys
+        # The field iterator is lazy, so collect the keys before deleting
+        for k in list(self):
             del self[k]
 
     def __str__(self):
@@ -1338,18 +1956,28 @@ class FList:
         return self._flist.str_compact()
 
     def __eq__(self, other):
-        if len(self) != len(other):
-            return False
         if not isinstance(other, FList):
+            if not isinstance(other, dict):
+                return NotImplemented
             other = self.client.flist(data=other)
-        for k in self:
-            if k not in other:
-                return False
 
-            if self[k] != other[k]:
-                return False
+        return self._flist.equals(other._flist)
 
-        return True
+    def diff(self, other):
+        """
+        Returns the fields that differ between this flist and other, without converting any values to Python.
+
+        Each field is given as a path like 'PIN_FLD_RESULTS[4].PIN_FLD_POID'.
+        Fields on other but not on this flist are added, fields on this flist but not on other are removed.
+        Array elements are matched up by elem_id.
+
+        :param other: FList or dict
+        :return: FListDiff(added, removed, changed) of lists of paths
+        """
+        if not isinstance(other, FList):
+            other = self.client.flist(data=other)
+
+        return FListDiff(*self._flist.diff(other._flist))
 
     def capsule(self, copy_capsule=True):
         """
@@ -1379,6 +2007,23 @@ class FList:
         return self._flist.capsule(copy_capsule)
 
 
+class _ConsumedFList:
+    """
+    Stands in for the C flist of an FList that was consumed by an opcode, so that any later use raises a ValueError
+    instead of touching the C flist that was handed to the opcode. See `FList.opcode`
+    """
+    __slots__ = ('_code',)
+
+    def __init__(self, code):
+        self._code = code
+
+    def __getattr__(self, name):
+        raise ValueError(f'This flist was consumed by opcode {self._code} and cannot be used')
+
+    def __str__(self):
+        return f'<flist consumed by opcode {self._code}>'
+
+
 class BRMArray:
     """
     A wrapper for an array of flists. Do not call this directly.
@@ -1420,7 +2065,7 @@ class BRMArray:
         return False
 
     def __iter__(self):
-        yield from self._cflist.array_init_iter(field_by_identifier(self._parent_name))
+        return self._cflist.array_iter(field_by_identifier(self._parent_name), _ARRAY_ITER_KEYS)
 
     def __contains__(self, elem_id):
         field_number = field_by_identifier(self._parent_name)
@@ -1442,18 +2087,27 @@ class BRMArray:
 
     def items(self):
         """Returns the (elem_id, flist) items from this array"""
-        for elem_id in self:
-            yield (elem_id, self._get_array_flist(elem_id))
+        client = self._parent_flist.client
+        for elem_id, _flist in self._cflist.array_iter(field_by_identifier(self._parent_name), _ARRAY_ITER_ITEMS):
+            yield elem_id, FList(client, _flist=_flist) if _flist is not None else None
 
     def values(self):
         """Returns the flists from this array"""
-        for elem_id in self:
-            yield self._get_array_flist(elem_id)
+        client = self._parent_flist.client
+        for _flist in self._cflist.array_iter(field_by_identifier(self._parent_name), _ARRAY_ITER_VALUES):
+            yield FList(client, _flist=_flist) if _flist is not None else None
 
     def keys(self):
         """Returns the elem_ids from this array"""
         yield from self
 
+    def view(self):
+        """
+        Returns a read-only view of this array, keyed by elem_id. See `FList.view()`
+        :return: FListView
+        """
+        return self._cflist.view(field_by_identifier(self._parent_name))
+
     def pop(self, elem_id, default=None):
         """Pops an flist off the array by elem_id"""
         val = default
@@ -1464,9 +2118,8 @@ class BRMArray:
 
     def clear(self):
         """Removes all the flists from this array"""
-        for elem_id in self:
-            # This is safe to delete while iterating
-            # because BRMArrayIterator pre-fetches the entire list of keys
+        # The array iterator is lazy, so collect the elem_ids before deleting
+        for elem_id in list(self):
             del self[elem_id]
 
     def count(self, recursive=False):
@@ -1521,6 +2174,11 @@ class BRMArray:
         return repr(flist.asdict())
 
     def __eq__(self, other):
+        if isinstance(other, BRMArray):
+            return self._cflist.array_equals(
+                field_by_identifier(self._parent_name), other._cflist, field_by_identifier(other._parent_name)
+            )
+
         if len(self) != len(other):
             return False
 
@@ -1533,6 +2191,114 @@ class BRMArray:
 
         return True
 
+    def sort(self, key, reverse=False, renumber=False):
+        """
+        Sorts the flists on this array in place, with Python's comparison rules.
+
+        Unlike FList.sort, which uses PIN_FLIST_SORT, the flists are not copied, so any references to them stay valid.
+        Flists missing a key field and NULL flists sort last. The sort is stable.
+
+            ar.sort('PIN_FLD_CREATED_T')
+            ar.sort(['PIN_FLD_STATUS', 'PIN_FLD_CREATED_T'], reverse=True)
+            ar.sort(lambda flist: flist['PIN_FLD_POID'].id)
+
+        :param key: a field, a list of fields, or a function called with each flist
+        :param reverse: set to True to sort in descending order
+        :param renumber: set to True to renumber the elem_ids 0, 1, 2, ... in sorted order
+        """
+        field = field_by_identifier(self._parent_name)
+        if callable(key):
+            keys = [key(flist) if flist is not None else None for flist in self.values()]
+            self._cflist.array_sort(field, None, keys, reverse, renumber)
+            return
+
+        if isinstance(key, (str, int)):
+            key = [key]
+
+        key_fields = tuple(field_by_identifier(k) for k in key)
+        self._cflist.array_sort(field, key_fields, None, reverse, renumber)
+
+    def filter(self, field, op, value):
+        """
+        Returns the elem_ids of the flists on this array where `flist[field] <op> value`, without creating an FList
+        for each flist. NULL flists are skipped. A missing field is None, which only matches '==' None or '!='.
+
+            elem_ids = out['PIN_FLD_BALANCES'].filter('PIN_FLD_CURRENT_BAL', '!=', 0)
+
+        :param field: the field on each flist to compare
+        :param op: one of '==', '!=', '<', '<=', '>', '>='
+        :param value: the value to compare to
+        :return: list of elem_ids
+        """
+        try:
+            op = _ARRAY_FILTER_OPS[op]
+        except KeyError:
+            raise ValueError(f'op should be one of {", ".join(_ARRAY_FILTER_OPS)}, not {op!r}') from None
+
+        return self._cflist.array_filter(field_by_identifier(self._parent_name), field_by_identifier(field), op, value)
+
+    def group_by(self, field):
+        """
+        Groups the flists on this array by the value of `field`, without creating an FList for each flist.
+        NULL flists are skipped. Flists missing the field are grouped under None.
+
+        :param field: the field on each flist to group by
+        :return: dict of value to a list of elem_ids
+        """
+        return self._cflist.array_group(
+            field_by_identifier(self._parent_name), field_by_identifier(field), _ARRAY_GROUP_ELEM_IDS
+        )
+
+    def index_by(self, field):
+        """
+        Returns a dict of the value of `field` to a read-only view of the flist with that value.
+        If several flists have the same value, the last one wins. NULL flists are skipped.
+        Like any view, these become stale once the flist is modified.
+
+        :param field: the field on each flist to index by
+        :return: dict of value to FListView
+        """
+        return self._cflist.array_group(
+            field_by_identifier(self._parent_name), field_by_identifier(field), _ARRAY_INDEX_VIEWS
+        )
+
+    def column(self, field, tstamp_mode='epoch_int', decimal_mode=None):
+        """
+        Returns the value of `field` on each flist of this array, in order, without creating an FList for each flist.
+        NULL flists are skipped, and a missing field is None.
+
+        Tstamps are returned as epoch ints by default, ready to be vectorized:
+
+            created = out['PIN_FLD_RESULTS'].column('PIN_FLD_CREATED_T')
+
+        :param field: the field on each flist to extract
+        :param tstamp_mode: 'epoch_int', 'datetime', 'aware_utc', or None for the client's tstamp_mode
+        :param decimal_mode: 'float', 'decimal', 'scaled_int', or None for the client's decimal_mode
+        :return: list of values
+        """
+        return self._cflist.array_column(
+            field_by_identifier(self._parent_name),
+            field_by_identifier(field),
+            _mode_value(_TSTAMP_MODES, 'tstamp_mode', tstamp_mode),
+            _mode_value(_DECIMAL_MODES, 'decimal_mode', decimal_mode),
+        )
+
+    def build_index(self, field):
+        """
+        Returns a read-only mapping of the value of `field` to the elem_id of the flist with that value,
+        for repeated lookups without scanning the array each time:
+
+            index = out['PIN_FLD_PRODUCTS'].build_index('PIN_FLD_PRODUCT_OBJ')
+            elem_id = index[product_poid]
+
+        If several flists have the same value, the last one wins. NULL flists are skipped.
+        The index is built in one pass, and is rebuilt on the next lookup after the flist holding the array is modified.
+
+        :param field: the field on each flist to index by
+        :return: ArrayIndex
+        """
+        return ArrayIndex(self._cflist, field_by_identifier(self._parent_name), field_by_identifier(field))
+
     def update(self, other):
         """Similar to concat, except does not duplicate keys on the flist"""
         if isinstance(other, list):
@@ -1542,22 +2308,394 @@ class BRMArray:
             self[elem_id] = flist
 
 
+class ArrayIndex(Mapping):
+    """
+    A mapping of the value of a field to the elem_id of an flist on an array. Use BRMArray.build_index to create one.
+    """
+    __slots__ = ('_cflist', '_field', '_key_field', '_generation', '_index')
+
+    def __init__(self, cflist, field, key_field):
+        self._cflist = cflist
+        self._field = field
+        self._key_field = key_field
+        self._generation = None
+        self._index = None
+        self._refresh()
+
+    def _refresh(self):
+        generation = self._cflist.tree_generation
+        if generation != self._generation:
+            self._index = self._cflist.array_group(self._field, self._key_field, _ARRAY_INDEX_ELEM_IDS)
+            self._generation = generation
+        return self._index
+
+    def __getitem__(self, value):
+        return self._refresh()[value]
+
+    def __iter__(self):
+        return iter(self._refresh())
+
+    def __len__(self):
+        return len(self._refresh())
+
+    def __repr__(self):
+        return f'ArrayIndex({self._refresh()!r})'
+
+
+class Opcode(int):
+    """
+    An opcode resolved once, with optional default flags, to call it without looking up names on every call:
+
+        READ_FLDS = pybrm.Opcode('PCM_OP_READ_FLDS', flags='PCM_OPFLG_CACHEABLE')
+        out = f(READ_FLDS)
+
+    An Opcode is the opcode number, so it can be used anywhere an opcode number can.
+    Flags passed to `FList.opcode` replace the Opcode's flags.
+    """
+    def __new__(cls, code, flags=None):
+        """
+        :param code: the opcode name, like 'PCM_OP_READ_OBJ', or number
+        :param flags: the default flags, in any form accepted by `FList.opcode`
+        """
+        name = None
+        if isinstance(code, str):
+            name = code
+            try:
+                code = opcode_by_name(code)
+            except KeyError:
+                raise KeyError("No opcode found for %s" % code)
+
+        self = super().__new__(cls, code)
+        self.name = name
+        self.flags = _bitwise_or_flags(flags)
+        return self
+
+    def __repr__(self):
+        return f'Opcode({self.name if self.name is not None else int(self)!r}, flags={self.flags})'
+
+
+class OpcodeCache:
+    """
+    A process wide LRU of the outputs of one opcode, keyed by the opcode flags and some fields of the input flist.
+    Use `cache_opcode` to create one.
+
+    Outputs are stored as BRM flist strings, so they can be served to an flist of any client.
+    While the calling client has an open transaction, the cache is neither read nor filled, since the output may hold
+    uncommitted changes, and changes made in the transaction are not in the cached outputs.
+    """
+    def __init__(self, code, key_fields=None, ttl=None, maxsize=256):
+        """
+        Don't invoke this directly, instead use pybrm.cache_opcode()
+        """
+        if key_fields is not None:
+            key_fields = tuple(key_fields)
+            for name in key_fields:
+                if field_type_by_identifier(name) in (PIN_FLDT_ARRAY, PIN_FLDT_SUBSTRUCT):
+                    raise ValueError(f'key_fields cannot have arrays or substructs: {field_name_by_identifier(name)}')
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f'ttl should be positive, not {ttl!r}')
+        if not isinstance(maxsize, int) or maxsize <= 0:
+            raise ValueError(f'maxsize should be a positive int, not {maxsize!r}')
+
+        self.code = code
+        self.key_fields = key_fields
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, flist, flags):
+        if self.key_fields is None:
+            # Formats the whole input flist on every call
+            return flags, str(flist)
+        # tstamps and decimals are read exactly, regardless of the client's modes
+        return flags, tuple(flist.get(name, tstamp_mode='epoch_int', decimal_mode='decimal') for name in self.key_fields)
+
+    @staticmethod
+    def _opcode(flist, code, flags):
+        if flist.client.retry_policy is None:
+            return FList(flist.client, _flist=flist._flist.opcode(code, flags, False))
+        return flist.client.retry_policy._call(flist, code, flags)
+
+    def _call(self, flist, code, flags):
+        client = flist.client
+        if client._transaction is not None and client._transaction.is_open():
+            return self._opcode(flist, code, flags)
+
+        key = self._key(flist, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                data = entry[1]
+            else:
+                self.misses += 1
+                data = None
+
+        if data is not None:
+            return client.flist_from_str(data)
+
+        out = self._opcode(flist, code, flags)
+        expires = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, str(out))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return out
+
+    def clear(self):
+        """Drops every cached output"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f'OpcodeCache({self.code}, key_fields={self.key_fields!r}, ttl={self.ttl!r}, maxsize={self.maxsize})'
+
+
+def cache_opcode(code, key_fields=None, ttl=None, maxsize=256):
+    """
+    Caches the outputs of an opcode whose output does not change for a while, like reading /config objects.
+    Every later call of this opcode with `FList.opcode`, by any client, with the same flags and the same values of
+    `key_fields` on the input flist, gets a new flist of the cached output instead of calling the CM:
+
+        pybrm.cache_opcode('PCM_OP_READ_OBJ', key_fields=['PIN_FLD_POID'], ttl=3600)
+
+    Calls with `reference=True` or `consume=True` are never cached, since the opcode may change the input flist.
+    Calls on a client with an open transaction skip the cache, since their outputs may be uncommitted.
+    Only successful outputs are cached. Do not cache opcodes that write.
+
+    :param code: the opcode name, number or Opcode
+    :param key_fields: the top level fields of the input flist that the output depends on.
+        If None, the whole input flist is the key, which formats it as a string on every call, so for large inputs
+        name the fields instead
+    :param ttl: the number of seconds an output is kept, or None to keep it until it is evicted
+    :param maxsize: the most outputs kept; the least recently used output is evicted first
+    :return: the OpcodeCache, which replaces any previous cache of this opcode
+    """
+    if isinstance(code, str):
+        try:
+            code = opcode_by_name(code)
+        except KeyError:
+            raise KeyError("No opcode found for %s" % code)
+
+    cache = OpcodeCache(int(code), key_fields=key_fields, ttl=ttl, maxsize=maxsize)
+    _OPCODE_CACHES[cache.code] = cache
+    return cache
+
+
+def uncache_opcode(code):
+    """
+    Stops caching an opcode and drops its cached outputs. Does nothing if the opcode is not cached
+    :param code: the opcode name, number or Opcode
+    """
+    if isinstance(code, str):
+        code = opcode_by_name(code)
+    _OPCODE_CACHES.pop(int(code), None)
+
+
+_PATH_STEP = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\[\s*(\*|-?\d+)\s*\])?\s*$')
+
+
+class Path:
+    """
+    A compiled path to a field, like 'PIN_FLD_BALANCES[840].PIN_FLD_CURRENT_BAL'
+
+    Substructures and fields are separated by '.', and every array needs either an [elem_id] or [*].
+    [*] matches every flist on the array. Use [-1] for PIN_ELEMID_ANY.
+
+    The path is compiled once, and each `get` resolves it in a single call to the C extension.
+    Only a path that ends on a substructure or array flist creates FList objects.
+
+        balance = pybrm.path('PIN_FLD_BALANCES[840].PIN_FLD_CURRENT_BAL')
+        for flist in flists:
+            print(balance.get(flist))
+
+    Use `pybrm.path` instead of creating a Path directly, which caches the compiled paths.
+    """
+    __slots__ = ['expression', '_steps', '_wildcard']
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._steps = _compile_path(expression)
+        self._wildcard = any(len(step) == 2 and step[1] is None for step in self._steps)
+
+    def __repr__(self):
+        return f'Path({self.expression!r})'
+
+    def _resolve(self, flist, steps, optional):
+        return [
+            FList(flist.client, _flist=value) if isinstance(value, _FList) else value
+            for value in flist._flist.path_get(steps, optional)
+        ]
+
+    def get(self, flist, default=None):
+        """
+        Returns the value at the end of the path, or `default` if any field on the way does not exist.
+        If the path has a wildcard, returns a list of the value of every match instead.
+
+        :param flist: FList
+        :param default: value to return if the field does not exist
+        :return: value, or list of values
+        """
+        values = self._resolve(flist, self._steps, True)
+        if self._wildcard:
+            return values
+
+        if not values or values[0] is None:
+            return default
+        return values[0]
+
+    def set(self, flist, value):
+        """
+        Sets the field at the end of the path. If the path has a wildcard, it is set on every match.
+        Raises KeyError if any substructure or array flist on the way does not exist.
+
+        :param flist: FList
+        :param value: the value to set
+        """
+        *parent_steps, (field, *index) = self._steps
+        if parent_steps:
+            parents = self._resolve(flist, tuple(parent_steps), False)
+        else:
+            parents = [flist]
+
+        for parent in parents:
+            if parent is None:
+                continue
+            if not index:
+                parent[field] = value
+            elif index[0] is not None:
+                parent[field][index[0]] = value
+            else:
+                array = parent[field]
+                for elem_id in list(array):
+                    array[elem_id] = value
+
+
+def _compile_path(expression):
+    """
+    Compiles a path into the steps that _FList.path_get expects:
+        (field,) for a substructure or a field, (field, elem_id) for an array flist, or (field, None) for [*]
+    """
+    parts = expression.split('.')
+    steps = []
+    for i, part in enumerate(parts):
+        match = _PATH_STEP.match(part)
+        if match is None:
+            raise ValueError(f'Illegal path {expression!r}')
+
+        name, index = match.groups()
+        field = field_by_identifier(name)
+        field_type = field_type_by_identifier(name)
+
+        if field_type == PIN_FLDT_ARRAY:
+            if index is None:
+                raise ValueError(f'Array {name} in path {expression!r} needs an [elem_id] or [*]')
+            steps.append((field, None if index == '*' else int(index)))
+        elif index is not None:
+            raise ValueError(f'Field {name} in path {expression!r} is not an array')
+        elif field_type != PIN_FLDT_SUBSTRUCT and i != len(parts) - 1:
+            raise ValueError(f'Field {name} in path {expression!r} is not a substructure or array')
+        else:
+            steps.append((field,))
+
+    return tuple(steps)
+
+
+@functools.lru_cache(maxsize=1024)
+def path(expression):
+    """
+    Returns the compiled Path for `expression`, like 'PIN_FLD_BALANCES[840].PIN_FLD_CURRENT_BAL'
+    Compiled paths are cached.
+    """
+    return Path(expression)
+
+
+def _mode_value(modes, argument, mode):
+    """Returns the C value of a mode name from `modes`, or _CLIENT_MODE for None"""
+    if mode is None:
+        return _CLIENT_MODE
+    try:
+        return modes[mode]
+    except KeyError:
+        raise ValueError(f'{argument} should be one of {", ".join(modes)}, not {mode!r}') from None
+
+
+def _mode_name(modes, value):
+    return next(name for name, mode_value in modes.items() if mode_value == value)
+
+
+def _projection_spec(spec):
+    """
+    Converts a projection spec into the dict of field number to nested spec or None that FList.project expects
+    """
+    if not isinstance(spec, dict):
+        spec = dict.fromkeys(spec)
+
+    return {field_by_identifier(k): _projection_spec(v) if v else None for k, v in spec.items()}
+
+
+def _sniff_flist_format(data):
+    """
+    Guess the format of an flist string from its first non-whitespace character.
+    Json flists are objects, xml flists start with a tag, and BRM flist strings start with the nesting level.
+    :param data: json, xml, or brm flist string
+    :return: 'json', 'xml', or 'str'
+    """
+    stripped = data.lstrip()
+    if stripped[:1] == '{':
+        return 'json'
+    if stripped[:1] == '<':
+        return 'xml'
+    return 'str'
+
+
 def _bitwise_or_flags(flags):
+    """
+    Returns flags as an int. flags may be None, a flag name or int, or a list/tuple of flag names and ints.
+    None and ints are returned as is, and names are resolved once per distinct spec.
+    """
     if flags is None:
-        flags = []
+        return 0
+
+    if isinstance(flags, int):
+        return flags
+
+    if isinstance(flags, str):
+        flags = (flags,)
 
-    if isinstance(flags, (str, int)):
-        flags = [flags]
+    return _compile_flags(tuple(flags))
 
+
+@functools.lru_cache(maxsize=256)
+def _compile_flags(flags):
     try:
         flags = [all_flags[flag] if isinstance(flag, str) else flag for flag in flags]
     except KeyError:
-        raise KeyError("No flag found for %s, check pybrm/fields.py" % flags)
+        raise KeyError("No flag found for %s, check pybrm/fields.py" % (flags,))
 
     # This will bit wise or each flag into one result, or return 0 if no flags are given
-    flags = functools.reduce(lambda a, b: operator.ior(a, b), flags, 0)
+    return functools.reduce(operator.ior, flags, 0)
+
+
+def flags(*names):
+    """
+    Returns the bitwise or of flag names and ints, to resolve a set of flags once, e.g. as a module constant:
+
+        SEARCH_FLAGS = pybrm.flags('SRCH_DISTINCT', 'SRCH_EXACT')
 
-    return flags
+    :param names: flag names like 'PCM_OPFLG_READ_RESULT', or ints
+    :return: int
+    """
+    return _bitwise_or_flags(names)
 
 
 _python_to_brm_level = {
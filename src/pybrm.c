@@ -1,8 +1,11 @@
 #include <Python.h>
 #include <time.h>
 #include <stdlib.h>
+#include <ctype.h>
+#include <errno.h>
 #include "pythread.h"
 #include "structmember.h"
+#include "datetime.h"
 #include "pcm.h"
 #include "cm_fm.h"
 #include "pin_errs.h"
@@ -53,6 +56,179 @@
         } \
     } while (0);
 
+/*
+*
+* FieldSet
+*
+* A small open addressing hash set of field numbers.
+* Walking an flist with PIN_FLIST_ANY_GET_NEXT returns every array element and every duplicate field
+* (see the comment about PIN_FLIST_CONCAT on FieldIterator), so callers use this to visit each field once
+* without allocating Python objects. Small flists never touch the heap.
+*
+*/
+#define FIELD_SET_SMALL_SIZE 32
+
+typedef struct {
+    pin_fld_num_t *fields;
+    Py_ssize_t capacity;
+    Py_ssize_t size;
+    pin_fld_num_t small[FIELD_SET_SMALL_SIZE];
+} FieldSet;
+
+static void FieldSet_init(FieldSet *set)
+{
+    memset(set->small, 0, sizeof(set->small));
+    set->fields = set->small;
+    set->capacity = FIELD_SET_SMALL_SIZE;
+    set->size = 0;
+}
+
+static void FieldSet_free(FieldSet *set)
+{
+    if (set->fields != set->small) {
+        PyMem_Free(set->fields);
+    }
+    set->fields = set->small;
+    set->capacity = FIELD_SET_SMALL_SIZE;
+    set->size = 0;
+}
+
+static Py_ssize_t FieldSet_slot(pin_fld_num_t *fields, Py_ssize_t capacity, pin_fld_num_t field)
+{
+    Py_ssize_t mask = capacity - 1;
+    Py_ssize_t i = (Py_ssize_t) (((unsigned int) field * 2654435761u) & mask);
+
+    while (fields[i] != 0 && fields[i] != field) {
+        i = (i + 1) & mask;
+    }
+    return i;
+}
+
+static int FieldSet_contains(FieldSet *set, pin_fld_num_t field)
+{
+    return set->fields[FieldSet_slot(set->fields, set->capacity, field)] == field;
+}
+
+/*
+* Returns 1 if the field was added, 0 if it was already present, -1 with a MemoryError on failure
+* Field numbers are never 0, so 0 marks an empty slot
+*/
+static int FieldSet_add(FieldSet *set, pin_fld_num_t field)
+{
+    Py_ssize_t i = 0;
+    Py_ssize_t j = 0;
+    Py_ssize_t capacity = 0;
+    pin_fld_num_t *fields = NULL;
+
+    i = FieldSet_slot(set->fields, set->capacity, field);
+    if (set->fields[i] == field) {
+        return 0;
+    }
+
+    if ((set->size + 1) * 2 > set->capacity) {
+        capacity = set->capacity * 2;
+        if ((fields = PyMem_Calloc(capacity, sizeof(pin_fld_num_t))) == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        for (j = 0; j < set->capacity; j++) {
+            if (set->fields[j] != 0) {
+                fields[FieldSet_slot(fields, capacity, set->fields[j])] = set->fields[j];
+            }
+        }
+        if (set->fields != set->small) {
+            PyMem_Free(set->fields);
+        }
+        set->fields = fields;
+        set->capacity = capacity;
+        i = FieldSet_slot(set->fields, set->capacity, field);
+    }
+
+    set->fields[i] = field;
+    set->size++;
+    return 1;
+}
+
+
+/*
+*
+* Field names
+*
+* A process wide cache of field numbers to interned field name strings.
+* Iterating over an flist yields the same name objects every time, instead of building a new string per field.
+* There are only so many fields in the data dictionary, so entries are never evicted.
+*
+*/
+typedef struct {
+    pin_fld_num_t field;
+    PyObject *name;
+} FieldNameEntry;
+
+static FieldNameEntry *field_names = NULL;
+static Py_ssize_t field_names_capacity = 0;
+static Py_ssize_t field_names_size = 0;
+
+static Py_ssize_t FieldName_slot(FieldNameEntry *entries, Py_ssize_t capacity, pin_fld_num_t field)
+{
+    Py_ssize_t mask = capacity - 1;
+    Py_ssize_t i = (Py_ssize_t) (((unsigned int) field * 2654435761u) & mask);
+
+    while (entries[i].field != 0 && entries[i].field != field) {
+        i = (i + 1) & mask;
+    }
+    return i;
+}
+
+/*
+* Returns the interned name of a field, or NULL with an exception set
+*
+* Return value: Borrowed Reference
+*/
+static PyObject *FieldName_get(pin_fld_num_t field)
+{
+    FieldNameEntry *entries = NULL;
+    Py_ssize_t capacity = 0;
+    Py_ssize_t i = 0;
+    const char *name = NULL;
+
+    if (field_names != NULL) {
+        i = FieldName_slot(field_names, field_names_capacity, field);
+        if (field_names[i].field == field) {
+            return field_names[i].name;
+        }
+    }
+
+    if ((field_names_size + 1) * 2 > field_names_capacity) {
+        capacity = field_names_capacity ? field_names_capacity * 2 : 256;
+        if ((entries = PyMem_Calloc(capacity, sizeof(FieldNameEntry))) == NULL) {
+            PyErr_NoMemory();
+            return NULL;
+        }
+        for (i = 0; i < field_names_capacity; i++) {
+            if (field_names[i].field != 0) {
+                entries[FieldName_slot(entries, capacity, field_names[i].field)] = field_names[i];
+            }
+        }
+        PyMem_Free(field_names);
+        field_names = entries;
+        field_names_capacity = capacity;
+    }
+
+    if ((name = PIN_FIELD_GET_NAME(field)) == NULL) {
+        PyErr_Format(PyExc_KeyError, "Do not know field %i", (int) field);
+        return NULL;
+    }
+
+    i = FieldName_slot(field_names, field_names_capacity, field);
+    if ((field_names[i].name = PyUnicode_InternFromString(name)) == NULL) {
+        return NULL;
+    }
+    field_names[i].field = field;
+    field_names_size++;
+    return field_names[i].name;
+}
+
+
 /*
 *
 * Exceptions
@@ -118,1838 +294,7334 @@ error:
 * Client
 *
 */
+
+/*
+* How PIN_FLDT_TSTAMP values are returned to Python: a naive local datetime, the raw epoch seconds,
+* or a datetime in UTC. See pybrm.Client.tstamp_mode
+*/
+enum {TSTAMP_DATETIME, TSTAMP_EPOCH_INT, TSTAMP_AWARE_UTC};
+
+/*
+* How PIN_FLDT_DECIMAL values are returned to Python: a float, an exact Decimal,
+* or an int of the value times 10 ** decimal_scale. See pybrm.Client.decimal_mode
+*/
+enum {DECIMAL_FLOAT, DECIMAL_DECIMAL, DECIMAL_SCALED_INT};
+
+/* Passed instead of a tstamp or decimal mode to use the mode of the client */
+#define CLIENT_MODE -1
+
 typedef struct {
     PyObject_HEAD
     int32 is_open;
     pcm_context_t *ctxp;
     int64 database;
     pin_errbuf_t ebuf;
+    int tstamp_mode;
+    int decimal_mode;
+    int decimal_scale;
 } Client;
 
+/* datetime.timezone.utc, for TSTAMP_AWARE_UTC */
+static PyObject *UtcTimezone = NULL;
 
-static PyObject *Client_is_open(Client *self)
-{
-    if (self->is_open) {
-        Py_RETURN_TRUE;
-    }
-    Py_RETURN_FALSE;
-}
+/* decimal.Decimal, for DECIMAL_DECIMAL and for setting decimals */
+static PyObject *DecimalType = NULL;
 
-static PyObject *Client_close(Client *self)
+/*
+* Converts a PIN_FLDT_TSTAMP value to Python
+* Unlike datetime.fromtimestamp called from Python, this does not go through the interpreter for each value
+*
+* Returns a New Reference
+*/
+static PyObject *Client_tstamp_to_python(Client *client, int tstamp_mode, time_t value)
 {
-    if (!self->is_open) {
-        Py_RETURN_NONE;
-    }
-    PCM_CONTEXT_CLOSE(self->ctxp, 0, &self->ebuf);
+    PyObject *args = NULL;
+    PyObject *ret = NULL;
 
-    self->is_open = 0;
+    if (tstamp_mode == CLIENT_MODE) {
+        tstamp_mode = client->tstamp_mode;
+    }
 
-    Py_RETURN_NONE;
+    switch (tstamp_mode) {
+        case TSTAMP_EPOCH_INT:
+            return PyLong_FromLongLong((long long) value);
+        case TSTAMP_AWARE_UTC:
+            args = Py_BuildValue("(LO)", (long long) value, UtcTimezone);
+            break;
+        case TSTAMP_DATETIME:
+            args = Py_BuildValue("(L)", (long long) value);
+            break;
+        default:
+            PyErr_Format(PyExc_ValueError, "Illegal tstamp mode %d", tstamp_mode);
+            return NULL;
+    }
+    if (args == NULL) {
+        return NULL;
+    }
+    ret = PyDateTime_FromTimestamp(args);
+    Py_DECREF(args);
+    return ret;
 }
 
-static void Client_dealloc(Client *self)
+/*
+* Days since 1970-01-01 of a date in the proleptic Gregorian calendar
+*/
+static long long days_from_civil(long long year, int month, int day)
 {
-    Client_close(self);
-
-    Py_TYPE(self)->tp_free((PyObject *) self);
+    long long era = 0;
+    long long year_of_era = 0;
+    long long day_of_year = 0;
+    long long day_of_era = 0;
+
+    year -= month <= 2;
+    era = (year >= 0 ? year : year - 399) / 400;
+    year_of_era = year - era * 400;
+    day_of_year = (153 * (month + (month > 2 ? -3 : 9)) + 2) / 5 + day - 1;
+    day_of_era = year_of_era * 365 + year_of_era / 4 - year_of_era / 100 + day_of_year;
+    return era * 146097 + day_of_era - 719468;
 }
 
-static PyObject * Client_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+/*
+* Converts a datetime to epoch seconds, the same as int(value.timestamp())
+* A naive datetime is in local time, like datetime.timestamp
+*
+* Returns 0 on success, or -1 with an exception set
+*/
+/*
+* Sets *local to the local wall clock time of the epoch seconds u, itself counted as if it were UTC
+*
+* Returns 0, or -1 with an OverflowError or ValueError set, like datetime.timestamp()
+*/
+static int Client_local_seconds(long long u, long long *local)
 {
-    Client *self = NULL;
+    time_t t = (time_t) u;
+    struct tm tm_value;
 
-    self = (Client *) type->tp_alloc(type, 0);
-    if (self != NULL) {
-        self->is_open = 0;
+    if ((long long) t != u || localtime_r(&t, &tm_value) == NULL) {
+        PyErr_SetString(PyExc_OverflowError, "timestamp out of range for platform time_t");
+        return -1;
     }
-    return (PyObject *) self;
+    // The range of datetime
+    if (tm_value.tm_year + 1900 < 1 || tm_value.tm_year + 1900 > 9999) {
+        PyErr_Format(PyExc_ValueError, "year %d is out of range", tm_value.tm_year + 1900);
+        return -1;
+    }
+    *local = days_from_civil(tm_value.tm_year + 1900, tm_value.tm_mon + 1, tm_value.tm_mday) * 86400
+        + tm_value.tm_hour * 3600 + tm_value.tm_min * 60 + tm_value.tm_sec;
+    return 0;
 }
 
-
-static PyObject *Client_open(Client *self, PyObject *args, PyObject *kwargs)
+/*
+* Converts a local wall clock time t, counted as if it were UTC, to epoch seconds, the same way datetime.timestamp() does
+* mktime cannot tell the two times of a DST fold apart, so this solves local(u) == t for u instead,
+* taking the earlier time of a fold if fold is 0, and the later one if it is 1
+*
+* Returns 0, or -1 with an exception set
+*/
+static int Client_local_to_seconds(long long t, int fold, long long *seconds)
 {
+    // Longest a fold can be, the same as CPython
+    const long long max_fold_seconds = 24 * 3600;
+    long long lt = 0;
+    long long a = 0;
+    long long b = 0;
+    long long u1 = 0;
+    long long u2 = 0;
+    long long t1 = 0;
+    long long t2 = 0;
+
+    if (Client_local_seconds(t, &lt) < 0) {
+        return -1;
+    }
+    a = lt - t;
+    u1 = t - a;
+    if (Client_local_seconds(u1, &t1) < 0) {
+        return -1;
+    }
+    if (t1 == t) {
+        // u1 is a solution, but there may be an earlier one for fold 0, or a later one for fold 1
+        u2 = fold ? u1 + max_fold_seconds : u1 - max_fold_seconds;
+        if (Client_local_seconds(u2, &lt) < 0) {
+            return -1;
+        }
+        b = lt - u2;
+        if (a == b) {
+            *seconds = u1;
+            return 0;
+        }
+    } else {
+        b = t1 - u1;
+    }
 
-    if (self->is_open == 1) {
-         return Py_BuildValue("L", self->database);
+    u2 = t - b;
+    if (Client_local_seconds(u2, &t2) < 0) {
+        return -1;
+    }
+    if (t2 == t) {
+        *seconds = u2;
+    } else if (t1 == t) {
+        *seconds = u1;
+    } else {
+        // t is in the gap of a DST change
+        *seconds = fold ? Py_MIN(u1, u2) : Py_MAX(u1, u2);
     }
+    return 0;
+}
 
-    PIN_ERRBUF_CLEAR(&self->ebuf);
-    // splint actually gives an error if the following ; is present, so remove it from splint
-    // None of these PIN_ERR_ macros actually return anything
+static int Client_datetime_to_tstamp(PyObject *value, time_t *tstamp)
+{
+    PyObject *offset = NULL;
+    long long seconds = 0;
 
-    PCM_CONNECT(&self->ctxp, &self->database, &self->ebuf);
-    // 64 bytes in 1 blocks are definitely lost in loss record 14 of 192
-    // Conditional jump or move depends on uninitialised value(s)
-    // Client_open (test.c:87)
+    if ((offset = PyObject_CallMethod(value, "utcoffset", NULL)) == NULL) {
+        return -1;
+    }
 
-    CHECK_PIN_ERR(self->ebuf, "Error opening pcm_connection");
+    seconds = days_from_civil(PyDateTime_GET_YEAR(value), PyDateTime_GET_MONTH(value), PyDateTime_GET_DAY(value)) * 86400
+        + PyDateTime_DATE_GET_HOUR(value) * 3600 + PyDateTime_DATE_GET_MINUTE(value) * 60 + PyDateTime_DATE_GET_SECOND(value);
 
-    self->is_open = 1;
+    if (offset == Py_None) {
+        Py_DECREF(offset);
+        if (Client_local_to_seconds(seconds, PyDateTime_DATE_GET_FOLD(value), &seconds) < 0) {
+            return -1;
+        }
+        *tstamp = (time_t) seconds;
+        return 0;
+    }
 
-    return Py_BuildValue("L", self->database);
-error:
+    seconds -= (long long) PyDateTime_DELTA_GET_DAYS(offset) * 86400 + PyDateTime_DELTA_GET_SECONDS(offset);
+    Py_DECREF(offset);
 
-    return NULL;
+    *tstamp = (time_t) seconds;
+    return 0;
 }
 
-static PyObject *Client_capsule(Client *self, PyObject *args, PyObject *kwargs)
-{
-    if (!self->is_open) {
-        Py_RETURN_NONE;
-    }
-
-    return PyCapsule_New(self->ctxp, "pybrm.ctxp", NULL);
-}
 
-static PyObject *Client_ebufp_capsule(Client *self, PyObject *args, PyObject *kwargs)
+/*
+* Returns an int of the decimal string text times 10 ** scale, rounded half away from zero
+* text is what pbo_decimal_to_str returned, like -12.345
+*
+* Returns a New Reference
+*/
+static PyObject *Client_scaled_int(const char *text, int scale)
 {
-    if (!self->is_open) {
-        Py_RETURN_NONE;
+    char *digits = NULL;
+    char *out = NULL;
+    const char *p = text;
+    int negative = 0;
+    int round_up = 0;
+    int i = 0;
+    PyObject *value = NULL;
+    PyObject *one = NULL;
+    PyObject *sum = NULL;
+    PyObject *ret = NULL;
+
+    if (strpbrk(text, "eE") != NULL) {
+        /* Not expected from pbo_decimal_to_str, so leave an exponent to round(Decimal(text).scaleb(scale)) */
+        if ((value = PyObject_CallFunction(DecimalType, "s", text)) == NULL) {
+            return NULL;
+        }
+        sum = PyObject_CallMethod(value, "scaleb", "i", scale);
+        Py_DECREF(value);
+        if (sum == NULL) {
+            return NULL;
+        }
+        ret = PyObject_CallMethod(sum, "__round__", NULL);
+        Py_DECREF(sum);
+        return ret;
     }
 
-    return PyCapsule_New(&self->ebuf, "pybrm.ebufp", NULL);
-}
+    if ((digits = PyMem_Malloc(strlen(text) + scale + 2)) == NULL) {
+        return PyErr_NoMemory();
+    }
+    out = digits;
 
-static PyObject *Client_raise_ebuf_error(Client *self, PyObject *args, PyObject *kwargs)
-{
-    if (!self->is_open) {
-        Py_RETURN_NONE;
+    if (*p == '-' || *p == '+') {
+        negative = *p == '-';
+        p++;
+    }
+    while (isdigit((unsigned char) *p)) {
+        *out++ = *p++;
+    }
+    if (*p == '.') {
+        p++;
+    }
+    for (i = 0; i < scale; i++) {
+        *out++ = isdigit((unsigned char) *p) ? *p++ : '0';
+    }
+    round_up = isdigit((unsigned char) *p) && *p >= '5';
+    if (out == digits) {
+        *out++ = '0';
     }
+    *out = '\0';
 
-    CHECK_PIN_ERR(self->ebuf, "Error in ebuf")
+    if ((value = PyLong_FromString(digits, NULL, 10)) == NULL) {
+        goto error;
+    }
+    if (round_up) {
+        if ((one = PyLong_FromLong(1)) == NULL) {
+            goto error;
+        }
+        sum = PyNumber_Add(value, one);
+        Py_DECREF(value);
+        if ((value = sum) == NULL) {
+            goto error;
+        }
+    }
+    if (negative) {
+        ret = PyNumber_Negative(value);
+    } else {
+        Py_INCREF(value);
+        ret = value;
+    }
 
-    Py_RETURN_NONE;
 error:
-    return NULL;
+    Py_XDECREF(one);
+    Py_XDECREF(value);
+    PyMem_Free(digits);
+    return ret;
 }
 
 /*
-* This is just to test Client_raise_ebuf_error
+* Converts a non NULL PIN_FLDT_DECIMAL value to Python
+* A NULL decimal, which some applications store, is None
+*
+* Returns a New Reference
 */
-static PyObject *Client_set_ebuf_error(Client *self, PyObject *args, PyObject *kwargs)
+static PyObject *Client_decimal_to_python(Client *client, int decimal_mode, pin_fld_num_t field, pin_decimal_t *value)
 {
-    if (!self->is_open) {
-        Py_RETURN_NONE;
-    }
-
-    pin_set_err(&self->ebuf, PIN_ERRLOC_APP, PIN_ERRCLASS_APPLICATION, PIN_ERR_BAD_VALUE, 0, 0, 0);
+    double double_value = 0;
+    int is_null = 0;
+    char *text = NULL;
+    PyObject *ret = NULL;
 
-    Py_RETURN_NONE;
-}
+    if (decimal_mode == CLIENT_MODE) {
+        decimal_mode = client->decimal_mode;
+    }
 
+    if (decimal_mode == DECIMAL_FLOAT) {
+        double_value = pbo_decimal_to_double(value, &client->ebuf);
+        if (PIN_ERR_IS_ERR(&client->ebuf) && client->ebuf.pin_err == PIN_ERR_IS_NULL) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+            Py_RETURN_NONE;
+        }
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting pbo_decimal_to_double for field %s", PIN_FIELD_GET_NAME(field));
+        return PyFloat_FromDouble(double_value);
+    }
+    if (decimal_mode != DECIMAL_DECIMAL && decimal_mode != DECIMAL_SCALED_INT) {
+        PyErr_Format(PyExc_ValueError, "Illegal decimal mode %d", decimal_mode);
+        return NULL;
+    }
 
-static PyMethodDef Client_methods[] = {
-    {"open", (PyCFunction) Client_open, METH_VARARGS, "Opens a connection to the CM"},
-    {"close", (PyCFunction) Client_close, METH_NOARGS, "Closes a connection to the CM"},
-    {"is_open", (PyCFunction) Client_is_open, METH_NOARGS, "Checks if a connection is open"},
-    {"capsule", (PyCFunction) Client_capsule, METH_NOARGS, "Returns a capsule to the ctxp"},
-    {"ebufp_capsule", (PyCFunction) Client_ebufp_capsule, METH_NOARGS, "Returns a capsule to the ebufp"},
-    {"raise_ebuf_error", (PyCFunction) Client_raise_ebuf_error, METH_NOARGS, "If the ebuf has an error, this will raise an exception and reset the ebuf"},
-    {"set_ebuf_error", (PyCFunction) Client_set_ebuf_error, METH_NOARGS, "Sets the err buff. This is only for testing raise_ebuf_err"},
-    {NULL, NULL, 0, NULL}
-};
+    is_null = pbo_decimal_is_null(value, &client->ebuf);
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting pbo_decimal_is_null for field %s", PIN_FIELD_GET_NAME(field));
+    if (is_null) {
+        Py_RETURN_NONE;
+    }
 
+    /* pbo_decimal_t is opaque, so its string is the only exact representation */
+    text = pbo_decimal_to_str(value, &client->ebuf);
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting pbo_decimal_to_str for field %s", PIN_FIELD_GET_NAME(field));
 
-static PyTypeObject ClientType = {
-    PyVarObject_HEAD_INIT(NULL, 0)
-    .tp_name = "brm.Client",
-    .tp_doc = "BRM CM wrapper",
-    .tp_basicsize = sizeof(Client),
-    .tp_itemsize = 0,
-    .tp_flags = Py_TPFLAGS_DEFAULT,
-    .tp_new = Client_new,
-    .tp_dealloc = (destructor) Client_dealloc,
-    .tp_methods = Client_methods
-};
+    if (decimal_mode == DECIMAL_DECIMAL) {
+        ret = PyObject_CallFunction(DecimalType, "s", text);
+    } else {
+        ret = Client_scaled_int(text, client->decimal_scale);
+    }
+    free(text);
+    return ret;
 
+error:
+    return NULL;
+}
 
 /*
+* Creates a pin_decimal_t from a str, int, float or Decimal. The caller owns the pin_decimal_t
+* Only a str is parsed as given; the others are formatted here rather than with str() in Python
 *
-* FList
+* Returns 0 on success, or -1 with an exception set
+*/
+/*
+* Formats a finite Decimal in positional notation, since pin_decimal takes neither exponents nor NaN or Infinity
 *
+* Returns a New Reference
 */
+static PyObject *Client_decimal_to_str(pin_fld_num_t field, PyObject *value)
+{
+    PyObject *is_finite = NULL;
+    int finite = 0;
 
+    if ((is_finite = PyObject_CallMethod(value, "is_finite", NULL)) == NULL) {
+        return NULL;
+    }
+    finite = PyObject_IsTrue(is_finite);
+    Py_DECREF(is_finite);
+    if (finite < 0) {
+        return NULL;
+    }
+    if (!finite) {
+        PyErr_Format(PyExc_ValueError, "Cannot set %R on decimal field %s", value, PIN_FIELD_GET_NAME(field));
+        return NULL;
+    }
+    return PyObject_CallMethod(value, "__format__", "s", "f");
+}
+
+static int Client_decimal_from_python(Client *client, pin_fld_num_t field, PyObject *value, pin_decimal_t **decimalpp)
+{
+    const char *text = NULL;
+    PyObject *str = NULL;
+    PyObject *decimal = NULL;
+    int is_decimal = 0;
+
+    *decimalpp = NULL;
+
+    if (PyUnicode_Check(value)) {
+        Py_INCREF(value);
+        str = value;
+    } else if (PyLong_Check(value)) {
+        /* Not str(value), so that bools and int subclasses are numbers */
+        str = PyLong_Type.tp_repr(value);
+    } else if (PyFloat_Check(value)) {
+        if (!Py_IS_FINITE(PyFloat_AS_DOUBLE(value))) {
+            PyErr_Format(PyExc_ValueError, "Cannot set %R on decimal field %s", value, PIN_FIELD_GET_NAME(field));
+            return -1;
+        }
+        /* The digits of the shortest repr, so that 0.1 stays 0.1, but 1e+16 is written out */
+        if ((str = PyFloat_Type.tp_repr(value)) == NULL) {
+            return -1;
+        }
+        decimal = PyObject_CallFunctionObjArgs(DecimalType, str, NULL);
+        Py_CLEAR(str);
+        if (decimal == NULL) {
+            return -1;
+        }
+        str = Client_decimal_to_str(field, decimal);
+        Py_DECREF(decimal);
+    } else if ((is_decimal = PyObject_IsInstance(value, DecimalType)) > 0) {
+        str = Client_decimal_to_str(field, value);
+    } else {
+        if (is_decimal == 0) {
+            PyErr_Format(PyExc_TypeError, "expecting a float or decimal for field %s, not %s",
+                         PIN_FIELD_GET_NAME(field), Py_TYPE(value)->tp_name);
+        }
+        return -1;
+    }
+
+    if (str == NULL || (text = PyUnicode_AsUTF8(str)) == NULL) {
+        goto error;
+    }
+
+    *decimalpp = pin_decimal(text, &client->ebuf);
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error converting to decimal for setting field %s", PIN_FIELD_GET_NAME(field));
+    if (*decimalpp == NULL) {
+        PyErr_SetString(BRMError, "Error converting to pin_decimal_t\n");
+        goto error;
+    }
+
+    Py_XDECREF(str);
+    return 0;
+
+error:
+    Py_XDECREF(str);
+    return -1;
+}
+
+static PyObject *Client_is_open(Client *self)
+{
+    if (self->is_open) {
+        Py_RETURN_TRUE;
+    }
+    Py_RETURN_FALSE;
+}
+
+static PyObject *Client_close(Client *self)
+{
+    if (!self->is_open) {
+        Py_RETURN_NONE;
+    }
+    PCM_CONTEXT_CLOSE(self->ctxp, 0, &self->ebuf);
+    // A broken connection fails to close, but the context is gone either way
+    PIN_ERRBUF_RESET(&self->ebuf);
+
+    self->is_open = 0;
+
+    Py_RETURN_NONE;
+}
+
+static void Client_dealloc(Client *self)
+{
+    Client_close(self);
+
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static PyObject * Client_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    Client *self = NULL;
+
+    self = (Client *) type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->is_open = 0;
+        self->decimal_scale = 2;
+    }
+    return (PyObject *) self;
+}
+
+
+/*
+* Opens the connection with PCM_CONNECT, which connects to the cm_ptr of the pin.conf
+* Or, given a capsule of a login flist, opens it with PCM_CONTEXT_OPEN, which connects to the PIN_FLD_CM_PTRS on it
+* The database of the login poid must be given with the capsule
+*/
+static PyObject *Client_open(Client *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *capsule = NULL;
+    long long database = 0;
+    pin_flist_t *login_flistp = NULL;
+
+    if (!PyArg_ParseTuple(args, "|OL", &capsule, &database)) {
+        return NULL;
+    }
+
+    if (self->is_open == 1) {
+         return Py_BuildValue("L", self->database);
+    }
+
+    PIN_ERRBUF_CLEAR(&self->ebuf);
+    // splint actually gives an error if the following ; is present, so remove it from splint
+    // None of these PIN_ERR_ macros actually return anything
+
+    if (capsule == NULL || capsule == Py_None) {
+        PCM_CONNECT(&self->ctxp, &self->database, &self->ebuf);
+        // 64 bytes in 1 blocks are definitely lost in loss record 14 of 192
+        // Conditional jump or move depends on uninitialised value(s)
+        // Client_open (test.c:87)
+    } else {
+        if ((login_flistp = (pin_flist_t *) PyCapsule_GetPointer(capsule, "pybrm.flistp")) == NULL) {
+            goto error;
+        }
+        Py_BEGIN_ALLOW_THREADS
+        PCM_CONTEXT_OPEN(&self->ctxp, login_flistp, &self->ebuf);
+        Py_END_ALLOW_THREADS
+        self->database = (int64) database;
+    }
+
+    CHECK_PIN_ERR(self->ebuf, "Error opening pcm_connection");
+
+    self->is_open = 1;
+
+    return Py_BuildValue("L", self->database);
+error:
+
+    return NULL;
+}
+
+static PyObject *Client_capsule(Client *self, PyObject *args, PyObject *kwargs)
+{
+    if (!self->is_open) {
+        Py_RETURN_NONE;
+    }
+
+    return PyCapsule_New(self->ctxp, "pybrm.ctxp", NULL);
+}
+
+static PyObject *Client_ebufp_capsule(Client *self, PyObject *args, PyObject *kwargs)
+{
+    if (!self->is_open) {
+        Py_RETURN_NONE;
+    }
+
+    return PyCapsule_New(&self->ebuf, "pybrm.ebufp", NULL);
+}
+
+static PyObject *Client_raise_ebuf_error(Client *self, PyObject *args, PyObject *kwargs)
+{
+    if (!self->is_open) {
+        Py_RETURN_NONE;
+    }
+
+    CHECK_PIN_ERR(self->ebuf, "Error in ebuf")
+
+    Py_RETURN_NONE;
+error:
+    return NULL;
+}
+
+/*
+* This is just to test Client_raise_ebuf_error
+*/
+static PyObject *Client_set_ebuf_error(Client *self, PyObject *args, PyObject *kwargs)
+{
+    if (!self->is_open) {
+        Py_RETURN_NONE;
+    }
+
+    pin_set_err(&self->ebuf, PIN_ERRLOC_APP, PIN_ERRCLASS_APPLICATION, PIN_ERR_BAD_VALUE, 0, 0, 0);
+
+    Py_RETURN_NONE;
+}
+
+
+static PyMethodDef Client_methods[] = {
+    {"open", (PyCFunction) Client_open, METH_VARARGS, "Opens a connection to the CM"},
+    {"close", (PyCFunction) Client_close, METH_NOARGS, "Closes a connection to the CM"},
+    {"is_open", (PyCFunction) Client_is_open, METH_NOARGS, "Checks if a connection is open"},
+    {"capsule", (PyCFunction) Client_capsule, METH_NOARGS, "Returns a capsule to the ctxp"},
+    {"ebufp_capsule", (PyCFunction) Client_ebufp_capsule, METH_NOARGS, "Returns a capsule to the ebufp"},
+    {"raise_ebuf_error", (PyCFunction) Client_raise_ebuf_error, METH_NOARGS, "If the ebuf has an error, this will raise an exception and reset the ebuf"},
+    {"set_ebuf_error", (PyCFunction) Client_set_ebuf_error, METH_NOARGS, "Sets the err buff. This is only for testing raise_ebuf_err"},
+    {NULL, NULL, 0, NULL}
+};
+
+
+static PyMemberDef Client_members[] = {
+    {"tstamp_mode", T_INT, offsetof(Client, tstamp_mode), 0, "how tstamp fields are returned, see pybrm.Client.tstamp_mode"},
+    {"decimal_mode", T_INT, offsetof(Client, decimal_mode), 0, "how decimal fields are returned, see pybrm.Client.decimal_mode"},
+    {"decimal_scale", T_INT, offsetof(Client, decimal_scale), 0, "the scale of DECIMAL_SCALED_INT"},
+    {NULL}
+};
+
+
+static PyTypeObject ClientType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "brm.Client",
+    .tp_doc = "BRM CM wrapper",
+    .tp_basicsize = sizeof(Client),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = Client_new,
+    .tp_dealloc = (destructor) Client_dealloc,
+    .tp_methods = Client_methods,
+    .tp_members = Client_members
+};
+
+
+/*
+*
+* Poid
+*
+* An immutable Poid that is created from and applied to a poid_t directly, without formatting or parsing a string.
+* It keeps the interface of the namedtuple it replaces: Poid(type, id=-1, revision=0, database=None),
+* the same fields, indexing and unpacking, and equality and hashing with the equivalent tuple.
+* Like the namedtuple, it also takes a str of an int for the id, revision and database.
+* A database of None is replaced by the database of the client when the Poid is set on an flist.
+*
+*/
+typedef struct {
+    PyObject_HEAD
+    /* str, or None for a NULL poid */
+    PyObject *type;
+    long long id;
+    int revision;
+    /* int, or None for the database of the client */
+    PyObject *database;
+    Py_hash_t hash;
+} Poid;
+
+static PyTypeObject PoidType;
+
+#define Poid_Check(op) PyObject_TypeCheck(op, &PoidType)
+
+/*
+* Returns a New Reference
+*/
+static PyObject *Poid_make(PyTypeObject *type, PyObject *poid_type, long long id, int revision, PyObject *database)
+{
+    Poid *self = NULL;
+
+    if (poid_type != Py_None && !PyUnicode_Check(poid_type)) {
+        PyErr_Format(PyExc_TypeError, "Poid type must be str or None, not %s", Py_TYPE(poid_type)->tp_name);
+        return NULL;
+    }
+    if (database != Py_None && !PyLong_Check(database)) {
+        PyErr_Format(PyExc_TypeError, "Poid database must be int or None, not %s", Py_TYPE(database)->tp_name);
+        return NULL;
+    }
+
+    if ((self = (Poid *) type->tp_alloc(type, 0)) == NULL) {
+        return NULL;
+    }
+    Py_INCREF(poid_type);
+    self->type = poid_type;
+    self->id = id;
+    self->revision = revision;
+    Py_INCREF(database);
+    self->database = database;
+    self->hash = -1;
+
+    return (PyObject *) self;
+}
+
+/*
+* Converts the id, revision or database of a Poid to an int
+* A str of an int is parsed like int() does, since the namedtuple Poid took those and poid strings were formatted from them
+*
+* Returns a New Reference
+*/
+static PyObject *Poid_int_field(PyObject *value)
+{
+    if (PyUnicode_Check(value)) {
+        return PyLong_FromUnicodeObject(value, 10);
+    }
+    return PyNumber_Index(value);
+}
+
+/*
+* Makes a Poid from the Python objects passed to Poid() or _replace()
+* The id and revision are left as given when id_obj or revision_obj is NULL
+*
+* Returns a New Reference
+*/
+static PyObject *Poid_make_from_fields(PyTypeObject *type, PyObject *poid_type, PyObject *id_obj, long long id,
+                                       PyObject *revision_obj, int revision, PyObject *database)
+{
+    long value = 0;
+    PyObject *ret = NULL;
+
+    if (id_obj != NULL) {
+        if ((id_obj = Poid_int_field(id_obj)) == NULL) {
+            return NULL;
+        }
+        id = PyLong_AsLongLong(id_obj);
+        Py_DECREF(id_obj);
+        if (id == -1 && PyErr_Occurred()) {
+            return NULL;
+        }
+    }
+
+    if (revision_obj != NULL) {
+        if ((revision_obj = Poid_int_field(revision_obj)) == NULL) {
+            return NULL;
+        }
+        value = PyLong_AsLong(revision_obj);
+        Py_DECREF(revision_obj);
+        if (value == -1 && PyErr_Occurred()) {
+            return NULL;
+        }
+        if (value < INT_MIN || value > INT_MAX) {
+            PyErr_SetString(PyExc_OverflowError, "Poid revision is out of range");
+            return NULL;
+        }
+        revision = (int) value;
+    }
+
+    if (database == Py_None) {
+        return Poid_make(type, poid_type, id, revision, database);
+    }
+    if ((database = Poid_int_field(database)) == NULL) {
+        return NULL;
+    }
+    ret = Poid_make(type, poid_type, id, revision, database);
+    Py_DECREF(database);
+    return ret;
+}
+
+static PyObject *Poid_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    PyObject *poid_type = Py_None;
+    PyObject *id = NULL;
+    PyObject *revision = NULL;
+    PyObject *database = Py_None;
+
+    char *kwargs_names[] = {"type", "id", "revision", "database", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|OOOO", kwargs_names, &poid_type, &id, &revision, &database)) {
+        return NULL;
+    }
+
+    return Poid_make_from_fields(type, poid_type, id, -1, revision, 0, database);
+}
+
+/*
+* Returns a New Reference
+*/
+static PyObject *Poid_from_pdp(poid_t *pdp)
+{
+    PyObject *poid_type = NULL;
+    PyObject *database = NULL;
+    PyObject *ret = NULL;
+
+    if ((poid_type = PyUnicode_FromString(PIN_POID_GET_TYPE(pdp))) == NULL) {
+        goto error;
+    }
+    if ((database = PyLong_FromLongLong((long long) PIN_POID_GET_DB(pdp))) == NULL) {
+        goto error;
+    }
+    ret = Poid_make(&PoidType, poid_type, (long long) PIN_POID_GET_ID(pdp), (int) PIN_POID_GET_REV(pdp), database);
+
+error:
+    Py_XDECREF(poid_type);
+    Py_XDECREF(database);
+    return ret;
+}
+
+/*
+* Creates a new poid_t from a Poid. The caller owns the poid_t, typically by putting it on an flist
+* Sets *pdpp to NULL for a Poid with a type of None
+*
+* Returns 0 on success, or -1 with an exception set
+*/
+static int Poid_to_pdp(Poid *self, Client *client, poid_t **pdpp)
+{
+    const char *poid_type = NULL;
+    long long database = 0;
+    char poid_string[512];
+
+    *pdpp = NULL;
+    if (self->type == Py_None) {
+        return 0;
+    }
+    if ((poid_type = PyUnicode_AsUTF8(self->type)) == NULL) {
+        return -1;
+    }
+    if (poid_type[0] >= '0' && poid_type[0] <= '9') {
+        PyErr_Format(PyExc_ValueError, "PIN_POID_FROM_STR cannot take a type starting with integer: %s", poid_type);
+        return -1;
+    }
+    if (self->database == Py_None) {
+        database = (long long) client->database;
+    } else if ((database = PyLong_AsLongLong(self->database)) == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+
+    if (self->revision == 0) {
+        *pdpp = PIN_POID_CREATE(database, poid_type, self->id, &client->ebuf);
+    } else {
+        /* PIN_POID_CREATE has no revision, so only a revised poid goes through a string */
+        snprintf(poid_string, sizeof(poid_string), "0.0.0.%lld %s %lld %d", database, poid_type, self->id, self->revision);
+        *pdpp = PIN_POID_FROM_STR(poid_string, NULL, &client->ebuf);
+    }
+    if (PIN_ERR_IS_ERR(&client->ebuf)) {
+        PIN_ERRBUF_RESET(&client->ebuf);
+        *pdpp = NULL;
+        PyErr_Format(PyExc_ValueError, "Invalid POID: 0.0.0.%lld %s %lld %d", database, poid_type, self->id, self->revision);
+        return -1;
+    }
+
+    return 0;
+}
+
+/*
+* Returns a New Reference to the equivalent tuple
+*/
+static PyObject *Poid_as_tuple(Poid *self)
+{
+    return Py_BuildValue("(OLiO)", self->type, self->id, self->revision, self->database);
+}
+
+static void Poid_dealloc(Poid *self)
+{
+    Py_XDECREF(self->type);
+    Py_XDECREF(self->database);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static PyObject *Poid_repr(Poid *self)
+{
+    return PyUnicode_FromFormat("Poid(type=%R, id=%lld, revision=%d, database=%R)",
+                                self->type, self->id, self->revision, self->database);
+}
+
+static PyObject *Poid_str(Poid *self)
+{
+    return PyUnicode_FromFormat("0.0.0.%S %S %lld %d", self->database, self->type, self->id, self->revision);
+}
+
+static Py_hash_t Poid_hash(Poid *self)
+{
+    PyObject *tuple = NULL;
+
+    if (self->hash == -1) {
+        if ((tuple = Poid_as_tuple(self)) == NULL) {
+            return -1;
+        }
+        self->hash = PyObject_Hash(tuple);
+        Py_DECREF(tuple);
+    }
+    return self->hash;
+}
+
+/*
+* Poids compare field by field, and against tuples the way the namedtuple did
+*/
+static PyObject *Poid_richcompare(Poid *self, PyObject *other, int op)
+{
+    Poid *other_poid = NULL;
+    PyObject *tuple = NULL;
+    PyObject *other_tuple = NULL;
+    PyObject *ret = NULL;
+    int equal = 0;
+
+    if (Poid_Check(other) && (op == Py_EQ || op == Py_NE)) {
+        other_poid = (Poid *) other;
+        equal = self->id == other_poid->id && self->revision == other_poid->revision;
+        if (equal && (equal = PyObject_RichCompareBool(self->type, other_poid->type, Py_EQ)) < 0) {
+            return NULL;
+        }
+        if (equal && (equal = PyObject_RichCompareBool(self->database, other_poid->database, Py_EQ)) < 0) {
+            return NULL;
+        }
+        if (equal == (op == Py_EQ)) {
+            Py_RETURN_TRUE;
+        }
+        Py_RETURN_FALSE;
+    }
+
+    if (Poid_Check(other)) {
+        if ((other_tuple = Poid_as_tuple((Poid *) other)) == NULL) {
+            return NULL;
+        }
+    } else if (PyTuple_Check(other)) {
+        Py_INCREF(other);
+        other_tuple = other;
+    } else {
+        Py_RETURN_NOTIMPLEMENTED;
+    }
+
+    if ((tuple = Poid_as_tuple(self)) != NULL) {
+        ret = PyObject_RichCompare(tuple, other_tuple, op);
+    }
+    Py_XDECREF(tuple);
+    Py_DECREF(other_tuple);
+    return ret;
+}
+
+static Py_ssize_t Poid_length(Poid *self)
+{
+    return 4;
+}
+
+static PyObject *Poid_item(Poid *self, Py_ssize_t i)
+{
+    switch (i) {
+        case 0:
+            Py_INCREF(self->type);
+            return self->type;
+        case 1:
+            return PyLong_FromLongLong(self->id);
+        case 2:
+            return PyLong_FromLong(self->revision);
+        case 3:
+            Py_INCREF(self->database);
+            return self->database;
+        default:
+            PyErr_SetString(PyExc_IndexError, "Poid index out of range");
+            return NULL;
+    }
+}
+
+static PyObject *Poid_is_type_only(Poid *self)
+{
+    return PyBool_FromLong(self->id == -1);
+}
+
+static PyObject *Poid_replace(Poid *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *poid_type = self->type;
+    PyObject *id = NULL;
+    PyObject *revision = NULL;
+    PyObject *database = self->database;
+
+    char *kwargs_names[] = {"type", "id", "revision", "database", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|$OOOO", kwargs_names, &poid_type, &id, &revision, &database)) {
+        return NULL;
+    }
+
+    return Poid_make_from_fields(Py_TYPE(self), poid_type, id, self->id, revision, self->revision, database);
+}
+
+static PyObject *Poid_asdict(Poid *self)
+{
+    return Py_BuildValue("{sOsLsisO}", "type", self->type, "id", self->id, "revision", self->revision,
+                         "database", self->database);
+}
+
+static PyObject *Poid_reduce(Poid *self)
+{
+    return Py_BuildValue("(O(OLiO))", Py_TYPE(self), self->type, self->id, self->revision, self->database);
+}
+
+static PyMemberDef Poid_members[] = {
+    {"type", T_OBJECT, offsetof(Poid, type), READONLY, "the poid type, like /account"},
+    {"id", T_LONGLONG, offsetof(Poid, id), READONLY, "the poid id, -1 for a type only poid"},
+    {"revision", T_INT, offsetof(Poid, revision), READONLY, "the poid revision"},
+    {"database", T_OBJECT, offsetof(Poid, database), READONLY, "the database number, or None for the client's"},
+    {NULL}
+};
+
+static PyMethodDef Poid_methods[] = {
+    {"is_type_only", (PyCFunction) Poid_is_type_only, METH_NOARGS, "returns True if the id is -1"},
+    {"_replace", (PyCFunction) Poid_replace, METH_VARARGS | METH_KEYWORDS, "returns a new Poid with some fields replaced"},
+    {"_asdict", (PyCFunction) Poid_asdict, METH_NOARGS, "returns a dict of the fields"},
+    {"__reduce__", (PyCFunction) Poid_reduce, METH_NOARGS, "supports pickling"},
+    {NULL, NULL, 0, NULL}
+};
+
+static PySequenceMethods Poid_as_sequence = {
+    .sq_length = (lenfunc) Poid_length,
+    .sq_item = (ssizeargfunc) Poid_item,
+};
+
+static PyTypeObject PoidType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "pybrm.Poid",
+    .tp_doc = "Poid(type, id=-1, revision=0, database=None)",
+    .tp_basicsize = sizeof(Poid),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+    .tp_new = Poid_new,
+    .tp_dealloc = (destructor) Poid_dealloc,
+    .tp_repr = (reprfunc) Poid_repr,
+    .tp_str = (reprfunc) Poid_str,
+    .tp_hash = (hashfunc) Poid_hash,
+    .tp_richcompare = (richcmpfunc) Poid_richcompare,
+    .tp_as_sequence = &Poid_as_sequence,
+    .tp_members = Poid_members,
+    .tp_methods = Poid_methods,
+};
+
+
+/*
+*
+* FList
+*
+*/
+
+
+typedef struct ChildEntry ChildEntry;
+
+typedef struct {
+    PyObject_HEAD
+
+    Client *client;
+    pin_flist_t *flistp;
+    PyObject *parent_flist;
+    pin_fld_num_t parent_field;
+    int32 elem_id;
+    /* Child cache, see FList_get_child_from_cache. NULL until the first child is handed out */
+    ChildEntry *children;
+    Py_ssize_t children_capacity;
+    Py_ssize_t children_size;
+    PyObject *weakref;
+    /* Bumped whenever a field is set or dropped on this flist. See ArrayIterator */
+    unsigned long generation;
+    /* Bumped whenever this flist, or any flist below it, is modified. See FListView */
+    unsigned long tree_generation;
+    /* Set when the flist may hold the same field twice, e.g. after PIN_FLIST_CONCAT. See FieldIterator */
+    int may_have_duplicates;
+    /* The result of FList_count, valid while count_generation == generation */
+    int32 cached_count;
+    unsigned long count_generation;
+} FList;
+
+/*
+* An entry in the child cache of a parent FList
+* The child is a borrowed reference: a child removes its own entry when it is deallocated
+* An entry with a NULL child is an empty slot
+*/
+struct ChildEntry {
+    pin_fld_num_t field;
+    int32 elem_id;
+    FList *child;
+};
+
+#define CHILD_CACHE_MIN_SIZE 8
+
+static PyMemberDef FList_members[] = {
+    {"tree_generation", T_ULONG, offsetof(FList, tree_generation), READONLY,
+        "Changes whenever this flist, or any flist below it, is modified"},
+    {NULL}
+};
+
+
+/*
+* Records that this flist was modified, on this FList and on every parent FList above it
+* Call this after every change to the C flist
+*/
+static void FList_mark_modified(FList *self)
+{
+    FList *flist = NULL;
+
+    self->generation++;
+    for (flist = self; flist != NULL; flist = (FList *) flist->parent_flist) {
+        flist->tree_generation++;
+    }
+}
+
+
+/*
+* Raises a ValueError if this FList has no C flist, because it was consumed by an opcode, or was never opened
+* Every FList method that uses self->flistp calls this first, so that Python objects still holding an FList,
+* like a BRMArray, raise instead of handing NULL to BRM
+*/
+static int FList_check_open(FList *self)
+{
+    if (self->flistp == NULL) {
+        PyErr_SetString(PyExc_ValueError, "flist was consumed by an opcode, or was never opened");
+        return -1;
+    }
+    return 0;
+}
+
+
+/*
+*
+* The child cache
+*
+* Parent FLists cache the child FLists they have handed out, keyed by (field, elem_id), so that getting the same
+* substruct or array element twice returns the same FList. This is a small open addressing hash table with
+* linear probing, so that lookups do not allocate any Python objects.
+*
+*/
+static Py_ssize_t FList_child_slot(ChildEntry *entries, Py_ssize_t capacity, pin_fld_num_t field, int32 elem_id)
+{
+    Py_ssize_t mask = capacity - 1;
+    Py_ssize_t i = (Py_ssize_t) ((((unsigned int) field * 2654435761u) ^ ((unsigned int) elem_id * 40503u)) & mask);
+
+    while (entries[i].child != NULL && (entries[i].field != field || entries[i].elem_id != elem_id)) {
+        i = (i + 1) & mask;
+    }
+    return i;
+}
+
+/*
+* Returns the cached child FList, or NULL if it is not in cache
+*
+* Return value: Borrowed Reference
+*/
+static FList *FList_get_child_from_cache(FList *self, pin_fld_num_t field, int32 elem_id)
+{
+    if (self->children == NULL) {
+        return NULL;
+    }
+    return self->children[FList_child_slot(self->children, self->children_capacity, field, elem_id)].child;
+}
+
+/*
+* Adds a child to the cache. The cache does not own a reference to the child.
+* Returns -1 with a MemoryError on failure
+*/
+static int FList_add_child_to_cache(FList *self, FList *child, pin_fld_num_t field, int32 elem_id)
+{
+    ChildEntry *entries = NULL;
+    Py_ssize_t capacity = 0;
+    Py_ssize_t i = 0;
+    Py_ssize_t j = 0;
+
+    if ((self->children_size + 1) * 2 > self->children_capacity) {
+        capacity = self->children_capacity ? self->children_capacity * 2 : CHILD_CACHE_MIN_SIZE;
+        if ((entries = PyMem_Calloc(capacity, sizeof(ChildEntry))) == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        for (i = 0; i < self->children_capacity; i++) {
+            if (self->children[i].child != NULL) {
+                j = FList_child_slot(entries, capacity, self->children[i].field, self->children[i].elem_id);
+                entries[j] = self->children[i];
+            }
+        }
+        PyMem_Free(self->children);
+        self->children = entries;
+        self->children_capacity = capacity;
+    }
+
+    i = FList_child_slot(self->children, self->children_capacity, field, elem_id);
+    if (self->children[i].child == NULL) {
+        self->children_size++;
+    }
+    self->children[i].field = field;
+    self->children[i].elem_id = elem_id;
+    self->children[i].child = child;
+    return 0;
+}
+
+/*
+* Removes a child from the cache on the parent, if it is there
+*/
+static void FList_remove_child_from_cache(FList *self, pin_fld_num_t field, int32 elem_id)
+{
+    Py_ssize_t mask = self->children_capacity - 1;
+    Py_ssize_t i = 0;
+    Py_ssize_t j = 0;
+    Py_ssize_t home = 0;
+
+    if (self->children == NULL) {
+        return;
+    }
+
+    i = FList_child_slot(self->children, self->children_capacity, field, elem_id);
+    if (self->children[i].child == NULL) {
+        return;
+    }
+    self->children[i].child = NULL;
+    self->children_size--;
+
+    /* Shift back any entries after the hole that would no longer be found by linear probing */
+    j = i;
+    while (1) {
+        j = (j + 1) & mask;
+        if (self->children[j].child == NULL) {
+            break;
+        }
+        home = FList_child_slot(self->children, self->children_capacity, self->children[j].field, self->children[j].elem_id);
+        if (home == j) {
+            continue;
+        }
+        self->children[i] = self->children[j];
+        self->children[j].child = NULL;
+        i = j;
+    }
+}
+
+
+/*
+* Disassociates the child from the parent: the child takes ownership of its C flist
+* Calling code must have already taken the child's C flist off of the parent's C flist
+*/
+static void FList_disassociate_child(FList *self, FList *child, pin_fld_num_t field, int32 elem_id)
+{
+    if (child == NULL) {
+        return;
+    }
+    FList_remove_child_from_cache(self, field, elem_id);
+    child->parent_flist = NULL;
+    child->parent_field = 0;
+    /* Decref the parent since we are disassociating the child */
+    Py_DECREF(self);
+}
+
+
+/*
+* Either Drop the child C Flist or disassociate the child C Flist from the parent
+* If there are no Python references to the child, we must drop it
+* If there are Python references to the child, we cannot drop it, but must disassociate it
+*
+* Use FList_get_child_from_cache to get the child
+* Then call one of the PIN_*_TAKE Macros to remove the C Flist from the parent
+* Then call this function which will decide whether to DESTROY the flist or not
+*/
+static int FList_delete_child(FList *self, FList *child, pin_flist_t **flistpp, pin_fld_num_t field, int32 elem_id)
+{
+    if (child == NULL) {
+        PIN_FLIST_DESTROY_EX(flistpp, NULL);
+        *flistpp = NULL;
+    } else {
+        FList_disassociate_child(self, child, field, elem_id);
+    }
+
+    return 0;
+}
+
+
+static void FList_dealloc(FList *self)
+{
+
+    /*
+    Here are the rules:
+        A Parent Python FList is one where self->parent_flist == NULL
+
+        A Child Python FList is one where self->parent_flist != NULL
+
+        Only a Child Python FList has a strong reference to a Parent Python FList
+        The Parent Python FList has borrowed references to the Child Python FLists in its child cache
+
+        If a Child Python FList has 0 references,
+            it does NOT destroy any C Flists
+
+        If a Parent Python FList has 0 references,
+            it destroy's its own FList, which destroy all Child C Flists
+
+        It cannot be that a Parent Python FList has 0 references
+            and a Child Python Flist has 1 reference
+            Because the Child has the ref to the parent
+
+    */
+
+    if (self->parent_flist) {
+        // I am a child
+        // Do NOT destroy any C Flist
+        // When Python Parent has 0 references,
+        // it will destroy the C Parent FList,
+        // which will destroy the C Child Flist
+
+        FList_remove_child_from_cache((FList *) self->parent_flist, self->parent_field, self->elem_id);
+
+        Py_XDECREF(self->parent_flist);
+
+    } else {
+        // I am a parent - go ahead and destroy the C parent which will destroy any children C flists
+        PIN_FLIST_DESTROY_EX(&self->flistp, NULL);
+        self->flistp = NULL;
+    }
+    PyMem_Free(self->children);
+    self->children = NULL;
+    if (self->weakref != NULL) { // TODO this isn't getting triggered in the tests ... check this, I would have thought this would
+        PyObject_ClearWeakRefs((PyObject *) self);
+    }
+    Py_XDECREF(self->client);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+
+}
+
+static PyObject *FList_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    FList *self = NULL;
+
+    self = (FList *) type->tp_alloc(type, 0);
+    if (self != NULL) {
+        self->flistp = NULL;
+        self->parent_flist = NULL;
+        self->elem_id = 0;
+        self->children = NULL;
+        self->children_capacity = 0;
+        self->children_size = 0;
+        self->generation = 0;
+        self->may_have_duplicates = 0;
+        self->cached_count = -1;
+        self->count_generation = 0;
+        self->tree_generation = 0;
+    }
+    return (PyObject *) self;
+}
+
+static int FList_init(FList *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *client = NULL;
+    /* is_open: whether or not the flistp should be instantiated to empty flist */
+    int is_open = 0;
+    char *flist_string = NULL;
+
+    if (!PyArg_ParseTuple(args, "O!|is", &ClientType, &client, &is_open, &flist_string)) {
+        return -1;
+    }
+
+    if (client) {
+        Py_INCREF(client);
+        self->client = (Client *)client;
+    }
+
+    if (flist_string) {
+        /* BRM always prints a message to stderr if the flist is invalid. Even if you turn debugging off */
+        PIN_STR_TO_FLIST(flist_string, self->client->database, &self->flistp, &self->client->ebuf);
+        CHECK_PIN_ERR(self->client->ebuf, "FList string is invalid");
+        self->may_have_duplicates = 1;
+
+    } else {
+        if (is_open) {
+            self->flistp = PIN_FLIST_CREATE(&self->client->ebuf);
+            CHECK_PIN_ERR(self->client->ebuf, "Error opening flist");
+        }
+    }
+
+    return 0;
+
+error:
+    return -1;
+}
+
+
+static PyTypeObject FListType;
+/*
+* Careful: FList_make_flist Vs FList_make_flist_on_parent
+* Use FList_make_flist when you do not need to maintain a reference to Parent
+* E.g. Copy, opcode
+* Every other time you require a reference on the Parent
+*
+* Calling code should make sure to set flistp after doing something to the C Flist
+*
+* Returns a New Reference
+*/
+
+static PyObject *FList_make_flist(FList *self)
+{
+    FList *new_flist = NULL;
+    PyObject *arg_list = NULL;
+
+    if ((arg_list = Py_BuildValue("(Oi)", (Client *)self->client, 0)) == NULL) {
+        goto error;
+    }
+
+    // New Reference, calling code needs to return it to Python or Py_XDECREF on error
+    if ((new_flist = (FList *) PyObject_CallObject((PyObject *) &FListType, arg_list)) == NULL) {
+        goto error;
+    }
+
+error:
+    Py_XDECREF(arg_list);
+    return (PyObject *) new_flist;
+}
+
+
+/*
+* Either retrieves a preexisting child FList from cache, or creates a new FList with null flist->flistp
+* Calling code needs to check if (flist->flistp) and decide on what to do.
+*
+* Careful: FList_make_flist Vs FList_make_flist_on_parent
+* Use FList_make_flist_on_parent when you need to maintain a reference on parent
+* E.g. Get a subflist, get a subarray, create a subflist, create a subarray
+* Don't use this for copying.
+*
+* Calling code should make sure to set flistp after doing something to the C Flist
+* Alternatively, calling code can simply decref this. It will immediately deallocate and remove itself
+* from the parents cash, in FList_dealloc
+*
+* Returns a New Reference
+*/
+static PyObject *FList_make_flist_on_parent(FList *self, pin_fld_num_t parent_field, int32 elem_id)
+{
+    FList *new_flist = NULL;
+
+    if ((new_flist = FList_get_child_from_cache(self, parent_field, elem_id)) != NULL) {
+        Py_INCREF(new_flist);
+        return (PyObject *) new_flist;
+    }
+
+    if ((new_flist = (FList *) FList_make_flist((FList *) self)) == NULL) {
+        return NULL;
+    }
+
+    if (FList_add_child_to_cache(self, new_flist, parent_field, elem_id) < 0) {
+        Py_DECREF(new_flist);
+        return NULL;
+    }
+
+    new_flist->parent_flist = (PyObject *) self;
+    new_flist->parent_field = parent_field;
+    new_flist->elem_id = elem_id;
+    new_flist->may_have_duplicates = self->may_have_duplicates;
+    Py_INCREF(self);
+
+    return (PyObject *) new_flist;
+}
+
+
+
+
+static PyObject *FList_set_capsule(FList *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *capsule = NULL;
+
+    pin_flist_t *flistp = NULL;
+    int is_copy = 1;
+
+    if (!PyArg_ParseTuple(args, "Oi", &capsule, &is_copy)) {
+        goto error;
+    }
+
+    if (!PyCapsule_CheckExact((PyObject *) capsule)) {
+        PyErr_SetString(PyExc_TypeError, "Expecting a PyCapsule type\n");
+        goto error;
+    }
+
+    if (self->flistp != NULL) {
+        PyErr_SetString(PyExc_ValueError, "Do not call set_pointer on an open flist\n");
+        goto error;
+    }
+
+    if ((flistp = (pin_flist_t *) PyCapsule_GetPointer(capsule, "pybrm.flistp")) == NULL){
+        goto error;
+    }
+
+    self->flistp = flistp;
+    if (is_copy) {
+        self->flistp = PIN_FLIST_COPY(flistp, &self->client->ebuf);
+        CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
+    }
+    assert(self->flistp);
+    // The flist was built outside of pybrm
+    self->may_have_duplicates = 1;
+    FList_mark_modified(self);
+
+    Py_RETURN_NONE;
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_capsule(FList *self, PyObject *args, PyObject *kwargs)
+{
+    int is_copy = 1;
+    pin_flist_t *flistp = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i", &is_copy)) {
+        goto error;
+    }
+
+    flistp = self->flistp;
+
+    if (is_copy) {
+        flistp = PIN_FLIST_COPY(self->flistp, &self->client->ebuf);
+        CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
+    } else {
+        // The pointer is handed to code that may modify it
+        FList_mark_modified(self);
+    }
+
+    return PyCapsule_New(flistp, "pybrm.flistp", NULL);
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_str(FList *self)
+{
+    char *flist_string = NULL;
+    int flist_string_length = 0;
+    PyObject *ret = NULL;
+
+    if (self->flistp == NULL) {
+        return PyUnicode_FromString("<flist without a C flist>");
+    }
+
+    PIN_FLIST_TO_STR(self->flistp, &flist_string, &flist_string_length, &self->client->ebuf);
+
+    CHECK_PIN_ERR(self->client->ebuf, "Error converting flist to string.");
+
+    ret = PyUnicode_FromString(flist_string);
+
+    free(flist_string);
+    flist_string = NULL;
+
+error:
+    return ret;
+}
+
+static PyObject *FList_str_compact(FList *self)
+{
+    char *flist_string = NULL;
+    int flist_string_length = 0;
+    PyObject *ret = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    PIN_FLIST_TO_STR_COMPACT_BINARY(self->flistp, &flist_string, &flist_string_length, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error converting flist to string.");
+
+    ret = PyUnicode_FromString(flist_string);
+
+    free(flist_string);
+    flist_string = NULL;
+
+error:
+    return ret;
+}
+
+
+static PyObject *FList_xml(FList *self, PyObject *args, PyObject *kwargs)
+{
+    int flag = 0;
+    char *root_element_name = NULL;
+
+    char *flist_string = NULL;
+    int flist_string_length = 0;
+    PyObject *ret = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|s", &flag, &root_element_name)) {
+        return NULL;
+    }
+
+    PIN_FLIST_TO_XML(self->flistp, flag, 0, &flist_string, &flist_string_length, root_element_name, &self->client->ebuf);
+
+    CHECK_PIN_ERR(self->client->ebuf, "Error converting flist to xml.");
+
+    ret = PyUnicode_FromString(flist_string);
+
+    free(flist_string);
+    flist_string = NULL;
+
+error:
+    return ret;
+}
+
+
+/*
+* Calling code must return the result to Python or decref it
+* Py_RETURN_NONE will incref the Py_None singleton
+*/
+static PyObject *FList_drop_field(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    int optional = 0;
+
+    FList *child = NULL;
+    pin_flist_t *temp = NULL;
+    pin_fld_type_t field_type = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|ii", &field, &elem_id, &optional)) {
+        return NULL;
+    }
+
+    field_type = PIN_GET_TYPE_FROM_FLD(field);
+
+    if (field_type == PIN_FLDT_SUBSTRUCT || field_type == PIN_FLDT_ARRAY) {
+        child = FList_get_child_from_cache(self, field, elem_id);
+    }
+
+    if (field_type == PIN_FLDT_SUBSTRUCT) {
+        temp = (pin_flist_t *)PIN_FLIST_FLD_TAKE(self->flistp, PIN_MAKE_FLD(field_type, field), optional, &self->client->ebuf);
+
+    } else if (field_type == PIN_FLDT_ARRAY) {
+        temp = PIN_FLIST_ELEM_TAKE(self->flistp, PIN_MAKE_FLD(field_type, field), elem_id, optional, &self->client->ebuf);
+
+    } else {
+        PIN_FLIST_FLD_DROP(self->flistp, PIN_MAKE_FLD(field_type, field), &self->client->ebuf);
+    }
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+
+    if (field_type == PIN_FLDT_SUBSTRUCT || field_type == PIN_FLDT_ARRAY) {
+        if (FList_delete_child(self, child, &temp, field, elem_id) < 0) {
+            goto error;
+        };
+    }
+
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_drop_array(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    pin_flist_t *temp = NULL;
+    FList *child = NULL;
+    PyObject *ret = NULL;
+
+    int deleted_count = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i", &field)) {
+        return NULL;
+    }
+
+    while (1)
+    {
+        last_cookie = cookie;
+        temp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &self->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+        if (last_cookie == cookie) {
+            break;
+        }
+
+        child = FList_get_child_from_cache(self, field, elem_id);
+
+        temp = PIN_FLIST_ELEM_TAKE(self->flistp, field, elem_id, 1, &self->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+        FList_mark_modified(self);
+
+        if (FList_delete_child(self, child, &temp, field, elem_id) < 0) {
+            goto error;
+        };
+
+        // This will cause PIN_FLIST_ELEM_GET_NEXT to take the first item again
+        // Without this it will not delete everything since the cookie shifts on each take
+        cookie = NULL;
+        deleted_count++;
+
+    }
+
+    ret = Py_BuildValue("i", deleted_count);
+
+error:
+    return ret;
+}
+
+static PyObject *FList_set_poid(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    PyObject *value = Py_None;
+    const char *poid_string = NULL;
+
+    poid_t *pdp = NULL;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O", kwargs_names, &field, &value)) {
+        return NULL;
+    }
+
+     /*
+     pdp = PIN_POID_FROM_STR allocates new memory on heap.
+     If you use PIN_FLIST_FLD_PUT, calling code can no longer access pdp
+     Also, calling PIN_FLIST_DESTROY on the flist will free the memory for this
+     You can prove this by then calling PIN_POID_DESTROY on pdp which will fail
+     If you use PIN_FLIST_FLD_SET, then PIN_FLIST_DESTROY does not free the mem
+     You can prove this by calling PIN_POID_DESTROY on pdp which will not fail
+     Calling PIN_POID_DESTROY a second time will then fail.
+
+     Note also that you cannot trust `if (pdp)` - it will return true
+     regardless if you PIN_POID_DESTROY or PIN_FLIST_DESTROY.
+     */
+
+    if (Poid_Check(value)) {
+        if (Poid_to_pdp((Poid *) value, self->client, &pdp) < 0) {
+            return NULL;
+        }
+    } else if (PyUnicode_Check(value)) {
+        if ((poid_string = PyUnicode_AsUTF8(value)) == NULL) {
+            return NULL;
+        }
+        pdp = PIN_POID_FROM_STR((char *) poid_string, NULL, &self->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error creating POID from %s", poid_string);
+    } else if (value != Py_None) {
+        PyErr_Format(PyExc_TypeError, "value must be Poid, str, or None for field %s", PIN_FIELD_GET_NAME(field));
+        return NULL;
+    }
+
+    PIN_FLIST_FLD_PUT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_POID, field), (void *) pdp, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting poid for field %s", PIN_FIELD_GET_NAME(field));
+    FList_mark_modified(self);
+
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_get_poid(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+
+    poid_t *pdp = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        return NULL;
+    }
+
+    pdp = (poid_t *) PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_POID, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error creating poid from field %s", PIN_FIELD_GET_NAME(field));
+
+    if (pdp == NULL) {
+        Py_RETURN_NONE;
+    }
+    return Poid_from_pdp(pdp);
+
+error:
+    return NULL;
+}
+
+static PyObject *FList_get_int(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+    int *value = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        return NULL;
+    }
+
+    value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_INT, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting pin_fld_num_t field %s", PIN_FIELD_GET_NAME(field));
+
+    if (value == NULL) {
+        Py_RETURN_NONE;
+    }
+    return Py_BuildValue("i", *value);
+error:
+    return NULL;
+}
+
+static PyObject *FList_get_enum(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+    int *value = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        return NULL;
+    }
+
+    value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ENUM, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting enum field %s", PIN_FIELD_GET_NAME(field));
+
+    if (value == NULL) { // TODO remove this? Won't ever trigger
+        Py_RETURN_NONE;
+    }
+
+    return Py_BuildValue("i", *value);
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_get_str(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+    char *value = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        return NULL;
+    }
+
+    value = (char *) PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_STR, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting str field %s", PIN_FIELD_GET_NAME(field));
+
+    if (value == NULL) {
+        Py_RETURN_NONE;
+    }
+
+    return Py_BuildValue("s", value);
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_get_binstr(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+
+    pin_binstr_t *binstrp;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        goto error;
+    }
+
+    binstrp = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BINSTR, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting str field %s", PIN_FIELD_GET_NAME(field));
+
+    // As far as I can tell binstrp will not be NULL
+    if (binstrp == NULL || binstrp->data == NULL) {
+        Py_RETURN_NONE;
+    }
+
+    // Apparently if you give a NULL pointer here it is smart enough to return None to Python
+    return Py_BuildValue("y#", binstrp->data, binstrp->size);
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_get_buf(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+
+    pin_buf_t *buf;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        goto error;
+    }
+
+    buf = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BUF, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting str field %s", PIN_FIELD_GET_NAME(field));
+
+    // As far as I can tell buf will not be NULL
+    if (buf == NULL || buf->data == NULL) {
+        Py_RETURN_NONE;
+    }
+
+    // Apparently if you give a NULL pointer here it is smart enough to return None to Python
+    return Py_BuildValue("y#", buf->data, buf->size);
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_does_field_exist(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+
+    int elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_fld_type_t field_type = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i", &field)) {
+        goto error;
+    }
+
+    field_type = PIN_GET_TYPE_FROM_FLD(field);
+
+    if (field_type == PIN_FLDT_ARRAY) {
+        /*Use optional=0 to account for the case where a NULL FList is added to an Array */
+        PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 0, &cookie, &self->client->ebuf);
+
+    } else {
+        // Use optional=0 to account for the case where a NULL POID is added to an FList
+        // because PIN_FLIST_FLD_GET will return NULL
+        PIN_FLIST_FLD_GET(self->flistp, field, 0, &self->client->ebuf);
+
+
+    }
+
+    if (PIN_ERR_IS_ERR(&self->client->ebuf)) {
+        PIN_ERRBUF_RESET(&self->client->ebuf);
+        Py_RETURN_FALSE;
+    } else {
+        Py_RETURN_TRUE;
+    }
+
+    Py_RETURN_TRUE;
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_does_flist_exist_on_array(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int elem_id = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "ii", &field, &elem_id)) {
+        goto error;
+    }
+
+    if (elem_id == -1) {
+        elem_id = PIN_ELEMID_ANY;
+    }
+
+    /* Use optional=0 to account for case where a NULL Flist is added to the array */
+    PIN_FLIST_ELEM_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), elem_id, 0, &self->client->ebuf);
+    if (PIN_ERR_IS_ERR(&self->client->ebuf)) {
+        PIN_ERRBUF_RESET(&self->client->ebuf);
+        Py_RETURN_FALSE;
+    } else {
+        Py_RETURN_TRUE;
+    }
+error:
+    return NULL;
+}
+
+static PyObject *FList_get_tstamp(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+    int tstamp_mode = CLIENT_MODE;
+    time_t *value = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|ii", &field, &optional, &tstamp_mode)) {
+        return NULL;
+    }
+
+    value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_TSTAMP, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting tstamp field %s", PIN_FIELD_GET_NAME(field));
+
+    if (value == NULL) {
+        Py_RETURN_NONE;
+    }
+
+    return Client_tstamp_to_python(self->client, tstamp_mode, *value);
+
+error:
+    return NULL;
+}
+
+static PyObject *FList_get_decimal(FList *self, PyObject *args,
+                                   PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+    int decimal_mode = CLIENT_MODE;
+
+    pin_decimal_t *decimal_value;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|ii", &field, &optional, &decimal_mode)) {
+        return NULL;
+    }
+
+    decimal_value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_DECIMAL, field), optional, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting decimal field %s", PIN_FIELD_GET_NAME(field));
+
+    if (decimal_value == NULL) {
+        // The assumption here is that optional is 1,
+        // and that PIN_FLIST_FLD_GET won't return NUll
+        // without setting the ebuf error
+        // Is that accurate?
+        Py_RETURN_NONE;
+    }
+
+    /* A NULL decimal is None. I can't create one but I've seen it when pulling flists stored by other applications */
+    return Client_decimal_to_python(self->client, decimal_mode, field, decimal_value);
+
+error:
+    return NULL;
+}
+
+
+/*
+* Returns a New Reference
+*/
+static PyObject *FList_get_flist(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+
+    FList *sub_flist = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+        return NULL;
+    }
+
+    if ((sub_flist = (FList *) FList_make_flist_on_parent(self, field, 0)) == NULL) {
+        goto error;
+    }
+
+    if (!sub_flist->flistp) {
+        sub_flist->flistp = PIN_FLIST_SUBSTR_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_SUBSTRUCT, field), optional, &self->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+    }
+
+    if (!sub_flist->flistp) {
+        // If optional is 1 and flist doesn't exist at this index, return None
+        // decrefing the sub_flist will make it immediately deallocate, where it is removed from parents cache
+        Py_XDECREF(sub_flist);
+        Py_RETURN_NONE;
+    }
+
+    return (PyObject *) sub_flist;
+
+error:
+    Py_XDECREF(sub_flist);
+    return NULL;
+}
+
+
+static PyObject *FList_set_str(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    char *value = NULL;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|s", kwargs_names, &field, &value)) {
+        goto error;
+    }
+
+    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_STR, field), (void *) value, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_set_binstr(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    char *value = NULL;
+    int size = 0;
+
+
+    pin_binstr_t binstr;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|y#", kwargs_names, &field, &value, &size)) {
+        goto error;
+    }
+
+    binstr.data = value;
+    binstr.size = size; // This is wrong but I'm not going to support this now
+    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BINSTR, field), &binstr, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_set_buf(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    char *value = NULL;
+    int size = 0;
+
+
+    pin_buf_t buf;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|y#", kwargs_names, &field, &value, &size)) {
+        goto error;
+    }
+
+    buf.flag = 0;
+    buf.offset = 0;
+    buf.data = value;
+    buf.size = size;
+    buf.xbuf_file = NULL;
+    // TODO this doesn't handle xbuf, flag and offset ...
+    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BUF, field), &buf, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_set_tstamp(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    PyObject *value_obj = Py_None;
+    time_t value = 0;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O", kwargs_names, &field, &value_obj)) {
+        goto error;
+    }
+
+    if (PyDateTime_Check(value_obj)) {
+        if (Client_datetime_to_tstamp(value_obj, &value) < 0) {
+            goto error;
+        }
+    } else if (PyLong_Check(value_obj)) {
+        if ((value = (time_t) PyLong_AsLongLong(value_obj)) == -1 && PyErr_Occurred()) {
+            goto error;
+        }
+    } else if (value_obj != Py_None) {
+        PyErr_Format(PyExc_TypeError, "Expected datetime or int not %s", Py_TYPE(value_obj)->tp_name);
+        goto error;
+    }
+
+    // For BRM time stamps, 0 behaves as null
+    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_TSTAMP, field), (void *) &value, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting tstamp for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+static PyObject *FList_set_int(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int value = 0;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$i", kwargs_names, &field, &value)) {
+        goto error;
+    }
+
+    // For BRM int values, there is no null int, just 0
+    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_INT, field), (void *) &value, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting int for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+static PyObject *FList_set_enum(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int value = 0;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$i", kwargs_names, &field, &value)) {
+        goto error;
+    }
+
+    // For BRM int values, there is no null enum, just 0
+    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ENUM, field), (void *) &value, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting int for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+static PyObject *FList_set_decimal(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    PyObject *value = Py_None;
+    pin_decimal_t *decimal_value = NULL;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O", kwargs_names, &field, &value)) {
+        return NULL;
+    }
+
+    if (value != Py_None) {
+        if (Client_decimal_from_python(self->client, field, value, &decimal_value) < 0) {
+            goto error;
+        }
+    }
+
+    PIN_FLIST_FLD_PUT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_DECIMAL, field), (void *) decimal_value, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting decimal for field %s", PIN_FIELD_GET_NAME(field));
+
+    FList_mark_modified(self);
+    Py_RETURN_NONE;
+
+error:
+    // pbo_decimal_destroy allows NULL values
+    pbo_decimal_destroy(&decimal_value);
+    return NULL;
+}
+
+
+/*
+* Returns a New Reference
+*/
+static PyObject *FList_get_array_flist(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    int optional = 0;
+
+    FList *sub_flist = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "iii", &field, &elem_id, &optional)) {
+        return NULL;
+    }
+
+    if ((sub_flist = (FList *) FList_make_flist_on_parent(self, field, elem_id)) == NULL) {
+        goto error;
+    }
+
+    if (!sub_flist->flistp) {
+        sub_flist->flistp = PIN_FLIST_ELEM_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), elem_id, optional, &self->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting flist for field %s elem_id %i", PIN_FIELD_GET_NAME(field), elem_id);
+    }
+
+    if (!sub_flist->flistp) {
+        // If optional is 1 and flist doesn't exist at this index, return None
+        // decrefing the sub_flist will make it immediately deallocate, where it is removed from parents cache
+        Py_XDECREF(sub_flist);
+        Py_RETURN_NONE;
+    }
+
+    return (PyObject *) sub_flist;
+
+error:
+    Py_XDECREF(sub_flist);
+    return NULL;
+}
+
+
+/*
+* Returns a New Reference
+*
+* Returns the flist at the PIN_ELEMID_ANY position on this array.
+* Remember that if nothing was directly set at PIN_ELEMID_ANY, this will return the very first flist placed on the array
+*
+* This will determine what the first flist on the array was, which is always identical to PIN_ELEMID_ANY
+* It will pull the elem_id from that, which is -1 for PIN_ELEMID_ANY and 0+ for a non PIN_ELEMID_ANY.
+* It uses this elem_id to look up in the cache.
+*/
+static PyObject *FList_get_any_array_flist(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int optional = 0;
+
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+
+    PyObject *arg_list = NULL;
+    PyObject *ret = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "ii", &field, &optional)) {
+        return NULL;
+    }
+
+    /*
+    * Normally you would use PIN_FLIST_ELEM_GET with PIN_ELEMID_ANY
+    * However we cannot cache that and return the proper FList wrapper
+    * So we will use PIN_FLIST_ELEM_GET_NEXT and set cookie = NULL
+    * This appears to have identical behavior to PIN_FLIST_ELEM_GET/PIN_ELEMID_ANY
+    * Note also that PIN_FLIST_ELEM_GET with -1 will do the same thing here...
+    */
+
+    PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &self->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+
+    if ((arg_list = Py_BuildValue("(iii)", field, elem_id, optional)) == NULL){
+        goto error;
+    }
+
+    ret = FList_get_array_flist(self, arg_list, NULL);
+
+error:
+    Py_XDECREF(arg_list);
+    return ret;
+}
+
+
+/*
+* Utility function for FList_set_flist_on_array_any. Check the comments there.
+*
+* The calling code will first copy the top level parent.
+* If there are any child python references to the parent, they need to point to flists on the new parent.
+*
+* This recurses through each child on the flist that is in cache, in other words, it recurses through all
+* the python references for this flist, and it updates each flistp to point to the parent.
+*
+* The calling code MUST destroy the old super-parent flistp, or it will be a memory leak.
+*/
+static int FList_recurse_any(FList *self) {
+    Py_ssize_t i = 0;
+    FList *child = NULL;
+    pin_fld_num_t field = 0;
+    int elem_id = 0;
+    int err = 0;
+
+    for (i = 0; i < self->children_capacity; i++) {
+        child = self->children[i].child;
+        if (child != NULL) {
+            field = self->children[i].field;
+            elem_id = self->children[i].elem_id;
+
+            // Set the child's flistp to the flist on the parent.
+            child->flistp = PIN_FLIST_ELEM_GET(self->flistp, field, elem_id, 1, &self->client->ebuf);
+            CHECK_PIN_ERR_FORMAT(self->client->ebuf, "failed to get child %s", PIN_FIELD_GET_NAME(field));
+            // Views and iterators of the child borrowed the old pointer
+            child->generation++;
+            child->tree_generation++;
+            if (FList_recurse_any(child) < 0) {
+                err = -1;
+            }
+        }
+    }
+    return err;
+error:
+    return -1;
+}
+
+
+static PyObject *FList_set_flist_on_array_any(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    FList *elem_flist = NULL;
+
+    pin_flist_t *flist_to_set = NULL;
+    PyObject *arg_list = NULL;
+    FList *ret = NULL;
+
+    char *kwargs_names[] = {"field", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O!", kwargs_names, &field, &FListType, &elem_flist)) {
+        goto error;
+    }
+
+    /* Check to see if there is a pre-existing flist at the PIN_ELEMID_ANY position */
+    if ((arg_list = Py_BuildValue("(ii)", field, 1)) == NULL){
+        goto error;
+    }
+    if ((ret = (FList *) FList_get_any_array_flist(self, arg_list, NULL)) == NULL) {
+        goto error;
+    }
+
+    Py_DECREF(arg_list);
+    arg_list = NULL;
+
+    /*
+    * If there is a pre-existing flistp at PIN_ELEMID_ANY, we have to take special care of it here.
+    * The PIN_FLIST_ELEM_SET will destroy the pre-existing flistp and replace it with the new one.
+    * However, we may have some python references to an FList that holds the pre-existing flistp.
+    *
+    * We CANNOT simply call the FList_drop_field (which disasscociates parent from child, and only drops if
+    * there are no Python references. This strategy works fine in FList_set_flist_on_array
+    * but it doesn't work here with PIN_ELEMID_ANY.
+    *
+    * It doesn't work because once we call FList_drop_field on the first flistp, the next call to
+    * PIN_FLIST_ELEM_SET will simply overwrite the second flistp, which is now the first flistp after the call to
+    * PIN_FLIST_ELEM_SET.
+    *
+    * Instead, we have to copy the first flistp, and find all the children, and the grandchildren, and etc.
+    * and update the children to point to the new copy. Then we can disassociate child from the parent, but not delete.
+    * After this, we can safely PIN_FLIST_ELEM_SET which will delete the original and destroy it's memory.
+    *
+    */
+    if ((PyObject *) ret != Py_None) {
+        ret->flistp = PIN_FLIST_COPY(ret->flistp, &self->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error copying parent field %s", PIN_FIELD_GET_NAME(field));
+        // Views and iterators of the old flist borrowed the pointer that PIN_FLIST_ELEM_SET is about to destroy
+        ret->generation++;
+        ret->tree_generation++;
+        if (FList_recurse_any(ret) < 0) {
+            goto error;
+        }
+
+        // ret came from the cache, so it is still associated with this parent
+        FList_disassociate_child(self, ret, field, ret->elem_id);
+    }
+
+    if (elem_flist) {
+        // otherwise we are setting it to NULL
+        flist_to_set = elem_flist->flistp;
+    }
+
+    PIN_FLIST_ELEM_SET(self->flistp, flist_to_set, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), PIN_ELEMID_ANY, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error setting element on array");
+    FList_mark_modified(self);
+
+    Py_XDECREF(ret);
+    Py_RETURN_NONE;
+
+error:
+    Py_XDECREF(arg_list);
+    Py_XDECREF(ret);
+    return NULL;
+}
+
+
+/*
+* Set an flist on an array using a regular, numeric index.
+* Do not use this for PIN_ELEMID_ANY - use FList_set_flist_on_array_any instead.
+*/
+static PyObject *FList_set_flist_on_array(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    FList *elem_flist = NULL;
+    int elem_id = 0;
+
+    pin_flist_t *flist_to_set = NULL;
+    PyObject *arg_list = NULL;
+    PyObject *result = NULL;
+
+    char *kwargs_names[] = {"field", "elem_id", "value", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ii|$O!", kwargs_names, &field, &elem_id, &FListType, &elem_flist)) {
+        goto error;
+    }
+
+    /*
+    * PIN_FLIST_SUBSTR_SET will DESTROY an flist if it already exists
+    * Thus need to call FList_drop_field to disassociate it if it exists
+    * FList_drop_field checks if there are any references to this child flist
+    * If there are, we take the memory of the child flist from the parent flist
+    * This way, the PIN_FLIST_ELEM_SET has nothing to destroy
+    * If there are not any references to this child flist,
+    * we both take the memory and then destroy it
+    * So in either case, the PIN_FLIST_ELEM_SET isn't actually destroying any memory
+    */
+
+    /*
+    * The PIN_ELEMID_ANY is a bit more complex, and is handled in this function:
+    * FList_set_flist_on_array_any
+    * The calling code should NOT call -1 for PIN_ELEMID_ANY
+    */
+
+
+    if ((arg_list = Py_BuildValue("(iii)", field, elem_id, 1)) == NULL) {
+        goto error;
+    }
+    if ((result = FList_drop_field(self, arg_list, NULL)) == NULL) {
+        goto error;
+    }
+
+    if (elem_flist) {
+        // otherwise we are setting it to NULL
+        flist_to_set = elem_flist->flistp;
+    }
+    /*
+    Note: there is NO NEED to set the elem_flist->parent_flist = self
+    Because PIN_FLIST_ELEM_SET will copy the elem_flist->flistp into self->flistp.
+    If self->flistp is destroyed, we can still refer to elem_flist->flistp without segfaulting.
+    */
+    PIN_FLIST_ELEM_SET(self->flistp, flist_to_set, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), elem_id, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error setting element on array");
+    FList_mark_modified(self);
+
+    Py_DECREF(arg_list);
+    return result;
+
+error:
+    Py_XDECREF(arg_list);
+    Py_XDECREF(result);
+    return NULL;
+}
+
+
+/*
+* COPY an flist onto this array
+* To create a brand new subflist, use FList_add_flist
+*/
+static PyObject *FList_set_substr(FList *self, PyObject *args, PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    FList *substr_flist = NULL;
+
+    PyObject *arg_list = NULL;
+    PyObject *ret = NULL;
+    pin_flist_t *flist_to_set = NULL;
+
+    /*
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "iO!", &field, &FListType, &substr_flist)) {
+        return NULL;
+    }
+    */
+    char *kwargs_names[] = {"field", "value", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O!", kwargs_names, &field, &FListType, &substr_flist)) {
+        goto error;
+    }
+
+    /*
+    Note:
+
+    This will COPY the input flist onto this parent flist.
+    Thus there is no need to set the substr_flist->parent_flist = self
+    Likewise there is no need to set the cache here, until someone calls a get
+    Because PIN_FLIST_SUBSTR_SET will COPY*** the substr_flist->flistp into self->flistp.
+    If self->flistp is destroyed, we can still refer to substr_flist->flistp without segfaulting.
+    */
+    if ((arg_list = Py_BuildValue("(iii)", field, 0, 1)) == NULL) {
+        goto error;
+    }
+
+    /*
+    * PIN_FLIST_SUBSTR_SET will DESTROY an flist if it already exists
+    * Thus need to call FList_drop_field to disassociate it if it exists
+    */
+    if ((ret = FList_drop_field(self, arg_list, NULL)) == NULL) {
+        goto error;
+    }
+
+    if (substr_flist != NULL) {
+        flist_to_set = substr_flist->flistp;
+    }
+
+    PIN_FLIST_SUBSTR_SET(self->flistp, flist_to_set, PIN_MAKE_FLD(PIN_FLDT_SUBSTRUCT, field), &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error setting substructure");
+    FList_mark_modified(self);
+
+    Py_DECREF(arg_list);
+
+    return ret;
+
+error:
+    Py_XDECREF(arg_list);
+    Py_XDECREF(ret);
+    return NULL;
+}
+
+
+static PyObject *FList_copy_flist(FList *self, PyObject *args, PyObject *kwargs)
+{
+    FList *flist_copy = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if ((flist_copy = (FList *) FList_make_flist(self)) == NULL) {
+        goto error;
+    }
+
+    flist_copy->flistp = PIN_FLIST_COPY(self->flistp, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
+    assert(flist_copy->flistp);
+    flist_copy->may_have_duplicates = self->may_have_duplicates;
+
+    return (PyObject *) flist_copy;
+
+error:
+    Py_XDECREF(flist_copy);
+    return NULL;
+}
+
+
+
+static PyObject *FList_sort_flist(FList *self, PyObject *args,
+                                  PyObject *kwargs)
+{
+    FList *sort_flist = NULL;
+    int sort_default = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "O!i", &FListType, &sort_flist, &sort_default)) {
+        goto error;
+    }
+
+    PIN_FLIST_SORT(self->flistp, sort_flist->flistp, 0, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error sorting flist");
+    FList_mark_modified(self);
+
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+static PyObject *FList_sort_reverse_flist(FList *self, PyObject *args,
+                                          PyObject *kwargs)
+{
+    FList *sort_flist = NULL;
+    int sort_default = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+
+    if (!PyArg_ParseTuple(args, "O!i", &FListType, &sort_flist, &sort_default)) {
+        goto error;
+    }
+
+    PIN_FLIST_SORT_REVERSE(self->flistp, sort_flist->flistp, 0, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error sorting flist");
+    FList_mark_modified(self);
+
+    Py_RETURN_NONE;
+
+
+error:
+    return NULL;
+}
+
+
+
+static PyObject *FList_concat(FList *self, PyObject *args, PyObject *kwargs)
+{
+    FList *other_flist = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "O!", &FListType, &other_flist)) {
+        goto error;
+    }
+
+    PIN_FLIST_CONCAT(self->flistp, other_flist->flistp, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error concatenating flist");
+    self->may_have_duplicates = 1;
+    FList_mark_modified(self);
+
+    Py_RETURN_NONE;
+
+
+error:
+    return NULL;
+}
+
+
+/*
+*
+* Merging
+*
+* FList_merge copies every field of another flist onto this one, overwriting the fields that already exist
+* instead of duplicating them like PIN_FLIST_CONCAT. Substructs on both flists are merged recursively,
+* and array elements are replaced by elem_id.
+* With in_place, fields are moved off the other flist instead of copied, so it ends up empty.
+*
+* Each side of the merge is a pin_flist_t and the FList wrapping it, if there is one. Without an FList,
+* nothing below the pin_flist_t has a Python reference, so its fields can be taken directly.
+* Otherwise the child cache is checked so that any child FList is disassociated before its flist is taken.
+*
+*/
+
+/*
+* Takes a substruct or array element off flistp, which is wrapped by owner if owner is not NULL
+* If a child FList points to it, the child keeps it, and *taken is a copy if keep is set, or NULL otherwise
+* The calling code is responsible for *taken
+*/
+static int FList_merge_take(Client *client, FList *owner, pin_flist_t *flistp, pin_fld_num_t field, int32 elem_id, int keep, pin_flist_t **taken)
+{
+    FList *child = NULL;
+    pin_flist_t *temp = NULL;
+
+    *taken = NULL;
+    if (owner != NULL) {
+        child = FList_get_child_from_cache(owner, field, elem_id);
+    }
+
+    if (PIN_FIELD_GET_TYPE(field) == PIN_FLDT_ARRAY) {
+        temp = PIN_FLIST_ELEM_TAKE(flistp, field, elem_id, 1, &client->ebuf);
+    } else {
+        temp = (pin_flist_t *) PIN_FLIST_FLD_TAKE(flistp, field, 1, &client->ebuf);
+    }
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error taking field %s", PIN_FIELD_GET_NAME(field));
+
+    if (child == NULL) {
+        *taken = temp;
+        return 0;
+    }
+
+    // The child FList takes ownership of the flist it already points to
+    FList_disassociate_child(owner, child, field, elem_id);
+    if (keep && temp != NULL) {
+        *taken = PIN_FLIST_COPY(temp, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error copying field %s", PIN_FIELD_GET_NAME(field));
+    }
+    return 0;
+
+error:
+    return -1;
+}
+
+/*
+* Replaces the array element at elem_id on dest_flistp with elem_flistp, which may be NULL
+* If put is set, dest_flistp takes ownership of elem_flistp, otherwise it is copied
+*/
+static int FList_merge_elem(Client *client, FList *dest, pin_flist_t *dest_flistp, pin_fld_num_t field, int32 elem_id, pin_flist_t *elem_flistp, int put)
+{
+    FList *child = NULL;
+    pin_flist_t *taken = NULL;
+    int32 any_elem_id = 0;
+    pin_cookie_t cookie = NULL;
+
+    if (elem_id == PIN_ELEMID_ANY) {
+        /*
+        * PIN_FLIST_ELEM_SET destroys the flist at PIN_ELEMID_ANY in place, so a child FList pointing to it is
+        * moved onto a copy, the same as FList_set_flist_on_array_any
+        */
+        if (dest != NULL) {
+            PIN_FLIST_ELEM_GET_NEXT(dest_flistp, field, &any_elem_id, 1, &cookie, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+            if (cookie != NULL && (child = FList_get_child_from_cache(dest, field, any_elem_id)) != NULL) {
+                child->flistp = PIN_FLIST_COPY(child->flistp, &client->ebuf);
+                CHECK_PIN_ERR_FORMAT(client->ebuf, "Error copying parent field %s", PIN_FIELD_GET_NAME(field));
+                child->generation++;
+                child->tree_generation++;
+                if (FList_recurse_any(child) < 0) {
+                    goto error;
+                }
+                FList_disassociate_child(dest, child, field, any_elem_id);
+            }
+        }
+    } else {
+        if (FList_merge_take(client, dest, dest_flistp, field, elem_id, 0, &taken) < 0) {
+            goto error;
+        }
+        PIN_FLIST_DESTROY_EX(&taken, NULL);
+    }
+
+    if (put) {
+        PIN_FLIST_ELEM_PUT(dest_flistp, elem_flistp, field, elem_id, &client->ebuf);
+    } else {
+        PIN_FLIST_ELEM_SET(dest_flistp, elem_flistp, field, elem_id, &client->ebuf);
+    }
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error setting element on array %s", PIN_FIELD_GET_NAME(field));
+    return 0;
+
+error:
+    return -1;
+}
+
+static int FList_merge_flists(Client *client, FList *dest, pin_flist_t *dest_flistp, FList *src, pin_flist_t *src_flistp, int in_place);
+
+/*
+* Merges one field of src_flistp onto dest_flistp, value being what PIN_FLIST_ANY_GET_NEXT returned for it
+* Scalar fields that were already merged are in merged, so a duplicate field keeps the first value
+* With in_place, the field is taken off src_flistp, which must not be walked with a cookie at the same time
+*/
+static int FList_merge_field(Client *client, FList *dest, pin_flist_t *dest_flistp, FList *src, pin_flist_t *src_flistp,
+                             pin_fld_num_t field, int32 elem_id, void *value, int in_place, FieldSet *merged)
+{
+    pin_flist_t *dest_sub_flistp = NULL;
+    pin_flist_t *taken = NULL;
+    FList *dest_child = NULL;
+    FList *src_child = NULL;
+    int first = 0;
+
+    switch (PIN_FIELD_GET_TYPE(field)) {
+        case PIN_FLDT_ARRAY:
+            if (in_place) {
+                if (FList_merge_take(client, src, src_flistp, field, elem_id, 1, &taken) < 0) {
+                    goto error;
+                }
+                value = taken;
+            }
+            if (FList_merge_elem(client, dest, dest_flistp, field, elem_id, (pin_flist_t *) value, in_place) < 0) {
+                goto error;
+            }
+            taken = NULL;
+            break;
+
+        case PIN_FLDT_SUBSTRUCT:
+            dest_sub_flistp = PIN_FLIST_SUBSTR_GET(dest_flistp, field, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+
+            if (value != NULL && dest_sub_flistp != NULL) {
+                dest_child = dest != NULL ? FList_get_child_from_cache(dest, field, 0) : NULL;
+                src_child = src != NULL ? FList_get_child_from_cache(src, field, 0) : NULL;
+                if (FList_merge_flists(client, dest_child, dest_sub_flistp, src_child, (pin_flist_t *) value, in_place) < 0) {
+                    goto error;
+                }
+                if (in_place) {
+                    if (FList_merge_take(client, src, src_flistp, field, 0, 0, &taken) < 0) {
+                        goto error;
+                    }
+                    PIN_FLIST_DESTROY_EX(&taken, NULL);
+                }
+                break;
+            }
+
+            // A missing or NULL substruct on either side is replaced outright
+            if (FList_merge_take(client, dest, dest_flistp, field, 0, 0, &taken) < 0) {
+                goto error;
+            }
+            PIN_FLIST_DESTROY_EX(&taken, NULL);
+            if (in_place) {
+                if (FList_merge_take(client, src, src_flistp, field, 0, 1, &taken) < 0) {
+                    goto error;
+                }
+                PIN_FLIST_SUBSTR_PUT(dest_flistp, taken, field, &client->ebuf);
+                taken = NULL;
+            } else {
+                PIN_FLIST_SUBSTR_SET(dest_flistp, (pin_flist_t *) value, field, &client->ebuf);
+            }
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error setting substructure %s", PIN_FIELD_GET_NAME(field));
+            break;
+
+        default:
+            if ((first = FieldSet_add(merged, field)) < 0) {
+                goto error;
+            }
+            // PIN_FLIST_FLD_COPY and PIN_FLIST_FLD_MOVE both use the first occurrence of the field
+            if (in_place) {
+                if (first) {
+                    PIN_FLIST_FLD_MOVE(src_flistp, field, dest_flistp, field, &client->ebuf);
+                } else {
+                    PIN_FLIST_FLD_DROP(src_flistp, field, &client->ebuf);
+                }
+            } else if (first) {
+                PIN_FLIST_FLD_COPY(src_flistp, field, dest_flistp, field, &client->ebuf);
+            }
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error merging field %s", PIN_FIELD_GET_NAME(field));
+    }
+    return 0;
+
+error:
+    PIN_FLIST_DESTROY_EX(&taken, NULL);
+    return -1;
+}
+
+typedef struct {
+    pin_fld_num_t field;
+    int32 elem_id;
+} MergeEntry;
+
+/*
+* With in_place, the fields of src_flistp are listed before any of them is taken off, since that would invalidate the cookie
+* Each listed field is then looked up again, so that a field that cannot be taken is not visited forever
+*/
+static int FList_merge_flists(Client *client, FList *dest, pin_flist_t *dest_flistp, FList *src, pin_flist_t *src_flistp, int in_place)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    void *value = NULL;
+    MergeEntry *entries = NULL;
+    MergeEntry *resized = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t capacity = 0;
+    Py_ssize_t i = 0;
+    FieldSet merged;
+    int result = -1;
+
+    FieldSet_init(&merged);
+    while (1) {
+        last_cookie = cookie;
+        value = PIN_FLIST_ANY_GET_NEXT(src_flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error merging flists");
+
+        if (!in_place) {
+            if (FList_merge_field(client, dest, dest_flistp, src, src_flistp, field, elem_id, value, 0, &merged) < 0) {
+                goto error;
+            }
+            continue;
+        }
+
+        if (count == capacity) {
+            capacity = capacity ? capacity * 2 : 16;
+            if ((resized = PyMem_Realloc(entries, capacity * sizeof(MergeEntry))) == NULL) {
+                PyErr_NoMemory();
+                goto error;
+            }
+            entries = resized;
+        }
+        entries[count].field = field;
+        entries[count].elem_id = elem_id;
+        count++;
+    }
+
+    for (i = 0; i < count; i++) {
+        field = entries[i].field;
+        value = NULL;
+        if (PIN_FIELD_GET_TYPE(field) == PIN_FLDT_SUBSTRUCT) {
+            // Duplicate substructs were listed in order, and each one is taken off once it is merged
+            value = PIN_FLIST_SUBSTR_GET(src_flistp, field, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+        }
+        if (FList_merge_field(client, dest, dest_flistp, src, src_flistp, field, entries[i].elem_id, value, 1, &merged) < 0) {
+            goto error;
+        }
+    }
+    result = 0;
+
+error:
+    PyMem_Free(entries);
+    FieldSet_free(&merged);
+    if (dest != NULL) {
+        FList_mark_modified(dest);
+    }
+    if (in_place && src != NULL) {
+        FList_mark_modified(src);
+    }
+    return result;
+}
+
+static FList *FList_root(FList *self)
+{
+    while (self->parent_flist != NULL) {
+        self = (FList *) self->parent_flist;
+    }
+    return self;
+}
+
+static PyObject *FList_merge(FList *self, PyObject *args)
+{
+    FList *other = NULL;
+    int in_place = 0;
+    pin_flist_t *other_copy = NULL;
+    int result = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "O!|i", &FListType, &other, &in_place)) {
+        return NULL;
+    }
+
+    if (FList_root(self) != FList_root(other)) {
+        if (FList_merge_flists(self->client, self, self->flistp, other, other->flistp, in_place) < 0) {
+            return NULL;
+        }
+        Py_RETURN_NONE;
+    }
+
+    // Merging a substruct into its parent, or the other way around, would change other while walking it
+    if (in_place) {
+        PyErr_SetString(PyExc_ValueError, "Cannot merge in place an flist from the same parent flist");
+        return NULL;
+    }
+    other_copy = PIN_FLIST_COPY(other->flistp, &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
+    result = FList_merge_flists(self->client, self, self->flistp, NULL, other_copy, 1);
+    PIN_FLIST_DESTROY_EX(&other_copy, NULL);
+    if (result < 0) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+
+error:
+    return NULL;
+}
+
+
+/*
+*
+* Projection
+*
+* FList_project keeps only the fields named in a spec, either copying them onto a new flist or dropping the others
+* in place. The spec is a dict of field number to either None, to keep the whole field, or a nested spec,
+* to keep only those fields on a substruct or on every element of an array. FList.project builds it from the same
+* shape as the results of Client.search.
+*
+*/
+typedef struct ProjectionSpec {
+    Py_ssize_t size;
+    pin_fld_num_t *fields;
+    /* A NULL subspec keeps the whole field */
+    struct ProjectionSpec **subspecs;
+} ProjectionSpec;
+
+static void ProjectionSpec_free(ProjectionSpec *spec)
+{
+    Py_ssize_t i = 0;
+
+    if (spec == NULL) {
+        return;
+    }
+    if (spec->subspecs != NULL) {
+        for (i = 0; i < spec->size; i++) {
+            ProjectionSpec_free(spec->subspecs[i]);
+        }
+    }
+    PyMem_Free(spec->fields);
+    PyMem_Free(spec->subspecs);
+    PyMem_Free(spec);
+}
+
+static ProjectionSpec *ProjectionSpec_new(PyObject *dict)
+{
+    ProjectionSpec *spec = NULL;
+    PyObject *key = NULL;
+    PyObject *value = NULL;
+    Py_ssize_t pos = 0;
+    Py_ssize_t i = 0;
+
+    if (!PyDict_Check(dict)) {
+        PyErr_Format(PyExc_TypeError, "spec should be a dict, not %R", dict);
+        return NULL;
+    }
+    if ((spec = PyMem_Calloc(1, sizeof(ProjectionSpec))) == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    spec->size = PyDict_Size(dict);
+    spec->fields = PyMem_Calloc(spec->size ? spec->size : 1, sizeof(pin_fld_num_t));
+    spec->subspecs = PyMem_Calloc(spec->size ? spec->size : 1, sizeof(ProjectionSpec *));
+    if (spec->fields == NULL || spec->subspecs == NULL) {
+        PyErr_NoMemory();
+        goto error;
+    }
+
+    while (PyDict_Next(dict, &pos, &key, &value)) {
+        spec->fields[i] = (pin_fld_num_t) PyLong_AsLong(key);
+        if (spec->fields[i] == -1 && PyErr_Occurred()) {
+            goto error;
+        }
+        if (value != Py_None && (spec->subspecs[i] = ProjectionSpec_new(value)) == NULL) {
+            goto error;
+        }
+        i++;
+    }
+    return spec;
+
+error:
+    ProjectionSpec_free(spec);
+    return NULL;
+}
+
+/*
+* Returns 1 and sets subspec if field is in the spec, or 0 if not
+*/
+static int ProjectionSpec_find(ProjectionSpec *spec, pin_fld_num_t field, ProjectionSpec **subspec)
+{
+    Py_ssize_t i = 0;
+
+    for (i = 0; i < spec->size; i++) {
+        if (spec->fields[i] == field) {
+            *subspec = spec->subspecs[i];
+            return 1;
+        }
+    }
+    return 0;
+}
+
+/*
+* Copies the fields of src_flistp in spec onto dest_flistp
+*/
+static int FList_project_copy(Client *client, ProjectionSpec *spec, pin_flist_t *src_flistp, pin_flist_t *dest_flistp)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    void *value = NULL;
+    ProjectionSpec *subspec = NULL;
+    pin_flist_t *sub_flistp = NULL;
+    pin_fld_type_t field_type = 0;
+
+    while (1) {
+        last_cookie = cookie;
+        value = PIN_FLIST_ANY_GET_NEXT(src_flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error projecting flist");
+
+        if (!ProjectionSpec_find(spec, field, &subspec)) {
+            continue;
+        }
+        field_type = PIN_FIELD_GET_TYPE(field);
+
+        if (field_type != PIN_FLDT_ARRAY && field_type != PIN_FLDT_SUBSTRUCT) {
+            PIN_FLIST_FLD_COPY(src_flistp, field, dest_flistp, field, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error copying field %s", PIN_FIELD_GET_NAME(field));
+            continue;
+        }
+
+        if (subspec == NULL || value == NULL) {
+            if (field_type == PIN_FLDT_ARRAY) {
+                PIN_FLIST_ELEM_SET(dest_flistp, (pin_flist_t *) value, field, elem_id, &client->ebuf);
+            } else {
+                PIN_FLIST_SUBSTR_SET(dest_flistp, (pin_flist_t *) value, field, &client->ebuf);
+            }
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error copying field %s", PIN_FIELD_GET_NAME(field));
+            continue;
+        }
+
+        sub_flistp = PIN_FLIST_CREATE(&client->ebuf);
+        CHECK_PIN_ERR(client->ebuf, "Error creating flist");
+        if (FList_project_copy(client, subspec, (pin_flist_t *) value, sub_flistp) < 0) {
+            goto error;
+        }
+        if (field_type == PIN_FLDT_ARRAY) {
+            PIN_FLIST_ELEM_PUT(dest_flistp, sub_flistp, field, elem_id, &client->ebuf);
+        } else {
+            PIN_FLIST_SUBSTR_PUT(dest_flistp, sub_flistp, field, &client->ebuf);
+        }
+        sub_flistp = NULL;
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error copying field %s", PIN_FIELD_GET_NAME(field));
+    }
+    return 0;
+
+error:
+    PIN_FLIST_DESTROY_EX(&sub_flistp, NULL);
+    return -1;
+}
+
+/*
+* Drops every field in fields off flistp, which is wrapped by owner if owner is not NULL
+* Child FLists of the dropped fields keep their flists, the same as FList_drop_field
+* Does not mark owner as modified
+*
+* Returns 1 if any field was dropped, 0 if fields is empty, -1 on error
+*/
+static int FList_drop_fields(Client *client, FList *owner, pin_flist_t *flistp, FieldSet *fields)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_flist_t *taken = NULL;
+    Py_ssize_t i = 0;
+    int dropped = 0;
+
+    for (i = 0; i < fields->capacity; i++) {
+        field = fields->fields[i];
+        if (field == 0) {
+            continue;
+        }
+        dropped = 1;
+
+        switch (PIN_FIELD_GET_TYPE(field)) {
+            case PIN_FLDT_ARRAY:
+                // Take the first element until there are none left, the same as FList_drop_array
+                while (1) {
+                    cookie = NULL;
+                    PIN_FLIST_ELEM_GET_NEXT(flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+                    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+                    if (cookie == NULL) {
+                        break;
+                    }
+                    if (FList_merge_take(client, owner, flistp, field, elem_id, 0, &taken) < 0) {
+                        goto error;
+                    }
+                    PIN_FLIST_DESTROY_EX(&taken, NULL);
+                }
+                break;
+
+            case PIN_FLDT_SUBSTRUCT:
+                if (FList_merge_take(client, owner, flistp, field, 0, 0, &taken) < 0) {
+                    goto error;
+                }
+                PIN_FLIST_DESTROY_EX(&taken, NULL);
+                break;
+
+            default:
+                PIN_FLIST_FLD_DROP(flistp, field, &client->ebuf);
+                CHECK_PIN_ERR_FORMAT(client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+        }
+    }
+    return dropped;
+
+error:
+    return -1;
+}
+
+/*
+* Drops the fields of flistp that are not in spec, which is wrapped by owner if owner is not NULL
+* Fields are only dropped once the walk is over, so that the cookie is not invalidated
+*
+* Nested flists without an FList are not marked as modified themselves, so the nearest owner above them is marked
+* Returns 1 if fields were dropped that no FList has been marked as modified for yet, 0 if not, -1 on error
+*/
+static int FList_project_drop(Client *client, ProjectionSpec *spec, FList *owner, pin_flist_t *flistp)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    void *value = NULL;
+    ProjectionSpec *subspec = NULL;
+    FList *child = NULL;
+    FieldSet dropped;
+    int modified = 0;
+    int result = 0;
+
+    FieldSet_init(&dropped);
+    while (1) {
+        last_cookie = cookie;
+        value = PIN_FLIST_ANY_GET_NEXT(flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error projecting flist");
+
+        if (!ProjectionSpec_find(spec, field, &subspec)) {
+            if (FieldSet_add(&dropped, field) < 0) {
+                goto error;
+            }
+            continue;
+        }
+        if (subspec == NULL || value == NULL) {
+            continue;
+        }
+
+        switch (PIN_FIELD_GET_TYPE(field)) {
+            case PIN_FLDT_ARRAY:
+                child = owner != NULL ? FList_get_child_from_cache(owner, field, elem_id) : NULL;
+                break;
+            case PIN_FLDT_SUBSTRUCT:
+                child = owner != NULL ? FList_get_child_from_cache(owner, field, 0) : NULL;
+                break;
+            default:
+                continue;
+        }
+        if ((result = FList_project_drop(client, subspec, child, (pin_flist_t *) value)) < 0) {
+            goto error;
+        }
+        modified |= result;
+    }
+
+    if ((result = FList_drop_fields(client, owner, flistp, &dropped)) < 0) {
+        goto error;
+    }
+    modified |= result;
+
+    FieldSet_free(&dropped);
+    if (modified && owner != NULL) {
+        FList_mark_modified(owner);
+        return 0;
+    }
+    return modified;
+
+error:
+    FieldSet_free(&dropped);
+    if (owner != NULL) {
+        FList_mark_modified(owner);
+    }
+    return -1;
+}
+
+/*
+* Returns a new FList with only the fields in spec, or drops every other field off this FList if in_place is set
+*/
+static PyObject *FList_project(FList *self, PyObject *args)
+{
+    PyObject *spec_dict = NULL;
+    int in_place = 0;
+    ProjectionSpec *spec = NULL;
+    FList *projection = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "O|i", &spec_dict, &in_place)) {
+        return NULL;
+    }
+    if ((spec = ProjectionSpec_new(spec_dict)) == NULL) {
+        goto error;
+    }
+
+    if (in_place) {
+        if (FList_project_drop(self->client, spec, self, self->flistp) < 0) {
+            goto error;
+        }
+        ProjectionSpec_free(spec);
+        Py_RETURN_NONE;
+    }
+
+    if ((projection = (FList *) FList_make_flist(self)) == NULL) {
+        goto error;
+    }
+    projection->flistp = PIN_FLIST_CREATE(&self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error creating flist");
+    if (FList_project_copy(self->client, spec, self->flistp, projection->flistp) < 0) {
+        goto error;
+    }
+
+    ProjectionSpec_free(spec);
+    return (PyObject *) projection;
+
+error:
+    ProjectionSpec_free(spec);
+    Py_XDECREF(projection);
+    return NULL;
+}
+
+
+// There is a bug in PIN_FLIST_COUNT
+// If substructs/arrays are set using PIN_FLIST_FLD_SET, then PIN_FLIST_COUNT will count recursively
+// Instead, FList_count walks the top level fields the same way as FieldIterator
+// PIN_FLIST_ELEM_COUNT seems to work fine, however
+
+/*
+* Returns the number of distinct fields on the flist, not recursively, counting an array as one field
+* This is the number of keys FieldIterator yields, computed without creating any Python objects.
+* The count is cached until the next time a field is set or dropped on this flist.
+*/
+/*
+* Counts the distinct top level fields of flistp without creating any Python objects
+* Array elements are always folded into their array, other fields only if may_have_duplicates is set
+*
+* Returns the count, or -1 with an exception set
+*/
+static int32 FList_count_fields(Client *client, pin_flist_t *flistp, int may_have_duplicates)
+{
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    int32 count = 0;
+    FieldSet seen;
+
+    FieldSet_init(&seen);
+    while (1) {
+        last_cookie = cookie;
+        PIN_FLIST_ANY_GET_NEXT(flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error counting flist");
+
+        if (may_have_duplicates || PIN_FIELD_GET_TYPE(field) == PIN_FLDT_ARRAY) {
+            switch (FieldSet_add(&seen, field)) {
+                case -1:
+                    goto error;
+                case 0:
+                    continue;
+            }
+        }
+        count++;
+    }
+    FieldSet_free(&seen);
+    return count;
+
+error:
+    FieldSet_free(&seen);
+    return -1;
+}
+
+static PyObject *FList_count(FList *self, PyObject *Py_UNUSED(ignored))
+{
+    int32 count = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (self->cached_count >= 0 && self->count_generation == self->generation) {
+        return PyLong_FromLong(self->cached_count);
+    }
+
+    if ((count = FList_count_fields(self->client, self->flistp, self->may_have_duplicates)) < 0) {
+        return NULL;
+    }
+
+    self->cached_count = count;
+    self->count_generation = self->generation;
+    return PyLong_FromLong(count);
+}
+
+
+static PyObject *FList_array_count(FList *self, PyObject *args,
+                                   PyObject *kwargs)
+{
+    pin_fld_num_t field = 0;
+    int32 count = -1;
+    PyObject *ret = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i", &field)) {
+        return NULL;
+    }
+
+    count = PIN_FLIST_ELEM_COUNT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), &self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error counting flist");
+
+    ret = Py_BuildValue("i", count);
+
+error:
+    return ret;
+}
+
+/*
+*
+* FieldIterator
+*
+* Walks the fields of an flist with PIN_FLIST_ANY_GET_NEXT on demand, yielding interned field names,
+* or field numbers.
+*
+* PIN_FLIST_ANY_GET_NEXT returns an array field once per element, so array fields are always deduplicated.
+*
+* If two flists, which both have the same field, are concatenated with PIN_FLIST_CONCAT
+* BRM will actually have both fields on the flist, for some reason.
+* It's probably a bug. For example, if you call PIN_FLIST_FLD_GET, which field should it return?
+*   It returns the first field.
+* You can prove this by printing the flist. It will show the duplicating value.
+* The COUNT will also return one extra field.
+* Only flists that may hold such duplicates (see may_have_duplicates) pay for deduplicating every field.
+*
+* The reason we don't want to return the same key twice is to prevent something like this:
+* for k, v in flist.items():
+*     print(k, v)
+* For duplicate keys with distinct values, this will print the first value twice
+*
+* Setting or dropping fields while iterating raises a RuntimeError, just like a dict.
+*
+*/
+typedef struct {
+    PyObject_HEAD
+    FList *flist;
+    pin_cookie_t cookie;
+    /* yield field numbers instead of names */
+    int numbers;
+    int exhausted;
+    unsigned long generation;
+    FieldSet seen;
+} FieldIterator;
+
+static PyTypeObject FieldIteratorType;
+
+static void FieldIterator_dealloc(FieldIterator *self)
+{
+    FieldSet_free(&self->seen);
+    Py_XDECREF(self->flist);
+    PyObject_Del(self);
+}
+
+static PyObject *FieldIterator_next(FieldIterator *self)
+{
+    Client *client = self->flist->client;
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t last_cookie = NULL;
+    PyObject *name = NULL;
+
+    if (self->exhausted) {
+        return NULL;
+    }
+    if (self->flist->generation != self->generation) {
+        self->exhausted = 1;
+        PyErr_SetString(PyExc_RuntimeError, "flist changed during iteration");
+        return NULL;
+    }
+
+    while (1) {
+        last_cookie = self->cookie;
+        PIN_FLIST_ANY_GET_NEXT(self->flist->flistp, &field, &elem_id, &self->cookie, &client->ebuf);
+        if (last_cookie == self->cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
+            self->exhausted = 1;
+            return NULL;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error iterating flist");
+
+        if (self->flist->may_have_duplicates || PIN_FIELD_GET_TYPE(field) == PIN_FLDT_ARRAY) {
+            switch (FieldSet_add(&self->seen, field)) {
+                case -1:
+                    goto error;
+                case 0:
+                    continue;
+            }
+        }
+        break;
+    }
+
+    if (self->numbers) {
+        return PyLong_FromLong(field);
+    }
+    if ((name = FieldName_get(field)) == NULL) {
+        goto error;
+    }
+    Py_INCREF(name);
+    return name;
+
+error:
+    self->exhausted = 1;
+    return NULL;
+}
+
+static PyTypeObject FieldIteratorType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "brm.FieldIterator",
+    .tp_doc = "Iterator over the fields of an flist",
+    .tp_basicsize = sizeof(FieldIterator),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_dealloc = (destructor) FieldIterator_dealloc,
+    .tp_iter = PyObject_SelfIter,
+    .tp_iternext = (iternextfunc) FieldIterator_next,
+};
+
+/*
+* Returns an iterator over the field names on the flist, or over the field numbers if numbers is set
+*/
+static PyObject *FList_iter_fields(FList *self, PyObject *args, PyObject *kwargs)
+{
+    int numbers = 0;
+    FieldIterator *iter = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "|i", &numbers)) {
+        return NULL;
+    }
+
+    if ((iter = PyObject_New(FieldIterator, &FieldIteratorType)) == NULL) {
+        return NULL;
+    }
+    Py_INCREF(self);
+    iter->flist = self;
+    iter->cookie = NULL;
+    iter->numbers = numbers;
+    iter->exhausted = 0;
+    iter->generation = self->generation;
+    FieldSet_init(&iter->seen);
+
+    return (PyObject *) iter;
+}
+
+
+/*
+*
+* ArrayIterator
+*
+* Walks the elements of an array with a single PIN_FLIST_ELEM_GET_NEXT cookie, yielding each elem_id,
+* the child FList at that elem_id, or both, as it goes. The children are taken from the parent's child cache,
+* so no element is looked up by elem_id a second time.
+*
+* Setting or dropping fields on the flist invalidates the cookie, so that raises a RuntimeError,
+* just like changing a dict while iterating over it. Modifying the child flists themselves is fine.
+*
+* After PIN_FLIST_CONCAT an array can hold the same elem_id twice; only the first one is yielded.
+*
+*/
+#define ARRAY_ITER_KEYS 0
+#define ARRAY_ITER_VALUES 1
+#define ARRAY_ITER_ITEMS 2
 
 typedef struct {
     PyObject_HEAD
+    FList *flist;
+    pin_fld_num_t field;
+    pin_cookie_t cookie;
+    int kind;
+    int exhausted;
+    unsigned long generation;
+    /* The elem_ids seen so far, only when the flist may have duplicates */
+    PyObject *seen;
+} ArrayIterator;
+
+static PyTypeObject ArrayIteratorType;
+
+static void ArrayIterator_dealloc(ArrayIterator *self)
+{
+    Py_XDECREF(self->seen);
+    Py_XDECREF(self->flist);
+    PyObject_Del(self);
+}
 
-    Client *client;
-    pin_flist_t *flistp;
-    PyObject *iter_fields;
-    int iter_length;
-    PyObject *parent_flist;
-    pin_fld_num_t parent_field;
-    int32 elem_id;
-    PyObject *children;
-    PyObject *weakref;
-} FList;
+/*
+* Returns the child FList for an element, or None for a NULL element
+*
+* Returns a New Reference
+*/
+static PyObject *ArrayIterator_child(ArrayIterator *self, int32 elem_id, pin_flist_t *elem_flistp)
+{
+    FList *child = NULL;
 
-static PyMemberDef FList_members[] = {
-    {NULL}
-};
+    if (elem_flistp == NULL) {
+        Py_RETURN_NONE;
+    }
 
+    if ((child = (FList *) FList_make_flist_on_parent(self->flist, self->field, elem_id)) == NULL) {
+        return NULL;
+    }
+    if (!child->flistp) {
+        child->flistp = elem_flistp;
+    }
+    return (PyObject *) child;
+}
 
-/*
-* Removes a child from the children dictionary on the parent
-* Parent FLists have a children dictionary containing weak references to children
-*/
-static int FList_remove_child_from_cache(FList *self, pin_fld_num_t field, int32 elem_id)
+static PyObject *ArrayIterator_next(ArrayIterator *self)
 {
-    PyObject *tuple = NULL;
+    Client *client = self->flist->client;
+    int32 elem_id = 0;
+    pin_cookie_t last_cookie = self->cookie;
+    pin_flist_t *elem_flistp = NULL;
+    PyObject *child = NULL;
+    PyObject *ret = NULL;
+    PyObject *elem_id_object = NULL;
 
-    if ((tuple = PyTuple_New(2)) == NULL) {
-        return -1;
+    if (self->exhausted) {
+        return NULL;
+    }
+    if (self->flist->generation != self->generation) {
+        self->exhausted = 1;
+        PyErr_SetString(PyExc_RuntimeError, "flist changed during array iteration");
+        return NULL;
     }
 
-    PyTuple_SetItem(tuple, 0, Py_BuildValue("i", field));
-    PyTuple_SetItem(tuple, 1, Py_BuildValue("i", elem_id));
+    while (1) {
+        last_cookie = self->cookie;
+        elem_flistp = PIN_FLIST_ELEM_GET_NEXT(self->flist->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, self->field), &elem_id, 1, &self->cookie, &client->ebuf);
+        CHECK_PIN_ERR(client->ebuf, "Error iterating flist");
+        if (last_cookie == self->cookie) {
+            self->exhausted = 1;
+            return NULL;
+        }
+        if (self->seen == NULL) {
+            break;
+        }
 
-    if (PyDict_DelItem(self->children, tuple) < 0) {
-        Py_DECREF(tuple);
-        return -1;
-    };
+        if ((elem_id_object = PyLong_FromLong(elem_id)) == NULL) {
+            goto error;
+        }
+        switch (PySet_Contains(self->seen, elem_id_object)) {
+            case 0:
+                if (PySet_Add(self->seen, elem_id_object) < 0) {
+                    Py_DECREF(elem_id_object);
+                    goto error;
+                }
+                Py_DECREF(elem_id_object);
+                break;
+            case 1:
+                Py_DECREF(elem_id_object);
+                continue;
+            default:
+                Py_DECREF(elem_id_object);
+                goto error;
+        }
+        break;
+    }
 
-    Py_DECREF(tuple);
-    return 0;
+    switch (self->kind) {
+        case ARRAY_ITER_KEYS:
+            return PyLong_FromLong(elem_id);
+        case ARRAY_ITER_VALUES:
+            return ArrayIterator_child(self, elem_id, elem_flistp);
+        default:
+            if ((child = ArrayIterator_child(self, elem_id, elem_flistp)) == NULL) {
+                return NULL;
+            }
+            ret = Py_BuildValue("(iN)", elem_id, child);
+            return ret;
+    }
 
+error:
+    self->exhausted = 1;
+    return NULL;
 }
 
+static PyTypeObject ArrayIteratorType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "brm.ArrayIterator",
+    .tp_doc = "Iterator over the elements of an array",
+    .tp_basicsize = sizeof(ArrayIterator),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_dealloc = (destructor) ArrayIterator_dealloc,
+    .tp_iter = PyObject_SelfIter,
+    .tp_iternext = (iternextfunc) ArrayIterator_next,
+};
+
 /*
-* Returns a weak reference from the cache
-* Caller must call PyErr_Occurred()
-* This can be used with FList_delete_child which requires a weakref
-*
-* Return value: New Reference, caller should Py_XDECREF
+* Returns an iterator over the array field
+* kind is ARRAY_ITER_KEYS (elem_ids), ARRAY_ITER_VALUES (child FLists or None) or ARRAY_ITER_ITEMS (both)
 */
-static PyObject *FList_get_child_from_cache(FList *self, pin_fld_num_t field, int32 elem_id)
+static PyObject *FList_array_iter(FList *self, PyObject *args, PyObject *kwargs)
 {
-    PyObject *weakref = NULL;
-    PyObject *tuple = NULL;
+    pin_fld_num_t field = 0;
+    int kind = ARRAY_ITER_KEYS;
+    ArrayIterator *iter = NULL;
 
-    if ((tuple = PyTuple_New(2)) == NULL) {
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "i|i", &field, &kind)) {
+        return NULL;
+    }
+
+    if ((iter = PyObject_New(ArrayIterator, &ArrayIteratorType)) == NULL) {
+        return NULL;
+    }
+    Py_INCREF(self);
+    iter->flist = self;
+    iter->field = field;
+    iter->cookie = NULL;
+    iter->kind = kind;
+    iter->exhausted = 0;
+    iter->generation = self->generation;
+    iter->seen = NULL;
+    if (self->may_have_duplicates && (iter->seen = PySet_New(NULL)) == NULL) {
+        Py_DECREF(iter);
         return NULL;
     }
-    PyTuple_SetItem(tuple, 0, Py_BuildValue("i", field));
-    PyTuple_SetItem(tuple, 1, Py_BuildValue("i", elem_id));
 
-    weakref = PyDict_GetItemWithError(self->children, tuple);
-    Py_XINCREF(weakref);
-    Py_DECREF(tuple);
+    return (PyObject *) iter;
+}
+
+
+/*
+* Converts the value of a scalar field to Python, the same way as the FList getters
+* value is what PIN_FLIST_FLD_GET returned, and may be NULL
+*
+* Returns a New Reference
+*/
+static PyObject *FList_value_to_python(Client *client, pin_fld_num_t field, void *value)
+{
+    pin_fld_type_t field_type = PIN_FIELD_GET_TYPE(field);
+    pin_binstr_t *binstrp = NULL;
+    pin_buf_t *bufp = NULL;
+
+    switch (field_type) {
+        case PIN_FLDT_POID:
+            if (value == NULL) {
+                Py_RETURN_NONE;
+            }
+            return Poid_from_pdp((poid_t *) value);
+
+        case PIN_FLDT_STR:
+            if (value == NULL) {
+                Py_RETURN_NONE;
+            }
+            return PyUnicode_FromString((char *) value);
+
+        case PIN_FLDT_INT:
+        case PIN_FLDT_ENUM:
+            if (value == NULL) {
+                Py_RETURN_NONE;
+            }
+            return PyLong_FromLong(*(int *) value);
+
+        case PIN_FLDT_TSTAMP:
+            if (value == NULL) {
+                Py_RETURN_NONE;
+            }
+            return Client_tstamp_to_python(client, CLIENT_MODE, *(time_t *) value);
+
+        case PIN_FLDT_DECIMAL:
+            if (value == NULL) {
+                Py_RETURN_NONE;
+            }
+            return Client_decimal_to_python(client, CLIENT_MODE, field, (pin_decimal_t *) value);
+
+        case PIN_FLDT_BINSTR:
+            binstrp = (pin_binstr_t *) value;
+            if (binstrp == NULL || binstrp->data == NULL) {
+                Py_RETURN_NONE;
+            }
+            return PyBytes_FromStringAndSize((const char *) binstrp->data, binstrp->size);
+
+        case PIN_FLDT_BUF:
+            bufp = (pin_buf_t *) value;
+            if (bufp == NULL || bufp->data == NULL) {
+                Py_RETURN_NONE;
+            }
+            return PyBytes_FromStringAndSize((const char *) bufp->data, bufp->size);
+
+        default:
+            PyErr_Format(PyExc_NotImplementedError, "We do not support this data type %i for field %s", (int) field_type, PIN_FIELD_GET_NAME(field));
+            return NULL;
+    }
 
-    return weakref;
+error:
+    return NULL;
 }
 
 
+/*
+*
+* Sorting arrays
+*
+* FList_array_sort sorts the flists on an array by key, with Python's stable sort and comparison rules,
+* instead of the sort flist and BRM comparison rules of PIN_FLIST_SORT.
+* The keys are either pulled out of each flist natively, or computed by the calling code with a Python key function.
+* The flists are then taken off the array and put back on in sorted order, so they are relinked rather than copied,
+* and child FLists keep pointing at the same flists.
+*
+*/
+typedef struct {
+    int32 elem_id;
+    pin_flist_t *flistp;
+    FList *child;
+    /* Set while the flist is off the array */
+    int taken;
+} SortElem;
 
-static int FList_disassociate_child(FList *self, PyObject **weakref, pin_fld_num_t field, int32 elem_id)
+/*
+* After an error, puts back on the array every flist the sort took off and did not put back yet, in array order
+* They keep their elem_ids, or are numbered on from next_elem_id when renumbering, so they never replace a sorted flist
+* A flist that still cannot be put back is left to its child FList, or destroyed if it has none
+* Child FLists are moved in the cache along with their flists
+*/
+static void FList_array_sort_restore(FList *self, pin_fld_num_t field, SortElem *elems, Py_ssize_t count, int renumber,
+                                     int32 next_elem_id)
 {
-    FList *child_flist = NULL;
-    int err = 0;
-    if (*weakref != NULL) {
-        /* Decref the parent since we are disassociating the child */
-        Py_DECREF(self);
-        child_flist = (FList *) PyWeakref_GetObject(*weakref);
-        if ((PyObject *) child_flist == Py_None) {
-            // This might happen if the delete from the dict in FList_dealloc had an OOM
-            Py_DECREF(*weakref);
-            *weakref = NULL;
-            child_flist = NULL;
+    Client *client = self->client;
+    FList *child = NULL;
+    int32 elem_id = 0;
+    Py_ssize_t i = 0;
+    int restored = 0;
+
+    for (i = 0; i < count; i++) {
+        if (!elems[i].taken) {
+            continue;
+        }
+        elems[i].taken = 0;
+        restored = 1;
+        elem_id = renumber ? next_elem_id++ : elems[i].elem_id;
+        child = elems[i].child;
+        // A child that is still cached under its old elem_id is taken out, without touching a sorted child there
+        if (child != NULL && FList_get_child_from_cache(self, field, elems[i].elem_id) == child) {
+            FList_remove_child_from_cache(self, field, elems[i].elem_id);
+        }
+
+        if (elems[i].flistp == NULL) {
+            PIN_FLIST_ELEM_SET(self->flistp, NULL, field, elem_id, &client->ebuf);
         } else {
-            // child_flist will never be NULL
-            child_flist->parent_flist = NULL;
-            child_flist->parent_field = 0;
+            PIN_FLIST_ELEM_PUT(self->flistp, elems[i].flistp, field, elem_id, &client->ebuf);
         }
-        // This could fail in exceptional scenarios like OOM, leaving a child in cache
-        err = FList_remove_child_from_cache(self, field, elem_id);
-    }
+        if (!PIN_ERR_IS_ERR(&client->ebuf)) {
+            elems[i].flistp = NULL;
+            if (child != NULL) {
+                // The entry was just removed, so this never needs to grow the cache and cannot fail
+                child->elem_id = elem_id;
+                FList_add_child_to_cache(self, child, field, elem_id);
+            }
+            continue;
+        }
+        PIN_ERRBUF_RESET(&client->ebuf);
 
-    return err;
+        if (child == NULL) {
+            PIN_FLIST_DESTROY_EX(&elems[i].flistp, NULL);
+            continue;
+        }
+        // The same as FList_disassociate_child, the child is no longer in the cache
+        child->parent_flist = NULL;
+        child->parent_field = 0;
+        Py_DECREF(self);
+        elems[i].flistp = NULL;
+    }
+    if (restored) {
+        FList_mark_modified(self);
+    }
 }
 
+/*
+* Wraps a key so that missing keys compare last without comparing their values: (0, key) or (1,)
+* When the sort is reversed, missing keys are (-1,) instead, so that they still end up last
+*
+* Returns a New Reference
+*/
+static PyObject *FList_sort_key(PyObject *key, int reverse)
+{
+    if (key == NULL || key == Py_None) {
+        return Py_BuildValue("(i)", reverse ? -1 : 1);
+    }
+    return Py_BuildValue("(iO)", 0, key);
+}
 
 /*
-* Either Drop the child C Flist or disassociate the child C Flist from the parent
-* If there are no other references to the child, we must drop it
-* If there are other references to the child, we cannot drop it, but must disassociate it
+* Returns the sort key of elem_flistp from key_fields, a tuple of field numbers
 *
-* Use FList_get_child_from_cache to get a weak reference
-* Then call one of the PIN_*_TAKE Macros to remove the C Flist from the parent
-* Then call this function which will decide whether to DESTROY the flist or not
+* Returns a New Reference
 */
-static int FList_delete_child(FList *self, PyObject *weakref, pin_flist_t **flistpp, pin_fld_num_t field, int32 elem_id)
+static PyObject *FList_sort_key_from_fields(Client *client, pin_flist_t *elem_flistp, PyObject *key_fields, int reverse)
 {
-    /* this function may mutate weakref to NULL, which means we can destroy the child */
-    int err = FList_disassociate_child(self, &weakref, field, elem_id);
+    Py_ssize_t size = PyTuple_GET_SIZE(key_fields);
+    Py_ssize_t i = 0;
+    pin_fld_num_t field = 0;
+    pin_fld_type_t field_type = 0;
+    void *value = NULL;
+    PyObject *key = NULL;
+    PyObject *item = NULL;
+    PyObject *wrapped = NULL;
 
-    if (weakref == NULL) {
-        PIN_FLIST_DESTROY_EX(flistpp, NULL);
-        *flistpp = NULL;
+    if ((key = PyTuple_New(size)) == NULL) {
+        return NULL;
     }
+    for (i = 0; i < size; i++) {
+        field = (pin_fld_num_t) PyLong_AsLong(PyTuple_GET_ITEM(key_fields, i));
+        if (field == -1 && PyErr_Occurred()) {
+            goto error;
+        }
+        field_type = PIN_FIELD_GET_TYPE(field);
+        if (field_type == PIN_FLDT_ARRAY || field_type == PIN_FLDT_SUBSTRUCT) {
+            PyErr_Format(PyExc_TypeError, "Cannot sort by %s, which is not a field", PIN_FIELD_GET_NAME(field));
+            goto error;
+        }
 
-    return err;
-}
+        item = NULL;
+        if (elem_flistp != NULL) {
+            value = PIN_FLIST_FLD_GET(elem_flistp, field, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(field));
+            if ((item = FList_value_to_python(client, field, value)) == NULL) {
+                goto error;
+            }
+        }
+        wrapped = FList_sort_key(item, reverse);
+        Py_XDECREF(item);
+        if (wrapped == NULL) {
+            goto error;
+        }
+        PyTuple_SET_ITEM(key, i, wrapped);
+    }
+    return key;
 
+error:
+    Py_DECREF(key);
+    return NULL;
+}
 
-static void FList_dealloc(FList *self)
+/*
+* Sorts the array field by either key_fields, a tuple of field numbers, or keys, a list with one key per flist
+* in array order. Missing keys and NULL flists sort last.
+* If renumber is set, the flists are renumbered 0, 1, 2, ... in sorted order.
+*/
+static PyObject *FList_array_sort(FList *self, PyObject *args)
 {
-    Py_XDECREF(self->iter_fields);
+    pin_fld_num_t field = 0;
+    PyObject *key_fields = NULL;
+    PyObject *keys = NULL;
+    int reverse = 0;
+    int renumber = 0;
+
+    Client *client = self->client;
+    SortElem *elems = NULL;
+    SortElem *resized = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t capacity = 0;
+    Py_ssize_t i = 0;
+    Py_ssize_t j = 0;
+    Py_ssize_t placed = 0;
+    int32 elem_id = 0;
+    int32 new_elem_id = 0;
+    pin_flist_t *elem_flistp = NULL;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    PyObject *sort_keys = NULL;
+    PyObject *key = NULL;
+    PyObject *order = NULL;
+    PyObject *index = NULL;
+    PyObject *getitem = NULL;
+    PyObject *sort_method = NULL;
+    PyObject *sort_args = NULL;
+    PyObject *sort_kwargs = NULL;
+    PyObject *result = NULL;
 
-    /*
-    Here are the rules:
-        A Parent Python FList is one where self->parent_flist == NULL
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
 
-        A Child Python FList is one where self->parent_flist != NULL
+    if (!PyArg_ParseTuple(args, "iOOii", &field, &key_fields, &keys, &reverse, &renumber)) {
+        return NULL;
+    }
+    field = PIN_MAKE_FLD(PIN_FLDT_ARRAY, field);
+    if (key_fields != Py_None && !PyTuple_Check(key_fields)) {
+        PyErr_SetString(PyExc_TypeError, "key_fields should be a tuple");
+        return NULL;
+    }
+    if (keys != Py_None && !PyList_Check(keys)) {
+        PyErr_SetString(PyExc_TypeError, "keys should be a list");
+        return NULL;
+    }
 
-        Only a Child Python FList has a strong reference to a Parent Python FList
-        The Parent Python FList has weak references to the Child Python FLists
+    // Collect the flists and their keys, without changing the array
+    if ((sort_keys = PyList_New(0)) == NULL) {
+        goto error;
+    }
+    while (1) {
+        last_cookie = cookie;
+        elem_flistp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+        if (last_cookie == cookie) {
+            break;
+        }
+        if (elem_id == PIN_ELEMID_ANY && !renumber) {
+            PyErr_Format(PyExc_ValueError, "Cannot sort array %s with a PIN_ELEMID_ANY flist unless it is renumbered", PIN_FIELD_GET_NAME(field));
+            goto error;
+        }
 
-        If a Child Python FList has 0 references,
-            it does NOT destroy any C Flists
+        if (count == capacity) {
+            capacity = capacity ? capacity * 2 : 16;
+            if ((resized = PyMem_Realloc(elems, capacity * sizeof(SortElem))) == NULL) {
+                PyErr_NoMemory();
+                goto error;
+            }
+            elems = resized;
+        }
+        elems[count].elem_id = elem_id;
+        elems[count].flistp = elem_flistp;
+        elems[count].child = FList_get_child_from_cache(self, field, elem_id);
+        elems[count].taken = 0;
+
+        if (keys != Py_None) {
+            if (count >= PyList_GET_SIZE(keys)) {
+                PyErr_SetString(PyExc_ValueError, "There are fewer keys than flists on the array");
+                goto error;
+            }
+            key = FList_sort_key(elem_flistp == NULL ? NULL : PyList_GET_ITEM(keys, count), reverse);
+        } else if (key_fields != Py_None) {
+            key = FList_sort_key_from_fields(client, elem_flistp, key_fields, reverse);
+        } else {
+            key = FList_sort_key(NULL, reverse);
+        }
+        if (key == NULL) {
+            goto error;
+        }
+        if (PyList_Append(sort_keys, key) < 0) {
+            goto error;
+        }
+        Py_CLEAR(key);
+        count++;
+    }
+    if (keys != Py_None && PyList_GET_SIZE(keys) != count) {
+        PyErr_SetString(PyExc_ValueError, "There are more keys than flists on the array");
+        goto error;
+    }
 
-        If a Parent Python FList has 0 references,
-            it destroy's its own FList, which destroy all Child C Flists
+    // order = sorted(range(count), key=sort_keys.__getitem__, reverse=reverse)
+    if ((order = PyList_New(count)) == NULL) {
+        goto error;
+    }
+    for (i = 0; i < count; i++) {
+        if ((index = PyLong_FromSsize_t(i)) == NULL) {
+            goto error;
+        }
+        PyList_SET_ITEM(order, i, index);
+    }
+    if ((getitem = PyObject_GetAttrString(sort_keys, "__getitem__")) == NULL) {
+        goto error;
+    }
+    if ((sort_args = PyTuple_New(0)) == NULL) {
+        goto error;
+    }
+    if ((sort_kwargs = Py_BuildValue("{sOsO}", "key", getitem, "reverse", reverse ? Py_True : Py_False)) == NULL) {
+        goto error;
+    }
+    if ((sort_method = PyObject_GetAttrString(order, "sort")) == NULL) {
+        goto error;
+    }
+    if ((result = PyObject_Call(sort_method, sort_args, sort_kwargs)) == NULL) {
+        goto error;
+    }
 
-        It cannot be that a Parent Python FList has 0 references
-            and a Child Python Flist has 1 reference
-            Because the Child has the ref to the parent
+    // Take every flist off the array, always from the front, then put them back in sorted order
+    for (i = 0; i < count; i++) {
+        cookie = NULL;
+        elem_flistp = PIN_FLIST_ELEM_TAKE_NEXT(self->flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error taking flist off array %s", PIN_FIELD_GET_NAME(field));
+        elems[i].taken = 1;
+    }
+    for (i = 0; i < count; i++) {
+        if (elems[i].child != NULL) {
+            FList_remove_child_from_cache(self, field, elems[i].elem_id);
+        }
+    }
+    FList_mark_modified(self);
 
-    */
+    for (i = 0; i < count; i++) {
+        j = PyLong_AsSsize_t(PyList_GET_ITEM(order, i));
+        new_elem_id = renumber ? (int32) i : elems[j].elem_id;
+        if (elems[j].flistp == NULL) {
+            PIN_FLIST_ELEM_SET(self->flistp, NULL, field, new_elem_id, &client->ebuf);
+        } else {
+            PIN_FLIST_ELEM_PUT(self->flistp, elems[j].flistp, field, new_elem_id, &client->ebuf);
+        }
+        // The array owns the flist even if the put failed, the same as when reading json
+        elems[j].flistp = NULL;
+        elems[j].taken = 0;
+        placed++;
+
+        if (elems[j].child != NULL) {
+            // The entries were just removed, so this never needs to grow the cache and cannot fail
+            elems[j].child->elem_id = new_elem_id;
+            FList_add_child_to_cache(self, elems[j].child, field, new_elem_id);
+            elems[j].child = NULL;
+        }
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error setting element %i on array", (int) new_elem_id);
+    }
+
+    Py_DECREF(result);
+    Py_DECREF(sort_method);
+    Py_DECREF(sort_kwargs);
+    Py_DECREF(sort_args);
+    Py_DECREF(getitem);
+    Py_DECREF(order);
+    Py_DECREF(sort_keys);
+    PyMem_Free(elems);
+    Py_RETURN_NONE;
+
+error:
+    if (elems != NULL) {
+        // Before the first put, flists left on the array still have their old elem_ids, so the taken ones keep theirs
+        FList_array_sort_restore(self, field, elems, count, renumber && placed > 0, (int32) placed);
+    }
+    Py_XDECREF(key);
+    Py_XDECREF(result);
+    Py_XDECREF(sort_method);
+    Py_XDECREF(sort_kwargs);
+    Py_XDECREF(sort_args);
+    Py_XDECREF(getitem);
+    Py_XDECREF(order);
+    Py_XDECREF(sort_keys);
+    PyMem_Free(elems);
+    return NULL;
+}
+
+
+/*
+*
+* Comparison
+*
+* Compares two flists field by field straight from the pin_flist_t, without creating any FList or Python values.
+* Values compare the same way as their Python conversions, except DECIMALs are compared exactly with pbo_decimal_compare.
+* A diff records the paths of the fields that were added, removed or changed, like PIN_FLD_RESULTS[4].PIN_FLD_POID.
+*
+*/
+typedef struct {
+    Client *client;
+    /* The lists of paths, or NULL when only checking equality, in which case the walk stops at the first difference */
+    PyObject *added;
+    PyObject *removed;
+    PyObject *changed;
+    char *path;
+    Py_ssize_t path_length;
+    Py_ssize_t path_capacity;
+} FListDiffer;
+
+static int FList_compare_flists(FListDiffer *differ, pin_flist_t *flistp, pin_flist_t *other_flistp);
+
+static int FListDiffer_init(FListDiffer *differ, Client *client, int record_paths)
+{
+    differ->client = client;
+    differ->added = NULL;
+    differ->removed = NULL;
+    differ->changed = NULL;
+    differ->path = NULL;
+    differ->path_length = 0;
+    differ->path_capacity = 0;
+    if (!record_paths) {
+        return 0;
+    }
+    if ((differ->added = PyList_New(0)) == NULL || (differ->removed = PyList_New(0)) == NULL || (differ->changed = PyList_New(0)) == NULL) {
+        return -1;
+    }
+    return 0;
+}
 
-    if (self->parent_flist) {
-        // I am a child
-        // Do NOT destroy any C Flist
-        // When Python Parent has 0 references,
-        // it will destroy the C Parent FList,
-        // which will destroy the C Child Flist
+static void FListDiffer_free(FListDiffer *differ)
+{
+    Py_XDECREF(differ->added);
+    Py_XDECREF(differ->removed);
+    Py_XDECREF(differ->changed);
+    PyMem_Free(differ->path);
+    differ->path = NULL;
+}
 
-        // It's possible this can fail, leaving the weak reference in the parent's cache
-        // However there is no way to recover in a dealloc function like this
-        // Thus code that pulls from the cache needs to check for Py_None
-        FList_remove_child_from_cache((FList *) self->parent_flist, self->parent_field, self->elem_id);
+/*
+* Appends a field name or an [elem_id] to the current path, returning the previous path length to pop back to
+* Does nothing when only checking equality
+*/
+static Py_ssize_t FListDiffer_push(FListDiffer *differ, pin_fld_num_t field, int32 elem_id, int is_elem)
+{
+    char part[128];
+    Py_ssize_t previous = differ->path_length;
+    Py_ssize_t length = 0;
+    Py_ssize_t capacity = 0;
+    char *path = NULL;
 
-        Py_XDECREF(self->parent_flist);
+    if (differ->added == NULL) {
+        return previous;
+    }
 
+    if (is_elem) {
+        length = snprintf(part, sizeof(part), "[%d]", (int) elem_id);
     } else {
-        // I am a parent - go ahead and destroy the C parent which will destroy any children C flists
-        PIN_FLIST_DESTROY_EX(&self->flistp, NULL);
-        self->flistp = NULL;
-    }
-    Py_XDECREF(self->children);
-    if (self->weakref != NULL) { // TODO this isn't getting triggered in the tests ... check this, I would have thought this would
-        PyObject_ClearWeakRefs((PyObject *) self);
+        length = snprintf(part, sizeof(part), "%s%s", previous ? "." : "", PIN_FIELD_GET_NAME(field));
     }
-    Py_XDECREF(self->client);
-    Py_TYPE(self)->tp_free((PyObject *) self);
 
+    if (differ->path_length + length + 1 > differ->path_capacity) {
+        capacity = differ->path_capacity ? differ->path_capacity : 256;
+        while (capacity < differ->path_length + length + 1) {
+            capacity *= 2;
+        }
+        if ((path = PyMem_Realloc(differ->path, capacity)) == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        differ->path = path;
+        differ->path_capacity = capacity;
+    }
+    memcpy(differ->path + differ->path_length, part, length);
+    differ->path_length += length;
+    return previous;
 }
 
-static PyObject *FList_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+static void FListDiffer_pop(FListDiffer *differ, Py_ssize_t length)
 {
-    FList *self = NULL;
-
-    self = (FList *) type->tp_alloc(type, 0);
-    if (self != NULL) {
-        self->flistp = NULL;
-        self->parent_flist = NULL;
-        self->elem_id = 0;
-        self->children = NULL;
-        self->iter_fields = NULL;
-    }
-    return (PyObject *) self;
+    differ->path_length = length;
 }
 
-static int FList_init(FList *self, PyObject *args, PyObject *kwargs)
+/* Appends the current path to paths, unless only checking equality */
+static int FListDiffer_record(FListDiffer *differ, PyObject *paths)
 {
-    PyObject *client = NULL;
-    /* is_open: whether or not the flistp should be instantiated to empty flist */
-    int is_open = 0;
-    char *flist_string = NULL;
+    PyObject *path = NULL;
 
-    if (!PyArg_ParseTuple(args, "O!|is", &ClientType, &client, &is_open, &flist_string)) {
+    if (paths == NULL) {
+        return 0;
+    }
+    if ((path = PyUnicode_FromStringAndSize(differ->path, differ->path_length)) == NULL) {
         return -1;
     }
-
-    if (client) {
-        Py_INCREF(client);
-        self->client = (Client *)client;
+    if (PyList_Append(paths, path) < 0) {
+        Py_DECREF(path);
+        return -1;
     }
+    Py_DECREF(path);
+    return 0;
+}
 
-    if (flist_string) {
-        /* BRM always prints a message to stderr if the flist is invalid. Even if you turn debugging off */
-        PIN_STR_TO_FLIST(flist_string, self->client->database, &self->flistp, &self->client->ebuf);
-        CHECK_PIN_ERR(self->client->ebuf, "FList string is invalid");
+/*
+* Returns 1 if the field is on the flist, 0 if not, like FList_does_field_exist
+* For arrays, elem_id other than PIN_ELEMID_ANY checks for that element instead
+*/
+static int FList_compare_exists(Client *client, pin_flist_t *flistp, pin_fld_num_t field, int32 elem_id)
+{
+    pin_cookie_t cookie = NULL;
+    int32 next_elem_id = 0;
 
-    } else {
-        if (is_open) {
-            self->flistp = PIN_FLIST_CREATE(&self->client->ebuf);
-            CHECK_PIN_ERR(self->client->ebuf, "Error opening flist");
+    if (PIN_FIELD_GET_TYPE(field) == PIN_FLDT_ARRAY) {
+        /* Use optional=0 to account for the case where a NULL FList is added to an Array */
+        if (elem_id == PIN_ELEMID_ANY) {
+            PIN_FLIST_ELEM_GET_NEXT(flistp, field, &next_elem_id, 0, &cookie, &client->ebuf);
+        } else {
+            PIN_FLIST_ELEM_GET(flistp, field, elem_id, 0, &client->ebuf);
         }
+    } else {
+        /* Use optional=0 to account for the case where a NULL value is added to an FList */
+        PIN_FLIST_FLD_GET(flistp, field, 0, &client->ebuf);
     }
 
-    if ((self->children = PyDict_New()) == NULL) {
-        goto error;
-    };
-
-    if ((self->iter_fields = PyDict_New()) == NULL) {
-        goto error;
-    };
-
-    return 0;
-
-error:
-    return -1;
+    if (PIN_ERR_IS_ERR(&client->ebuf)) {
+        PIN_ERRBUF_RESET(&client->ebuf);
+        return 0;
+    }
+    return 1;
 }
 
-
-static PyTypeObject FListType;
 /*
-* Careful: FList_make_flist Vs FList_make_flist_on_parent
-* Use FList_make_flist when you do not need to maintain a reference to Parent
-* E.g. Copy, opcode
-* Every other time you require a reference on the Parent
-*
-* Calling code should make sure to set flistp after doing something to the C Flist
-*
-* Returns a New Reference
+* Compares two values of a scalar field, either of which may be NULL
+* Returns 1 if equal, 0 if not, -1 on error
 */
-
-static PyObject *FList_make_flist(FList *self)
+static int FList_compare_values(Client *client, pin_fld_num_t field, void *value, void *other_value)
 {
-    FList *new_flist = NULL;
-    PyObject *arg_list = NULL;
+    poid_t *pdp = NULL;
+    poid_t *other_pdp = NULL;
+    const char *type = NULL;
+    const char *other_type = NULL;
+    pin_binstr_t *binstrp = NULL;
+    pin_binstr_t *other_binstrp = NULL;
+    pin_buf_t *bufp = NULL;
+    pin_buf_t *other_bufp = NULL;
+    int is_null = 0;
+    int other_is_null = 0;
+    int result = 0;
+
+    if (value == NULL || other_value == NULL) {
+        return value == other_value;
+    }
+
+    switch (PIN_FIELD_GET_TYPE(field)) {
+        case PIN_FLDT_POID:
+            pdp = (poid_t *) value;
+            other_pdp = (poid_t *) other_value;
+            type = PIN_POID_GET_TYPE(pdp);
+            other_type = PIN_POID_GET_TYPE(other_pdp);
+            if (type == NULL || other_type == NULL) {
+                if (type != other_type) {
+                    return 0;
+                }
+            } else if (strcmp(type, other_type) != 0) {
+                return 0;
+            }
+            return PIN_POID_GET_DB(pdp) == PIN_POID_GET_DB(other_pdp)
+                && PIN_POID_GET_ID(pdp) == PIN_POID_GET_ID(other_pdp)
+                && PIN_POID_GET_REV(pdp) == PIN_POID_GET_REV(other_pdp);
+
+        case PIN_FLDT_STR:
+            return strcmp((char *) value, (char *) other_value) == 0;
+
+        case PIN_FLDT_INT:
+        case PIN_FLDT_ENUM:
+            return *(int32 *) value == *(int32 *) other_value;
+
+        case PIN_FLDT_TSTAMP:
+            return *(time_t *) value == *(time_t *) other_value;
+
+        case PIN_FLDT_DECIMAL:
+            is_null = pbo_decimal_is_null((pin_decimal_t *) value, &client->ebuf);
+            other_is_null = pbo_decimal_is_null((pin_decimal_t *) other_value, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error comparing decimals for field %s", PIN_FIELD_GET_NAME(field));
+            if (is_null || other_is_null) {
+                return is_null && other_is_null;
+            }
+            result = pbo_decimal_compare((pin_decimal_t *) value, (pin_decimal_t *) other_value, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error comparing decimals for field %s", PIN_FIELD_GET_NAME(field));
+            return result == 0;
+
+        case PIN_FLDT_BINSTR:
+            binstrp = (pin_binstr_t *) value;
+            other_binstrp = (pin_binstr_t *) other_value;
+            if (binstrp->data == NULL || other_binstrp->data == NULL) {
+                return binstrp->data == other_binstrp->data;
+            }
+            return binstrp->size == other_binstrp->size && memcmp(binstrp->data, other_binstrp->data, binstrp->size) == 0;
 
-    if ((arg_list = Py_BuildValue("(Oi)", (Client *)self->client, 0)) == NULL) {
-        goto error;
-    }
+        case PIN_FLDT_BUF:
+            bufp = (pin_buf_t *) value;
+            other_bufp = (pin_buf_t *) other_value;
+            if (bufp->data == NULL || other_bufp->data == NULL) {
+                return bufp->data == other_bufp->data;
+            }
+            return bufp->size == other_bufp->size && memcmp(bufp->data, other_bufp->data, bufp->size) == 0;
 
-    // New Reference, calling code needs to return it to Python or Py_XDECREF on error
-    if ((new_flist = (FList *) PyObject_CallObject((PyObject *) &FListType, arg_list)) == NULL) {
-        goto error;
+        default:
+            PyErr_Format(PyExc_NotImplementedError, "We do not support this data type %i for field %s", (int) PIN_FIELD_GET_TYPE(field), PIN_FIELD_GET_NAME(field));
+            goto error;
     }
 
 error:
-    Py_XDECREF(arg_list);
-    return (PyObject *) new_flist;
+    return -1;
 }
 
-
 /*
-* Either retrieves a preexisting child FList from cache, or creates a new FList with null flist->flistp
-* Calling code needs to check if (flist->flistp) and decide on what to do.
-*
-* Careful: FList_make_flist Vs FList_make_flist_on_parent
-* Use FList_make_flist_on_parent when you need to maintain a reference on parent
-* E.g. Get a subflist, get a subarray, create a subflist, create a subarray
-* Don't use this for copying.
-*
-* Calling code should make sure to set flistp after doing something to the C Flist
-* Alternatively, calling code can simply decref this. It will immediately deallocate and remove itself
-* from the parents cash, in FList_dealloc
-*
-* Returns a New Reference
+* Compares the elements of array field on flistp to the elements of array other_field on other_flistp
+* Elements are matched up by elem_id. NULL elements only equal NULL elements.
+* Returns 1 if equal, 0 if not, -1 on error
 */
-static PyObject *FList_make_flist_on_parent(FList *self, pin_fld_num_t parent_field, int32 elem_id)
+static int FList_compare_arrays(FListDiffer *differ, pin_flist_t *flistp, pin_fld_num_t field, pin_flist_t *other_flistp, pin_fld_num_t other_field)
 {
-    FList *new_flist = NULL;
-    PyObject *weakref = NULL;
-    PyObject *tuple = NULL;
-
-    if ((tuple = PyTuple_New(2)) == NULL) {
-        goto error;
-    }
-    PyTuple_SetItem(tuple, 0, Py_BuildValue("i", parent_field));
-    PyTuple_SetItem(tuple, 1, Py_BuildValue("i", elem_id));
+    Client *client = differ->client;
+    pin_flist_t *elem_flistp = NULL;
+    pin_flist_t *other_elem_flistp = NULL;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    Py_ssize_t previous = 0;
+    int equal = 1;
+    int result = 0;
 
-    weakref = PyDict_GetItemWithError(self->children, tuple);
-    if (PyErr_Occurred()) {
-        goto error;
-    }
+    while (1) {
+        last_cookie = cookie;
+        elem_flistp = PIN_FLIST_ELEM_GET_NEXT(flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+        if (last_cookie == cookie) {
+            break;
+        }
+        if ((previous = FListDiffer_push(differ, field, elem_id, 1)) < 0) {
+            goto error;
+        }
 
-    if (weakref != NULL) {
-        // Cache hit, but it's possible the cache is Py_None under some exceptional scenarios
-        new_flist = (FList *) PyWeakref_GetObject(weakref);
-        if ((PyObject *) new_flist == Py_None) {
-            // This might happen if the delete from the dict in FList_dealloc had an OOM
-            weakref = NULL;
-            new_flist = NULL;
-            // No need to delete the key from the dict, since we will put it back in below
+        if (!FList_compare_exists(client, other_flistp, other_field, elem_id)) {
+            result = 0;
+            if (FListDiffer_record(differ, differ->removed) < 0) {
+                goto error;
+            }
         } else {
-            // new_flist won't ever be NULL here
-            Py_INCREF(new_flist);
+            other_elem_flistp = PIN_FLIST_ELEM_GET(other_flistp, other_field, elem_id, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting elem_id %d on array %s", (int) elem_id, PIN_FIELD_GET_NAME(other_field));
+            if (elem_flistp == NULL || other_elem_flistp == NULL) {
+                result = elem_flistp == other_elem_flistp;
+                if (!result && FListDiffer_record(differ, differ->changed) < 0) {
+                    goto error;
+                }
+            } else if ((result = FList_compare_flists(differ, elem_flistp, other_elem_flistp)) < 0) {
+                goto error;
+            }
         }
-    }
 
-    if (weakref == NULL) {
-        new_flist = (FList *) FList_make_flist((FList *) self);
-        if (new_flist == NULL) {
-            goto error;
+        FListDiffer_pop(differ, previous);
+        if (!result) {
+            equal = 0;
+            if (differ->added == NULL) {
+                return 0;
+            }
         }
+    }
 
-        weakref = PyWeakref_NewRef((PyObject *) new_flist, NULL);
-        if (weakref == NULL) {
-            Py_DECREF(new_flist);
-            new_flist = NULL;
+    cookie = NULL;
+    while (1) {
+        last_cookie = cookie;
+        PIN_FLIST_ELEM_GET_NEXT(other_flistp, other_field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(other_field));
+        if (last_cookie == cookie) {
+            break;
+        }
+        if (FList_compare_exists(client, flistp, field, elem_id)) {
+            continue;
+        }
+        equal = 0;
+        if (differ->added == NULL) {
+            return 0;
+        }
+        if ((previous = FListDiffer_push(differ, field, elem_id, 1)) < 0) {
             goto error;
         }
-
-        if (PyDict_SetItem(self->children, tuple, weakref) < 0) {
-            Py_DECREF(weakref);
-            Py_DECREF(new_flist);
-            new_flist = NULL;
+        if (FListDiffer_record(differ, differ->added) < 0) {
             goto error;
-        };
-        Py_DECREF(weakref);
-
-        new_flist->parent_flist = (PyObject *) self;
-        new_flist->parent_field = parent_field;
-        new_flist->elem_id = elem_id;
-        Py_INCREF(self);
+        }
+        FListDiffer_pop(differ, previous);
     }
 
+    return equal;
+
 error:
-    Py_XDECREF(tuple);
-    return (PyObject *) new_flist;
+    return -1;
 }
 
-
-
-
-static PyObject *FList_set_capsule(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Compares field, which is on both flists
+* Returns 1 if equal, 0 if not, -1 on error
+*/
+static int FList_compare_field(FListDiffer *differ, pin_flist_t *flistp, pin_flist_t *other_flistp, pin_fld_num_t field)
 {
-    PyObject *capsule = NULL;
-
-    pin_flist_t *flistp = NULL;
-    int is_copy = 1;
-
-    if (!PyArg_ParseTuple(args, "Oi", &capsule, &is_copy)) {
-        goto error;
-    }
-
-    if (!PyCapsule_CheckExact((PyObject *) capsule)) {
-        PyErr_SetString(PyExc_TypeError, "Expecting a PyCapsule type\n");
-        goto error;
-    }
+    Client *client = differ->client;
+    pin_flist_t *sub_flistp = NULL;
+    pin_flist_t *other_sub_flistp = NULL;
+    void *value = NULL;
+    void *other_value = NULL;
+    int result = 0;
+
+    switch (PIN_FIELD_GET_TYPE(field)) {
+        case PIN_FLDT_ARRAY:
+            return FList_compare_arrays(differ, flistp, field, other_flistp, field);
+
+        case PIN_FLDT_SUBSTRUCT:
+            sub_flistp = PIN_FLIST_SUBSTR_GET(flistp, field, 1, &client->ebuf);
+            other_sub_flistp = PIN_FLIST_SUBSTR_GET(other_flistp, field, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+            if (sub_flistp != NULL && other_sub_flistp != NULL) {
+                return FList_compare_flists(differ, sub_flistp, other_sub_flistp);
+            }
+            result = sub_flistp == other_sub_flistp;
+            break;
 
-    if (self->flistp != NULL) {
-        PyErr_SetString(PyExc_ValueError, "Do not call set_pointer on an open flist\n");
-        goto error;
+        default:
+            value = PIN_FLIST_FLD_GET(flistp, field, 1, &client->ebuf);
+            other_value = PIN_FLIST_FLD_GET(other_flistp, field, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(field));
+            if ((result = FList_compare_values(client, field, value, other_value)) < 0) {
+                goto error;
+            }
     }
 
-    if ((flistp = (pin_flist_t *) PyCapsule_GetPointer(capsule, "pybrm.flistp")) == NULL){
+    if (!result && FListDiffer_record(differ, differ->changed) < 0) {
         goto error;
     }
+    return result;
 
-    self->flistp = flistp;
-    if (is_copy) {
-        self->flistp = PIN_FLIST_COPY(flistp, &self->client->ebuf);
-        CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
-    }
-    assert(self->flistp);
-
-    Py_RETURN_NONE;
 error:
-    return NULL;
+    return -1;
 }
 
-
-static PyObject *FList_capsule(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Compares the top level fields of two flists, recursing into substructs and arrays
+* Returns 1 if equal, 0 if not, -1 on error
+*/
+static int FList_compare_flists(FListDiffer *differ, pin_flist_t *flistp, pin_flist_t *other_flistp)
 {
-    int is_copy = 1;
-    pin_flist_t *flistp = NULL;
+    Client *client = differ->client;
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    Py_ssize_t previous = 0;
+    FieldSet seen;
+    int equal = 1;
+    int result = 0;
+
+    // Fields are deduplicated, as arrays come up once per element, and concatenated flists can repeat fields
+    FieldSet_init(&seen);
+    while (1) {
+        last_cookie = cookie;
+        PIN_FLIST_ANY_GET_NEXT(flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error comparing flists");
 
-    if (!PyArg_ParseTuple(args, "i", &is_copy)) {
-        goto error;
-    }
+        switch (FieldSet_add(&seen, field)) {
+            case -1:
+                goto error;
+            case 0:
+                continue;
+        }
 
-    flistp = self->flistp;
+        if ((previous = FListDiffer_push(differ, field, 0, 0)) < 0) {
+            goto error;
+        }
+        if (!FList_compare_exists(client, other_flistp, field, PIN_ELEMID_ANY)) {
+            result = 0;
+            if (FListDiffer_record(differ, differ->removed) < 0) {
+                goto error;
+            }
+        } else if ((result = FList_compare_field(differ, flistp, other_flistp, field)) < 0) {
+            goto error;
+        }
+        FListDiffer_pop(differ, previous);
 
-    if (is_copy) {
-        flistp = PIN_FLIST_COPY(self->flistp, &self->client->ebuf);
-        CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
+        if (!result) {
+            equal = 0;
+            if (differ->added == NULL) {
+                goto done;
+            }
+        }
     }
 
-    return PyCapsule_New(flistp, "pybrm.flistp", NULL);
-error:
-    return NULL;
-}
-
-
-static PyObject *FList_str(FList *self)
-{
-    char *flist_string = NULL;
-    int flist_string_length = 0;
-    PyObject *ret = NULL;
-
-    PIN_FLIST_TO_STR(self->flistp, &flist_string, &flist_string_length, &self->client->ebuf);
+    // Every field left on the other flist that was not seen on this one was added
+    cookie = NULL;
+    while (1) {
+        last_cookie = cookie;
+        PIN_FLIST_ANY_GET_NEXT(other_flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error comparing flists");
 
-    CHECK_PIN_ERR(self->client->ebuf, "Error converting flist to string.");
+        switch (FieldSet_add(&seen, field)) {
+            case -1:
+                goto error;
+            case 0:
+                continue;
+        }
 
-    ret = PyUnicode_FromString(flist_string);
+        equal = 0;
+        if (differ->added == NULL) {
+            goto done;
+        }
+        if ((previous = FListDiffer_push(differ, field, 0, 0)) < 0) {
+            goto error;
+        }
+        if (FListDiffer_record(differ, differ->added) < 0) {
+            goto error;
+        }
+        FListDiffer_pop(differ, previous);
+    }
 
-    free(flist_string);
-    flist_string = NULL;
+done:
+    FieldSet_free(&seen);
+    return equal;
 
 error:
-    return ret;
+    FieldSet_free(&seen);
+    return -1;
 }
 
-static PyObject *FList_str_compact(FList *self)
+static PyObject *FList_equals(FList *self, PyObject *args)
 {
-    char *flist_string = NULL;
-    int flist_string_length = 0;
-    PyObject *ret = NULL;
+    FList *other = NULL;
+    FListDiffer differ;
+    int result = 0;
 
-    PIN_FLIST_TO_STR_COMPACT_BINARY(self->flistp, &flist_string, &flist_string_length, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error converting flist to string.");
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
 
-    ret = PyUnicode_FromString(flist_string);
+    if (!PyArg_ParseTuple(args, "O!", &FListType, &other)) {
+        return NULL;
+    }
 
-    free(flist_string);
-    flist_string = NULL;
+    if (other->flistp == self->flistp) {
+        Py_RETURN_TRUE;
+    }
 
-error:
-    return ret;
-}
+    FListDiffer_init(&differ, self->client, 0);
+    result = FList_compare_flists(&differ, self->flistp, other->flistp);
+    FListDiffer_free(&differ);
 
+    if (result < 0) {
+        return NULL;
+    }
+    return PyBool_FromLong(result);
+}
 
-static PyObject *FList_xml(FList *self, PyObject *args, PyObject *kwargs)
+static PyObject *FList_array_equals(FList *self, PyObject *args)
 {
-    int flag = 0;
-    char *root_element_name = NULL;
-
-    char *flist_string = NULL;
-    int flist_string_length = 0;
-    PyObject *ret = NULL;
+    pin_fld_num_t field = 0;
+    FList *other = NULL;
+    pin_fld_num_t other_field = 0;
+    FListDiffer differ;
+    int result = 0;
 
-    if (!PyArg_ParseTuple(args, "i|s", &flag, &root_element_name)) {
+    if (FList_check_open(self) < 0) {
         return NULL;
     }
 
-    PIN_FLIST_TO_XML(self->flistp, flag, 0, &flist_string, &flist_string_length, root_element_name, &self->client->ebuf);
-
-    CHECK_PIN_ERR(self->client->ebuf, "Error converting flist to xml.");
+    if (!PyArg_ParseTuple(args, "iO!i", &field, &FListType, &other, &other_field)) {
+        return NULL;
+    }
 
-    ret = PyUnicode_FromString(flist_string);
+    field = PIN_MAKE_FLD(PIN_FLDT_ARRAY, field);
+    other_field = PIN_MAKE_FLD(PIN_FLDT_ARRAY, other_field);
 
-    free(flist_string);
-    flist_string = NULL;
+    FListDiffer_init(&differ, self->client, 0);
+    result = FList_compare_arrays(&differ, self->flistp, field, other->flistp, other_field);
+    FListDiffer_free(&differ);
 
-error:
-    return ret;
+    if (result < 0) {
+        return NULL;
+    }
+    return PyBool_FromLong(result);
 }
 
-
 /*
-* Calling code must return the result to Python or decref it
-* Py_RETURN_NONE will incref the Py_None singleton
+* Returns a tuple of the (added, removed, changed) paths going from this flist to other
 */
-static PyObject *FList_drop_field(FList *self, PyObject *args, PyObject *kwargs)
+static PyObject *FList_diff(FList *self, PyObject *args)
 {
-    pin_fld_num_t field = 0;
-    int32 elem_id = 0;
-    int optional = 0;
-
-    PyObject *weakref = NULL;
-    pin_flist_t *temp = NULL;
-    pin_fld_type_t field_type = 0;
+    FList *other = NULL;
+    FListDiffer differ;
+    PyObject *ret = NULL;
 
-    if (!PyArg_ParseTuple(args, "i|ii", &field, &elem_id, &optional)) {
+    if (FList_check_open(self) < 0) {
         return NULL;
     }
 
-    field_type = PIN_GET_TYPE_FROM_FLD(field);
+    if (!PyArg_ParseTuple(args, "O!", &FListType, &other)) {
+        return NULL;
+    }
 
-    if (field_type == PIN_FLDT_SUBSTRUCT || field_type == PIN_FLDT_ARRAY) {
-        weakref = FList_get_child_from_cache(self, field, elem_id);
-        if (PyErr_Occurred()) {
-            goto error;
-        }
+    if (FListDiffer_init(&differ, self->client, 1) < 0) {
+        goto error;
+    }
+    if (FList_compare_flists(&differ, self->flistp, other->flistp) < 0) {
+        goto error;
     }
 
-    if (field_type == PIN_FLDT_SUBSTRUCT) {
-        temp = (pin_flist_t *)PIN_FLIST_FLD_TAKE(self->flistp, PIN_MAKE_FLD(field_type, field), optional, &self->client->ebuf);
+    ret = PyTuple_Pack(3, differ.added, differ.removed, differ.changed);
 
-    } else if (field_type == PIN_FLDT_ARRAY) {
-        temp = PIN_FLIST_ELEM_TAKE(self->flistp, PIN_MAKE_FLD(field_type, field), elem_id, optional, &self->client->ebuf);
+error:
+    FListDiffer_free(&differ);
+    return ret;
+}
 
-    } else {
-        PIN_FLIST_FLD_DROP(self->flistp, PIN_MAKE_FLD(field_type, field), &self->client->ebuf);
-    }
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
 
-    if (field_type == PIN_FLDT_SUBSTRUCT || field_type == PIN_FLDT_ARRAY) {
-        if (FList_delete_child(self, weakref, &temp, field, elem_id) < 0) {
-            goto error;
-        };
-    }
+/*
+*
+* Resetting
+*
+* FList_reset puts an flist back into the shape of a template, for FListPool. Only the top level fields that differ
+* from the template are touched: fields the template does not have are dropped, and changed or missing fields are
+* copied again from the template. A pooled flist is typically mutated in a few fields, so this is much less work
+* than destroying it and copying the template again.
+*
+*/
 
-    Py_XDECREF(weakref);
-    Py_RETURN_NONE;
+/*
+* Copies field from src_flistp onto flistp, which does not have it
+*/
+static int FList_reset_copy_field(Client *client, pin_flist_t *flistp, pin_flist_t *src_flistp, pin_fld_num_t field)
+{
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    pin_flist_t *elem_flistp = NULL;
+
+    switch (PIN_FIELD_GET_TYPE(field)) {
+        case PIN_FLDT_ARRAY:
+            while (1) {
+                last_cookie = cookie;
+                elem_flistp = PIN_FLIST_ELEM_GET_NEXT(src_flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+                CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+                if (last_cookie == cookie) {
+                    break;
+                }
+                PIN_FLIST_ELEM_SET(flistp, elem_flistp, field, elem_id, &client->ebuf);
+                CHECK_PIN_ERR_FORMAT(client->ebuf, "Error setting element %i on array", (int) elem_id);
+            }
+            break;
+
+        case PIN_FLDT_SUBSTRUCT:
+            elem_flistp = PIN_FLIST_SUBSTR_GET(src_flistp, field, 1, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+            PIN_FLIST_SUBSTR_SET(flistp, elem_flistp, field, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error setting substructure %s", PIN_FIELD_GET_NAME(field));
+            break;
+
+        default:
+            PIN_FLIST_FLD_COPY(src_flistp, field, flistp, field, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error copying field %s", PIN_FIELD_GET_NAME(field));
+    }
+    return 0;
 
 error:
-    Py_XDECREF(weakref);
-    return NULL;
+    return -1;
 }
 
-
-static PyObject *FList_drop_array(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Resets this flist to the template flist. Returns the number of top level fields that were dropped or copied
+*/
+static PyObject *FList_reset(FList *self, PyObject *args)
 {
-    pin_fld_num_t field = 0;
+    FList *template = NULL;
 
+    Client *client = self->client;
+    pin_fld_num_t field = 0;
     int32 elem_id = 0;
     pin_cookie_t cookie = NULL;
     pin_cookie_t last_cookie = NULL;
-    pin_flist_t *temp = NULL;
-    PyObject *weakref;
-    PyObject *ret = NULL;
-
-    int deleted_count = 0;
+    FListDiffer differ;
+    FieldSet seen;
+    FieldSet stale;
+    FieldSet missing;
+    Py_ssize_t i = 0;
+    long count = 0;
+    int result = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
 
-    if (!PyArg_ParseTuple(args, "i", &field)) {
+    if (!PyArg_ParseTuple(args, "O!", &FListType, &template)) {
         return NULL;
     }
+    if (template->flistp == self->flistp) {
+        return PyLong_FromLong(0);
+    }
 
-    while (1)
-    {
+    FListDiffer_init(&differ, client, 0);
+    FieldSet_init(&seen);
+    FieldSet_init(&stale);
+    FieldSet_init(&missing);
+
+    // Fields on this flist that are not on the template, or differ from it, are stale
+    while (1) {
         last_cookie = cookie;
-        temp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+        PIN_FLIST_ANY_GET_NEXT(self->flistp, &field, &elem_id, &cookie, &client->ebuf);
         if (last_cookie == cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
             break;
         }
+        CHECK_PIN_ERR(client->ebuf, "Error resetting flist");
 
-        weakref = FList_get_child_from_cache(self, field, elem_id);
-        if (PyErr_Occurred()) {
+        switch (FieldSet_add(&seen, field)) {
+            case -1:
+                goto error;
+            case 0:
+                continue;
+        }
+
+        if (!FList_compare_exists(client, template->flistp, field, PIN_ELEMID_ANY)) {
+            result = 0;
+        } else if ((result = FList_compare_field(&differ, self->flistp, template->flistp, field)) < 0) {
+            goto error;
+        }
+        if (!result && FieldSet_add(&stale, field) < 0) {
             goto error;
         }
+    }
 
-        temp = PIN_FLIST_ELEM_TAKE(self->flistp, field, elem_id, 1, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error dropping field %s", PIN_FIELD_GET_NAME(field));
+    // Fields on the template that are not on this flist, or are stale, are copied back
+    cookie = NULL;
+    while (1) {
+        last_cookie = cookie;
+        PIN_FLIST_ANY_GET_NEXT(template->flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error resetting flist");
 
-        if (FList_delete_child(self, weakref, &temp, field, elem_id) < 0) {
-            Py_XDECREF(weakref);
-            goto error;
-        };
+        if (!FieldSet_contains(&seen, field) || FieldSet_contains(&stale, field)) {
+            if (FieldSet_add(&missing, field) < 0) {
+                goto error;
+            }
+        }
+    }
 
-        // This will cause PIN_FLIST_ELEM_GET_NEXT to take the first item again
-        // Without this it will not delete everything since the cookie shifts on each take
-        cookie = NULL;
-        deleted_count++;
-        Py_XDECREF(weakref);
+    if (FList_drop_fields(client, self, self->flistp, &stale) < 0) {
+        goto error;
+    }
+    for (i = 0; i < missing.capacity; i++) {
+        if (missing.fields[i] != 0 && FList_reset_copy_field(client, self->flistp, template->flistp, missing.fields[i]) < 0) {
+            goto error;
+        }
+    }
 
+    for (i = 0; i < stale.capacity; i++) {
+        count += stale.fields[i] != 0;
+    }
+    for (i = 0; i < missing.capacity; i++) {
+        count += missing.fields[i] != 0 && !FieldSet_contains(&stale, missing.fields[i]);
+    }
+    if (count) {
+        FList_mark_modified(self);
     }
 
-    ret = Py_BuildValue("i", deleted_count);
+    FListDiffer_free(&differ);
+    FieldSet_free(&seen);
+    FieldSet_free(&stale);
+    FieldSet_free(&missing);
+    return PyLong_FromLong(count);
 
 error:
-    return ret;
+    FList_mark_modified(self);
+    FListDiffer_free(&differ);
+    FieldSet_free(&seen);
+    FieldSet_free(&stale);
+    FieldSet_free(&missing);
+    return NULL;
 }
 
-static PyObject *FList_set_poid(FList *self, PyObject *args, PyObject *kwargs)
-{
-    pin_fld_num_t field = 0;
-    char *poid_string = NULL;
-
-    poid_t *pdp = NULL;
-
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$s", kwargs_names, &field, &poid_string)) {
-        return NULL;
-    }
 
-     /*
-     pdp = PIN_POID_FROM_STR allocates new memory on heap.
-     If you use PIN_FLIST_FLD_PUT, calling code can no longer access pdp
-     Also, calling PIN_FLIST_DESTROY on the flist will free the memory for this
-     You can prove this by then calling PIN_POID_DESTROY on pdp which will fail
-     If you use PIN_FLIST_FLD_SET, then PIN_FLIST_DESTROY does not free the mem
-     You can prove this by calling PIN_POID_DESTROY on pdp which will not fail
-     Calling PIN_POID_DESTROY a second time will then fail.
+/*
+*
+* JSON encoding
+*
+* Writes an flist as json straight from the pin_flist_t, without building the intermediate dict of Python values.
+* The output matches what json.dumps produced from the old FList._json_formatted:
+*   POIDs are strings like "0.0.0.1 /account -1 0", TSTAMPs are epoch ints, DECIMALs are floats,
+*   NULL substructs and NULL array elements are null, empty substructs are {}, arrays are objects keyed by elem_id.
+*
+*/
+#define JSON_WRITER_FLUSH_SIZE 65536
 
-     Note also that you cannot trust `if (pdp)` - it will return true
-     regardless if you PIN_POID_DESTROY or PIN_FLIST_DESTROY.
-     */
+typedef struct {
+    char *buffer;
+    Py_ssize_t length;
+    Py_ssize_t capacity;
+    PyObject *stream;
+} JsonWriter;
 
-    if (poid_string) {
-        pdp = PIN_POID_FROM_STR(poid_string, NULL, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error creating POID from %s", poid_string);
+static int JsonWriter_init(JsonWriter *writer, PyObject *stream)
+{
+    writer->length = 0;
+    writer->capacity = 4096;
+    writer->stream = stream;
+    if ((writer->buffer = PyMem_Malloc(writer->capacity)) == NULL) {
+        PyErr_NoMemory();
+        return -1;
     }
+    return 0;
+}
 
-    PIN_FLIST_FLD_PUT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_POID, field), (void *) pdp, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting poid from %s", poid_string);
+static void JsonWriter_free(JsonWriter *writer)
+{
+    PyMem_Free(writer->buffer);
+    writer->buffer = NULL;
+}
 
-    Py_RETURN_NONE;
+static int JsonWriter_write(JsonWriter *writer, const char *data, Py_ssize_t length)
+{
+    Py_ssize_t capacity = writer->capacity;
+    char *buffer = NULL;
 
-error:
-    return NULL;
+    if (writer->length + length > capacity) {
+        while (writer->length + length > capacity) {
+            capacity *= 2;
+        }
+        if ((buffer = PyMem_Realloc(writer->buffer, capacity)) == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        writer->buffer = buffer;
+        writer->capacity = capacity;
+    }
+    memcpy(writer->buffer + writer->length, data, length);
+    writer->length += length;
+    return 0;
 }
 
-
-static PyObject *FList_get_poid(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonWriter_write_str(JsonWriter *writer, const char *data)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
+    return JsonWriter_write(writer, data, (Py_ssize_t) strlen(data));
+}
 
-    poid_t *pdp = NULL;
-    pin_const_poid_type_t poid_type = NULL;
-    pin_poid_id_t id_poid = 0;
-    pin_db_no_t database = 0;
-    pin_poid_rev_t revision = 0;
-    PyObject *ret = NULL;
+/*
+* Hands the buffered output to stream.write()
+* Only call this between complete json tokens, so that a multibyte UTF-8 sequence is never split
+*/
+static int JsonWriter_flush(JsonWriter *writer)
+{
+    PyObject *chunk = NULL;
+    PyObject *result = NULL;
 
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    if (writer->stream == NULL || writer->length == 0) {
+        return 0;
     }
-
-    pdp = (poid_t *) PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_POID, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error creating poid from field %s", PIN_FIELD_GET_NAME(field));
-
-    if (pdp) {
-        poid_type = PIN_POID_GET_TYPE(pdp);
-        id_poid = PIN_POID_GET_ID(pdp);
-        database = PIN_POID_GET_DB(pdp);
-        revision = PIN_POID_GET_REV(pdp);
-        ret = Py_BuildValue("sLiL", poid_type, id_poid, revision, database);
-    } else {
-        Py_RETURN_NONE;
+    if ((chunk = PyUnicode_DecodeUTF8(writer->buffer, writer->length, NULL)) == NULL) {
+        return -1;
     }
-
-    return ret;
-
-error:
-    return NULL;
+    result = PyObject_CallMethod(writer->stream, "write", "O", chunk);
+    Py_DECREF(chunk);
+    if (result == NULL) {
+        return -1;
+    }
+    Py_DECREF(result);
+    writer->length = 0;
+    return 0;
 }
 
-static PyObject *FList_get_int(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonWriter_maybe_flush(JsonWriter *writer)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
-    int *value = NULL;
-
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    if (writer->stream != NULL && writer->length >= JSON_WRITER_FLUSH_SIZE) {
+        return JsonWriter_flush(writer);
     }
+    return 0;
+}
 
-    value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_INT, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting pin_fld_num_t field %s", PIN_FIELD_GET_NAME(field));
+/* Writes the escaped characters of a json string, without the surrounding quotes */
+static int JsonWriter_write_escaped(JsonWriter *writer, const char *value)
+{
+    const unsigned char *start = (const unsigned char *) value;
+    const unsigned char *p = start;
+    char escape[8];
 
-    if (value == NULL) {
-        Py_RETURN_NONE;
-    }
-    return Py_BuildValue("i", *value);
-error:
-    return NULL;
+    for (; *p; p++) {
+        if (*p >= 0x20 && *p != '"' && *p != '\\') {
+            continue;
+        }
+        if (JsonWriter_write(writer, (const char *) start, p - start) < 0) {
+            return -1;
+        }
+        switch (*p) {
+            case '"': strcpy(escape, "\\\""); break;
+            case '\\': strcpy(escape, "\\\\"); break;
+            case '\n': strcpy(escape, "\\n"); break;
+            case '\r': strcpy(escape, "\\r"); break;
+            case '\t': strcpy(escape, "\\t"); break;
+            case '\b': strcpy(escape, "\\b"); break;
+            case '\f': strcpy(escape, "\\f"); break;
+            default: snprintf(escape, sizeof(escape), "\\u%04x", *p); break;
+        }
+        if (JsonWriter_write_str(writer, escape) < 0) {
+            return -1;
+        }
+        start = p + 1;
+    }
+    return JsonWriter_write(writer, (const char *) start, p - start);
 }
 
-static PyObject *FList_get_enum(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonWriter_write_string(JsonWriter *writer, const char *value)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
-    int *value = NULL;
-
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    if (JsonWriter_write(writer, "\"", 1) < 0) {
+        return -1;
     }
-
-    value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ENUM, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting enum field %s", PIN_FIELD_GET_NAME(field));
-
-    if (value == NULL) { // TODO remove this? Won't ever trigger
-        Py_RETURN_NONE;
+    if (JsonWriter_write_escaped(writer, value) < 0) {
+        return -1;
     }
+    return JsonWriter_write(writer, "\"", 1);
+}
 
-    return Py_BuildValue("i", *value);
+/* Formats a double the same way json.dumps does */
+static int JsonWriter_write_double(JsonWriter *writer, double value)
+{
+    char *repr = NULL;
+    int err = 0;
 
-error:
-    return NULL;
+    if (Py_IS_NAN(value)) {
+        return JsonWriter_write_str(writer, "NaN");
+    }
+    if (Py_IS_INFINITY(value)) {
+        return JsonWriter_write_str(writer, value > 0 ? "Infinity" : "-Infinity");
+    }
+    if ((repr = PyOS_double_to_string(value, 'r', 0, Py_DTSF_ADD_DOT_0, NULL)) == NULL) {
+        return -1;
+    }
+    err = JsonWriter_write_str(writer, repr);
+    PyMem_Free(repr);
+    return err;
 }
 
 
-static PyObject *FList_get_str(FList *self, PyObject *args, PyObject *kwargs)
+static int FList_write_json(Client *client, pin_flist_t *flistp, JsonWriter *writer);
+
+/*
+* Writes the value of the first occurrence of `field` on `flistp`
+* Arrays are written in full, as an object keyed by elem_id
+*/
+static int FList_write_json_value(Client *client, pin_flist_t *flistp, pin_fld_num_t field, JsonWriter *writer)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
-    char *value = NULL;
+    char number[64];
+    void *value = NULL;
+    poid_t *pdp = NULL;
+    pin_binstr_t *binstrp = NULL;
+    pin_buf_t *bufp = NULL;
+    double decimal_value = 0;
+    pin_flist_t *elem_flistp = NULL;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    int first = 1;
+    pin_fld_type_t field_type = PIN_GET_TYPE_FROM_FLD(field);
 
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    if (field_type == PIN_FLDT_ARRAY) {
+        if (JsonWriter_write(writer, "{", 1) < 0) {
+            goto error;
+        }
+        while (1) {
+            last_cookie = cookie;
+            elem_flistp = PIN_FLIST_ELEM_GET_NEXT(flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+            if (last_cookie == cookie) {
+                break;
+            }
+            snprintf(number, sizeof(number), "%s\"%d\":", first ? "" : ", ", (int) elem_id);
+            first = 0;
+            if (JsonWriter_write_str(writer, number) < 0) {
+                goto error;
+            }
+            if (elem_flistp == NULL) {
+                if (JsonWriter_write(writer, "null", 4) < 0) {
+                    goto error;
+                }
+            } else if (FList_write_json(client, elem_flistp, writer) < 0) {
+                goto error;
+            }
+        }
+        return JsonWriter_write(writer, "}", 1);
     }
 
-    value = (char *) PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_STR, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting str field %s", PIN_FIELD_GET_NAME(field));
+    if (field_type == PIN_FLDT_SUBSTRUCT) {
+        elem_flistp = PIN_FLIST_SUBSTR_GET(flistp, field, 1, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+        if (elem_flistp == NULL) {
+            return JsonWriter_write(writer, "null", 4);
+        }
+        return FList_write_json(client, elem_flistp, writer);
+    }
+
+    value = PIN_FLIST_FLD_GET(flistp, field, 1, &client->ebuf);
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(field));
 
     if (value == NULL) {
-        Py_RETURN_NONE;
+        return JsonWriter_write(writer, "null", 4);
     }
 
-    return Py_BuildValue("s", value);
+    switch (field_type) {
+        case PIN_FLDT_POID:
+            pdp = (poid_t *) value;
+            snprintf(number, sizeof(number), "\"0.0.0.%lld ", (long long) PIN_POID_GET_DB(pdp));
+            if (JsonWriter_write_str(writer, number) < 0) {
+                goto error;
+            }
+            if (JsonWriter_write_escaped(writer, PIN_POID_GET_TYPE(pdp)) < 0) {
+                goto error;
+            }
+            snprintf(number, sizeof(number), " %lld %lld\"", (long long) PIN_POID_GET_ID(pdp), (long long) PIN_POID_GET_REV(pdp));
+            return JsonWriter_write_str(writer, number);
+
+        case PIN_FLDT_STR:
+            return JsonWriter_write_string(writer, (char *) value);
+
+        case PIN_FLDT_INT:
+        case PIN_FLDT_ENUM:
+            snprintf(number, sizeof(number), "%d", *(int *) value);
+            return JsonWriter_write_str(writer, number);
+
+        case PIN_FLDT_TSTAMP:
+            snprintf(number, sizeof(number), "%lld", (long long) *(time_t *) value);
+            return JsonWriter_write_str(writer, number);
+
+        case PIN_FLDT_DECIMAL:
+            decimal_value = pbo_decimal_to_double((pin_decimal_t *) value, &client->ebuf);
+            if (PIN_ERR_IS_ERR(&client->ebuf) && client->ebuf.pin_err == PIN_ERR_IS_NULL) {
+                PIN_ERRBUF_RESET(&client->ebuf);
+                return JsonWriter_write(writer, "null", 4);
+            }
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting pbo_decimal_to_double for field %s", PIN_FIELD_GET_NAME(field));
+            return JsonWriter_write_double(writer, decimal_value);
+
+        case PIN_FLDT_BINSTR:
+            binstrp = (pin_binstr_t *) value;
+            if (binstrp->data == NULL) {
+                return JsonWriter_write(writer, "null", 4);
+            }
+            PyErr_Format(PyExc_TypeError, "Field %s of type bytes is not JSON serializable", PIN_FIELD_GET_NAME(field));
+            goto error;
+
+        case PIN_FLDT_BUF:
+            bufp = (pin_buf_t *) value;
+            if (bufp->data == NULL) {
+                return JsonWriter_write(writer, "null", 4);
+            }
+            PyErr_Format(PyExc_TypeError, "Field %s of type bytes is not JSON serializable", PIN_FIELD_GET_NAME(field));
+            goto error;
+
+        default:
+            PyErr_Format(PyExc_NotImplementedError, "We do not support this data type %i for field %s", (int) field_type, PIN_FIELD_GET_NAME(field));
+            goto error;
+    }
 
 error:
-    return NULL;
+    return -1;
 }
 
-
-static PyObject *FList_get_binstr(FList *self, PyObject *args, PyObject *kwargs)
+static int FList_write_json(Client *client, pin_flist_t *flistp, JsonWriter *writer)
 {
     pin_fld_num_t field = 0;
-    int optional = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    int first = 1;
+    FieldSet seen;
 
-    pin_binstr_t *binstrp;
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
+    FieldSet_init(&seen);
+
+    if (JsonWriter_write(writer, "{", 1) < 0) {
         goto error;
     }
 
-    binstrp = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BINSTR, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting str field %s", PIN_FIELD_GET_NAME(field));
+    while (1)
+    {
+        last_cookie = cookie;
+        PIN_FLIST_ANY_GET_NEXT(flistp, &field, &elem_id, &cookie, &client->ebuf);
+        if (last_cookie == cookie) {
+            // Err buf is always filled on the very last iteration
+            PIN_ERRBUF_RESET(&client->ebuf);
+            break;
+        }
+        CHECK_PIN_ERR(client->ebuf, "Error iterating flist");
 
-    // As far as I can tell binstrp will not be NULL
-    if (binstrp == NULL || binstrp->data == NULL) {
-        Py_RETURN_NONE;
+        /* Array elements and fields duplicated by PIN_FLIST_CONCAT are visited more than once */
+        switch (FieldSet_add(&seen, field)) {
+            case 0:
+                continue;
+            case -1:
+                goto error;
+        }
+
+        if (!first && JsonWriter_write(writer, ", ", 2) < 0) {
+            goto error;
+        }
+        first = 0;
+
+        if (JsonWriter_write_string(writer, pin_name_of_field(field)) < 0) {
+            goto error;
+        }
+        if (JsonWriter_write(writer, ": ", 2) < 0) {
+            goto error;
+        }
+        if (FList_write_json_value(client, flistp, field, writer) < 0) {
+            goto error;
+        }
+        if (JsonWriter_maybe_flush(writer) < 0) {
+            goto error;
+        }
     }
 
-    // Apparently if you give a NULL pointer here it is smart enough to return None to Python
-    return Py_BuildValue("y#", binstrp->data, binstrp->size);
+    FieldSet_free(&seen);
+    return JsonWriter_write(writer, "}", 1);
 
 error:
-    return NULL;
+    FieldSet_free(&seen);
+    return -1;
 }
 
 
-static PyObject *FList_get_buf(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Serializes the flist to json
+* If stream is None, returns the json string. Otherwise writes it to stream.write() in chunks and returns None
+*/
+static PyObject *FList_to_json(FList *self, PyObject *args, PyObject *kwargs)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
+    PyObject *stream = Py_None;
+    PyObject *ret = NULL;
+    JsonWriter writer;
 
-    pin_buf_t *buf;
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        goto error;
+    char *kwargs_names[] = {"stream", NULL};
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
     }
 
-    buf = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BUF, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting str field %s", PIN_FIELD_GET_NAME(field));
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O", kwargs_names, &stream)) {
+        return NULL;
+    }
 
-    // As far as I can tell buf will not be NULL
-    if (buf == NULL || buf->data == NULL) {
-        Py_RETURN_NONE;
+    if (JsonWriter_init(&writer, stream == Py_None ? NULL : stream) < 0) {
+        return NULL;
     }
 
-    // Apparently if you give a NULL pointer here it is smart enough to return None to Python
-    return Py_BuildValue("y#", buf->data, buf->size);
+    if (FList_write_json(self->client, self->flistp, &writer) < 0) {
+        goto error;
+    }
+
+    if (writer.stream == NULL) {
+        ret = PyUnicode_DecodeUTF8(writer.buffer, writer.length, NULL);
+    } else if (JsonWriter_flush(&writer) == 0) {
+        Py_INCREF(Py_None);
+        ret = Py_None;
+    }
 
 error:
-    return NULL;
+    JsonWriter_free(&writer);
+    return ret;
 }
 
 
-static PyObject *FList_does_field_exist(FList *self, PyObject *args, PyObject *kwargs)
-{
-    pin_fld_num_t field = 0;
-
-    int elem_id = 0;
-    pin_cookie_t cookie = NULL;
-    pin_fld_type_t field_type = 0;
+/*
+*
+* JSON decoding
+*
+* Parses json text straight into a pin_flist_t, without materializing a dict of Python values.
+* Field names are resolved with PIN_FIELD_OF_NAME, the same lookup behind pybrm.constants' field cache.
+* Values are converted the same way the FList setters convert the values json.loads would produce.
+*
+*/
+#define JSON_MAX_NUMBER 64
 
-    if (!PyArg_ParseTuple(args, "i", &field)) {
-        goto error;
-    }
+typedef struct {
+    const char *start;
+    const char *p;
+    const char *end;
+    Client *client;
+    PyObject *flags;
+    char *scratch;
+    Py_ssize_t scratch_capacity;
+} JsonReader;
 
-    field_type = PIN_GET_TYPE_FROM_FLD(field);
+typedef struct {
+    int32 elem_id;
+    pin_flist_t *flistp;
+} JsonElem;
 
-    if (field_type == PIN_FLDT_ARRAY) {
-        /*Use optional=0 to account for the case where a NULL FList is added to an Array */
-        PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 0, &cookie, &self->client->ebuf);
+static int JsonReader_error(JsonReader *reader, const char *message)
+{
+    PyErr_Format(PyExc_ValueError, "Illegal json flist string: %s at position %zd", message, (Py_ssize_t) (reader->p - reader->start));
+    return -1;
+}
 
-    } else {
-        // Use optional=0 to account for the case where a NULL POID is added to an FList
-        // because PIN_FLIST_FLD_GET will return NULL
-        PIN_FLIST_FLD_GET(self->flistp, field, 0, &self->client->ebuf);
+static void JsonReader_skip_whitespace(JsonReader *reader)
+{
+    while (reader->p < reader->end && (*reader->p == ' ' || *reader->p == '\t' || *reader->p == '\n' || *reader->p == '\r')) {
+        reader->p++;
+    }
+}
 
+/* Skips whitespace and returns the next character without consuming it, or 0 at the end of the text */
+static char JsonReader_peek(JsonReader *reader)
+{
+    JsonReader_skip_whitespace(reader);
+    return reader->p < reader->end ? *reader->p : 0;
+}
 
+static int JsonReader_expect(JsonReader *reader, char c)
+{
+    if (JsonReader_peek(reader) != c) {
+        char message[32];
+        snprintf(message, sizeof(message), "expecting '%c'", c);
+        return JsonReader_error(reader, message);
     }
+    reader->p++;
+    return 0;
+}
 
-    if (PIN_ERR_IS_ERR(&self->client->ebuf)) {
-        PIN_ERRBUF_RESET(&self->client->ebuf);
-        Py_RETURN_FALSE;
-    } else {
-        Py_RETURN_TRUE;
+static int JsonReader_literal(JsonReader *reader, const char *literal)
+{
+    size_t length = strlen(literal);
+    if ((size_t) (reader->end - reader->p) < length || strncmp(reader->p, literal, length) != 0) {
+        return JsonReader_error(reader, "invalid literal");
     }
-
-    Py_RETURN_TRUE;
-error:
-    return NULL;
+    reader->p += length;
+    return 0;
 }
 
-
-static PyObject *FList_does_flist_exist_on_array(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonReader_scratch_put(JsonReader *reader, Py_ssize_t *length, const char *data, Py_ssize_t size)
 {
-    pin_fld_num_t field = 0;
-    int elem_id = 0;
+    char *scratch = NULL;
+    Py_ssize_t capacity = reader->scratch_capacity;
 
-    if (!PyArg_ParseTuple(args, "ii", &field, &elem_id)) {
-        goto error;
+    if (*length + size + 1 > capacity) {
+        while (*length + size + 1 > capacity) {
+            capacity *= 2;
+        }
+        if ((scratch = PyMem_Realloc(reader->scratch, capacity)) == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        reader->scratch = scratch;
+        reader->scratch_capacity = capacity;
     }
+    memcpy(reader->scratch + *length, data, size);
+    *length += size;
+    reader->scratch[*length] = '\0';
+    return 0;
+}
 
-    if (elem_id == -1) {
-        elem_id = PIN_ELEMID_ANY;
+static int JsonReader_hex4(JsonReader *reader, unsigned int *value)
+{
+    int i = 0;
+    char c = 0;
+
+    *value = 0;
+    if (reader->end - reader->p < 4) {
+        return JsonReader_error(reader, "truncated \\u escape");
+    }
+    for (i = 0; i < 4; i++) {
+        c = *reader->p++;
+        *value <<= 4;
+        if (c >= '0' && c <= '9') {
+            *value |= c - '0';
+        } else if (c >= 'a' && c <= 'f') {
+            *value |= c - 'a' + 10;
+        } else if (c >= 'A' && c <= 'F') {
+            *value |= c - 'A' + 10;
+        } else {
+            return JsonReader_error(reader, "invalid \\u escape");
+        }
     }
+    return 0;
+}
 
-    /* Use optional=0 to account for case where a NULL Flist is added to the array */
-    PIN_FLIST_ELEM_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), elem_id, 0, &self->client->ebuf);
-    if (PIN_ERR_IS_ERR(&self->client->ebuf)) {
-        PIN_ERRBUF_RESET(&self->client->ebuf);
-        Py_RETURN_FALSE;
-    } else {
-        Py_RETURN_TRUE;
+/*
+* Parses a json string into reader->scratch as a NUL terminated UTF-8 string
+* The result is only valid until the next call
+*/
+static const char *JsonReader_string(JsonReader *reader)
+{
+    Py_ssize_t length = 0;
+    const char *run = NULL;
+    char utf8[4];
+    unsigned int code = 0;
+    unsigned int low = 0;
+    Py_ssize_t utf8_length = 0;
+
+    if (JsonReader_expect(reader, '"') < 0) {
+        return NULL;
+    }
+    reader->scratch[0] = '\0';
+
+    run = reader->p;
+    while (1) {
+        if (reader->p >= reader->end) {
+            JsonReader_error(reader, "unterminated string");
+            return NULL;
+        }
+        if (*reader->p != '"' && *reader->p != '\\') {
+            if ((unsigned char) *reader->p < 0x20) {
+                JsonReader_error(reader, "invalid control character in string");
+                return NULL;
+            }
+            reader->p++;
+            continue;
+        }
+        if (JsonReader_scratch_put(reader, &length, run, reader->p - run) < 0) {
+            return NULL;
+        }
+        if (*reader->p == '"') {
+            reader->p++;
+            return reader->scratch;
+        }
+
+        /* escape sequence */
+        reader->p++;
+        if (reader->p >= reader->end) {
+            JsonReader_error(reader, "unterminated string");
+            return NULL;
+        }
+        utf8_length = 1;
+        switch (*reader->p++) {
+            case '"': utf8[0] = '"'; break;
+            case '\\': utf8[0] = '\\'; break;
+            case '/': utf8[0] = '/'; break;
+            case 'b': utf8[0] = '\b'; break;
+            case 'f': utf8[0] = '\f'; break;
+            case 'n': utf8[0] = '\n'; break;
+            case 'r': utf8[0] = '\r'; break;
+            case 't': utf8[0] = '\t'; break;
+            case 'u':
+                if (JsonReader_hex4(reader, &code) < 0) {
+                    return NULL;
+                }
+                if (code >= 0xD800 && code <= 0xDBFF && reader->end - reader->p >= 6 && reader->p[0] == '\\' && reader->p[1] == 'u') {
+                    reader->p += 2;
+                    if (JsonReader_hex4(reader, &low) < 0) {
+                        return NULL;
+                    }
+                    if (low >= 0xDC00 && low <= 0xDFFF) {
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00);
+                    } else {
+                        /* Not a surrogate pair; step back so the second escape is decoded on its own */
+                        reader->p -= 6;
+                    }
+                }
+                if (code < 0x80) {
+                    utf8[0] = (char) code;
+                } else if (code < 0x800) {
+                    utf8[0] = (char) (0xC0 | (code >> 6));
+                    utf8[1] = (char) (0x80 | (code & 0x3F));
+                    utf8_length = 2;
+                } else if (code < 0x10000) {
+                    utf8[0] = (char) (0xE0 | (code >> 12));
+                    utf8[1] = (char) (0x80 | ((code >> 6) & 0x3F));
+                    utf8[2] = (char) (0x80 | (code & 0x3F));
+                    utf8_length = 3;
+                } else {
+                    utf8[0] = (char) (0xF0 | (code >> 18));
+                    utf8[1] = (char) (0x80 | ((code >> 12) & 0x3F));
+                    utf8[2] = (char) (0x80 | ((code >> 6) & 0x3F));
+                    utf8[3] = (char) (0x80 | (code & 0x3F));
+                    utf8_length = 4;
+                }
+                break;
+            default:
+                JsonReader_error(reader, "invalid escape");
+                return NULL;
+        }
+        if (JsonReader_scratch_put(reader, &length, utf8, utf8_length) < 0) {
+            return NULL;
+        }
+        run = reader->p;
     }
-error:
-    return NULL;
 }
 
-static PyObject *FList_get_tstamp(FList *self, PyObject *args, PyObject *kwargs)
+/* Skips the digits at reader->p, returning how many there were */
+static Py_ssize_t JsonReader_digits(JsonReader *reader)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
-    int *value = NULL;
+    const char *start = reader->p;
 
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    while (reader->p < reader->end && *reader->p >= '0' && *reader->p <= '9') {
+        reader->p++;
     }
+    return reader->p - start;
+}
 
-    value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_TSTAMP, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting tstamp field %s", PIN_FIELD_GET_NAME(field));
+/*
+* Copies the text of a json number into `number` and validates it against the json grammar:
+*   -?(0|[1-9][0-9]*)(.[0-9]+)?([eE][+-]?[0-9]+)?
+* So forms strtod would also accept, like inf, nan, hex or a leading +, are rejected
+* is_integer is set if the number has no fraction or exponent
+*/
+static int JsonReader_number(JsonReader *reader, char *number, int *is_integer)
+{
+    const char *start = reader->p;
+    Py_ssize_t length = 0;
 
-    if (value == NULL) {
-        Py_RETURN_NONE;
+    *is_integer = 1;
+    if (reader->p < reader->end && *reader->p == '-') {
+        reader->p++;
+    }
+    if (reader->p < reader->end && *reader->p == '0') {
+        reader->p++;
+    } else if (JsonReader_digits(reader) == 0) {
+        goto error;
+    }
+    if (reader->p < reader->end && *reader->p == '.') {
+        *is_integer = 0;
+        reader->p++;
+        if (JsonReader_digits(reader) == 0) {
+            goto error;
+        }
+    }
+    if (reader->p < reader->end && (*reader->p == 'e' || *reader->p == 'E')) {
+        *is_integer = 0;
+        reader->p++;
+        if (reader->p < reader->end && (*reader->p == '+' || *reader->p == '-')) {
+            reader->p++;
+        }
+        if (JsonReader_digits(reader) == 0) {
+            goto error;
+        }
+    }
+    if (reader->p < reader->end && strchr("0123456789+-.eE", *reader->p) != NULL) {
+        goto error;
     }
 
-    return Py_BuildValue("i", *value);
+    length = reader->p - start;
+    if (length >= JSON_MAX_NUMBER) {
+        goto error;
+    }
+    memcpy(number, start, length);
+    number[length] = '\0';
+    return 0;
 
 error:
-    return NULL;
+    reader->p = start;
+    return JsonReader_error(reader, "invalid number");
 }
 
-static PyObject *FList_get_decimal(FList *self, PyObject *args,
-                                   PyObject *kwargs)
+/*
+* Checks if text is a float the way float() would, independent of the locale, unlike strtod
+*/
+static int JsonReader_is_float(const char *text)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
-
-    pin_decimal_t *decimal_value;
-    double output_value;
+    char *end = NULL;
 
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    PyOS_string_to_double(text, &end, NULL);
+    if (PyErr_Occurred()) {
+        PyErr_Clear();
+        return 0;
     }
+    return *text != '\0' && *end == '\0';
+}
 
-    decimal_value = PIN_FLIST_FLD_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_DECIMAL, field), optional, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting decimal field %s", PIN_FIELD_GET_NAME(field));
+/* Parses a base 10 integer that must span the whole string */
+static int JsonReader_parse_long(const char *text, long long *value)
+{
+    char *end = NULL;
 
-    if (decimal_value == NULL) {
-        // The assumption here is that optional is 1,
-        // and that PIN_FLIST_FLD_GET won't return NUll
-        // without setting the ebuf error
-        // Is that accurate?
-        Py_RETURN_NONE;
+    if (*text == '\0') {
+        return -1;
     }
-
-    output_value = pbo_decimal_to_double(decimal_value, &self->client->ebuf);
-    if (PIN_ERR_IS_ERR(&self->client->ebuf)) {
-        if (self->client->ebuf.pin_err == PIN_ERR_IS_NULL) {
-            /* I can't create this error but I've seen it when pulling flists stored by other applications
-            * pretty sure we can just return None */
-            PIN_ERRBUF_RESET(&self->client->ebuf);
-            Py_RETURN_NONE;
-        }
+    errno = 0;
+    *value = strtoll(text, &end, 10);
+    if (*end != '\0' || errno == ERANGE) {
+        return -1;
     }
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting pbo_decimal_to_double for field %s", PIN_FIELD_GET_NAME(field));
+    return 0;
+}
 
-    return Py_BuildValue("d", output_value);
+/*
+* Reads a json value for an INT, ENUM or TSTAMP field
+* Strings holding integers are accepted, like the FList setters do.
+* For INT fields, a string may also be a flag name, e.g. "SRCH_EXACT"
+*/
+static int JsonReader_integer(JsonReader *reader, pin_fld_num_t field, pin_fld_type_t field_type, long long *value)
+{
+    char number[JSON_MAX_NUMBER];
+    const char *text = NULL;
+    int is_integer = 0;
+    double double_value = 0;
+    PyObject *flag = NULL;
+
+    *value = 0;
+    switch (JsonReader_peek(reader)) {
+        case 'n':
+            return JsonReader_literal(reader, "null");
+        case 't':
+            *value = 1;
+            return JsonReader_literal(reader, "true");
+        case 'f':
+            return JsonReader_literal(reader, "false");
+        case '"':
+            if ((text = JsonReader_string(reader)) == NULL) {
+                return -1;
+            }
+            if (JsonReader_parse_long(text, value) == 0) {
+                return 0;
+            }
+            if (field_type == PIN_FLDT_INT && reader->flags != NULL && reader->flags != Py_None) {
+                if ((flag = PyMapping_GetItemString(reader->flags, (char *) text)) != NULL) {
+                    *value = PyLong_AsLongLong(flag);
+                    Py_DECREF(flag);
+                    return PyErr_Occurred() ? -1 : 0;
+                }
+                if (!PyErr_ExceptionMatches(PyExc_KeyError)) {
+                    return -1;
+                }
+                PyErr_Clear();
+                PyErr_Format(PyExc_TypeError, "Expected int or a string flag, not %s for field %s", text, PIN_FIELD_GET_NAME(field));
+                return -1;
+            }
+            PyErr_Format(PyExc_TypeError, "Expected int not %s for field %s", text, PIN_FIELD_GET_NAME(field));
+            return -1;
+        case '{':
+        case '[':
+            PyErr_Format(PyExc_TypeError, "Expected int for field %s", PIN_FIELD_GET_NAME(field));
+            return -1;
+    }
 
-error:
-    return NULL;
+    if (JsonReader_number(reader, number, &is_integer) < 0) {
+        return -1;
+    }
+    if (is_integer) {
+        if (JsonReader_parse_long(number, value) < 0) {
+            PyErr_Format(PyExc_OverflowError, "Integer %s is too big for field %s", number, PIN_FIELD_GET_NAME(field));
+            return -1;
+        }
+        return 0;
+    }
+    if (field_type != PIN_FLDT_TSTAMP) {
+        PyErr_Format(PyExc_TypeError, "Expected int not %s for field %s", number, PIN_FIELD_GET_NAME(field));
+        return -1;
+    }
+    /* This will truncate floats which is OK because time date type is time_t */
+    double_value = PyOS_string_to_double(number, NULL, PyExc_OverflowError);
+    if (double_value == -1.0 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (double_value >= 9223372036854775807.0 || double_value <= -9223372036854775808.0) {
+        PyErr_Format(PyExc_OverflowError, "Number %s is too big for field %s", number, PIN_FIELD_GET_NAME(field));
+        return -1;
+    }
+    *value = (long long) double_value;
+    return 0;
 }
 
+static int JsonReader_flist(JsonReader *reader, pin_flist_t *flistp, FieldSet *virtual_arrays);
 
 /*
-* Returns a New Reference
+* Parses a json object into a new flist, or sets *flistpp to NULL for json null
+* If null_is_empty, json null creates an empty flist instead
 */
-static PyObject *FList_get_flist(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonReader_sub_flist(JsonReader *reader, pin_flist_t **flistpp, int null_is_empty)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
+    int is_null = 0;
+    int result = 0;
+
+    *flistpp = NULL;
+    if (JsonReader_peek(reader) == 'n') {
+        is_null = 1;
+        if (JsonReader_literal(reader, "null") < 0) {
+            return -1;
+        }
+        if (!null_is_empty) {
+            return 0;
+        }
+    } else if (JsonReader_peek(reader) != '{') {
+        PyErr_SetString(PyExc_TypeError, "Expecting an object for a substruct or array element");
+        return -1;
+    }
 
-    FList *sub_flist = NULL;
+    *flistpp = PIN_FLIST_CREATE(&reader->client->ebuf);
+    CHECK_PIN_ERR(reader->client->ebuf, "Error opening flist");
 
-    if (!PyArg_ParseTuple(args, "i|i", &field, &optional)) {
-        return NULL;
+    if (!is_null) {
+        // Deeply nested json would otherwise overflow the C stack
+        if (Py_EnterRecursiveCall(" while decoding a json flist")) {
+            goto error;
+        }
+        result = JsonReader_flist(reader, *flistpp, NULL);
+        Py_LeaveRecursiveCall();
+        if (result < 0) {
+            goto error;
+        }
     }
+    return 0;
 
-    if ((sub_flist = (FList *) FList_make_flist_on_parent(self, field, 0)) == NULL) {
-        goto error;
+error:
+    PIN_FLIST_DESTROY_EX(flistpp, NULL);
+    *flistpp = NULL;
+    return -1;
+}
+
+static int JsonReader_elem_id(JsonReader *reader, const char *key, int32 *elem_id)
+{
+    long long value = 0;
+
+    if (strcmp(key, "*") == 0 || strcmp(key, "PIN_ELEMID_ANY") == 0 || strcmp(key, "-1") == 0) {
+        *elem_id = PIN_ELEMID_ANY;
+        return 0;
+    }
+    if (key[0] == '-' || key[0] == '+' || JsonReader_parse_long(key, &value) < 0 || value > INT32_MAX) {
+        PyErr_Format(PyExc_TypeError, "Invalid elem_id %s", key);
+        return -1;
     }
+    *elem_id = (int32) value;
+    return 0;
+}
 
-    if (!sub_flist->flistp) {
-        sub_flist->flistp = PIN_FLIST_SUBSTR_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_SUBSTRUCT, field), optional, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+/*
+* Parses an array field, either a json list (elem_ids 0, 1, ...) or an object keyed by elem_id.
+*
+* Like FList._set_array, the PIN_ELEMID_ANY element is placed on first, before all the other elements.
+* Otherwise, if PIN_ELEMID_ANY is placed on later, it will overwrite the first element.
+* So elements are parsed into a small buffer and only put on the flist at the end.
+*/
+static int JsonReader_array(JsonReader *reader, pin_flist_t *flistp, pin_fld_num_t field, FieldSet *virtual_arrays)
+{
+    JsonElem *elems = NULL;
+    JsonElem *resized = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t capacity = 0;
+    Py_ssize_t i = 0;
+    pin_flist_t *any_flistp = NULL;
+    int has_any = 0;
+    int32 elem_id = 0;
+    const char *key = NULL;
+    char close = 0;
+    pin_flist_t *elem_flistp = NULL;
+
+    if (JsonReader_peek(reader) == 'n') {
+        if (JsonReader_literal(reader, "null") < 0) {
+            return -1;
+        }
+        PIN_FLIST_ELEM_SET(flistp, NULL, field, 0, &reader->client->ebuf);
+        CHECK_PIN_ERR(reader->client->ebuf, "Error setting element on array");
+        return 0;
     }
 
-    if (!sub_flist->flistp) {
-        // If optional is 1 and flist doesn't exist at this index, return None
-        // decrefing the sub_flist will make it immediately deallocate, where it is removed from parents cache
-        Py_XDECREF(sub_flist);
-        Py_RETURN_NONE;
+    if (JsonReader_peek(reader) == '[') {
+        close = ']';
+    } else if (JsonReader_peek(reader) == '{') {
+        close = '}';
+    } else {
+        PyErr_Format(PyExc_TypeError, "Expecting a list or object for array field %s", PIN_FIELD_GET_NAME(field));
+        return -1;
     }
+    reader->p++;
 
-    return (PyObject *) sub_flist;
+    if (JsonReader_peek(reader) == close) {
+        reader->p++;
+        if (virtual_arrays != NULL && FieldSet_add(virtual_arrays, field) < 0) {
+            return -1;
+        }
+        return 0;
+    }
 
-error:
-    Py_XDECREF(sub_flist);
-    return NULL;
-}
+    while (1) {
+        if (close == '}') {
+            if ((key = JsonReader_string(reader)) == NULL || JsonReader_elem_id(reader, key, &elem_id) < 0) {
+                goto error;
+            }
+            if (JsonReader_expect(reader, ':') < 0) {
+                goto error;
+            }
+            /* In object form a null value is a NULL flist */
+            if (JsonReader_sub_flist(reader, &elem_flistp, 0) < 0) {
+                goto error;
+            }
+        } else {
+            elem_id = (int32) count;
+            /* In list form FList._set_array builds every element with client.flist(data=val), so null is an empty flist */
+            if (JsonReader_sub_flist(reader, &elem_flistp, 1) < 0) {
+                goto error;
+            }
+        }
 
+        if (elem_id == PIN_ELEMID_ANY) {
+            PIN_FLIST_DESTROY_EX(&any_flistp, NULL);
+            any_flistp = elem_flistp;
+            has_any = 1;
+        } else {
+            if (count == capacity) {
+                capacity = capacity ? capacity * 2 : 8;
+                if ((resized = PyMem_Realloc(elems, capacity * sizeof(JsonElem))) == NULL) {
+                    PIN_FLIST_DESTROY_EX(&elem_flistp, NULL);
+                    PyErr_NoMemory();
+                    goto error;
+                }
+                elems = resized;
+            }
+            elems[count].elem_id = elem_id;
+            elems[count].flistp = elem_flistp;
+            count++;
+        }
+        elem_flistp = NULL;
 
-static PyObject *FList_set_str(FList *self, PyObject *args, PyObject *kwargs)
-{
-    pin_fld_num_t field = 0;
-    char *value = NULL;
+        if (JsonReader_peek(reader) == ',') {
+            reader->p++;
+            continue;
+        }
+        if (JsonReader_expect(reader, close) < 0) {
+            goto error;
+        }
+        break;
+    }
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|s", kwargs_names, &field, &value)) {
-        goto error;
+    if (has_any) {
+        PIN_FLIST_ELEM_SET(flistp, any_flistp, field, PIN_ELEMID_ANY, &reader->client->ebuf);
+        CHECK_PIN_ERR(reader->client->ebuf, "Error setting element on array");
+        PIN_FLIST_DESTROY_EX(&any_flistp, NULL);
     }
 
-    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_STR, field), (void *) value, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+    for (i = 0; i < count; i++) {
+        if (elems[i].flistp == NULL) {
+            PIN_FLIST_ELEM_SET(flistp, NULL, field, elems[i].elem_id, &reader->client->ebuf);
+        } else {
+            PIN_FLIST_ELEM_PUT(flistp, elems[i].flistp, field, elems[i].elem_id, &reader->client->ebuf);
+            elems[i].flistp = NULL;
+        }
+        CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting element %i on array", (int) elems[i].elem_id);
+    }
 
-    Py_RETURN_NONE;
+    PyMem_Free(elems);
+    return 0;
 
 error:
-    return NULL;
+    PIN_FLIST_DESTROY_EX(&any_flistp, NULL);
+    for (; i < count; i++) {
+        PIN_FLIST_DESTROY_EX(&elems[i].flistp, NULL);
+    }
+    PyMem_Free(elems);
+    return -1;
 }
 
-
-static PyObject *FList_set_binstr(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonReader_poid(JsonReader *reader, pin_flist_t *flistp, pin_fld_num_t field)
 {
-    pin_fld_num_t field = 0;
-    char *value = NULL;
-    int size = 0;
+    const char *text = NULL;
+    char *poid_string = NULL;
+    char *owned = NULL;
+    const char *p = NULL;
+    int tokens = 0;
+    int in_token = 0;
+    size_t length = 0;
+    poid_t *pdp = NULL;
 
+    if (JsonReader_peek(reader) == 'n') {
+        if (JsonReader_literal(reader, "null") < 0) {
+            return -1;
+        }
+        PIN_FLIST_FLD_PUT(flistp, field, NULL, &reader->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting poid for field %s", PIN_FIELD_GET_NAME(field));
+        return 0;
+    }
+    if (JsonReader_peek(reader) != '"') {
+        PyErr_Format(PyExc_TypeError, "value must be Poid, tuple, str, or None for field %s", PIN_FIELD_GET_NAME(field));
+        return -1;
+    }
+    if ((text = JsonReader_string(reader)) == NULL) {
+        return -1;
+    }
 
-    pin_binstr_t binstr;
+    for (p = text; *p; p++) {
+        if (isspace((unsigned char) *p)) {
+            in_token = 0;
+        } else if (!in_token) {
+            in_token = 1;
+            tokens++;
+        }
+    }
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|y#", kwargs_names, &field, &value, &size)) {
+    if (tokens == 4) {
+        /* A real Poid string like 0.0.0.1 /account -1 0 */
+        poid_string = (char *) text;
+    } else {
+        /* Just the type, like /account */
+        if (text[0] >= '0' && text[0] <= '9') {
+            PyErr_Format(PyExc_ValueError, "PIN_POID_FROM_STR cannot take a type starting with integer: %s", text);
+            return -1;
+        }
+        length = strlen(text) + 64;
+        if ((owned = PyMem_Malloc(length)) == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        snprintf(owned, length, "0.0.0.%lld %s -1 0", (long long) reader->client->database, text);
+        poid_string = owned;
+    }
+
+    pdp = PIN_POID_FROM_STR(poid_string, NULL, &reader->client->ebuf);
+    if (PIN_ERR_IS_ERR(&reader->client->ebuf)) {
+        PIN_ERRBUF_RESET(&reader->client->ebuf);
+        PyErr_Format(PyExc_ValueError, "Invalid POID string: %s", poid_string);
         goto error;
     }
 
-    binstr.data = value;
-    binstr.size = size; // This is wrong but I'm not going to support this now
-    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BINSTR, field), &binstr, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+    PIN_FLIST_FLD_PUT(flistp, field, (void *) pdp, &reader->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting poid from %s", poid_string);
 
-    Py_RETURN_NONE;
+    PyMem_Free(owned);
+    return 0;
 
 error:
-    return NULL;
+    PyMem_Free(owned);
+    return -1;
 }
 
-
-static PyObject *FList_set_buf(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonReader_decimal(JsonReader *reader, pin_flist_t *flistp, pin_fld_num_t field)
 {
-    pin_fld_num_t field = 0;
-    char *value = NULL;
-    int size = 0;
-
-
-    pin_buf_t buf;
+    char number[JSON_MAX_NUMBER];
+    const char *text = NULL;
+    int is_integer = 0;
+    pin_decimal_t *decimal_value = NULL;
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|y#", kwargs_names, &field, &value, &size)) {
-        goto error;
+    switch (JsonReader_peek(reader)) {
+        case 'n':
+            if (JsonReader_literal(reader, "null") < 0) {
+                return -1;
+            }
+            break;
+        case '"':
+            if ((text = JsonReader_string(reader)) == NULL) {
+                return -1;
+            }
+            if (!JsonReader_is_float(text)) {
+                PyErr_Format(PyExc_TypeError, "expecting a float or decimal, not %s", text);
+                return -1;
+            }
+            break;
+        case 't':
+        case 'f':
+        case '{':
+        case '[':
+            PyErr_Format(PyExc_TypeError, "expecting a float or decimal for field %s", PIN_FIELD_GET_NAME(field));
+            return -1;
+        default:
+            if (JsonReader_number(reader, number, &is_integer) < 0) {
+                return -1;
+            }
+            text = number;
     }
 
-    buf.flag = 0;
-    buf.offset = 0;
-    buf.data = value;
-    buf.size = size;
-    buf.xbuf_file = NULL;
-    // TODO this doesn't handle xbuf, flag and offset ...
-    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_BUF, field), &buf, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+    if (text != NULL) {
+        decimal_value = pin_decimal(text, &reader->client->ebuf);
+        CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error converting to decimal for setting field %s", PIN_FIELD_GET_NAME(field));
+    }
 
-    Py_RETURN_NONE;
+    PIN_FLIST_FLD_PUT(flistp, field, (void *) decimal_value, &reader->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting decimal for field %s", PIN_FIELD_GET_NAME(field));
+    return 0;
 
 error:
-    return NULL;
+    pbo_decimal_destroy(&decimal_value);
+    return -1;
 }
 
-
-static PyObject *FList_set_tstamp(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonReader_str(JsonReader *reader, pin_flist_t *flistp, pin_fld_num_t field)
 {
-    pin_fld_num_t field = 0;
-    time_t value = 0;
-
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$i", kwargs_names, &field, &value)) {
-        goto error;
+    char number[JSON_MAX_NUMBER];
+    const char *text = NULL;
+    int is_integer = 0;
+
+    switch (JsonReader_peek(reader)) {
+        case 'n':
+            if (JsonReader_literal(reader, "null") < 0) {
+                return -1;
+            }
+            break;
+        case '"':
+            if ((text = JsonReader_string(reader)) == NULL) {
+                return -1;
+            }
+            break;
+        /* FList._set_str calls str() on anything that is not a string */
+        case 't':
+            if (JsonReader_literal(reader, "true") < 0) {
+                return -1;
+            }
+            text = "True";
+            break;
+        case 'f':
+            if (JsonReader_literal(reader, "false") < 0) {
+                return -1;
+            }
+            text = "False";
+            break;
+        case '{':
+        case '[':
+            PyErr_Format(PyExc_TypeError, "Expecting a string for field %s", PIN_FIELD_GET_NAME(field));
+            return -1;
+        default:
+            if (JsonReader_number(reader, number, &is_integer) < 0) {
+                return -1;
+            }
+            text = number;
     }
 
-    // For BRM time stamps, 0 behaves as null
-    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_TSTAMP, field), (void *) &value, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting tstamp for field %s", PIN_FIELD_GET_NAME(field));
-
-    Py_RETURN_NONE;
+    PIN_FLIST_FLD_SET(flistp, field, (void *) text, &reader->client->ebuf);
+    CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting str for field %s", PIN_FIELD_GET_NAME(field));
+    return 0;
 
 error:
-    return NULL;
+    return -1;
 }
 
-static PyObject *FList_set_int(FList *self, PyObject *args, PyObject *kwargs)
+static int JsonReader_field(JsonReader *reader, pin_flist_t *flistp, pin_fld_num_t field, FieldSet *virtual_arrays)
 {
-    pin_fld_num_t field = 0;
-    int value = 0;
+    pin_fld_type_t field_type = PIN_FIELD_GET_TYPE(field);
+    long long value = 0;
+    int int_value = 0;
+    time_t tstamp_value = 0;
+    pin_flist_t *sub_flistp = NULL;
+
+    switch (field_type) {
+        case PIN_FLDT_POID:
+            return JsonReader_poid(reader, flistp, field);
+
+        case PIN_FLDT_STR:
+            return JsonReader_str(reader, flistp, field);
+
+        case PIN_FLDT_DECIMAL:
+            return JsonReader_decimal(reader, flistp, field);
+
+        case PIN_FLDT_INT:
+        case PIN_FLDT_ENUM:
+            if (JsonReader_integer(reader, field, field_type, &value) < 0) {
+                return -1;
+            }
+            if (value > INT32_MAX || value < INT32_MIN) {
+                PyErr_SetString(PyExc_OverflowError, "BRM's int data type is 32 bits, you provided too big of an integer");
+                return -1;
+            }
+            int_value = (int) value;
+            PIN_FLIST_FLD_SET(flistp, field, (void *) &int_value, &reader->client->ebuf);
+            CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting int for field %s", PIN_FIELD_GET_NAME(field));
+            return 0;
+
+        case PIN_FLDT_TSTAMP:
+            if (JsonReader_integer(reader, field, field_type, &value) < 0) {
+                return -1;
+            }
+            tstamp_value = (time_t) value;
+            PIN_FLIST_FLD_SET(flistp, field, (void *) &tstamp_value, &reader->client->ebuf);
+            CHECK_PIN_ERR_FORMAT(reader->client->ebuf, "Error setting tstamp for field %s", PIN_FIELD_GET_NAME(field));
+            return 0;
+
+        case PIN_FLDT_SUBSTRUCT:
+            if (JsonReader_sub_flist(reader, &sub_flistp, 0) < 0) {
+                return -1;
+            }
+            if (sub_flistp == NULL) {
+                PIN_FLIST_SUBSTR_SET(flistp, NULL, field, &reader->client->ebuf);
+            } else {
+                PIN_FLIST_SUBSTR_PUT(flistp, sub_flistp, field, &reader->client->ebuf);
+            }
+            CHECK_PIN_ERR(reader->client->ebuf, "Error setting substructure");
+            return 0;
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$i", kwargs_names, &field, &value)) {
-        goto error;
-    }
+        case PIN_FLDT_ARRAY:
+            return JsonReader_array(reader, flistp, field, virtual_arrays);
 
-    // For BRM int values, there is no null int, just 0
-    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_INT, field), (void *) &value, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting int for field %s", PIN_FIELD_GET_NAME(field));
+        case PIN_FLDT_BINSTR:
+        case PIN_FLDT_BUF:
+            PyErr_Format(PyExc_TypeError, "Field %s expects bytes, which json cannot represent", PIN_FIELD_GET_NAME(field));
+            return -1;
 
-    Py_RETURN_NONE;
+        default:
+            PyErr_Format(PyExc_NotImplementedError, "We do not support this data type yet: %i", (int) field_type);
+            return -1;
+    }
 
 error:
-    return NULL;
+    return -1;
 }
 
-static PyObject *FList_set_enum(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Parses a json object onto flistp
+* virtual_arrays is only given for the top level flist. It collects the array fields set to {} or []
+* so that FList can record them in FList._virtual_arrays
+*/
+static int JsonReader_flist(JsonReader *reader, pin_flist_t *flistp, FieldSet *virtual_arrays)
 {
+    const char *key = NULL;
     pin_fld_num_t field = 0;
-    int value = 0;
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$i", kwargs_names, &field, &value)) {
-        goto error;
+    if (JsonReader_expect(reader, '{') < 0) {
+        return -1;
+    }
+    if (JsonReader_peek(reader) == '}') {
+        reader->p++;
+        return 0;
     }
 
-    // For BRM int values, there is no null enum, just 0
-    PIN_FLIST_FLD_SET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ENUM, field), (void *) &value, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting int for field %s", PIN_FIELD_GET_NAME(field));
-
-    Py_RETURN_NONE;
-
-error:
-    return NULL;
+    while (1) {
+        if ((key = JsonReader_string(reader)) == NULL) {
+            return -1;
+        }
+        if ((field = PIN_FIELD_OF_NAME(key)) == 0) {
+            PyErr_Format(PyExc_KeyError, "Do not know field %s\n", key);
+            return -1;
+        }
+        if (JsonReader_expect(reader, ':') < 0) {
+            return -1;
+        }
+        if (JsonReader_field(reader, flistp, field, virtual_arrays) < 0) {
+            return -1;
+        }
+        if (JsonReader_peek(reader) == ',') {
+            reader->p++;
+            continue;
+        }
+        return JsonReader_expect(reader, '}');
+    }
 }
 
 
-static PyObject *FList_set_decimal(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Populates an unopened FList from json text, the reverse of FList_to_json
+* Returns a list of the top level array fields that were set to an empty {} or []
+*/
+static PyObject *FList_from_json(FList *self, PyObject *args)
 {
-    pin_fld_num_t field = 0;
-    char *value = NULL;
-    pin_decimal_t *decimal_value = NULL;
+    const char *text = NULL;
+    Py_ssize_t length = 0;
+    PyObject *flags = NULL;
+    pin_flist_t *flistp = NULL;
+    PyObject *virtual_list = NULL;
+    PyObject *field_object = NULL;
+    FieldSet virtual_arrays;
+    JsonReader reader;
+    Py_ssize_t i = 0;
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$s", kwargs_names, &field, &value)) {
+    if (!PyArg_ParseTuple(args, "s#|O", &text, &length, &flags)) {
+        return NULL;
+    }
+
+    if (self->flistp != NULL) {
+        PyErr_SetString(PyExc_ValueError, "Do not call from_json on an open flist\n");
         return NULL;
     }
 
-    if (value) {
-        decimal_value = pin_decimal(value, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error converting to decimal for setting field %s", PIN_FIELD_GET_NAME(field));
-        if (decimal_value == NULL) {
-            PyErr_SetString(BRMError, "Error converting to pin_decimal_t\n");
+    FieldSet_init(&virtual_arrays);
+    reader.start = text;
+    reader.p = text;
+    reader.end = text + length;
+    reader.client = self->client;
+    reader.flags = flags;
+    reader.scratch_capacity = 256;
+    if ((reader.scratch = PyMem_Malloc(reader.scratch_capacity)) == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    flistp = PIN_FLIST_CREATE(&self->client->ebuf);
+    CHECK_PIN_ERR(self->client->ebuf, "Error opening flist");
+
+    if (JsonReader_flist(&reader, flistp, &virtual_arrays) < 0) {
+        goto error;
+    }
+    if (JsonReader_peek(&reader) != 0) {
+        JsonReader_error(&reader, "extra data");
+        goto error;
+    }
+
+    if ((virtual_list = PyList_New(0)) == NULL) {
+        goto error;
+    }
+    for (i = 0; i < virtual_arrays.capacity; i++) {
+        if (virtual_arrays.fields[i] == 0) {
+            continue;
+        }
+        if ((field_object = PyLong_FromLong(virtual_arrays.fields[i])) == NULL) {
             goto error;
         }
+        if (PyList_Append(virtual_list, field_object) < 0) {
+            Py_DECREF(field_object);
+            goto error;
+        }
+        Py_DECREF(field_object);
     }
 
-    PIN_FLIST_FLD_PUT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_DECIMAL, field), (void *) decimal_value, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error setting decimal for field %s", PIN_FIELD_GET_NAME(field));
-
-    Py_RETURN_NONE;
+    self->flistp = flistp;
+    FList_mark_modified(self);
+    FieldSet_free(&virtual_arrays);
+    PyMem_Free(reader.scratch);
+    return virtual_list;
 
 error:
-    // pbo_decimal_destroy allows NULL values
-    pbo_decimal_destroy(&decimal_value);
+    Py_XDECREF(virtual_list);
+    PIN_FLIST_DESTROY_EX(&flistp, NULL);
+    FieldSet_free(&virtual_arrays);
+    PyMem_Free(reader.scratch);
     return NULL;
 }
 
 
+/*
+*
+* FListView
+*
+* A read-only cursor over an flist, returned by FList.view()
+*
+* Getting a substruct or array flist through FList allocates a Python FList plus a C FList,
+* and registers it in the parent's child cache. A view instead borrows the
+* pointer of the flist it wraps and keeps a single strong reference to the FList it was made from,
+* which keeps the C flist alive. Substructs and array elements are returned as more views on the same owner.
+*
+* Because the pointer is borrowed, a view becomes stale as soon as the owner's flist is modified, through
+* the owner or any of its children. Every access checks the owner's generation and raises a RuntimeError
+* on a stale view, instead of reading memory that may have been freed.
+*
+*/
+typedef struct {
+    PyObject_HEAD
+    FList *owner;
+    pin_flist_t *flistp;
+    /* 0 for a view of an flist, otherwise the array field on flistp that this view walks */
+    pin_fld_num_t array_field;
+    unsigned long generation;
+} FListView;
+
+static PyTypeObject FListViewType;
+
 /*
 * Returns a New Reference
 */
-static PyObject *FList_get_array_flist(FList *self, PyObject *args, PyObject *kwargs)
+static PyObject *FListView_make(FList *owner, pin_flist_t *flistp, pin_fld_num_t array_field, unsigned long generation)
 {
-    pin_fld_num_t field = 0;
-    int32 elem_id = 0;
-    int optional = 0;
-
-    FList *sub_flist = NULL;
+    FListView *view = NULL;
 
-    if (!PyArg_ParseTuple(args, "iii", &field, &elem_id, &optional)) {
+    if ((view = PyObject_New(FListView, &FListViewType)) == NULL) {
         return NULL;
     }
+    Py_INCREF(owner);
+    view->owner = owner;
+    view->flistp = flistp;
+    view->array_field = array_field;
+    view->generation = generation;
+    return (PyObject *) view;
+}
 
-    if ((sub_flist = (FList *) FList_make_flist_on_parent(self, field, elem_id)) == NULL) {
-        goto error;
+static void FListView_dealloc(FListView *self)
+{
+    Py_XDECREF(self->owner);
+    PyObject_Del(self);
+}
+
+static int FListView_check(FListView *self)
+{
+    if (self->owner->tree_generation != self->generation) {
+        PyErr_SetString(PyExc_RuntimeError, "flist was modified after the view was created");
+        return -1;
     }
+    return 0;
+}
 
-    if (!sub_flist->flistp) {
-        sub_flist->flistp = PIN_FLIST_ELEM_GET(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), elem_id, optional, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting flist for field %s elem_id %i", PIN_FIELD_GET_NAME(field), elem_id);
+/*
+* Resolves a field name or number to a field number
+* Sets a KeyError and returns 0 if the field is unknown
+*/
+static pin_fld_num_t FListView_field(PyObject *key)
+{
+    pin_fld_num_t field = 0;
+    const char *name = NULL;
+
+    if (PyUnicode_Check(key)) {
+        if ((name = PyUnicode_AsUTF8(key)) == NULL) {
+            return 0;
+        }
+        field = PIN_FIELD_OF_NAME(name);
+    } else if (PyLong_Check(key)) {
+        field = (pin_fld_num_t) PyLong_AsLong(key);
+        if (PyErr_Occurred()) {
+            return 0;
+        }
+        if (PIN_FIELD_GET_NAME(field) == NULL) {
+            field = 0;
+        }
+    } else {
+        PyErr_Format(PyExc_TypeError, "field should be str or int, not %R", key);
+        return 0;
     }
 
-    if (!sub_flist->flistp) {
-        // If optional is 1 and flist doesn't exist at this index, return None
-        // decrefing the sub_flist will make it immediately deallocate, where it is removed from parents cache
-        Py_XDECREF(sub_flist);
-        Py_RETURN_NONE;
+    if (field == 0) {
+        PyErr_Format(PyExc_KeyError, "Do not know field %R", key);
     }
+    return field;
+}
 
-    return (PyObject *) sub_flist;
+/*
+* Converts an elem_id key, accepting '*', 'PIN_ELEMID_ANY' and -1 for PIN_ELEMID_ANY
+* Returns -1 with an exception set on failure
+*/
+static int FListView_elem_id(PyObject *key, int32 *elem_id)
+{
+    long value = 0;
 
-error:
-    Py_XDECREF(sub_flist);
-    return NULL;
+    if (PyUnicode_Check(key)) {
+        if (PyUnicode_CompareWithASCIIString(key, "*") == 0 || PyUnicode_CompareWithASCIIString(key, "PIN_ELEMID_ANY") == 0) {
+            *elem_id = PIN_ELEMID_ANY;
+            return 0;
+        }
+    }
+    if (!PyLong_Check(key)) {
+        PyErr_Format(PyExc_TypeError, "elem_id should be int, not %R", key);
+        return -1;
+    }
+    value = PyLong_AsLong(key);
+    if (value == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    *elem_id = value == -1 ? PIN_ELEMID_ANY : (int32) value;
+    return 0;
 }
 
-
 /*
-* Returns a New Reference
-*
-* Returns the flist at the PIN_ELEMID_ANY position on this array.
-* Remember that if nothing was directly set at PIN_ELEMID_ANY, this will return the very first flist placed on the array
+* Returns the Python value of field on flistp, converted the same way as the FList getters
+* Substructs are returned as views, and arrays as array views
+* If the field is not on the flist, sets a KeyError, or returns None if optional
 *
-* This will determine what the first flist on the array was, which is always identical to PIN_ELEMID_ANY
-* It will pull the elem_id from that, which is -1 for PIN_ELEMID_ANY and 0+ for a non PIN_ELEMID_ANY.
-* It uses this elem_id to look up in the cache.
+* Returns a New Reference
 */
-static PyObject *FList_get_any_array_flist(FList *self, PyObject *args, PyObject *kwargs)
+static PyObject *FListView_value(FListView *self, pin_flist_t *flistp, pin_fld_num_t field, int optional)
 {
-    pin_fld_num_t field = 0;
-    int optional = 0;
-
+    Client *client = self->owner->client;
+    pin_fld_type_t field_type = PIN_FIELD_GET_TYPE(field);
+    void *value = NULL;
     int32 elem_id = 0;
     pin_cookie_t cookie = NULL;
 
-    PyObject *arg_list = NULL;
-    PyObject *ret = NULL;
+    if (field_type == PIN_FLDT_ARRAY) {
+        PIN_FLIST_ELEM_GET_NEXT(flistp, field, &elem_id, 0, &cookie, &client->ebuf);
+    } else {
+        /* optional=0 so that a NULL value can be told apart from a missing field */
+        value = PIN_FLIST_FLD_GET(flistp, field, 0, &client->ebuf);
+    }
 
-    if (!PyArg_ParseTuple(args, "ii", &field, &optional)) {
-        return NULL;
+    if (PIN_ERR_IS_ERR(&client->ebuf)) {
+        if (client->ebuf.pin_err == PIN_ERR_NOT_FOUND) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+            if (optional) {
+                Py_RETURN_NONE;
+            }
+            PyErr_Format(PyExc_KeyError, "Field %s not found", PIN_FIELD_GET_NAME(field));
+            return NULL;
+        }
     }
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(field));
 
-    /*
-    * Normally you would use PIN_FLIST_ELEM_GET with PIN_ELEMID_ANY
-    * However we cannot cache that and return the proper FList wrapper
-    * So we will use PIN_FLIST_ELEM_GET_NEXT and set cookie = NULL
-    * This appears to have identical behavior to PIN_FLIST_ELEM_GET/PIN_ELEMID_ANY
-    * Note also that PIN_FLIST_ELEM_GET with -1 will do the same thing here...
-    */
+    switch (field_type) {
+        case PIN_FLDT_ARRAY:
+            return FListView_make(self->owner, flistp, field, self->generation);
 
-    PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &self->client->ebuf);
-    CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(field));
+        case PIN_FLDT_SUBSTRUCT:
+            if (value == NULL) {
+                Py_RETURN_NONE;
+            }
+            return FListView_make(self->owner, (pin_flist_t *) value, 0, self->generation);
 
-    if ((arg_list = Py_BuildValue("(iii)", field, elem_id, optional)) == NULL){
-        goto error;
+        default:
+            return FList_value_to_python(client, field, value);
     }
 
-    ret = FList_get_array_flist(self, arg_list, NULL);
-
 error:
-    Py_XDECREF(arg_list);
-    return ret;
+    return NULL;
 }
 
-
 /*
-* Utility function for FList_set_flist_on_array_any. Check the comments there.
-*
-* The calling code will first copy the top level parent.
-* If there are any child python references to the parent, they need to point to flists on the new parent.
+* Returns the element at elem_id of an array view as a view, or None for a NULL element
+* If the element is not on the array, sets a KeyError, or returns None if optional
 *
-* This recurses through each child on the flist that is in cache, in other words, it recurses through all
-* the python references for this flist, and it updates each flistp to point to the parent.
-*
-* The calling code MUST destroy the old super-parent flistp, or it will be a memory leak.
+* Returns a New Reference
 */
-static int FList_recurse_any(FList *self) {
-    PyObject *key = NULL, *value = NULL;
-    Py_ssize_t pos = 0;
-    FList *child = NULL;
-    PyObject *field_object = NULL, *elem_id_object = NULL;
+static PyObject *FListView_element(FListView *self, int32 elem_id, int optional)
+{
+    Client *client = self->owner->client;
+    pin_flist_t *elem_flistp = NULL;
+
+    elem_flistp = PIN_FLIST_ELEM_GET(self->flistp, self->array_field, elem_id, 0, &client->ebuf);
+    if (PIN_ERR_IS_ERR(&client->ebuf)) {
+        if (client->ebuf.pin_err == PIN_ERR_NOT_FOUND) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+            if (optional) {
+                Py_RETURN_NONE;
+            }
+            PyErr_Format(PyExc_KeyError, "elem_id %i not found", (int) elem_id);
+            return NULL;
+        }
+    }
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting element %i", (int) elem_id);
+
+    if (elem_flistp == NULL) {
+        Py_RETURN_NONE;
+    }
+    return FListView_make(self->owner, elem_flistp, 0, self->generation);
+
+error:
+    return NULL;
+}
+
+static PyObject *FListView_lookup(FListView *self, PyObject *key, int optional)
+{
     pin_fld_num_t field = 0;
-    int elem_id = 0;
-    int err = 0;
+    int32 elem_id = 0;
 
-    while (PyDict_Next(self->children, &pos, &key, &value)) {
-        // key is tuple of (field, elem_id)
-        // value is weakref to an FList
-        child = (FList *) PyWeakref_GetObject(value);
-        if ((PyObject *) child != Py_None) {
-            field_object = PyTuple_GetItem(key, 0);
-            field = PyLong_AsLong(field_object);
-
-            elem_id_object = PyTuple_GetItem(key, 1);
-            elem_id = PyLong_AsLong(elem_id_object);
-            if (PyErr_Occurred()) {
-                goto error;
-            }
+    if (FListView_check(self) < 0) {
+        return NULL;
+    }
 
-            // Set the child's flistp to the flist on the parent.
-            child->flistp = PIN_FLIST_ELEM_GET(self->flistp, field, elem_id, 1, &self->client->ebuf);
-            CHECK_PIN_ERR_FORMAT(self->client->ebuf, "failed to get child %s", PIN_FIELD_GET_NAME(field));
-            if (FList_recurse_any(child) < 0) {
-                err = -1;
-            }
+    if (self->array_field) {
+        if (FListView_elem_id(key, &elem_id) < 0) {
+            return NULL;
         }
+        return FListView_element(self, elem_id, optional);
     }
-    return err;
-error:
-    return -1;
+
+    if ((field = FListView_field(key)) == 0) {
+        return NULL;
+    }
+    return FListView_value(self, self->flistp, field, optional);
 }
 
+static PyObject *FListView_subscript(FListView *self, PyObject *key)
+{
+    return FListView_lookup(self, key, 0);
+}
 
-static PyObject *FList_set_flist_on_array_any(FList *self, PyObject *args, PyObject *kwargs)
+static PyObject *FListView_get(FListView *self, PyObject *args)
 {
-    pin_fld_num_t field = 0;
-    FList *elem_flist = NULL;
+    PyObject *key = NULL;
+    PyObject *default_value = Py_None;
+    PyObject *value = NULL;
 
-    pin_flist_t *flist_to_set = NULL;
-    PyObject *arg_list = NULL;
-    FList *ret = NULL;
-    PyObject *weakref = NULL;
+    if (!PyArg_ParseTuple(args, "O|O", &key, &default_value)) {
+        return NULL;
+    }
 
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O!", kwargs_names, &field, &FListType, &elem_flist)) {
-        goto error;
+    if ((value = FListView_lookup(self, key, 1)) == NULL) {
+        return NULL;
     }
+    if (value == Py_None) {
+        Py_DECREF(value);
+        Py_INCREF(default_value);
+        return default_value;
+    }
+    return value;
+}
 
-    /* Check to see if there is a pre-existing flist at the PIN_ELEMID_ANY position */
-    if ((arg_list = Py_BuildValue("(ii)", field, 1)) == NULL){
-        goto error;
+/*
+* Builds the list of keys of this view, as field names or elem_ids
+* If with_values is set, builds a list of (key, value) tuples instead
+*
+* Returns a New Reference
+*/
+static PyObject *FListView_list(FListView *self, int with_keys, int with_values)
+{
+    Client *client = self->owner->client;
+    pin_fld_num_t field = 0;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    pin_flist_t *elem_flistp = NULL;
+    FieldSet seen;
+    PyObject *list = NULL;
+    PyObject *key = NULL;
+    PyObject *value = NULL;
+    PyObject *item = NULL;
+
+    if (FListView_check(self) < 0) {
+        return NULL;
     }
-    if ((ret = (FList *) FList_get_any_array_flist(self, arg_list, NULL)) == NULL) {
+
+    FieldSet_init(&seen);
+    if ((list = PyList_New(0)) == NULL) {
         goto error;
     }
 
-    Py_DECREF(arg_list);
-    arg_list = NULL;
-
-    /*
-    * If there is a pre-existing flistp at PIN_ELEMID_ANY, we have to take special care of it here.
-    * The PIN_FLIST_ELEM_SET will destroy the pre-existing flistp and replace it with the new one.
-    * However, we may have some python references to an FList that holds the pre-existing flistp.
-    *
-    * We CANNOT simply call the FList_drop_field (which disasscociates parent from child, and only drops if
-    * there are no Python references. This strategy works fine in FList_set_flist_on_array
-    * but it doesn't work here with PIN_ELEMID_ANY.
-    *
-    * It doesn't work because once we call FList_drop_field on the first flistp, the next call to
-    * PIN_FLIST_ELEM_SET will simply overwrite the second flistp, which is now the first flistp after the call to
-    * PIN_FLIST_ELEM_SET.
-    *
-    * Instead, we have to copy the first flistp, and find all the children, and the grandchildren, and etc.
-    * and update the children to point to the new copy. Then we can disassociate child from the parent, but not delete.
-    * After this, we can safely PIN_FLIST_ELEM_SET which will delete the original and destroy it's memory.
-    *
-    */
-    if ((PyObject *) ret != Py_None) {
-        weakref = FList_get_child_from_cache(self, field, ret->elem_id);
-        if (PyErr_Occurred()) {
-            goto error;
+    while (1) {
+        last_cookie = cookie;
+        if (self->array_field) {
+            elem_flistp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, self->array_field, &elem_id, 1, &cookie, &client->ebuf);
+            CHECK_PIN_ERR(client->ebuf, "Error iterating over flist view");
+            if (last_cookie == cookie) {
+                break;
+            }
+        } else {
+            PIN_FLIST_ANY_GET_NEXT(self->flistp, &field, &elem_id, &cookie, &client->ebuf);
+            if (last_cookie == cookie) {
+                // Err buf is always filled on the very last iteration
+                PIN_ERRBUF_RESET(&client->ebuf);
+                break;
+            }
+            CHECK_PIN_ERR(client->ebuf, "Error iterating over flist view");
         }
 
-        ret->flistp = PIN_FLIST_COPY(ret->flistp, &self->client->ebuf);
-        CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error copying parent field %s", PIN_FIELD_GET_NAME(field));
-        if (FList_recurse_any(ret) < 0) {
-            goto error;
+        if (self->array_field) {
+            key = with_keys ? PyLong_FromLong(elem_id) : NULL;
+            if (with_values) {
+                value = elem_flistp ? FListView_make(self->owner, elem_flistp, 0, self->generation) : (Py_INCREF(Py_None), Py_None);
+            }
+        } else {
+            /* ANY_GET_NEXT returns every array element and every duplicate field; only visit each field once */
+            switch (FieldSet_add(&seen, field)) {
+                case -1:
+                    goto error;
+                case 0:
+                    continue;
+            }
+            if (with_keys && (key = FieldName_get(field)) != NULL) {
+                // FieldName_get returns a borrowed reference
+                Py_INCREF(key);
+            }
+            if (with_values) {
+                value = FListView_value(self, self->flistp, field, 0);
+            }
         }
 
-        if (FList_disassociate_child(self, &weakref, field, ret->elem_id) < 0) {
+        if ((with_keys && key == NULL) || (with_values && value == NULL)) {
             goto error;
         }
+        if (with_keys && with_values) {
+            item = PyTuple_Pack(2, key, value);
+            Py_CLEAR(key);
+            Py_CLEAR(value);
+        } else {
+            item = with_keys ? key : value;
+            key = NULL;
+            value = NULL;
+        }
+        if (item == NULL || PyList_Append(list, item) < 0) {
+            goto error;
+        }
+        Py_CLEAR(item);
     }
 
-    if (elem_flist) {
-        // otherwise we are setting it to NULL
-        flist_to_set = elem_flist->flistp;
-    }
-
-    PIN_FLIST_ELEM_SET(self->flistp, flist_to_set, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), PIN_ELEMID_ANY, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error setting element on array");
-
-    Py_XDECREF(weakref);
-    Py_XDECREF(ret);
-    Py_RETURN_NONE;
+    FieldSet_free(&seen);
+    return list;
 
 error:
-    Py_XDECREF(arg_list);
-    Py_XDECREF(ret);
-    Py_XDECREF(weakref);
+    FieldSet_free(&seen);
+    Py_XDECREF(key);
+    Py_XDECREF(value);
+    Py_XDECREF(item);
+    Py_XDECREF(list);
     return NULL;
 }
 
-
-/*
-* Set an flist on an array using a regular, numeric index.
-* Do not use this for PIN_ELEMID_ANY - use FList_set_flist_on_array_any instead.
-*/
-static PyObject *FList_set_flist_on_array(FList *self, PyObject *args, PyObject *kwargs)
+static PyObject *FListView_keys(FListView *self, PyObject *Py_UNUSED(ignored))
 {
-    pin_fld_num_t field = 0;
-    FList *elem_flist = NULL;
-    int elem_id = 0;
+    return FListView_list(self, 1, 0);
+}
 
-    pin_flist_t *flist_to_set = NULL;
-    PyObject *arg_list = NULL;
-    PyObject *result = NULL;
+static PyObject *FListView_values(FListView *self, PyObject *Py_UNUSED(ignored))
+{
+    return FListView_list(self, 0, 1);
+}
 
-    char *kwargs_names[] = {"field", "elem_id", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "ii|$O!", kwargs_names, &field, &elem_id, &FListType, &elem_flist)) {
-        goto error;
-    }
+static PyObject *FListView_items(FListView *self, PyObject *Py_UNUSED(ignored))
+{
+    return FListView_list(self, 1, 1);
+}
 
-    /*
-    * PIN_FLIST_SUBSTR_SET will DESTROY an flist if it already exists
-    * Thus need to call FList_drop_field to disassociate it if it exists
-    * FList_drop_field checks if there are any references to this child flist
-    * If there are, we take the memory of the child flist from the parent flist
-    * This way, the PIN_FLIST_ELEM_SET has nothing to destroy
-    * If there are not any references to this child flist,
-    * we both take the memory and then destroy it
-    * So in either case, the PIN_FLIST_ELEM_SET isn't actually destroying any memory
-    */
+static PyObject *FListView_iter(FListView *self)
+{
+    PyObject *keys = NULL;
+    PyObject *iter = NULL;
 
-    /*
-    * The PIN_ELEMID_ANY is a bit more complex, and is handled in this function:
-    * FList_set_flist_on_array_any
-    * The calling code should NOT call -1 for PIN_ELEMID_ANY
-    */
+    if ((keys = FListView_list(self, 1, 0)) == NULL) {
+        return NULL;
+    }
+    iter = PyObject_GetIter(keys);
+    Py_DECREF(keys);
+    return iter;
+}
 
+static Py_ssize_t FListView_length(FListView *self)
+{
+    Client *client = self->owner->client;
+    int32 count = 0;
 
-    if ((arg_list = Py_BuildValue("(iii)", field, elem_id, 1)) == NULL) {
-        goto error;
-    }
-    if ((result = FList_drop_field(self, arg_list, NULL)) == NULL) {
-        goto error;
+    if (FListView_check(self) < 0) {
+        return -1;
     }
 
-    if (elem_flist) {
-        // otherwise we are setting it to NULL
-        flist_to_set = elem_flist->flistp;
+    if (self->array_field) {
+        count = PIN_FLIST_ELEM_COUNT(self->flistp, self->array_field, &client->ebuf);
+        CHECK_PIN_ERR(client->ebuf, "Error counting flist view");
+        return count;
     }
-    /*
-    Note: there is NO NEED to set the elem_flist->parent_flist = self
-    Because PIN_FLIST_ELEM_SET will copy the elem_flist->flistp into self->flistp.
-    If self->flistp is destroyed, we can still refer to elem_flist->flistp without segfaulting.
-    */
-    PIN_FLIST_ELEM_SET(self->flistp, flist_to_set, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), elem_id, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error setting element on array");
 
-    Py_DECREF(arg_list);
-    return result;
+    // A view does not know whether its flist was concatenated, so duplicate fields are always folded
+    return FList_count_fields(client, self->flistp, 1);
 
 error:
-    Py_XDECREF(arg_list);
-    Py_XDECREF(result);
-    return NULL;
+    return -1;
 }
 
-
-/*
-* COPY an flist onto this array
-* To create a brand new subflist, use FList_add_flist
-*/
-static PyObject *FList_set_substr(FList *self, PyObject *args, PyObject *kwargs)
+static int FListView_contains(FListView *self, PyObject *key)
 {
+    Client *client = self->owner->client;
     pin_fld_num_t field = 0;
-    FList *substr_flist = NULL;
-
-    PyObject *arg_list = NULL;
-    PyObject *ret = NULL;
-    pin_flist_t *flist_to_set = NULL;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
 
-    /*
-    if (!PyArg_ParseTuple(args, "iO!", &field, &FListType, &substr_flist)) {
-        return NULL;
-    }
-    */
-    char *kwargs_names[] = {"field", "value", NULL};
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "i|$O!", kwargs_names, &field, &FListType, &substr_flist)) {
-        goto error;
+    if (FListView_check(self) < 0) {
+        return -1;
     }
 
-    /*
-    Note:
-
-    This will COPY the input flist onto this parent flist.
-    Thus there is no need to set the substr_flist->parent_flist = self
-    Likewise there is no need to set the cache here, until someone calls a get
-    Because PIN_FLIST_SUBSTR_SET will COPY*** the substr_flist->flistp into self->flistp.
-    If self->flistp is destroyed, we can still refer to substr_flist->flistp without segfaulting.
-    */
-    if ((arg_list = Py_BuildValue("(iii)", field, 0, 1)) == NULL) {
-        goto error;
+    if (self->array_field) {
+        if (FListView_elem_id(key, &elem_id) < 0) {
+            return -1;
+        }
+        PIN_FLIST_ELEM_GET(self->flistp, self->array_field, elem_id, 0, &client->ebuf);
+    } else {
+        if ((field = FListView_field(key)) == 0) {
+            if (PyErr_ExceptionMatches(PyExc_KeyError)) {
+                PyErr_Clear();
+            }
+            return PyErr_Occurred() ? -1 : 0;
+        }
+        if (PIN_FIELD_GET_TYPE(field) == PIN_FLDT_ARRAY) {
+            PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 0, &cookie, &client->ebuf);
+        } else {
+            PIN_FLIST_FLD_GET(self->flistp, field, 0, &client->ebuf);
+        }
     }
 
-    /*
-    * PIN_FLIST_SUBSTR_SET will DESTROY an flist if it already exists
-    * Thus need to call FList_drop_field to disassociate it if it exists
-    */
-    if ((ret = FList_drop_field(self, arg_list, NULL)) == NULL) {
-        goto error;
+    if (PIN_ERR_IS_ERR(&client->ebuf)) {
+        PIN_ERRBUF_RESET(&client->ebuf);
+        return 0;
     }
+    return 1;
+}
 
-    if (substr_flist != NULL) {
-        flist_to_set = substr_flist->flistp;
-    }
+static PyObject *FListView_str(FListView *self)
+{
+    char *flist_string = NULL;
+    int flist_string_length = 0;
+    PyObject *ret = NULL;
+    Client *client = self->owner->client;
 
-    PIN_FLIST_SUBSTR_SET(self->flistp, flist_to_set, PIN_MAKE_FLD(PIN_FLDT_SUBSTRUCT, field), &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error setting substructure");
+    if (FListView_check(self) < 0) {
+        return NULL;
+    }
+    if (self->array_field) {
+        return PyUnicode_FromFormat("<FListView of array %s>", PIN_FIELD_GET_NAME(self->array_field));
+    }
 
-    Py_DECREF(arg_list);
+    PIN_FLIST_TO_STR(self->flistp, &flist_string, &flist_string_length, &client->ebuf);
+    CHECK_PIN_ERR(client->ebuf, "Error converting flist to string.");
 
-    return ret;
+    ret = PyUnicode_FromString(flist_string);
+    free(flist_string);
 
 error:
-    Py_XDECREF(arg_list);
-    Py_XDECREF(ret);
-    return NULL;
+    return ret;
 }
 
-
-static PyObject *FList_copy_flist(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Returns a New Reference
+*/
+static PyObject *FList_view(FList *self, PyObject *args)
 {
-    FList *flist_copy = NULL;
+    pin_fld_num_t field = 0;
 
-    if ((flist_copy = (FList *) FList_make_flist(self)) == NULL) {
-        goto error;
+    if (FList_check_open(self) < 0) {
+        return NULL;
     }
 
-    flist_copy->flistp = PIN_FLIST_COPY(self->flistp, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error copying flist");
-    assert(flist_copy->flistp);
-
-    return (PyObject *) flist_copy;
+    if (!PyArg_ParseTuple(args, "|i", &field)) {
+        return NULL;
+    }
 
-error:
-    Py_XDECREF(flist_copy);
-    return NULL;
+    return FListView_make(self, self->flistp, field, self->tree_generation);
 }
 
+static PyMethodDef FListView_methods[] = {
+    {"get", (PyCFunction) FListView_get, METH_VARARGS, "gets a value, or default if it does not exist"},
+    {"keys", (PyCFunction) FListView_keys, METH_NOARGS, "returns the field names or elem_ids"},
+    {"values", (PyCFunction) FListView_values, METH_NOARGS, "returns the values"},
+    {"items", (PyCFunction) FListView_items, METH_NOARGS, "returns the (key, value) pairs"},
+    {NULL}
+};
 
+static PyMappingMethods FListView_as_mapping = {
+    .mp_length = (lenfunc) FListView_length,
+    .mp_subscript = (binaryfunc) FListView_subscript,
+};
 
-static PyObject *FList_sort_flist(FList *self, PyObject *args,
-                                  PyObject *kwargs)
-{
-    FList *sort_flist = NULL;
-    int sort_default = 0;
+static PySequenceMethods FListView_as_sequence = {
+    .sq_contains = (objobjproc) FListView_contains,
+};
 
-    if (!PyArg_ParseTuple(args, "O!i", &FListType, &sort_flist, &sort_default)) {
-        goto error;
-    }
+static PyTypeObject FListViewType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "brm.FListView",
+    .tp_doc = "Read-only view of an flist",
+    .tp_basicsize = sizeof(FListView),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_dealloc = (destructor) FListView_dealloc,
+    .tp_methods = FListView_methods,
+    .tp_as_mapping = &FListView_as_mapping,
+    .tp_as_sequence = &FListView_as_sequence,
+    .tp_iter = (getiterfunc) FListView_iter,
+    .tp_str = (reprfunc) FListView_str,
+};
 
-    PIN_FLIST_SORT(self->flistp, sort_flist->flistp, 0, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error sorting flist");
 
-    Py_RETURN_NONE;
+/*
+*
+* Filtering and grouping arrays
+*
+* Evaluates a field on every flist of an array natively, converting only that field to Python,
+* instead of wrapping every flist with BRMArray.values(). NULL flists are skipped, and a missing field is None.
+*
+*/
+enum {ARRAY_GROUP_ELEM_IDS, ARRAY_INDEX_VIEWS, ARRAY_INDEX_ELEM_IDS};
+
+/*
+* Returns the value of key_field on elem_flistp, or None if it is missing
+*
+* Returns a New Reference
+*/
+static PyObject *FList_array_key(Client *client, pin_flist_t *elem_flistp, pin_fld_num_t key_field)
+{
+    void *value = NULL;
+
+    value = PIN_FLIST_FLD_GET(elem_flistp, key_field, 1, &client->ebuf);
+    CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(key_field));
+    return FList_value_to_python(client, key_field, value);
 
 error:
     return NULL;
 }
 
-static PyObject *FList_sort_reverse_flist(FList *self, PyObject *args,
-                                          PyObject *kwargs)
+static int FList_check_key_field(pin_fld_num_t key_field)
 {
-    FList *sort_flist = NULL;
-    int sort_default = 0;
+    pin_fld_type_t field_type = PIN_FIELD_GET_TYPE(key_field);
 
+    if (field_type == PIN_FLDT_ARRAY || field_type == PIN_FLDT_SUBSTRUCT) {
+        PyErr_Format(PyExc_TypeError, "%s is not a field", PIN_FIELD_GET_NAME(key_field));
+        return -1;
+    }
+    return 0;
+}
 
-    if (!PyArg_ParseTuple(args, "O!i", &FListType, &sort_flist, &sort_default)) {
-        goto error;
+/*
+* Returns a list of the elem_ids of the flists on array field where key_field <op> value
+* op is one of Py_LT, Py_LE, Py_EQ, Py_NE, Py_GT, Py_GE
+* A missing field only matches == None or != value, as it cannot be ordered
+*/
+static PyObject *FList_array_filter(FList *self, PyObject *args)
+{
+    pin_fld_num_t field = 0;
+    pin_fld_num_t key_field = 0;
+    int op = 0;
+    PyObject *value = NULL;
+
+    Client *client = self->client;
+    pin_flist_t *elem_flistp = NULL;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    PyObject *key = NULL;
+    PyObject *elem_id_obj = NULL;
+    PyObject *results = NULL;
+    int match = 0;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
     }
 
-    PIN_FLIST_SORT_REVERSE(self->flistp, sort_flist->flistp, 0, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error sorting flist");
+    if (!PyArg_ParseTuple(args, "iiiO", &field, &key_field, &op, &value)) {
+        return NULL;
+    }
+    if (op < Py_LT || op > Py_GE) {
+        PyErr_Format(PyExc_ValueError, "Illegal comparison %d", op);
+        return NULL;
+    }
+    if (FList_check_key_field(key_field) < 0) {
+        return NULL;
+    }
+    field = PIN_MAKE_FLD(PIN_FLDT_ARRAY, field);
 
-    Py_RETURN_NONE;
+    if ((results = PyList_New(0)) == NULL) {
+        return NULL;
+    }
+    while (1) {
+        last_cookie = cookie;
+        elem_flistp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+        if (last_cookie == cookie) {
+            break;
+        }
+        if (elem_flistp == NULL) {
+            continue;
+        }
+        if ((key = FList_array_key(client, elem_flistp, key_field)) == NULL) {
+            goto error;
+        }
+
+        if (key == Py_None || value == Py_None) {
+            match = (op == Py_EQ && key == value) || (op == Py_NE && key != value);
+        } else if ((match = PyObject_RichCompareBool(key, value, op)) < 0) {
+            goto error;
+        }
+        Py_CLEAR(key);
 
+        if (match) {
+            if ((elem_id_obj = PyLong_FromLong(elem_id)) == NULL) {
+                goto error;
+            }
+            if (PyList_Append(results, elem_id_obj) < 0) {
+                goto error;
+            }
+            Py_CLEAR(elem_id_obj);
+        }
+    }
+    return results;
 
 error:
+    Py_XDECREF(key);
+    Py_XDECREF(elem_id_obj);
+    Py_XDECREF(results);
     return NULL;
 }
 
-
-
-static PyObject *FList_concat(FList *self, PyObject *args, PyObject *kwargs)
+/*
+* Groups the flists on array field by the value of key_field
+* With ARRAY_GROUP_ELEM_IDS, returns a dict of value to a list of elem_ids
+* With ARRAY_INDEX_VIEWS, returns a dict of value to a view of the last flist with that value
+* With ARRAY_INDEX_ELEM_IDS, returns a dict of value to the elem_id of the last flist with that value
+*/
+static PyObject *FList_array_group(FList *self, PyObject *args)
 {
-    FList *other_flist = NULL;
+    pin_fld_num_t field = 0;
+    pin_fld_num_t key_field = 0;
+    int mode = 0;
 
-    if (!PyArg_ParseTuple(args, "O!", &FListType, &other_flist)) {
-        goto error;
+    Client *client = self->client;
+    pin_flist_t *elem_flistp = NULL;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    PyObject *key = NULL;
+    PyObject *item = NULL;
+    PyObject *group = NULL;
+    PyObject *results = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
     }
 
-    PIN_FLIST_CONCAT(self->flistp, other_flist->flistp, &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error concatenating flist");
+    if (!PyArg_ParseTuple(args, "iii", &field, &key_field, &mode)) {
+        return NULL;
+    }
+    if (FList_check_key_field(key_field) < 0) {
+        return NULL;
+    }
+    field = PIN_MAKE_FLD(PIN_FLDT_ARRAY, field);
 
-    Py_RETURN_NONE;
+    if ((results = PyDict_New()) == NULL) {
+        return NULL;
+    }
+    while (1) {
+        last_cookie = cookie;
+        elem_flistp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+        if (last_cookie == cookie) {
+            break;
+        }
+        if (elem_flistp == NULL) {
+            continue;
+        }
+        if ((key = FList_array_key(client, elem_flistp, key_field)) == NULL) {
+            goto error;
+        }
 
+        if (mode == ARRAY_INDEX_VIEWS || mode == ARRAY_INDEX_ELEM_IDS) {
+            if (mode == ARRAY_INDEX_VIEWS) {
+                item = FListView_make(self, elem_flistp, 0, self->tree_generation);
+            } else {
+                item = PyLong_FromLong(elem_id);
+            }
+            if (item == NULL) {
+                goto error;
+            }
+            if (PyDict_SetItem(results, key, item) < 0) {
+                goto error;
+            }
+        } else {
+            if ((item = PyLong_FromLong(elem_id)) == NULL) {
+                goto error;
+            }
+            // Borrowed Reference
+            if ((group = PyDict_GetItemWithError(results, key)) == NULL) {
+                if (PyErr_Occurred()) {
+                    goto error;
+                }
+                if ((group = PyList_New(0)) == NULL) {
+                    goto error;
+                }
+                if (PyDict_SetItem(results, key, group) < 0) {
+                    Py_DECREF(group);
+                    goto error;
+                }
+                Py_DECREF(group);
+            }
+            if (PyList_Append(group, item) < 0) {
+                goto error;
+            }
+        }
+        Py_CLEAR(item);
+        Py_CLEAR(key);
+    }
+    return results;
 
 error:
+    Py_XDECREF(key);
+    Py_XDECREF(item);
+    Py_XDECREF(results);
     return NULL;
 }
 
-
-// There is a bug in PIN_FLIST_COUNT
-// If substructs/arrays are set using PIN_FLIST_FLD_SET, then PIN_FLIST_COUNT will count recursively
-// Instead, we are using the flist_iter_init as a workaround
-// PIN_FLIST_ELEM_COUNT seems to work fine, however
-
-
-static PyObject *FList_array_count(FList *self, PyObject *args,
-                                   PyObject *kwargs)
+/*
+* Returns a list of the value of key_field on each flist of array field, in order. NULL flists are skipped
+* tstamp_mode and decimal_mode override the modes of the client, e.g. to extract tstamps as epoch ints
+*/
+static PyObject *FList_array_column(FList *self, PyObject *args)
 {
     pin_fld_num_t field = 0;
-    int32 count = -1;
-    PyObject *ret = NULL;
+    pin_fld_num_t key_field = 0;
+    int tstamp_mode = CLIENT_MODE;
+    int decimal_mode = CLIENT_MODE;
 
-    if (!PyArg_ParseTuple(args, "i", &field)) {
+    Client *client = self->client;
+    pin_flist_t *elem_flistp = NULL;
+    int32 elem_id = 0;
+    pin_cookie_t cookie = NULL;
+    pin_cookie_t last_cookie = NULL;
+    void *value = NULL;
+    PyObject *item = NULL;
+    PyObject *results = NULL;
+
+    if (FList_check_open(self) < 0) {
         return NULL;
     }
 
-    count = PIN_FLIST_ELEM_COUNT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), &self->client->ebuf);
-    CHECK_PIN_ERR(self->client->ebuf, "Error counting flist");
+    if (!PyArg_ParseTuple(args, "ii|ii", &field, &key_field, &tstamp_mode, &decimal_mode)) {
+        return NULL;
+    }
+    if (FList_check_key_field(key_field) < 0) {
+        return NULL;
+    }
+    field = PIN_MAKE_FLD(PIN_FLDT_ARRAY, field);
 
-    ret = Py_BuildValue("i", count);
+    if ((results = PyList_New(0)) == NULL) {
+        return NULL;
+    }
+    while (1) {
+        last_cookie = cookie;
+        elem_flistp = PIN_FLIST_ELEM_GET_NEXT(self->flistp, field, &elem_id, 1, &cookie, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(field));
+        if (last_cookie == cookie) {
+            break;
+        }
+        if (elem_flistp == NULL) {
+            continue;
+        }
+        value = PIN_FLIST_FLD_GET(elem_flistp, key_field, 1, &client->ebuf);
+        CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(key_field));
+
+        if (value != NULL && PIN_FIELD_GET_TYPE(key_field) == PIN_FLDT_TSTAMP) {
+            item = Client_tstamp_to_python(client, tstamp_mode, *(time_t *) value);
+        } else if (value != NULL && PIN_FIELD_GET_TYPE(key_field) == PIN_FLDT_DECIMAL) {
+            item = Client_decimal_to_python(client, decimal_mode, key_field, (pin_decimal_t *) value);
+        } else {
+            item = FList_value_to_python(client, key_field, value);
+        }
+        if (item == NULL) {
+            goto error;
+        }
+        if (PyList_Append(results, item) < 0) {
+            goto error;
+        }
+        Py_CLEAR(item);
+    }
+    return results;
 
 error:
-    return ret;
+    Py_XDECREF(item);
+    Py_XDECREF(results);
+    return NULL;
 }
 
-static PyObject *FList_init_iter(FList *self, PyObject *args, PyObject *kwargs)
-{
-    pin_fld_num_t   fld_num = 0;
-    int32       elem_id = 0;
-    pin_cookie_t    cookie = NULL;
-    pin_cookie_t    last_cookie = NULL;
 
-    PyObject *fld_name_object = NULL;
+/*
+*
+* Paths
+*
+* Resolves a compiled path like PIN_FLD_BALANCES[840].PIN_FLD_CURRENT_BAL in a single call, walking the
+* pin_flist_t directly instead of wrapping every substruct and array element along the way.
+* Only a path that ends on a substruct or array element creates FList wrappers, through the child cache.
+*
+* The steps are a tuple of (field,) for a substruct or a field, (field, elem_id) for an array element,
+* or (field, None) for every element of an array. pybrm.Path compiles them from the path string.
+*
+*/
+#define PATH_MAX_STEPS 32
 
-    PyDict_Clear(self->iter_fields);
+enum {PATH_FIELD, PATH_ELEM, PATH_WILDCARD};
 
-    /*
-    * If two flists, which both have the same field, are concatenated with PIN_FLIST_CONCAT
-    * BRM will actually have both fields on the flist, for some reason.
-    * It's probably a bug. For example, if you call PIN_FLIST_FLD_GET, which field should it return?
-    *   It returns the first field.
-    * You can prove this by printing the flist. It will show the duplicating value.
-    * The COUNT will also return one extra field.
-    * However in the function, we are going to ignore this case and instead deduplicate with the self->iter_fields
-    * which is a dictionary (that maintains order in Python 3.6)
-    * Please remember that PIN_FLIST_COUNT also has bugs, and then the count() of the flist actually ends up
-    * counting the number of items returned by this function in self->iter_fields.
-    * This in this concatenated case, we will only return the count of unique fields, not duplicate bug fields.
-    *
-    * The reason we don't want to return the same key twice is to prevent something like this:
-    * for k, v in flist.items():
-    *     print(k, v)
-    * For duplicate keys with distinct values, this will print the first value twice
-    */
+typedef struct {
+    pin_fld_num_t field;
+    int32 elem_id;
+    int kind;
+} PathStep;
 
+static Py_ssize_t PathStep_parse(PyObject *steps_tuple, PathStep *steps)
+{
+    Py_ssize_t size = 0;
+    Py_ssize_t i = 0;
+    PyObject *step = NULL;
+    PyObject *elem_id = NULL;
 
-    while (1)
-    {
-        last_cookie = cookie;
-        PIN_FLIST_ANY_GET_NEXT(self->flistp, &fld_num, &elem_id, &cookie, &self->client->ebuf);
-        if (last_cookie == cookie) {
-            // Err buf is always filled on the very last iteration
-            PIN_ERRBUF_RESET(&self->client->ebuf);
-            break;
+    if (!PyTuple_Check(steps_tuple) || (size = PyTuple_GET_SIZE(steps_tuple)) == 0 || size > PATH_MAX_STEPS) {
+        PyErr_Format(PyExc_ValueError, "path should be a tuple of 1 to %d steps", PATH_MAX_STEPS);
+        return -1;
+    }
+    for (i = 0; i < size; i++) {
+        step = PyTuple_GET_ITEM(steps_tuple, i);
+        if (!PyTuple_Check(step) || PyTuple_GET_SIZE(step) < 1 || PyTuple_GET_SIZE(step) > 2) {
+            PyErr_Format(PyExc_ValueError, "Illegal path step %R", step);
+            return -1;
         }
-        CHECK_PIN_ERR(self->client->ebuf, "Error iterating flist");
-
-        if ((fld_name_object = Py_BuildValue("s", pin_name_of_field(fld_num))) == NULL) {
-            goto error;
+        steps[i].field = (pin_fld_num_t) PyLong_AsLong(PyTuple_GET_ITEM(step, 0));
+        if (steps[i].field == -1 && PyErr_Occurred()) {
+            return -1;
         }
-
-        switch (PyDict_Contains(self->iter_fields, fld_name_object)) {
-            case 0:
-                /* This field name is not yet in our dict, so add it */
-                if (PyDict_SetItem(self->iter_fields, fld_name_object, Py_None) < 0) {
-                    Py_DECREF(Py_None);
-                    goto error;
-                };
-                break;
-            case 1:
-                /* this field name already exists and is a duplicate, so don't add it */
-                break;
-            case 2:
-                /* error */
-                goto error;
-
+        steps[i].elem_id = 0;
+        steps[i].kind = PATH_FIELD;
+        if (PyTuple_GET_SIZE(step) == 2) {
+            elem_id = PyTuple_GET_ITEM(step, 1);
+            if (elem_id == Py_None) {
+                steps[i].kind = PATH_WILDCARD;
+            } else {
+                steps[i].kind = PATH_ELEM;
+                steps[i].elem_id = (int32) PyLong_AsLong(elem_id);
+                if (steps[i].elem_id == -1 && PyErr_Occurred()) {
+                    return -1;
+                }
+            }
         }
-
-        Py_DECREF(fld_name_object);
     }
+    return size;
+}
 
-    Py_INCREF(self->iter_fields);
+/*
+* Returns the FList at the end of the path, creating the children along the way through the child cache
+* elem_ids holds the elem_id matched by each wildcard step
+*
+* Returns a New Reference
+*/
+static PyObject *FList_path_flist(FList *self, PathStep *steps, Py_ssize_t size, int32 *elem_ids)
+{
+    FList *current = self;
+    PyObject *child = NULL;
+    PyObject *arg_list = NULL;
+    Py_ssize_t i = 0;
 
-    return self->iter_fields;
+    Py_INCREF(current);
+    for (i = 0; i < size; i++) {
+        if (steps[i].kind == PATH_FIELD) {
+            arg_list = Py_BuildValue("(ii)", steps[i].field, 0);
+        } else {
+            arg_list = Py_BuildValue("(iii)", steps[i].field, steps[i].kind == PATH_WILDCARD ? elem_ids[i] : steps[i].elem_id, 0);
+        }
+        if (arg_list == NULL) {
+            goto error;
+        }
+        if (steps[i].kind == PATH_FIELD) {
+            child = FList_get_flist(current, arg_list, NULL);
+        } else {
+            child = FList_get_array_flist(current, arg_list, NULL);
+        }
+        Py_DECREF(arg_list);
+        Py_DECREF(current);
+        if (child == NULL) {
+            return NULL;
+        }
+        if (child == Py_None) {
+            return child;
+        }
+        current = (FList *) child;
+    }
+    return (PyObject *) current;
 
 error:
-    Py_XDECREF(fld_name_object);
+    Py_DECREF(current);
     return NULL;
 }
 
 /*
-Returns a list of Array indexes.
-Remember that a BRM Array is more like a Hash but with numeric keys, "sparse array"
+* Walks steps[i:] from flistp, appending each match to results
+* Raises a KeyError for a missing field if strict, otherwise skips it
 */
-static PyObject *FList_array_init_iter(FList *self, PyObject *args, PyObject *kwargs)
+static int FList_path_walk(FList *self, PathStep *steps, Py_ssize_t size, Py_ssize_t i, pin_flist_t *flistp, int32 *elem_ids, int strict, PyObject *results)
 {
-    pin_fld_num_t field = 0;
-
-    int elem_id = 0;
+    Client *client = self->client;
+    PathStep *step = &steps[i];
+    pin_fld_type_t field_type = PIN_FIELD_GET_TYPE(step->field);
+    pin_flist_t *sub_flistp = NULL;
+    void *value = NULL;
+    int32 elem_id = 0;
     pin_cookie_t cookie = NULL;
     pin_cookie_t last_cookie = NULL;
-    PyObject *dict = NULL;
-    PyObject *elem_id_object = NULL;
-
-    if (!PyArg_ParseTuple(args, "i", &field)) {
-        goto error;
-    }
-
-    if ((dict = PyDict_New()) == NULL) {
-        goto error;
+    PyObject *result = NULL;
+    int found = 0;
+
+    if (step->kind == PATH_WILDCARD) {
+        while (1) {
+            last_cookie = cookie;
+            sub_flistp = PIN_FLIST_ELEM_GET_NEXT(flistp, step->field, &elem_id, 1, &cookie, &client->ebuf);
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error iterating array %s", PIN_FIELD_GET_NAME(step->field));
+            if (last_cookie == cookie) {
+                break;
+            }
+            elem_ids[i] = elem_id;
+            if (i == size - 1) {
+                if ((result = FList_path_flist(self, steps, size, elem_ids)) == NULL) {
+                    goto error;
+                }
+            } else if (sub_flistp == NULL) {
+                continue;
+            } else {
+                if (FList_path_walk(self, steps, size, i + 1, sub_flistp, elem_ids, 0, results) < 0) {
+                    goto error;
+                }
+                continue;
+            }
+            if (PyList_Append(results, result) < 0) {
+                goto error;
+            }
+            Py_CLEAR(result);
+        }
+        return 0;
     }
 
-    while (1)
-    {
-        last_cookie = cookie;
-        PIN_FLIST_ELEM_GET_NEXT(self->flistp, PIN_MAKE_FLD(PIN_FLDT_ARRAY, field), &elem_id, 1, &cookie, &self->client->ebuf);
-        CHECK_PIN_ERR(self->client->ebuf, "Error iterating flist");
-        if (last_cookie == cookie) {
-            break;
+    if (field_type == PIN_FLDT_ARRAY || field_type == PIN_FLDT_SUBSTRUCT) {
+        if (field_type == PIN_FLDT_ARRAY) {
+            if (step->kind != PATH_ELEM) {
+                PyErr_Format(PyExc_ValueError, "Array %s in a path needs an [elem_id] or [*]", PIN_FIELD_GET_NAME(step->field));
+                goto error;
+            }
+            PIN_FLIST_ELEM_GET(flistp, step->field, step->elem_id, 0, &client->ebuf);
+        } else {
+            PIN_FLIST_FLD_GET(flistp, step->field, 0, &client->ebuf);
         }
+        found = !PIN_ERR_IS_ERR(&client->ebuf);
+        PIN_ERRBUF_RESET(&client->ebuf);
 
-        if ((elem_id_object = Py_BuildValue("i", elem_id)) == NULL) {
-            goto error;
+        if (found && i == size - 1) {
+            if ((result = FList_path_flist(self, steps, size, elem_ids)) == NULL) {
+                goto error;
+            }
+        } else if (found) {
+            if (field_type == PIN_FLDT_ARRAY) {
+                sub_flistp = PIN_FLIST_ELEM_GET(flistp, step->field, step->elem_id, 1, &client->ebuf);
+            } else {
+                sub_flistp = PIN_FLIST_SUBSTR_GET(flistp, step->field, 1, &client->ebuf);
+            }
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting flist for field %s", PIN_FIELD_GET_NAME(step->field));
+            if (sub_flistp == NULL) {
+                // A NULL substruct or array element has no fields below it
+                found = 0;
+            } else {
+                return FList_path_walk(self, steps, size, i + 1, sub_flistp, elem_ids, strict, results);
+            }
         }
-        if (PyDict_SetItem(dict, elem_id_object, Py_None) < 0) {
+    } else {
+        if (i != size - 1) {
+            PyErr_Format(PyExc_ValueError, "Field %s in a path is not a substruct or array", PIN_FIELD_GET_NAME(step->field));
             goto error;
         }
-        Py_DECREF(elem_id_object);
+        /* optional=0 so that a NULL value can be told apart from a missing field */
+        value = PIN_FLIST_FLD_GET(flistp, step->field, 0, &client->ebuf);
+        if (PIN_ERR_IS_ERR(&client->ebuf) && client->ebuf.pin_err == PIN_ERR_NOT_FOUND) {
+            PIN_ERRBUF_RESET(&client->ebuf);
+        } else {
+            CHECK_PIN_ERR_FORMAT(client->ebuf, "Error getting field %s", PIN_FIELD_GET_NAME(step->field));
+            found = 1;
+            if ((result = FList_value_to_python(client, step->field, value)) == NULL) {
+                goto error;
+            }
+        }
     }
 
-    return dict;
+    if (!found) {
+        if (strict) {
+            PyErr_Format(PyExc_KeyError, "Field %s not found", PIN_FIELD_GET_NAME(step->field));
+            goto error;
+        }
+        return 0;
+    }
+    if (PyList_Append(results, result) < 0) {
+        goto error;
+    }
+    Py_DECREF(result);
+    return 0;
 
 error:
-    Py_XDECREF(dict);
-    Py_XDECREF(elem_id_object);
-    return NULL;
+    Py_XDECREF(result);
+    return -1;
+}
+
+/*
+* Returns a list of the values matched by the path steps
+* Without a wildcard there is at most one value. Missing fields raise a KeyError, unless optional is set.
+*/
+static PyObject *FList_path_get(FList *self, PyObject *args)
+{
+    PyObject *steps_tuple = NULL;
+    int optional = 0;
+    PathStep steps[PATH_MAX_STEPS];
+    int32 elem_ids[PATH_MAX_STEPS];
+    Py_ssize_t size = 0;
+    PyObject *results = NULL;
+
+    if (FList_check_open(self) < 0) {
+        return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "O|i", &steps_tuple, &optional)) {
+        return NULL;
+    }
+    if ((size = PathStep_parse(steps_tuple, steps)) < 0) {
+        return NULL;
+    }
+    if ((results = PyList_New(0)) == NULL) {
+        return NULL;
+    }
+    if (FList_path_walk(self, steps, size, 0, self->flistp, elem_ids, !optional, results) < 0) {
+        Py_DECREF(results);
+        return NULL;
+    }
+    return results;
+}
+
+
+/*
+* Checks if this FList has a C flist. It does not once it has been consumed by an opcode
+*/
+static PyObject *FList_is_open(FList *self, PyObject *Py_UNUSED(ignored))
+{
+    return PyBool_FromLong(self->flistp != NULL);
 }
 
 
@@ -1960,8 +7632,9 @@ static PyObject *FList_opcode(FList *self, PyObject *args, PyObject *kwargs)
     int code = 0;
     int flag = 0;
     int is_reference = 0;
+    int is_consume = 0;
 
-    if (!PyArg_ParseTuple(args, "i|ii", &code, &flag, &is_reference)) {
+    if (!PyArg_ParseTuple(args, "i|iii", &code, &flag, &is_reference, &is_consume)) {
         return NULL;
     }
 
@@ -1970,6 +7643,27 @@ static PyObject *FList_opcode(FList *self, PyObject *args, PyObject *kwargs)
         goto error;
     }
 
+    if (self->flistp == NULL) {
+        PyErr_SetString(PyExc_ValueError, "Cannot call an opcode with an unopened flist\n");
+        goto error;
+    }
+
+    if (is_consume) {
+        /*
+        The C flist is handed over to the opcode, so nothing else may point into it afterwards
+        Only a parent owns its C flist, and cached children point into it
+        */
+        if (self->parent_flist != NULL) {
+            PyErr_SetString(PyExc_ValueError, "Only a top level flist can be consumed by an opcode");
+            goto error;
+        }
+        if (self->children_size > 0) {
+            PyErr_SetString(PyExc_ValueError, "Cannot consume an flist while flists on its substructs or arrays are still referenced");
+            goto error;
+        }
+        is_reference = 1;
+    }
+
     Py_BEGIN_ALLOW_THREADS
     if (!is_reference) {
         PCM_OP(self->client->ctxp, code, flag, self->flistp, &output_flistp, &self->client->ebuf);
@@ -1978,6 +7672,17 @@ static PyObject *FList_opcode(FList *self, PyObject *args, PyObject *kwargs)
     }
 
     Py_END_ALLOW_THREADS
+    if (is_reference) {
+        // The opcode may have changed the input flist
+        FList_mark_modified(self);
+    }
+    if (is_consume) {
+        // The output flist may be the input flist itself, in which case the output takes ownership of it
+        if (output_flistp != self->flistp) {
+            PIN_FLIST_DESTROY_EX(&self->flistp, NULL);
+        }
+        self->flistp = NULL;
+    }
     CHECK_PIN_ERR_FORMAT(self->client->ebuf, "Error calling opcode %i", code);
 
     if ((output_flist = (FList *) FList_make_flist(self)) == NULL) {
@@ -1988,7 +7693,7 @@ static PyObject *FList_opcode(FList *self, PyObject *args, PyObject *kwargs)
     return (PyObject *) output_flist;
 
 error:
-    Py_XDECREF(output_flist);
+    PIN_FLIST_DESTROY_EX(&output_flistp, NULL);
     return NULL;
 }
 
@@ -2026,8 +7731,24 @@ static PyMethodDef FList_methods[] = {
     {"sort_flist", (PyCFunction) FList_sort_flist, METH_VARARGS, "sorts an flist"},
     {"sort_reverse_flist", (PyCFunction) FList_sort_reverse_flist, METH_VARARGS, "sort reverse an flist"},
     {"array_count", (PyCFunction) FList_array_count, METH_VARARGS, "counts an array"},
-    {"init_iter", (PyCFunction) FList_init_iter, METH_VARARGS, "iter for flist"},
-    {"array_init_iter", (PyCFunction) FList_array_init_iter, METH_VARARGS, "iter for an array"},
+    {"merge", (PyCFunction) FList_merge, METH_VARARGS, "copies or moves the fields of another flist onto this one, overwriting existing fields"},
+    {"project", (PyCFunction) FList_project, METH_VARARGS, "keeps only the fields in a spec, on a new flist or in place"},
+    {"count", (PyCFunction) FList_count, METH_NOARGS, "counts the distinct fields on an flist"},
+    {"array_sort", (PyCFunction) FList_array_sort, METH_VARARGS, "sorts the flists on an array by key"},
+    {"array_filter", (PyCFunction) FList_array_filter, METH_VARARGS, "returns the elem_ids of the flists on an array matching a comparison"},
+    {"array_group", (PyCFunction) FList_array_group, METH_VARARGS, "groups the flists on an array by a field"},
+    {"array_column", (PyCFunction) FList_array_column, METH_VARARGS, "returns a field from every flist on an array"},
+    {"path_get", (PyCFunction) FList_path_get, METH_VARARGS, "returns the values at the end of a compiled path"},
+    {"equals", (PyCFunction) FList_equals, METH_VARARGS, "compares two flists"},
+    {"array_equals", (PyCFunction) FList_array_equals, METH_VARARGS, "compares two arrays"},
+    {"diff", (PyCFunction) FList_diff, METH_VARARGS, "returns the added, removed and changed paths between two flists"},
+    {"is_open", (PyCFunction) FList_is_open, METH_NOARGS, "checks if the flist has a C flist"},
+    {"reset", (PyCFunction) FList_reset, METH_VARARGS, "resets an flist to a template, touching only the fields that differ"},
+    {"iter_fields", (PyCFunction) FList_iter_fields, METH_VARARGS, "iterates over the fields of an flist"},
+    {"array_iter", (PyCFunction) FList_array_iter, METH_VARARGS, "iterates over the elements of an array"},
+    {"to_json", (PyCFunction) FList_to_json, METH_VARARGS | METH_KEYWORDS, "serializes the flist to json"},
+    {"from_json", (PyCFunction) FList_from_json, METH_VARARGS, "populates an unopened flist from json"},
+    {"view", (PyCFunction) FList_view, METH_VARARGS, "returns a read-only view of the flist, or of an array on it"},
     {"opcode", (PyCFunction) FList_opcode, METH_VARARGS, "issues an opcode on the flist"},
     {"concat", (PyCFunction) FList_concat, METH_VARARGS, "issues an opcode on the flist"},
     {"set_capsule", (PyCFunction) FList_set_capsule, METH_VARARGS, "returns a capsule wrapper of the c flist pointer"},
@@ -2263,6 +7984,10 @@ PyMODINIT_FUNC
 PyInit_cbrm(void) {
     PyObject *m = NULL;
     PyObject *exc_dict = NULL;
+    PyObject *fields = NULL;
+    PyObject *datetime_module = NULL;
+    PyObject *timezone = NULL;
+    PyObject *decimal_module = NULL;
 
     if (PyType_Ready(&FListType) < 0) {
         goto error;
@@ -2270,6 +7995,51 @@ PyInit_cbrm(void) {
     if (PyType_Ready(&ClientType) < 0) {
         goto error;
     }
+    if (PyType_Ready(&FListViewType) < 0) {
+        goto error;
+    }
+    if (PyType_Ready(&ArrayIteratorType) < 0) {
+        goto error;
+    }
+    if (PyType_Ready(&FieldIteratorType) < 0) {
+        goto error;
+    }
+    if (PyType_Ready(&PoidType) < 0) {
+        goto error;
+    }
+    if ((fields = Py_BuildValue("(ssss)", "type", "id", "revision", "database")) == NULL) {
+        goto error;
+    }
+    if (PyDict_SetItemString(PoidType.tp_dict, "_fields", fields) < 0) {
+        goto error;
+    }
+    Py_CLEAR(fields);
+
+    PyDateTime_IMPORT;
+    if (PyDateTimeAPI == NULL) {
+        goto error;
+    }
+    if ((datetime_module = PyImport_ImportModule("datetime")) == NULL) {
+        goto error;
+    }
+    timezone = PyObject_GetAttrString(datetime_module, "timezone");
+    Py_DECREF(datetime_module);
+    if (timezone == NULL) {
+        goto error;
+    }
+    UtcTimezone = PyObject_GetAttrString(timezone, "utc");
+    Py_DECREF(timezone);
+    if (UtcTimezone == NULL) {
+        goto error;
+    }
+    if ((decimal_module = PyImport_ImportModule("decimal")) == NULL) {
+        goto error;
+    }
+    DecimalType = PyObject_GetAttrString(decimal_module, "Decimal");
+    Py_DECREF(decimal_module);
+    if (DecimalType == NULL) {
+        goto error;
+    }
 
     if ((m = PyModule_Create(&cbrm)) == NULL) {
         goto error;
@@ -2285,6 +8055,16 @@ PyInit_cbrm(void) {
         goto error;
     };
 
+    Py_INCREF(&FListViewType);
+    if (PyModule_AddObject(m, "FListView", (PyObject *) &FListViewType) < 0) {
+        goto error;
+    };
+
+    Py_INCREF(&PoidType);
+    if (PyModule_AddObject(m, "Poid", (PyObject *) &PoidType) < 0) {
+        goto error;
+    };
+
     if ((exc_dict = BRMError_getter_code()) == NULL) {
         goto error;
     }
@@ -2304,6 +8084,7 @@ error:
     Py_XDECREF(BRMError);
     Py_CLEAR(BRMError);
     Py_XDECREF(exc_dict);
+    Py_XDECREF(fields);
     Py_XDECREF(m);
     return NULL;
 }
@@ -44,12 +44,14 @@ from pybrm import cbrm
 from pybrm import Client, FList, BRMError, Poid, BRMArray
 from pybrm import pin_field_get_name, pin_field_get_type, pin_field_of_name, pin_virtual_time
 from pybrm import constants, pin_conf
-from datetime import datetime
+from datetime import datetime, timezone
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, DEFAULT
 from decimal import Decimal
 import sys
 import logging
+import io
+import json
 
 
 class TestBrm(unittest.TestCase):
@@ -198,6 +200,34 @@ class TestAddFields(TestBrm):
         poid = f._get_poid('PIN_FLD_POID')
         self.assertEqual(p, poid)
 
+    def test_poid_type(self):
+        p = Poid('/event/pybrm', 123, database=1)
+        self.assertEqual(p, ('/event/pybrm', 123, 0, 1))
+        self.assertEqual(hash(p), hash(('/event/pybrm', 123, 0, 1)))
+        self.assertEqual(p, Poid(type='/event/pybrm', id=123, revision=0, database=1))
+        self.assertNotEqual(p, p._replace(revision=1))
+        poid_type, id, revision, database = p
+        self.assertEqual((poid_type, id, revision, database, p[-1]), ('/event/pybrm', 123, 0, 1, 1))
+        self.assertEqual(str(p), '0.0.0.1 /event/pybrm 123 0')
+        self.assertEqual(repr(p), "Poid(type='/event/pybrm', id=123, revision=0, database=1)")
+        self.assertTrue(Poid('/account').is_type_only())
+        self.assertEqual(Poid._fields, ('type', 'id', 'revision', 'database'))
+        self.assertRaises(TypeError, Poid, 123)
+        # Numeric strings are taken for the id, revision and database, like the namedtuple Poid
+        self.assertEqual(Poid('/event/pybrm', '123', '0', '1'), p)
+        self.assertEqual(Poid('/event/pybrm')._replace(id='123', database='1'), p)
+        self.assertRaises(ValueError, Poid, '/event/pybrm', 'abc')
+        self.assertRaises(TypeError, Poid, '/event/pybrm', 1.5)
+
+        f = self.c.flist()
+        f['PIN_FLD_POID'] = '/event/pybrm', '123'
+        self.assertEqual(f['PIN_FLD_POID'], p)
+        f['PIN_FLD_POID'] = p._replace(database=None)
+        self.assertEqual(f['PIN_FLD_POID'], p)
+        f['PIN_FLD_POID'] = p._replace(revision=2)
+        self.assertEqual(f['PIN_FLD_POID'].revision, 2)
+        self.assertRaises(ValueError, f.__setitem__, 'PIN_FLD_POID', Poid('1account'))
+
     def test_PIN_FLD_SERVICE_OBJ(self):
         f = self.c.flist()
         self.assertRaises(TypeError, f.__setitem__, 'PIN_FLD_SERVICE_OBJ', 123)
@@ -216,6 +246,35 @@ class TestAddFields(TestBrm):
         s = str(f)
         print(s)
 
+    def test_tstamp_mode(self):
+        f = self.c.flist()
+        now = datetime.now().replace(microsecond=0)
+        f['PIN_FLD_CREATED_T'] = now
+        self.assertEqual(f['PIN_FLD_CREATED_T'], now)
+        self.assertEqual(f.get('PIN_FLD_CREATED_T', tstamp_mode='epoch_int'), int(now.timestamp()))
+        self.assertEqual(f.get('PIN_FLD_CREATED_T', tstamp_mode='aware_utc'), now.astimezone(timezone.utc))
+        f['PIN_FLD_END_T'] = now.astimezone(timezone.utc)
+        self.assertEqual(f['PIN_FLD_END_T'], now)
+
+        c = Client(tstamp_mode='epoch_int')
+        try:
+            self.assertEqual(c.tstamp_mode, 'epoch_int')
+            f = c.flist({'PIN_FLD_CREATED_T': now})
+            self.assertEqual(f['PIN_FLD_CREATED_T'], int(now.timestamp()))
+            self.assertEqual(f.view()['PIN_FLD_CREATED_T'], int(now.timestamp()))
+            c.tstamp_mode = 'aware_utc'
+            self.assertEqual(f['PIN_FLD_CREATED_T'].tzinfo, timezone.utc)
+            self.assertRaises(ValueError, setattr, c, 'tstamp_mode', 'local')
+
+            # Naive datetimes convert like datetime.timestamp(), fold and range included
+            c.tstamp_mode = 'epoch_int'
+            for value in (datetime(2021, 11, 7, 1, 30), datetime(2021, 11, 7, 1, 30, fold=1), datetime(1969, 12, 31, 23, 59, 59)):
+                f['PIN_FLD_CREATED_T'] = value
+                self.assertEqual(f['PIN_FLD_CREATED_T'], int(value.timestamp()))
+            self.assertRaises((OverflowError, ValueError), f.__setitem__, 'PIN_FLD_CREATED_T', datetime.min)
+        finally:
+            c.close()
+
     def test_attr_PIN_FLD_CREATED_T(self):
         f = self.c.flist()
         self.assertRaises(TypeError, f.__setattr__, 'PIN_FLD_CREATED_T', "hello")
@@ -623,6 +682,37 @@ class TestFlist(TestBrm):
 
         self.assertRaises(BRMError, substruct._flist.set_decimal, pin_field_of_name('PIN_FLD_QUANTITY'), value='foo')
 
+    def test_decimal_mode(self):
+        flist = self.c.flist({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_QUANTITY': Decimal('12.345')}})
+        substruct = flist['PIN_FLD_INHERITED_INFO']
+        self.assertEqual(substruct['PIN_FLD_QUANTITY'], 12.345)
+        self.assertEqual(substruct.get('PIN_FLD_QUANTITY', decimal_mode='decimal'), Decimal('12.345'))
+        self.assertEqual(substruct.get('PIN_FLD_QUANTITY', decimal_mode='scaled_int'), 1235)
+        substruct['PIN_FLD_QUANTITY'] = -7
+        self.assertEqual(substruct.get('PIN_FLD_QUANTITY', decimal_mode='decimal'), Decimal('-7'))
+        self.assertRaises(ValueError, substruct.get, 'PIN_FLD_QUANTITY', decimal_mode='int')
+
+        # Exponents are written out, and values pin_decimal cannot hold are refused
+        substruct['PIN_FLD_QUANTITY'] = Decimal('1E+2')
+        self.assertEqual(substruct.get('PIN_FLD_QUANTITY', decimal_mode='decimal'), Decimal('100'))
+        substruct['PIN_FLD_QUANTITY'] = 1e16
+        self.assertEqual(substruct.get('PIN_FLD_QUANTITY', decimal_mode='decimal'), Decimal('10000000000000000'))
+        substruct['PIN_FLD_QUANTITY'] = 1e-7
+        self.assertEqual(substruct.get('PIN_FLD_QUANTITY', decimal_mode='decimal'), Decimal('0.0000001'))
+        for value in (Decimal('NaN'), Decimal('sNaN'), Decimal('Infinity'), float('nan'), float('-inf')):
+            self.assertRaises(ValueError, substruct.__setitem__, 'PIN_FLD_QUANTITY', value)
+        self.assertRaises(TypeError, substruct.__setitem__, 'PIN_FLD_QUANTITY', 'nan')
+
+        c = Client(decimal_mode='scaled_int', decimal_scale=3)
+        try:
+            f = c.flist({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_QUANTITY': 1.5}})
+            self.assertEqual(f['PIN_FLD_INHERITED_INFO']['PIN_FLD_QUANTITY'], 1500)
+            c.decimal_mode = 'decimal'
+            self.assertEqual(f['PIN_FLD_INHERITED_INFO']['PIN_FLD_QUANTITY'], Decimal('1.5'))
+            self.assertRaises(ValueError, setattr, c, 'decimal_scale', -1)
+        finally:
+            c.close()
+
     def test_get_int(self):
         flist = self.c.flist()
         flist['PIN_FLD_INHERITED_INFO'] = {}
@@ -775,6 +865,168 @@ class TestFlist(TestBrm):
 
         self.assertEquals(f, self.c.flist(f.json()))
 
+    def test_from_json_conversions(self):
+        f = self.c.flist_from_json('''{
+            "PIN_FLD_POID": "/account",
+            "PIN_FLD_FLAGS": "SRCH_EXACT",
+            "PIN_FLD_STATUS": "2",
+            "PIN_FLD_QUANTITY": "2.5",
+            "PIN_FLD_USAGE_TYPE": "caf\\u00e9 \\"quoted\\"",
+            "PIN_FLD_RESULTS": {},
+            "PIN_FLD_ARGS": {"*": {"PIN_FLD_STATUS": 5}, "4": {"PIN_FLD_STATUS": 6}}
+        }''')
+        self.assertEqual(f['PIN_FLD_POID'].type, '/account')
+        self.assertEqual(f['PIN_FLD_FLAGS'], constants.all_flags['SRCH_EXACT'])
+        self.assertEqual(f['PIN_FLD_STATUS'], 2)
+        self.assertEqual(f['PIN_FLD_QUANTITY'], 2.5)
+        self.assertEqual(f['PIN_FLD_USAGE_TYPE'], 'café "quoted"')
+        self.assertTrue('PIN_FLD_RESULTS' in f)
+        self.assertEqual(f['PIN_FLD_ARGS'][-1]['PIN_FLD_STATUS'], 5)
+        self.assertEqual(f['PIN_FLD_ARGS'][4]['PIN_FLD_STATUS'], 6)
+
+        self.assertRaises(KeyError, self.c.flist_from_json, '{"PIN_FLD_NOT_A_FIELD": 1}')
+        self.assertRaises(TypeError, self.c.flist_from_json, '{"PIN_FLD_STATUS": "abc"}')
+        self.assertRaises(OverflowError, self.c.flist_from_json, '{"PIN_FLD_STATUS": 99999999999}')
+        self.assertRaises(ValueError, self.c.flist_from_json, '{"PIN_FLD_STATUS": 1} extra')
+
+    def test_from_json_numbers(self):
+        f = self.c.flist_from_json('{"PIN_FLD_STATUS": -0, "PIN_FLD_QUANTITY": -1.5e2, "PIN_FLD_CREATED_T": 1.5e9}')
+        self.assertEqual(f['PIN_FLD_STATUS'], 0)
+        self.assertEqual(f['PIN_FLD_QUANTITY'], -150)
+        self.assertEqual(f.get('PIN_FLD_CREATED_T', tstamp_mode='epoch_int'), 1500000000)
+        for number in ('+1', '01', '1.', '.5', '1e', '0x10', 'inf', 'nan', '-', '1.5.3', '1e+-2'):
+            self.assertRaises(ValueError, self.c.flist_from_json, '{"PIN_FLD_QUANTITY": %s}' % number)
+        self.assertRaises(OverflowError, self.c.flist_from_json, '{"PIN_FLD_CREATED_T": 1e300}')
+
+    def test_from_json_deeply_nested(self):
+        depth = 100000
+        data = '{"PIN_FLD_INHERITED_INFO": ' * depth + '{}' + '}' * depth
+        self.assertRaises(RecursionError, self.c.flist_from_json, data)
+        data = '{"PIN_FLD_RESULTS": [' * depth + '{}' + ']}' * depth
+        self.assertRaises(RecursionError, self.c.flist_from_json, data)
+
+    def test_json(self):
+        f = self.c.flist({
+            'PIN_FLD_POID': ('/account', 1, 2),
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_CREATED_T': 1582600707,
+            'PIN_FLD_QUANTITY': 2.5,
+            'PIN_FLD_USAGE_TYPE': 'a "quoted"\nline',
+            'PIN_FLD_INHERITED_INFO': None,
+            'PIN_FLD_EVENT': {},
+            'PIN_FLD_ARGS': {4: {'PIN_FLD_STATUS': 3}, 16: None},
+        })
+        self.assertEqual(json.loads(f.json()), {
+            'PIN_FLD_POID': '0.0.0.1 /account 1 2',
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_CREATED_T': 1582600707,
+            'PIN_FLD_QUANTITY': 2.5,
+            'PIN_FLD_USAGE_TYPE': 'a "quoted"\nline',
+            'PIN_FLD_INHERITED_INFO': None,
+            'PIN_FLD_EVENT': {},
+            'PIN_FLD_ARGS': {'4': {'PIN_FLD_STATUS': 3}, '16': None},
+        })
+
+        stream = io.StringIO()
+        self.assertIsNone(f.json(stream))
+        self.assertEqual(stream.getvalue(), f.json())
+
+        f2 = self.c.flist({'PIN_FLD_STATUS': 2})
+        f._concat(f2)
+        self.assertEqual(json.loads(f.json())['PIN_FLD_STATUS'], 1)
+
+        f = self.c.flist({'PIN_FLD_PROVIDER_IPADDR': b'abc'})
+        self.assertRaises(TypeError, f.json)
+
+    def test_from_explicit_format(self):
+        f = self.c.flist({
+            'PIN_FLD_POID': '/account',
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_POID': ('/service', 1234)},
+            'PIN_FLD_ARGS': {4: {'PIN_FLD_STATUS': 3}},
+        })
+        self.assertEqual(f, self.c.flist_from_json(f.json()))
+        self.assertEqual(f, self.c.flist_from_xml(f.xml('PIN_XML_BY_TYPE')))
+        self.assertEqual(f, self.c.flist_from_str(str(f)))
+        self.assertEqual(f, self.c.flist('  \n' + f.json()))
+
+        self.assertRaises(ValueError, self.c.flist_from_json, str(f))
+        self.assertRaises(ValueError, self.c.flist_from_json, '[1, 2]')
+        self.assertRaises(ValueError, self.c.flist_from_xml, f.json())
+        self.assertRaises(ValueError, self.c.flist_from_str, 'abc')
+        self.assertRaises(ValueError, self.c.flist, '{"PIN_FLD_STATUS": ')
+
+    def test_sniff_flist_format(self):
+        self.assertEqual(pybrm.pybrm._sniff_flist_format('{}'), 'json')
+        self.assertEqual(pybrm.pybrm._sniff_flist_format(' \n<flist></flist>'), 'xml')
+        self.assertEqual(pybrm.pybrm._sniff_flist_format('0 PIN_FLD_POID POID [0] 0.0.0.1 /a -1 0'), 'str')
+
+    def test_iterate_fields(self):
+        f = self.c.flist({
+            'PIN_FLD_POID': '/a',
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_RESULTS': {0: {}, 1: {}, 2: {}},
+        })
+        self.assertEqual(list(f), ['PIN_FLD_POID', 'PIN_FLD_STATUS', 'PIN_FLD_RESULTS'])
+        # Nested iteration over the same flist no longer clobbers the outer iteration
+        pairs = [(a, b) for a in f for b in f]
+        self.assertEqual(len(pairs), 9)
+        self.assertTrue(list(f)[1] is list(f)[1])
+        self.assertEqual(list(f._flist.iter_fields(1)), [pin_field_of_name(k) for k in f])
+
+        with self.assertRaises(RuntimeError):
+            for k in f:
+                del f[k]
+
+        f.clear()
+        self.assertEqual(len(f), 0)
+
+    def test_view(self):
+        f = self.c.flist({
+            'PIN_FLD_POID': ('/account', 1),
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_CREATED_T': datetime.fromtimestamp(1582600707),
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2},
+            'PIN_FLD_EVENT': None,
+            'PIN_FLD_ARGS': {4: {'PIN_FLD_STATUS': 3}, 16: None},
+        })
+        view = f.view()
+        self.assertIsInstance(view, pybrm.FListView)
+        self.assertEqual(view['PIN_FLD_POID'], f['PIN_FLD_POID'])
+        self.assertIsInstance(view['PIN_FLD_POID'], Poid)
+        self.assertEqual(view['PIN_FLD_STATUS'], 1)
+        self.assertEqual(view['PIN_FLD_CREATED_T'], datetime.fromtimestamp(1582600707))
+        self.assertEqual(view['PIN_FLD_INHERITED_INFO']['PIN_FLD_STATUS'], 2)
+        self.assertIsNone(view['PIN_FLD_EVENT'])
+        self.assertEqual(view['PIN_FLD_ARGS'][4]['PIN_FLD_STATUS'], 3)
+        self.assertIsNone(view['PIN_FLD_ARGS'][16])
+        self.assertEqual(view['PIN_FLD_ARGS'].keys(), [4, 16])
+        self.assertEqual(f['PIN_FLD_ARGS'].view().keys(), [4, 16])
+        self.assertEqual(sorted(view), sorted(f.keys()))
+        self.assertEqual(len(view), len(f))
+        self.assertEqual(dict(view.items())['PIN_FLD_STATUS'], 1)
+        self.assertEqual(len(view.values()), len(f))
+        self.assertEqual(f['PIN_FLD_INHERITED_INFO'].view().keys(), ['PIN_FLD_STATUS'])
+        self.assertTrue('PIN_FLD_STATUS' in view)
+        self.assertFalse('PIN_FLD_NAME' in view)
+        self.assertRaises(KeyError, lambda: view['PIN_FLD_NAME'])
+        self.assertEqual(view.get('PIN_FLD_NAME', 'default'), 'default')
+
+    def test_view_is_stale_after_modification(self):
+        f = self.c.flist({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2}})
+        view = f.view()
+        sub_view = view['PIN_FLD_INHERITED_INFO']
+
+        f['PIN_FLD_INHERITED_INFO']['PIN_FLD_STATUS'] = 3
+        self.assertRaises(RuntimeError, lambda: view['PIN_FLD_INHERITED_INFO'])
+        self.assertRaises(RuntimeError, lambda: sub_view['PIN_FLD_STATUS'])
+        self.assertEqual(f.view()['PIN_FLD_INHERITED_INFO']['PIN_FLD_STATUS'], 3)
+
+        # The view keeps the flist alive
+        view = f.view()
+        del f
+        self.assertEqual(view['PIN_FLD_INHERITED_INFO']['PIN_FLD_STATUS'], 3)
+
     def test_get_enum(self):
         flist = self.c.flist()
         flist['PIN_FLD_STATUS'] = 0
@@ -863,6 +1115,29 @@ class TestFlist(TestBrm):
         del substruct['PIN_FLD_RATE_TAG']
         self.assertEqual(substruct.count(), 0)
 
+    def test_count_after_modification(self):
+        flist = self.c.flist()
+        flist['PIN_FLD_ARGS'] = {0: {'PIN_FLD_STATUS': 1}, 1: {'PIN_FLD_STATUS': 2}}
+        flist['PIN_FLD_POID'] = '/event/pybrm'
+        self.assertEqual(flist.count(), 2)
+        self.assertEqual(flist.count(), 2)
+        del flist['PIN_FLD_POID']
+        self.assertEqual(flist.count(), 1)
+        flist['PIN_FLD_RESULTS'] = [{'PIN_FLD_STATUS': 1}]
+        self.assertEqual(flist.count(), 2)
+        flist.clear()
+        self.assertEqual(flist.count(), 0)
+        self.assertFalse(flist)
+
+    def test_count_after_reference_opcode(self):
+        flist = self.c.flist({'PIN_FLD_POID': '/account', 'PIN_FLD_STATUS': 1})
+        self.assertEqual(flist.count(), 2)
+        generation = flist._flist.tree_generation
+        # The opcode may change the input flist, so the cached count is dropped
+        flist('PCM_OP_TEST_LOOPBACK', reference=True)
+        self.assertNotEqual(flist._flist.tree_generation, generation)
+        self.assertEqual(flist.count(), len(list(flist.keys())))
+
     def test_count_with_null_substructures(self):
         flist = self.c.flist()
         flist['PIN_FLD_POID'] = '/event/pybrm'
@@ -988,6 +1263,105 @@ class TestFlist(TestBrm):
         f.update({'PIN_FLD_STATUS': 2})
         self.assertEquals(f['PIN_FLD_STATUS'], 2)
 
+    def test_update_substruct(self):
+        f = self.c.flist({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 1, 'PIN_FLD_RATE_TAG': 'foo'}})
+        substruct = f['PIN_FLD_INHERITED_INFO']
+        f.update({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2}, 'PIN_FLD_RESULTS': {}})
+        self.assertEqual(f, {'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'foo'}})
+        self.assertEqual(substruct['PIN_FLD_STATUS'], 2)
+        self.assertIn('PIN_FLD_RESULTS', f)
+
+    def test_update_in_place(self):
+        f = self.c.flist({'PIN_FLD_STATUS': 1, 'PIN_FLD_RESULTS': [{'PIN_FLD_STATUS': 1}]})
+        element = f['PIN_FLD_RESULTS'][0]
+        other = self.c.flist({
+            'PIN_FLD_STATUS': 2,
+            'PIN_FLD_RESULTS': [{'PIN_FLD_STATUS': 2}],
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 3},
+        })
+        other_substruct = other['PIN_FLD_INHERITED_INFO']
+        f.update(other, in_place=True)
+        self.assertEqual(f, {
+            'PIN_FLD_STATUS': 2,
+            'PIN_FLD_RESULTS': [{'PIN_FLD_STATUS': 2}],
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 3},
+        })
+        self.assertEqual(len(other), 0)
+        # Python references to the replaced or moved flists keep their values
+        self.assertEqual(element['PIN_FLD_STATUS'], 1)
+        self.assertEqual(other_substruct['PIN_FLD_STATUS'], 3)
+
+    def test_update_in_place_null_and_duplicate_fields(self):
+        for in_place in (False, True):
+            f = self.c.flist({'PIN_FLD_STATUS': 1, 'PIN_FLD_RATE_TAG': 'foo'})
+            other = self.c.flist({'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': None})
+            other._concat(self.c.flist({'PIN_FLD_STATUS': 3}))
+            f.update(other, in_place=in_place)
+            # The first of the duplicate fields is kept, with or without in_place
+            self.assertEqual(f['PIN_FLD_STATUS'], 2)
+            self.assertIsNone(f['PIN_FLD_RATE_TAG'])
+            self.assertEqual(len(other), 0 if in_place else 3)
+
+    def test_update_from_substruct(self):
+        f = self.c.flist({'PIN_FLD_STATUS': 1, 'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2}})
+        f.update(f['PIN_FLD_INHERITED_INFO'])
+        self.assertEqual(f['PIN_FLD_STATUS'], 2)
+        self.assertRaises(ValueError, f.update, f['PIN_FLD_INHERITED_INFO'], in_place=True)
+
+    def test_project(self):
+        f = self.c.flist({
+            'PIN_FLD_POID': '/account',
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'foo'},
+            'PIN_FLD_RESULTS': {0: {'PIN_FLD_STATUS': 3, 'PIN_FLD_RATE_TAG': 'bar'}, 1: None},
+        })
+        p = f.project({'PIN_FLD_POID': None, 'PIN_FLD_INHERITED_INFO': {}, 'PIN_FLD_RESULTS': {'PIN_FLD_STATUS'}})
+        self.assertEqual(p, {
+            'PIN_FLD_POID': '/account',
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'foo'},
+            'PIN_FLD_RESULTS': {0: {'PIN_FLD_STATUS': 3}, 1: None},
+        })
+        self.assertEqual(len(f), 4)
+        self.assertEqual(f.project(['PIN_FLD_STATUS']), {'PIN_FLD_STATUS': 1})
+
+    def test_project_in_place(self):
+        f = self.c.flist({
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'foo'},
+            'PIN_FLD_RESULTS': [{'PIN_FLD_STATUS': 3}, {'PIN_FLD_STATUS': 4}],
+        })
+        substruct = f['PIN_FLD_INHERITED_INFO']
+        element = f['PIN_FLD_RESULTS'][1]
+        self.assertIs(f.project({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_RATE_TAG'}}, in_place=True), f)
+        self.assertEqual(f, {'PIN_FLD_INHERITED_INFO': {'PIN_FLD_RATE_TAG': 'foo'}})
+        self.assertEqual(substruct, {'PIN_FLD_RATE_TAG': 'foo'})
+        # The dropped array element is still usable
+        self.assertEqual(element['PIN_FLD_STATUS'], 4)
+
+    def test_project_in_place_nested(self):
+        f = self.c.flist({
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 1, 'PIN_FLD_RATE_TAG': 'foo'},
+            'PIN_FLD_RESULTS': [{'PIN_FLD_STATUS': 3, 'PIN_FLD_RATE_TAG': 'a'}],
+        })
+        view = f.view()
+        element_view = view['PIN_FLD_RESULTS'][0]
+        index = f['PIN_FLD_RESULTS'].build_index('PIN_FLD_RATE_TAG')
+        self.assertEqual(index['a'], 0)
+        generation = f._flist.tree_generation
+
+        # Only fields inside the array elements and the substruct are dropped, and neither has an FList
+        f.project({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS'}, 'PIN_FLD_RESULTS': {'PIN_FLD_STATUS'}}, in_place=True)
+        self.assertNotEqual(f._flist.tree_generation, generation)
+        self.assertRaises(RuntimeError, lambda: element_view['PIN_FLD_RATE_TAG'])
+        self.assertRaises(RuntimeError, lambda: view['PIN_FLD_RESULTS'])
+        self.assertNotIn('a', index)
+        self.assertEqual(f.view()['PIN_FLD_RESULTS'][0]['PIN_FLD_STATUS'], 3)
+
+        # Unchanged when nothing is dropped
+        generation = f._flist.tree_generation
+        f.project({'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS'}, 'PIN_FLD_RESULTS': None}, in_place=True)
+        self.assertEqual(f._flist.tree_generation, generation)
+
     def test_update_big(self):
         f = self.c.flist()
         f['PIN_FLD_STATUS'] = 1
@@ -1063,6 +1437,30 @@ class TestFlist(TestBrm):
         f2['PIN_FLD_POID'] = '/a'
         self.assertNotEquals(f, f2)
 
+    def test_equals_dict(self):
+        f = self.c.flist({'PIN_FLD_STATUS': 1, 'PIN_FLD_INHERITED_INFO': {'PIN_FLD_RATE_TAG': 'foo'}})
+        self.assertEqual(f, {'PIN_FLD_STATUS': 1, 'PIN_FLD_INHERITED_INFO': {'PIN_FLD_RATE_TAG': 'foo'}})
+        self.assertNotEqual(f, {'PIN_FLD_STATUS': 1, 'PIN_FLD_INHERITED_INFO': {'PIN_FLD_RATE_TAG': 'bar'}})
+        self.assertNotEqual(f, None)
+        self.assertEqual(f['PIN_FLD_INHERITED_INFO'], {'PIN_FLD_RATE_TAG': 'foo'})
+
+    def test_diff(self):
+        f = self.c.flist({
+            'PIN_FLD_POID': '/account',
+            'PIN_FLD_STATUS': 1,
+            'PIN_FLD_RESULTS': {0: {'PIN_FLD_STATUS': 1}, 1: {'PIN_FLD_STATUS': 1}, 2: None},
+        })
+        f2 = self.c.flist({
+            'PIN_FLD_POID': '/account',
+            'PIN_FLD_RATE_TAG': 'foo',
+            'PIN_FLD_RESULTS': {0: {'PIN_FLD_STATUS': 2}, 2: None, 3: {}},
+        })
+        diff = f.diff(f2)
+        self.assertEqual(sorted(diff.added), ['PIN_FLD_RATE_TAG', 'PIN_FLD_RESULTS[3]'])
+        self.assertEqual(sorted(diff.removed), ['PIN_FLD_RESULTS[1]', 'PIN_FLD_STATUS'])
+        self.assertEqual(diff.changed, ['PIN_FLD_RESULTS[0].PIN_FLD_STATUS'])
+        self.assertEqual(f.diff(f), ([], [], []))
+
 
 class TestDealloc(TestBrm):
     def test_delete_parent_then_child(self):
@@ -1360,6 +1758,20 @@ class TestCache(TestBrm):
         f['PIN_FLD_RESULTS']._get_array_flist(10, 1)
         self.assert_refcount(f, 1)
 
+    def test_many_children(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': [{'PIN_FLD_STATUS': i} for i in range(100)]})
+        children = {elem_id: f['PIN_FLD_RESULTS'][elem_id] for elem_id in range(100)}
+        self.assert_refcount(f, 101)
+        for elem_id in range(0, 100, 3):
+            del f['PIN_FLD_RESULTS'][elem_id]
+            self.assertEqual(children[elem_id]['PIN_FLD_STATUS'], elem_id)
+        self.assert_refcount(f, 101 - len(range(0, 100, 3)))
+        for elem_id in range(100):
+            if elem_id % 3:
+                self.assertTrue(f['PIN_FLD_RESULTS'][elem_id]._flist is children[elem_id]._flist)
+        children.clear()
+        self.assert_refcount(f, 1)
+
 
 class TestPinFieldFunctions(unittest.TestCase):
     def test_all(self):
@@ -1479,6 +1891,29 @@ class TestArray(TestBrm):
         self.assertEqual(len(results), 2)
         self.assertEqual(second['PIN_FLD_STATUS'], 0)
 
+    def test_lazy_iteration(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': {i * 2: {'PIN_FLD_STATUS': i} for i in range(50)}})
+        f['PIN_FLD_RESULTS'][100] = None
+        results = f['PIN_FLD_RESULTS']
+        items = list(results.items())
+        self.assertEqual([elem_id for elem_id, _ in items], [i * 2 for i in range(50)] + [100])
+        self.assertEqual([v['PIN_FLD_STATUS'] for _, v in items[:-1]], list(range(50)))
+        self.assertIsNone(items[-1][1])
+        self.assertTrue(items[3][1]._flist is results[6]._flist)
+        self.assertEqual(next(iter(results)), 0)
+
+        # Modifying the elements while iterating is fine, but not adding or removing elements
+        for elem_id, v in results.items():
+            if v is not None:
+                v['PIN_FLD_STATUS'] = elem_id
+        self.assertEqual(results[6]['PIN_FLD_STATUS'], 6)
+        with self.assertRaises(RuntimeError):
+            for elem_id in results:
+                del results[elem_id]
+
+        results.clear()
+        self.assertEqual(len(results), 0)
+
     def test_key_error(self):
         flist = self.c.flist()
         flist['PIN_FLD_RESULTS'] = []
@@ -1735,6 +2170,87 @@ class TestArray(TestBrm):
         f2['PIN_FLD_RESULTS']= {1: {'PIN_FLD_STATUS': 1}}
         self.assertNotEquals(f, f2)
 
+    def test_sort(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': {
+            0: {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'b'},
+            1: {'PIN_FLD_STATUS': 1, 'PIN_FLD_RATE_TAG': 'c'},
+            2: None,
+            3: {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'a'},
+            4: {'PIN_FLD_RATE_TAG': 'd'},
+        }})
+        ar = f['PIN_FLD_RESULTS']
+        elem = ar[3]
+        ar.sort('PIN_FLD_STATUS')
+        self.assertEqual(list(ar), [1, 0, 3, 2, 4])
+        # Missing keys and NULL flists sort last, also when reversed
+        ar.sort(['PIN_FLD_STATUS', 'PIN_FLD_RATE_TAG'], reverse=True)
+        self.assertEqual(list(ar), [0, 3, 1, 4, 2])
+        ar.sort(lambda flist: flist['PIN_FLD_STATUS'] if 'PIN_FLD_STATUS' in flist else None, reverse=True)
+        self.assertEqual(list(ar), [0, 3, 1, 4, 2])
+        ar.sort(lambda flist: flist['PIN_FLD_RATE_TAG'], renumber=True)
+        self.assertEqual(list(ar), [0, 1, 2, 3, 4])
+        self.assertEqual([flist and flist['PIN_FLD_RATE_TAG'] for flist in ar.values()], ['a', 'b', 'c', 'd', None])
+        # References to the flists follow them to their new elem_id
+        self.assertEqual(elem['PIN_FLD_RATE_TAG'], 'a')
+        elem['PIN_FLD_STATUS'] = 5
+        self.assertEqual(ar[0]['PIN_FLD_STATUS'], 5)
+
+    def test_filter(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': {
+            0: {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'a'},
+            1: {'PIN_FLD_STATUS': 1, 'PIN_FLD_RATE_TAG': 'b'},
+            2: None,
+            3: {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'a'},
+            4: {'PIN_FLD_RATE_TAG': 'c'},
+        }})
+        ar = f['PIN_FLD_RESULTS']
+        self.assertEqual(ar.filter('PIN_FLD_STATUS', '==', 2), [0, 3])
+        self.assertEqual(ar.filter('PIN_FLD_STATUS', '!=', 2), [1, 4])
+        self.assertEqual(ar.filter('PIN_FLD_STATUS', '<', 2), [1])
+        self.assertEqual(ar.filter('PIN_FLD_STATUS', '==', None), [4])
+        self.assertRaises(ValueError, ar.filter, 'PIN_FLD_STATUS', '=', 2)
+
+    def test_group_by_and_index_by(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': {
+            0: {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'a'},
+            1: {'PIN_FLD_STATUS': 1, 'PIN_FLD_RATE_TAG': 'b'},
+            2: None,
+            3: {'PIN_FLD_STATUS': 2, 'PIN_FLD_RATE_TAG': 'c'},
+        }})
+        ar = f['PIN_FLD_RESULTS']
+        self.assertEqual(ar.group_by('PIN_FLD_STATUS'), {2: [0, 3], 1: [1]})
+        index = ar.index_by('PIN_FLD_RATE_TAG')
+        self.assertEqual(sorted(index), ['a', 'b', 'c'])
+        self.assertEqual(index['c']['PIN_FLD_STATUS'], 2)
+        ar[1]['PIN_FLD_STATUS'] = 5
+        self.assertRaises(RuntimeError, index['c'].__getitem__, 'PIN_FLD_STATUS')
+
+    def test_column(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': {
+            0: {'PIN_FLD_CREATED_T': 100, 'PIN_FLD_STATUS': 1},
+            1: None,
+            2: {'PIN_FLD_STATUS': 2},
+        }})
+        ar = f['PIN_FLD_RESULTS']
+        self.assertEqual(ar.column('PIN_FLD_CREATED_T'), [100, None])
+        self.assertEqual(ar.column('PIN_FLD_CREATED_T', tstamp_mode='datetime'), [datetime.fromtimestamp(100), None])
+        self.assertEqual(ar.column('PIN_FLD_STATUS'), [1, 2])
+
+    def test_build_index(self):
+        f = self.c.flist({'PIN_FLD_RESULTS': {
+            0: {'PIN_FLD_RATE_TAG': 'a'},
+            1: {'PIN_FLD_RATE_TAG': 'b'},
+            2: None,
+        }})
+        ar = f['PIN_FLD_RESULTS']
+        index = ar.build_index('PIN_FLD_RATE_TAG')
+        self.assertEqual(dict(index), {'a': 0, 'b': 1})
+        self.assertNotIn('c', index)
+        ar[5] = {'PIN_FLD_RATE_TAG': 'c'}
+        self.assertEqual(index['c'], 5)
+        ar[0]['PIN_FLD_RATE_TAG'] = 'd'
+        self.assertEqual(dict(index), {'d': 0, 'b': 1, 'c': 5})
+
     def test_in_with_null(self):
         f = self.c.flist()
         self.assertFalse('PIN_FLD_RESULTS' in f)
@@ -1820,6 +2336,191 @@ class TestMisc(TestBrm):
     def test_client_log_level(self):
         self.assertRaises(ValueError, pybrm.pin_err_set_level, 100)
 
+    def test_flags(self):
+        all_flags = constants.all_flags
+        self.assertEqual(pybrm.flags(), 0)
+        self.assertEqual(pybrm.flags('SRCH_DISTINCT'), all_flags['SRCH_DISTINCT'])
+        self.assertEqual(pybrm.flags('SRCH_DISTINCT', 'SRCH_EXACT', 8),
+                         all_flags['SRCH_DISTINCT'] | all_flags['SRCH_EXACT'] | 8)
+        self.assertRaises(KeyError, pybrm.flags, 'SRCH_FOO')
+
+    def test_opcode_object(self):
+        loopback = pybrm.Opcode('PCM_OP_TEST_LOOPBACK', flags='SRCH_DISTINCT')
+        self.assertEqual(loopback, pybrm.constants.opcode_by_name('PCM_OP_TEST_LOOPBACK'))
+        self.assertEqual(loopback.flags, constants.all_flags['SRCH_DISTINCT'])
+        f = self.c.flist({'PIN_FLD_POID': '/account'})
+        self.assertEqual(f(loopback)['PIN_FLD_POID'], f['PIN_FLD_POID'])
+        self.assertEqual(f.opcode(loopback, flags=0)['PIN_FLD_POID'], f['PIN_FLD_POID'])
+        self.assertRaises(KeyError, pybrm.Opcode, 'PCM_OP_FOO')
+
+    def test_cache_opcode(self):
+        cache = pybrm.cache_opcode('PCM_OP_TEST_LOOPBACK', key_fields=['PIN_FLD_POID'], maxsize=2)
+        try:
+            out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 1})('PCM_OP_TEST_LOOPBACK')
+            self.assertEqual(out['PIN_FLD_STATUS'], 1)
+            # Served from the cache, so the loopback does not return the new status
+            out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 2})('PCM_OP_TEST_LOOPBACK')
+            self.assertEqual(out['PIN_FLD_STATUS'], 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 2})('PCM_OP_TEST_LOOPBACK', reference=True)
+            self.assertEqual(out['PIN_FLD_STATUS'], 2)
+            out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 2})('PCM_OP_TEST_LOOPBACK', flags=1)
+            self.assertEqual(out['PIN_FLD_STATUS'], 2)
+            self.c.flist({'PIN_FLD_POID': ('/account', 2)})('PCM_OP_TEST_LOOPBACK')
+            self.assertEqual(len(cache), 2)
+
+            cache.clear()
+            self.assertEqual(len(cache), 0)
+
+            # Inside a transaction the cache is neither read nor filled
+            self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 1})('PCM_OP_TEST_LOOPBACK')
+            with self.c.transaction('/event/pybrm'):
+                out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 2})('PCM_OP_TEST_LOOPBACK')
+                self.assertEqual(out['PIN_FLD_STATUS'], 2)
+                self.c.flist({'PIN_FLD_POID': ('/account', 3)})('PCM_OP_TEST_LOOPBACK')
+            self.assertEqual(len(cache), 1)
+            out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 2})('PCM_OP_TEST_LOOPBACK')
+            self.assertEqual(out['PIN_FLD_STATUS'], 1)
+
+            self.assertRaises(ValueError, pybrm.cache_opcode, 'PCM_OP_TEST_LOOPBACK', key_fields=['PIN_FLD_RESULTS'])
+        finally:
+            pybrm.uncache_opcode('PCM_OP_TEST_LOOPBACK')
+        out = self.c.flist({'PIN_FLD_POID': ('/account', 1), 'PIN_FLD_STATUS': 2})('PCM_OP_TEST_LOOPBACK')
+        self.assertEqual(out['PIN_FLD_STATUS'], 2)
+
+    def test_retry_policy(self):
+        error = BRMError('Error calling opcode', 'PIN_ERRLOC_CM', 'PIN_ERRCLASS_SYSTEM_DETERMINATE', 'PIN_ERR_STREAM_IO',
+                         'PIN_FLD_ERR_BUF')
+        with Client(retry_policy=pybrm.RetryPolicy(retries=1, backoff=0)) as c:
+            f = c.flist({'PIN_FLD_POID': '/account'})
+            f._flist = Mock(wraps=f._flist)
+
+            f._flist.opcode.side_effect = [error, DEFAULT]
+            self.assertEqual(f('PCM_OP_TEST_LOOPBACK')['PIN_FLD_POID'].type, '/account')
+            self.assertTrue(c.is_open())
+
+            f._flist.opcode.side_effect = [error, error]
+            self.assertRaises(BRMError, f, 'PCM_OP_TEST_LOOPBACK')
+
+            # A failed reconnect is retried as well, and only opens the closed client
+            c._open = Mock(wraps=c._open, side_effect=[error, DEFAULT])
+            f._flist.opcode.side_effect = [error, DEFAULT]
+            policy = c.retry_policy
+            c.retry_policy = pybrm.RetryPolicy(retries=2, backoff=0)
+            self.assertEqual(f('PCM_OP_TEST_LOOPBACK')['PIN_FLD_POID'].type, '/account')
+            self.assertEqual(c._open.call_count, 2)
+            self.assertTrue(c.is_open())
+
+            # The last reconnect failing leaves the client closed
+            c._open.side_effect = [error]
+            f._flist.opcode.side_effect = [error]
+            c.retry_policy = policy
+            self.assertRaises(BRMError, f, 'PCM_OP_TEST_LOOPBACK')
+            self.assertFalse(c.is_open())
+            del c._open
+            c._open()
+
+            # Not retried: with reference=True, or an opcode that is not idempotent
+            f._flist.opcode.side_effect = [error, DEFAULT]
+            self.assertRaises(BRMError, f, 'PCM_OP_TEST_LOOPBACK', reference=True)
+            f._flist.opcode.side_effect = [error, DEFAULT]
+            self.assertRaises(BRMError, f, 'PCM_OP_CUST_COMMIT_CUSTOMER')
+
+        self.assertRaises(ValueError, pybrm.RetryPolicy, retries=-1)
+        self.assertRaises(ValueError, pybrm.RetryPolicy, jitter=2)
+        policy = pybrm.RetryPolicy(backoff=1, max_backoff=3, jitter=0)
+        self.assertEqual([policy.delay(attempt) for attempt in range(4)], [1, 2, 3, 3])
+
+    def test_opcode_consume(self):
+        f = self.c.flist({'PIN_FLD_POID': '/account', 'PIN_FLD_RESULTS': [{'PIN_FLD_NAME': 'a'}]})
+        out = f('PCM_OP_TEST_LOOPBACK', consume=True)
+        self.assertEqual(out['PIN_FLD_POID'].type, '/account')
+        self.assertEqual(out['PIN_FLD_RESULTS'][0]['PIN_FLD_NAME'], 'a')
+        self.assertRaises(ValueError, f.__getitem__, 'PIN_FLD_POID')
+        self.assertRaises(ValueError, f.opcode, 'PCM_OP_TEST_LOOPBACK')
+        self.assertRaises(ValueError, f.copy)
+
+        # Objects that still hold the consumed C flist raise as well
+        f = self.c.flist({'PIN_FLD_POID': '/account', 'PIN_FLD_RESULTS': [{'PIN_FLD_NAME': 'a'}]})
+        ar = f['PIN_FLD_RESULTS']
+        index = ar.build_index('PIN_FLD_NAME')
+        view = f.view()
+        f('PCM_OP_TEST_LOOPBACK', consume=True)
+        self.assertRaises(ValueError, lambda: ar[0])
+        self.assertRaises(ValueError, len, ar)
+        self.assertRaises(ValueError, lambda: 0 in ar)
+        self.assertRaises(ValueError, lambda: index['a'])
+        self.assertRaises(RuntimeError, lambda: view['PIN_FLD_POID'])
+
+        f = self.c.flist({'PIN_FLD_POID': '/account', 'PIN_FLD_INHERITED_INFO': {'PIN_FLD_NAME': 'a'}})
+        info = f['PIN_FLD_INHERITED_INFO']
+        self.assertRaises(ValueError, f.opcode, 'PCM_OP_TEST_LOOPBACK', consume=True)
+        self.assertRaises(ValueError, info.opcode, 'PCM_OP_TEST_LOOPBACK', consume=True)
+        del info
+        self.assertEqual(f('PCM_OP_TEST_LOOPBACK', consume=True)['PIN_FLD_INHERITED_INFO']['PIN_FLD_NAME'], 'a')
+
+        pool = self.c.flist_pool({'PIN_FLD_POID': '/account'})
+        f = pool.acquire()
+        f('PCM_OP_TEST_LOOPBACK', consume=True)
+        pool.release(f)
+        self.assertEqual(len(pool), 0)
+
+    def test_flist_template(self):
+        tmpl = self.c.flist_template({
+            'PIN_FLD_POID': ('/account', -1),
+            'PIN_FLD_PROGRAM_NAME': 'a',
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_STATUS': 1, 'PIN_FLD_NAME': 'b'},
+            'PIN_FLD_RESULTS': [{'PIN_FLD_NAME': 'c'}, {'PIN_FLD_NAME': 'd'}],
+            'PIN_FLD_VALUES': {},
+        })
+        f = tmpl.instantiate({
+            'PIN_FLD_POID': ('/account', 1),
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_NAME': 'e'},
+            'PIN_FLD_RESULTS': {1: {'PIN_FLD_STATUS': 2}},
+        })
+        self.assertEqual(f['PIN_FLD_POID'].id, 1)
+        self.assertEqual(f['PIN_FLD_PROGRAM_NAME'], 'a')
+        self.assertEqual(f['PIN_FLD_INHERITED_INFO'].asdict(), {'PIN_FLD_STATUS': 1, 'PIN_FLD_NAME': 'e'})
+        self.assertEqual(f['PIN_FLD_RESULTS'][0]['PIN_FLD_NAME'], 'c')
+        self.assertEqual(f['PIN_FLD_RESULTS'][1].asdict(), {'PIN_FLD_STATUS': 2})
+        self.assertIn('PIN_FLD_VALUES', f)
+
+        g = tmpl()
+        self.assertEqual(g['PIN_FLD_POID'].id, -1)
+        self.assertEqual(g['PIN_FLD_INHERITED_INFO']['PIN_FLD_NAME'], 'b')
+        self.assertEqual(len(g['PIN_FLD_RESULTS']), 2)
+
+    def test_flist_pool(self):
+        template = {
+            'PIN_FLD_POID': ('/account', 1),
+            'PIN_FLD_STATUS': 10100,
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_NAME': 'a'},
+            'PIN_FLD_RESULTS': [{'PIN_FLD_NAME': 'b'}],
+        }
+        pool = self.c.flist_pool(template, size=1)
+        with pool.flist() as f:
+            self.assertEqual(f.asdict(), self.c.flist(template).asdict())
+            f['PIN_FLD_STATUS'] = 10102
+            f['PIN_FLD_INHERITED_INFO']['PIN_FLD_NAME'] = 'c'
+            f['PIN_FLD_RESULTS'][1] = {'PIN_FLD_NAME': 'd'}
+            f['PIN_FLD_ACCOUNT_NO'] = 'e'
+            del f['PIN_FLD_POID']
+        self.assertEqual(len(pool), 1)
+
+        g = pool.acquire()
+        self.assertIs(g, f)
+        self.assertEqual(g.asdict(), self.c.flist(template).asdict())
+        self.assertEqual(g._flist.reset(pool._template._flist), 0)
+
+        h = pool.acquire()
+        self.assertIsNot(h, g)
+        pool.release(g)
+        pool.release(h)
+        self.assertEqual(len(pool), 1)
+        self.assertRaises(ValueError, pool.release, g)
+        self.assertRaises(ValueError, pool.release, self.c.flist())
+
     def test_dict(self):
         f = self.c.flist({'PIN_FLD_POID': 'a'})
         self.assertEqual(f['PIN_FLD_POID'].type, 'a')
@@ -2297,6 +2998,50 @@ class TestBadCMInPinConf(unittest.TestCase):
                 f.write(old_contents)
 
 
+class TestClientPool(unittest.TestCase):
+    def setUp(self):
+        _, host, port = pin_conf('nap', 'cm_ptr').split()
+        self.endpoint = f'{host}:{port}'
+
+    def test_client_endpoint(self):
+        with Client(endpoint=self.endpoint) as c:
+            self.assertTrue(c.is_open())
+            out = c.flist({'PIN_FLD_POID': '/account'})('PCM_OP_TEST_LOOPBACK')
+            self.assertEqual(out['PIN_FLD_POID'].database, c.database)
+        self.assertRaises(ValueError, Client, open=False, endpoint='localhost')
+
+    def test_failover(self):
+        pool = pybrm.ClientPool(['localhost:22', self.endpoint], backoff=60)
+        with pool:
+            with pool.client() as c:
+                self.assertEqual(c.endpoint[1], int(self.endpoint.rpartition(':')[2]))
+            bad, good = pool.endpoints
+            self.assertEqual(bad.failures, 1)
+            self.assertEqual(good.outstanding, 0)
+            self.assertEqual(len(good.idle), 1)
+
+            # The bad endpoint is backing off, so the idle client is reused without trying it
+            with pool.client() as c2:
+                self.assertIs(c2, c)
+            self.assertEqual(bad.failures, 1)
+            self.assertRaises(ValueError, pool.release, c)
+
+        self.assertFalse(c.is_open())
+        pool = pybrm.ClientPool(['localhost:22'])
+        self.assertRaises(BRMError, pool.acquire)
+        self.assertRaises(ValueError, pybrm.ClientPool, [self.endpoint], strategy='random')
+
+    def test_least_outstanding(self):
+        with pybrm.ClientPool([self.endpoint, self.endpoint], strategy='least_outstanding') as pool:
+            c1 = pool.acquire()
+            c2 = pool.acquire()
+            self.assertEqual([endpoint.outstanding for endpoint in pool.endpoints], [1, 1])
+            pool.release(c1)
+            pool.release(c2, failed=True)
+            self.assertFalse(c2.is_open())
+            self.assertEqual(pool.endpoints[1].failures, 1)
+
+
 class TestLogging(unittest.TestCase):
     def test_illegal_log_file(self):
         log_file = 'pybrm_test_illegal_log'
@@ -2655,5 +3400,54 @@ class TestVirtualArray(TestBrm):
         del f.PIN_FLD_RESULTS
         self.assertNotIn(field_num, f._virtual_arrays)
 
+
+class TestPath(TestBrm):
+    def setUp(self):
+        super().setUp()
+        self.f = self.c.flist({
+            'PIN_FLD_POID': '/account',
+            'PIN_FLD_INHERITED_INFO': {'PIN_FLD_RATE_TAG': 'foo'},
+            'PIN_FLD_RESULTS': {
+                0: {'PIN_FLD_STATUS': 1, 'PIN_FLD_ARGS': [{'PIN_FLD_STATUS': 10}]},
+                3: {'PIN_FLD_STATUS': 2},
+                5: None,
+            },
+        })
+
+    def test_get(self):
+        self.assertEqual(pybrm.path('PIN_FLD_POID').get(self.f).type, '/account')
+        self.assertEqual(pybrm.path('PIN_FLD_INHERITED_INFO.PIN_FLD_RATE_TAG').get(self.f), 'foo')
+        self.assertEqual(pybrm.path('PIN_FLD_RESULTS[3].PIN_FLD_STATUS').get(self.f), 2)
+        self.assertEqual(pybrm.path('PIN_FLD_RESULTS[0].PIN_FLD_ARGS[0].PIN_FLD_STATUS').get(self.f), 10)
+        self.assertIsNone(pybrm.path('PIN_FLD_RESULTS[4].PIN_FLD_STATUS').get(self.f))
+        self.assertEqual(pybrm.path('PIN_FLD_RESULTS[5].PIN_FLD_STATUS').get(self.f, 'missing'), 'missing')
+        elem = pybrm.path('PIN_FLD_RESULTS[3]').get(self.f)
+        self.assertIsInstance(elem, FList)
+        self.assertEqual(elem, {'PIN_FLD_STATUS': 2})
+        self.assertIs(elem._flist, self.f['PIN_FLD_RESULTS'][3]._flist)
+
+    def test_wildcard(self):
+        self.assertEqual(pybrm.path('PIN_FLD_RESULTS[*].PIN_FLD_STATUS').get(self.f), [1, 2])
+        self.assertEqual(pybrm.path('PIN_FLD_RESULTS[*].PIN_FLD_ARGS[*].PIN_FLD_STATUS').get(self.f), [10])
+        elems = pybrm.path('PIN_FLD_RESULTS[*]').get(self.f)
+        self.assertEqual(len(elems), 3)
+        self.assertIsNone(elems[2])
+
+    def test_set(self):
+        pybrm.path('PIN_FLD_RESULTS[3].PIN_FLD_STATUS').set(self.f, 20)
+        self.assertEqual(self.f['PIN_FLD_RESULTS'][3]['PIN_FLD_STATUS'], 20)
+        pybrm.path('PIN_FLD_RESULTS[*].PIN_FLD_RATE_TAG').set(self.f, 'bar')
+        self.assertEqual(self.f['PIN_FLD_RESULTS'][0]['PIN_FLD_RATE_TAG'], 'bar')
+        self.assertEqual(self.f['PIN_FLD_RESULTS'][3]['PIN_FLD_RATE_TAG'], 'bar')
+        self.assertRaises(KeyError, pybrm.path('PIN_FLD_RESULTS[4].PIN_FLD_STATUS').set, self.f, 1)
+
+    def test_illegal(self):
+        self.assertRaises(ValueError, pybrm.path, 'PIN_FLD_RESULTS.PIN_FLD_STATUS')
+        self.assertRaises(ValueError, pybrm.path, 'PIN_FLD_STATUS.PIN_FLD_POID')
+        self.assertRaises(ValueError, pybrm.path, 'PIN_FLD_STATUS[1]')
+        self.assertRaises(ValueError, pybrm.path, 'PIN_FLD_RESULTS[a]')
+        self.assertIs(pybrm.path('PIN_FLD_POID'), pybrm.path('PIN_FLD_POID'))
+
+
 if __name__ == '__main__':
     unittest.main()